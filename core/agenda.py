@@ -0,0 +1,263 @@
+"""
+Registro de cambios de la agenda para la estación de trabajo en vivo.
+
+Cada alta, modificación o baja de un turno o una pausa agrega una fila
+AgendaChange con el siguiente número de la secuencia de su peluquería. La
+secuencia es el contador de ChangeStamp del ámbito "agenda:<id>": se
+incrementa y se lee con la fila bloqueada (SELECT ... FOR UPDATE) en la misma
+transacción que inserta el cambio, así que dos guardados simultáneos nunca
+obtienen el mismo número, los cambios de una misma peluquería se confirman en
+el orden de su número y un lector que pide "después de N" nunca se saltea uno
+que todavía no había confirmado.
+
+El endpoint de eventos (SSE, con long-poll como alternativa) envía los
+cambios posteriores al último número que recibió el navegador. Como los
+números de una peluquería son consecutivos, si falta alguno (el navegador
+estuvo desconectado más que AGENDA_CHANGE_RETENTION_HOURS) el lote lo indica con
+"reset" y la página se actualiza completa.
+"""
+
+import asyncio
+import json
+import time
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .day_agenda import day_agenda
+
+# Cambios enviados como máximo por lote (el resto sale en el siguiente)
+BATCH_SIZE = 200
+# Cada cuánto se revisa si hay cambios nuevos
+POLL_SECONDS = 1
+# Comentario SSE para que proxies y navegadores no corten la conexión
+HEARTBEAT_SECONDS = 15
+# Espera sugerida al navegador antes de reconectarse
+RETRY_MILLISECONDS = 2000
+
+
+def agenda_scope(hairdresser_id):
+    return f"agenda:{hairdresser_id}"
+
+
+def latest_sequence(hairdresser_id):
+    from .models import ChangeStamp
+
+    return (
+        ChangeStamp.objects.filter(scope=agenda_scope(hairdresser_id))
+        .values_list("version", flat=True)
+        .first()
+        or 0
+    )
+
+
+def next_sequence(hairdresser_id):
+    """
+    Incrementa el contador de la peluquería y retorna el nuevo valor, leído de
+    la misma fila bloqueada. La fila queda bloqueada hasta el commit de la
+    transacción que lo llama.
+    """
+    from .models import ChangeStamp
+
+    now = timezone.now()
+    stamp, created = ChangeStamp.objects.select_for_update().get_or_create(
+        scope=agenda_scope(hairdresser_id),
+        # Mismo valor inicial que bump() (ver core/caching.py)
+        defaults={"version": time.time_ns() // 1000, "changed_at": now},
+    )
+    if not created:
+        stamp.version += 1
+        stamp.changed_at = now
+        stamp.save(update_fields=["version", "changed_at"])
+    return stamp.version
+
+
+def record_agenda_change(hairdresser_id, kind, object_id):
+    from .models import AgendaChange
+
+    with transaction.atomic():
+        AgendaChange.objects.create(
+            hairdresser_id=hairdresser_id,
+            seq=next_sequence(hairdresser_id),
+            kind=kind,
+            object_id=object_id,
+        )
+
+
+def _appointment_payload(appointment, today):
+    return {
+        "type": "appointment",
+        "id": appointment.pk,
+        "status": appointment.status,
+        "start_time": appointment.start_time.isoformat(),
+        "end_time": appointment.end_time.isoformat(),
+        "today": timezone.localdate(appointment.start_time) == today,
+        "client": appointment.display_client_name,
+        "service": appointment.service.name,
+    }
+
+
+def _pause_payload(pause, today):
+    return {
+        "type": "pause",
+        "id": pause.pk,
+        "start_time": pause.start_time.isoformat(),
+        "end_time": pause.end_time.isoformat(),
+        "today": timezone.localdate(pause.start_time) == today,
+    }
+
+
+def changes_since(hairdresser_id, since):
+    """
+    Cambios posteriores a `since` como (primer número, último número, lista
+    de objetos). Si un mismo turno o pausa cambió varias veces se informa una
+    sola vez, con su estado actual (o deleted si ya no existe). Sin cambios
+    retorna (None, since, []).
+    """
+    from .models import AgendaChange, Appointment, Pause
+
+    rows = list(
+        AgendaChange.objects.filter(hairdresser_id=hairdresser_id, seq__gt=since)
+        .order_by("seq")
+        .values_list("seq", "kind", "object_id")[:BATCH_SIZE]
+    )
+    if not rows:
+        return None, since, []
+
+    ids = {"appointment": [], "pause": []}
+    for _, kind, object_id in rows:
+        if object_id not in ids[kind]:
+            ids[kind].append(object_id)
+
+    today = timezone.localdate()
+    appointments = Appointment.objects.filter(pk__in=ids["appointment"]).select_related(
+        "client", "service"
+    ).in_bulk()
+    pauses = Pause.objects.in_bulk(ids["pause"])
+    items = []
+    for kind, objects, payload in (
+        ("appointment", appointments, _appointment_payload),
+        ("pause", pauses, _pause_payload),
+    ):
+        for object_id in ids[kind]:
+            if object_id in objects:
+                items.append(payload(objects[object_id], today))
+            else:
+                items.append({"type": kind, "id": object_id, "deleted": True})
+    return rows[0][0], rows[-1][0], items
+
+
+def requested_sequence(request, hairdresser_id):
+    """
+    Último número recibido por el navegador: la cabecera Last-Event-ID (que
+    EventSource reenvía al reconectarse) o ?since=. Sin ninguno de los dos se
+    empieza desde el cambio más reciente.
+    """
+    value = request.headers.get("Last-Event-ID") or request.GET.get("since")
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return latest_sequence(hairdresser_id)
+
+
+def change_batch(hairdresser_id, since):
+    """(último número, datos del lote) o (since, None) si no hubo cambios."""
+    first, seq, items = changes_since(hairdresser_id, since)
+    if not items:
+        return since, None
+    return seq, {
+        "seq": seq,
+        "reset": first != since + 1,
+        "changes": items,
+        "pending_requests_count": day_agenda(hairdresser_id).pending_requests_count,
+    }
+
+
+def prune_agenda_changes(now=None):
+    """Borra los cambios más viejos que AGENDA_CHANGE_RETENTION_HOURS. Retorna cuántos borró."""
+    from .models import AgendaChange
+
+    cutoff = (now or timezone.now()) - timedelta(hours=settings.AGENDA_CHANGE_RETENTION_HOURS)
+    deleted, _ = AgendaChange.objects.filter(created_at__lt=cutoff).delete()
+    return deleted
+
+
+def sse_event(seq, data):
+    return f"id: {seq}\nevent: agenda\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_comment(text):
+    return f": {text}\n\n"
+
+
+def event_stream(hairdresser_id, since, seconds):
+    """
+    Generador SSE: envía cada lote de cambios apenas se confirma y un
+    comentario cada HEARTBEAT_SECONDS sin cambios. Termina a los `seconds`
+    segundos (tras una primera revisión aunque sea 0).
+    """
+    deadline = time.monotonic() + seconds
+    last_write = time.monotonic()
+    yield f"retry: {RETRY_MILLISECONDS}\n\n"
+    while True:
+        since, batch = change_batch(hairdresser_id, since)
+        now = time.monotonic()
+        if batch:
+            yield sse_event(since, batch)
+            last_write = now
+        elif now - last_write >= HEARTBEAT_SECONDS:
+            yield sse_comment("ping")
+            last_write = now
+        if now >= deadline:
+            return
+        time.sleep(POLL_SECONDS)
+
+
+async def aevent_stream(hairdresser_id, since, seconds):
+    """event_stream() para ASGI: la espera entre revisiones no ocupa un hilo."""
+    deadline = time.monotonic() + seconds
+    last_write = time.monotonic()
+    yield f"retry: {RETRY_MILLISECONDS}\n\n"
+    while True:
+        since, batch = await sync_to_async(change_batch)(hairdresser_id, since)
+        now = time.monotonic()
+        if batch:
+            yield sse_event(since, batch)
+            last_write = now
+        elif now - last_write >= HEARTBEAT_SECONDS:
+            yield sse_comment("ping")
+            last_write = now
+        if now >= deadline:
+            return
+        await asyncio.sleep(POLL_SECONDS)
+
+
+def _empty_batch(since):
+    return {"seq": since, "reset": False, "changes": []}
+
+
+def wait_for_changes(hairdresser_id, since, seconds):
+    """Long-poll: el primer lote de cambios, o un lote vacío a los `seconds` segundos."""
+    deadline = time.monotonic() + seconds
+    while True:
+        since, batch = change_batch(hairdresser_id, since)
+        if batch:
+            return batch
+        if time.monotonic() >= deadline:
+            return _empty_batch(since)
+        time.sleep(POLL_SECONDS)
+
+
+async def await_changes(hairdresser_id, since, seconds):
+    """wait_for_changes() para ASGI."""
+    deadline = time.monotonic() + seconds
+    while True:
+        since, batch = await sync_to_async(change_batch)(hairdresser_id, since)
+        if batch:
+            return batch
+        if time.monotonic() >= deadline:
+            return _empty_batch(since)
+        await asyncio.sleep(POLL_SECONDS)
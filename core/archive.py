@@ -0,0 +1,155 @@
+"""
+Archivo de turnos finalizados (partición activa / histórica).
+
+Los turnos COMPLETED, CANCELLED y NO_SHOW con más de
+APPOINTMENT_ARCHIVE_AFTER_DAYS días (0 = nunca) ya no cambian, pero
+engordan las tablas e índices que usan la agenda, las reservas y los
+webhooks. archive_appointments() los mueve, junto con sus reseñas y
+transacciones de pago, a ArchivedAppointment, ArchivedReview y
+ArchivedPaymentTransaction, en lotes pequeños, cada uno en su propia
+transacción. Se conservan los ids originales, así que los ids de ambas
+tablas no se repiten.
+
+Los turnos con un reembolso pendiente (PendingRefund) no se archivan: el
+reintento del reembolso los necesita en la tabla activa. Las celdas de
+agenda (SlotClaim) y las ofertas de adelanto (EarlyStartOffer) de los
+turnos archivados se borran: solo sirven para turnos por venir.
+
+Lo que lee el historial lo lee de ambas tablas: los listados y las reseñas
+intercalan las dos con keyset_paginate_many() (core/pagination.py), las
+estadísticas suman los agregados de cada una con merged_totals() y las
+exportaciones las unen con UNION ALL.
+"""
+
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .caching import bump, hairdresser_scope
+from .models import (
+    Appointment,
+    ArchivedAppointment,
+    ArchivedPaymentTransaction,
+    ArchivedReview,
+    EarlyStartOffer,
+    PaymentTransaction,
+    PendingRefund,
+    Review,
+    SlotClaim,
+)
+
+ARCHIVE_STATUSES = ("COMPLETED", "CANCELLED", "NO_SHOW")
+
+# Turnos movidos por transacción
+BATCH_SIZE = 200
+
+# Campos copiados tal cual de cada modelo activo a su modelo archivado
+APPOINTMENT_FIELDS = (
+    "id", "client_id", "service_id", "start_time", "end_time", "amount", "status", "created_at",
+    "payment_method", "amount_paid", "mercadopago_payment_id", "client_name", "search_text",
+)
+REVIEW_FIELDS = ("id", "appointment_id", "rating", "comment", "created_at")
+TRANSACTION_FIELDS = ("id", "appointment_id", "payment_id", "amount", "status", "created_at")
+
+# Modelos que apuntan a Appointment: se archivan o se borran con el turno
+ARCHIVED_RELATED = (Review, PaymentTransaction)
+DELETED_RELATED = (SlotClaim, EarlyStartOffer)
+
+
+def archivable_appointments(now=None):
+    """Turnos activos que ya pueden archivarse, o None si el archivo está desactivado."""
+    days = settings.APPOINTMENT_ARCHIVE_AFTER_DAYS
+    if not days:
+        return None
+    cutoff = (now or timezone.now()) - timedelta(days=days)
+    return Appointment.objects.filter(status__in=ARCHIVE_STATUSES, start_time__lt=cutoff).exclude(
+        pk__in=PendingRefund.objects.values("appointment_id")
+    )
+
+
+def _copy(queryset, fields, archived_model):
+    archived_model.objects.bulk_create(
+        [archived_model(**row) for row in queryset.values(*fields)], batch_size=BATCH_SIZE
+    )
+
+
+def _archive_batch(batch):
+    """
+    Mueve un lote de turnos (con sus reseñas y transacciones) al archivo.
+    Los turnos se bloquean y sus ids se fijan en una sola lectura: ningún
+    turno puede dejar de cumplir las condiciones (cambiar de estado o recibir
+    un reembolso pendiente) a mitad del lote, y lo que se copia es
+    exactamente lo que se borra.
+    """
+    ids = list(batch.select_for_update().values_list("pk", flat=True))
+    if not ids:
+        return 0
+    appointments = Appointment.objects.filter(pk__in=ids)
+    scopes = [
+        hairdresser_scope(hairdresser_id)
+        for hairdresser_id in appointments.order_by()
+        .values_list("service__hairdresser_id", flat=True)
+        .distinct()
+    ]
+    _copy(appointments, APPOINTMENT_FIELDS, ArchivedAppointment)
+    _copy(Review.objects.filter(appointment_id__in=ids), REVIEW_FIELDS, ArchivedReview)
+    _copy(
+        PaymentTransaction.objects.filter(appointment_id__in=ids),
+        TRANSACTION_FIELDS,
+        ArchivedPaymentTransaction,
+    )
+
+    # Sin señales: no son cambios de agenda ni de reseñas (el resumen de
+    # calificaciones ya cuenta las reseñas archivadas). PaymentTransaction
+    # protege al turno y no permite borrar instancias, así que va directo.
+    for model in ARCHIVED_RELATED + DELETED_RELATED:
+        related = model.objects.filter(appointment_id__in=ids)
+        related._raw_delete(related.db)
+    appointments._raw_delete(appointments.db)
+    bump(*scopes)
+    return len(ids)
+
+
+def archive_appointments(now=None, batch_size=BATCH_SIZE, pause_seconds=0, dry_run=False):
+    """Archiva por lotes los turnos finalizados antiguos. Retorna cuántos movió (o movería)."""
+    queryset = archivable_appointments(now)
+    if queryset is None:
+        return 0
+    if dry_run:
+        return queryset.count()
+
+    archived = 0
+    while True:
+        ids = list(queryset.order_by("pk").values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            return archived
+        with transaction.atomic():
+            # Se vuelven a aplicar las condiciones: un turno pudo cambiar de
+            # estado o recibir un reembolso pendiente desde que se eligió el lote
+            archived += _archive_batch(queryset.filter(pk__in=ids))
+        if pause_seconds:
+            # Deja pasar a otras escrituras entre lote y lote
+            time.sleep(pause_seconds)
+
+
+def merged_totals(querysets, fields=(), **aggregates):
+    """
+    Agrega cada queryset (p. ej. turnos activos y archivados) agrupando por
+    `fields` y suma los resultados de todos. Retorna {(valores de fields):
+    {agregado: total}}; sin fields, una sola clave ().
+    """
+    totals = {}
+    for queryset in querysets:
+        if fields:
+            rows = queryset.values(*fields).annotate(**aggregates).order_by()
+        else:
+            rows = [queryset.aggregate(**aggregates)]
+        for row in rows:
+            key = tuple(row[field] for field in fields)
+            current = totals.setdefault(key, dict.fromkeys(aggregates, 0))
+            for name in aggregates:
+                current[name] += row[name] or 0
+    return totals
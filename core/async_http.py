@@ -0,0 +1,66 @@
+"""
+Cliente HTTP no bloqueante para las vistas async (ASGI, ver core/async_views.py).
+
+Las llamadas usan un único httpx.AsyncClient por proceso, que reutiliza las
+conexiones (y los handshakes TLS) con MercadoPago y Nominatim entre
+peticiones y no ocupa ningún hilo mientras espera. Un cliente queda atado al
+event loop en el que abrió sus conexiones, así que se crea uno nuevo si el
+loop cambia (p. ej. con async_to_sync, que corre cada llamada en su propio
+loop). Se retorna un requests.Response y los errores de red se traducen a
+las excepciones de requests, de modo que el manejo de la respuesta es el
+mismo que en las vistas sincrónicas.
+"""
+
+import asyncio
+
+import requests
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import httpx
+except ImportError as e:
+    raise ImproperlyConfigured(
+        "ASYNC_VIEWS=True requiere httpx (declarado en pyproject.toml): uv sync o pip install httpx"
+    ) from e
+
+# (event loop, cliente) del proceso
+_client = None
+
+
+def _get_client():
+    global _client
+    loop = asyncio.get_running_loop()
+    if _client is None or _client[0] is not loop or _client[1].is_closed:
+        # Las conexiones del cliente anterior quedan en un loop ya cerrado
+        _client = (loop, httpx.AsyncClient())
+    return _client[1]
+
+
+def _to_requests_response(response):
+    converted = requests.Response()
+    converted.status_code = response.status_code
+    converted.reason = response.reason_phrase
+    converted.url = str(response.url)
+    converted.headers.update(response.headers)
+    converted.encoding = response.encoding
+    converted._content = response.content
+    return converted
+
+
+async def request(method, url, *, timeout=10, **kwargs):
+    """kwargs admitidos: params, data, json y headers (como en requests)."""
+    try:
+        response = await _get_client().request(method, url, timeout=timeout, **kwargs)
+    except httpx.TimeoutException as e:
+        raise requests.Timeout(str(e)) from e
+    except httpx.RequestError as e:
+        raise requests.ConnectionError(str(e)) from e
+    return _to_requests_response(response)
+
+
+async def get(url, **kwargs):
+    return await request("GET", url, **kwargs)
+
+
+async def post(url, **kwargs):
+    return await request("POST", url, **kwargs)
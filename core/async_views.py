@@ -0,0 +1,135 @@
+"""
+Versiones async (ASGI) de las vistas que pasan la mayor parte del tiempo
+esperando a una API externa: la reserva con preferencia de MercadoPago, la
+vinculación OAuth de MercadoPago y la geocodificación, y el feed en vivo de
+la estación de trabajo, que pasa casi todo el tiempo esperando cambios.
+
+Se activan con ASYNC_VIEWS=True (ver core/urls.py) cuando el sitio corre bajo
+un servidor ASGI; en despliegues WSGI se siguen usando las vistas de
+core/views.py. La validación, las escrituras y los mensajes reutilizan la
+lógica de esas vistas (vía sync_to_async) y solo la llamada HTTP se hace con
+await (core/async_http.py): mientras se espera a la API no se ocupa ningún
+hilo del servidor.
+"""
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.http import HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+
+from . import async_http
+from .agenda import aevent_stream, await_changes, requested_sequence
+from .metrics import track_outbound
+from .models import Hairdresser
+from .utils import ageocode_address
+from .views import (
+    HairdresserDetailView,
+    _mercadopago_token_failed,
+    _mercadopago_token_request,
+    _save_mercadopago_token,
+    _workstation_hairdresser_id,
+)
+
+
+_hairdresser_detail = HairdresserDetailView.as_view()
+
+
+async def hairdresser_detail(request, pk):
+    if request.method != "POST":
+        return await sync_to_async(_hairdresser_detail)(request, pk=pk)
+
+    view = HairdresserDetailView()
+    view.setup(request, pk=pk)
+    reservation = await sync_to_async(view.reserve)(request)
+    if isinstance(reservation, JsonResponse):
+        return reservation
+    appointment, payment_amount = reservation
+
+    # requires_payment=True: crear preferencia en MercadoPago
+    try:
+        pref_url, payload, mp_headers = await sync_to_async(view.preference_request)(
+            request, appointment, payment_amount
+        )
+        with track_outbound("mercadopago") as call:
+            mp_response = call.response = await async_http.post(
+                pref_url, json=payload, headers=mp_headers, timeout=10
+            )
+        return await sync_to_async(view.preference_response)(appointment, mp_response)
+    except Exception as e:
+        return await sync_to_async(view.preference_failed)(appointment, e)
+
+
+async def geocode_address_api(request):
+    user = await request.auser()
+    if not (
+        user.is_authenticated
+        and user.is_owner
+        and await Hairdresser.objects.filter(owner=user).aexists()
+    ):
+        return JsonResponse({"error": "No autorizado"}, status=403)
+
+    address = request.GET.get("address", "").strip()
+    if not address:
+        return JsonResponse({"error": "La dirección es requerida."}, status=400)
+
+    coords = await ageocode_address(address)
+    if coords:
+        return JsonResponse({
+            "success": True,
+            "latitude": coords["latitude"],
+            "longitude": coords["longitude"],
+        })
+    else:
+        return JsonResponse({
+            "success": False,
+            "error": "No se pudo encontrar la dirección en el mapa.",
+        }, status=404)
+
+
+@login_required
+async def mercadopago_callback(request):
+    prepared = await sync_to_async(_mercadopago_token_request)(request)
+    if isinstance(prepared, HttpResponseRedirect):
+        return prepared
+    hairdresser, token_url, payload, headers = prepared
+
+    try:
+        with track_outbound("mercadopago") as call:
+            response = call.response = await async_http.post(
+                token_url, data=payload, headers=headers, timeout=10
+            )
+    except Exception as e:
+        return await sync_to_async(_mercadopago_token_failed)(request, e)
+    return await sync_to_async(_save_mercadopago_token)(request, hairdresser, response)
+
+
+async def _workstation_feed_params(request):
+    """(peluquería, último cambio recibido) o None si el usuario no es dueño."""
+    hairdresser_id = await sync_to_async(_workstation_hairdresser_id)(request)
+    if hairdresser_id is None:
+        return None
+    since = await sync_to_async(requested_sequence)(request, hairdresser_id)
+    return hairdresser_id, since
+
+
+@login_required
+async def workstation_events(request):
+    params = await _workstation_feed_params(request)
+    if params is None:
+        return JsonResponse({"error": "No autorizado"}, status=403)
+
+    response = StreamingHttpResponse(
+        aevent_stream(*params, settings.WORKSTATION_STREAM_SECONDS),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@login_required
+async def workstation_changes(request):
+    params = await _workstation_feed_params(request)
+    if params is None:
+        return JsonResponse({"error": "No autorizado"}, status=403)
+    return JsonResponse(await await_changes(*params, settings.WORKSTATION_LONGPOLL_SECONDS))
@@ -0,0 +1,161 @@
+"""
+Caché de datos públicos versionada por ámbito.
+
+Cada ámbito ("catalog" para el listado/mapa y "hairdresser:<id>" para cada
+peluquería) tiene un contador en ChangeStamp que las señales incrementan al
+guardar o borrar sus datos. Las claves de caché incluyen la versión vigente,
+por lo que un cambio invalida todas las entradas del ámbito de una vez sin
+recorrerlas: las viejas dejan de pedirse y expiran solas.
+
+Las versiones se leen de la base de datos (una consulta indexada) y no de la
+caché, así que el resultado es coherente aunque cada proceso tenga su propia
+caché en memoria.
+"""
+
+import hashlib
+import time
+from functools import wraps
+
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+CATALOG_SCOPE = "catalog"
+
+# Tiempo máximo que una entrada queda en caché (las versiones ya garantizan
+# que no se sirva nada desactualizado; esto solo acota la memoria usada).
+DEFAULT_TIMEOUT = 60 * 60
+
+
+def hairdresser_scope(hairdresser_id):
+    return f"hairdresser:{hairdresser_id}"
+
+
+def bump(*scopes):
+    """Incrementa la versión de los ámbitos indicados."""
+    from .models import ChangeStamp
+
+    now = timezone.now()
+    for scope in scopes:
+        updated = ChangeStamp.objects.filter(scope=scope).update(
+            version=F("version") + 1, changed_at=now
+        )
+        if not updated:
+            # La versión inicial se toma del reloj (µs) para no repetir números
+            # ya usados en claves si la fila se pierde (restauraciones, tests).
+            ChangeStamp.objects.get_or_create(
+                scope=scope,
+                defaults={"version": time.time_ns() // 1000, "changed_at": now},
+            )
+
+
+def get_stamps(*scopes):
+    """
+    Retorna {ámbito: (versión, changed_at)} en una sola consulta. Los ámbitos
+    que todavía no cambiaron nunca se informan como (0, None).
+    """
+    from .models import ChangeStamp
+
+    stamps = {scope: (0, None) for scope in scopes}
+    for scope, version, changed_at in ChangeStamp.objects.filter(
+        scope__in=scopes
+    ).values_list("scope", "version", "changed_at"):
+        stamps[scope] = (version, changed_at)
+    return stamps
+
+
+def make_key(name, stamps, *parts):
+    """Clave de caché para `name` en las versiones dadas y con los parámetros `parts`."""
+    versions = ".".join(str(version) for version, _ in stamps.values())
+    digest = hashlib.md5(repr(parts).encode()).hexdigest()
+    return f"stilo:{name}:{versions}:{digest}"
+
+
+def cached(name, stamps, parts, builder, timeout=DEFAULT_TIMEOUT):
+    """
+    Retorna el valor guardado para (name, versiones, parts) o lo calcula con
+    `builder()` y lo guarda.
+    """
+    key = make_key(name, stamps, *parts)
+    value = cache.get(key)
+    if value is None:
+        value = builder()
+        cache.set(key, value, timeout)
+    return value
+
+
+def request_stamps(request, *scopes):
+    """
+    get_stamps() memorizado en el request, para que la validación condicional
+    y la vista compartan una única consulta.
+    """
+    memo = request.__dict__.setdefault("_change_stamps", {})
+    if scopes not in memo:
+        memo[scopes] = get_stamps(*scopes)
+    return memo[scopes]
+
+
+def conditional_on_stamps(get_scopes, per_user=False):
+    """
+    Decorador para respuestas GET que dependen solo de los ámbitos retornados
+    por get_scopes(request, *args, **kwargs) (None si no aplica).
+
+    Calcula ETag y Last-Modified a partir de las versiones, de modo que un
+    If-None-Match/If-Modified-Since vigente se responde con 304 sin ejecutar
+    la vista. Con per_user=True el ETag incluye al usuario, no se envía
+    Last-Modified y la respuesta se marca como privada.
+    """
+
+    def _stamps(request, args, kwargs):
+        memo = request.__dict__.setdefault("_conditional_scopes", {})
+        if "scopes" not in memo:
+            memo["scopes"] = get_scopes(request, *args, **kwargs)
+        scopes = memo["scopes"]
+        return None if scopes is None else request_stamps(request, *scopes)
+
+    def etag_func(request, *args, **kwargs):
+        stamps = _stamps(request, args, kwargs)
+        if stamps is None:
+            return None
+        parts = [request.get_full_path()]
+        if per_user:
+            parts.append(request.user.pk)
+        # La misma información que la clave de caché: versiones y parámetros
+        return make_key("etag", stamps, *parts).split(":", 2)[2]
+
+    def last_modified_func(request, *args, **kwargs):
+        stamps = _stamps(request, args, kwargs)
+        if per_user or stamps is None:
+            return None
+        dates = [changed_at for _, changed_at in stamps.values() if changed_at]
+        return max(dates) if dates else None
+
+    def decorator(view_func):
+        conditional_view = condition(
+            etag_func=etag_func, last_modified_func=last_modified_func
+        )(view_func)
+
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if response.status_code not in (200, 304):
+                # Los validadores describen la representación de las versiones,
+                # no un error o una redirección: con ellos el navegador
+                # revalidaría el error y recibiría 304 hasta el próximo cambio
+                for header in ("ETag", "Last-Modified"):
+                    if response.has_header(header):
+                        del response[header]
+            # Sin max-age el navegador podría reutilizar la respuesta por una
+            # frescura heurística (según Last-Modified); no-cache lo obliga a
+            # revalidar siempre, lo que aquí cuesta un 304.
+            if per_user:
+                patch_cache_control(response, private=True, no_cache=True)
+            else:
+                patch_cache_control(response, no_cache=True)
+            return response
+
+        return _wrapped_view
+
+    return decorator
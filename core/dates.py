@@ -0,0 +1,36 @@
+"""
+Rangos de fechas locales como intervalos [inicio, fin) de datetimes aware.
+
+Filtrar con `start_time__date=dia` obliga a la base de datos a convertir
+cada fila a la zona horaria local antes de comparar, y ningún índice sobre
+start_time sirve para eso. Un rango `start_time__gte=inicio,
+start_time__lt=fin` con los límites del día local compara la columna tal
+cual y se resuelve con el índice. Los QuerySet de turnos y pausas usan
+estas funciones en on_day() e in_month() (ver core/models.py).
+"""
+
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+
+def local_day_range(day, days=1):
+    """[inicio, fin) de `days` días locales a partir de la fecha day."""
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    end = timezone.make_aware(datetime.combine(day + timedelta(days=days), time.min))
+    return start, end
+
+
+def local_month_range(day):
+    """[inicio, fin) del mes local que contiene la fecha day."""
+    first = day.replace(day=1)
+    next_month = (first + timedelta(days=32)).replace(day=1)
+    return local_day_range(first, days=(next_month - first).days)
+
+
+def month_from_param(value):
+    """Primer día del mes de un parámetro YYYY-MM, o del mes local actual si falta o es inválido."""
+    try:
+        return datetime.strptime(value or "", "%Y-%m").date()
+    except ValueError:
+        return timezone.localdate().replace(day=1)
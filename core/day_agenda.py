@@ -0,0 +1,134 @@
+"""
+Agenda del día de una peluquería, compartida por la estación de trabajo y
+las acciones del dueño.
+
+day_agenda() arma con una sola consulta de turnos (más una de pausas) los
+turnos y pausas del día y la cantidad de solicitudes pendientes de otros
+días, y lo guarda en caché con la versión del ámbito "hairdresser:<id>" (ver
+core/caching.py): cualquier alta, cambio o baja de un turno o una pausa
+invalida la copia. La clasificación en turno actual, siguiente, próximos y
+finalizados depende de la hora, así que se calcula al leerla, en memoria.
+"""
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .caching import cached, get_stamps, hairdresser_scope
+from .dates import local_day_range
+
+FINISHED_STATUSES = ("COMPLETED", "NO_SHOW", "CANCELLED")
+
+# Una copia por día y versión; las de días anteriores dejan de pedirse
+DAY_AGENDA_TIMEOUT = 60 * 60 * 24
+
+
+class DayAgenda:
+    """Turnos (ordenados por horario) y pausas de un día de una peluquería."""
+
+    def __init__(self, day, appointments, pauses, pending_requests_count):
+        self.day = day
+        self.appointments = appointments
+        self.pauses = pauses
+        # Solicitudes pendientes de confirmación manual para otros días
+        self.pending_requests_count = pending_requests_count
+
+    def active_after(self, moment):
+        """Turnos no finalizados que comienzan después de moment, en orden."""
+        return [
+            app
+            for app in self.appointments
+            if app.status not in FINISHED_STATUSES and app.start_time > moment
+        ]
+
+    def next_appointment(self, now):
+        """Próximo turno del día que todavía no comenzó (para ofrecer adelantarlo)."""
+        upcoming = self.active_after(now)
+        return upcoming[0] if upcoming else None
+
+    def workstation(self, now):
+        """Turnos y pausas clasificados como los muestra la estación de trabajo."""
+        current_appointment = None
+        next_appointment = None
+        upcoming_appointments = []
+        completed_appointments = []
+
+        for app in self.appointments:
+            if app.status in FINISHED_STATUSES:
+                completed_appointments.append(app)
+            # El primer turno que ya comenzó (o debió comenzar) es el actual
+            elif app.start_time <= now and not current_appointment:
+                current_appointment = app
+            elif not next_appointment:
+                next_appointment = app
+            else:
+                upcoming_appointments.append(app)
+
+        active_pause = next(
+            (p for p in self.pauses if p.start_time <= now < p.end_time), None
+        )
+
+        # Timeline de eventos futuros (turnos en espera y pausas futuras)
+        upcoming_timeline = [
+            {"type": "appointment", "time": app.start_time, "object": app}
+            for app in upcoming_appointments
+        ]
+        upcoming_timeline += [
+            {
+                "type": "pause",
+                "time": p.start_time,
+                "object": p,
+                "duration": int((p.end_time - p.start_time).total_seconds() / 60),
+            }
+            for p in self.pauses
+            if p.start_time > now
+        ]
+        upcoming_timeline.sort(key=lambda x: x["time"])
+
+        return {
+            "current_appointment": current_appointment,
+            "next_appointment": next_appointment,
+            "completed_appointments": completed_appointments,
+            "active_pause": active_pause,
+            "upcoming_timeline": upcoming_timeline,
+        }
+
+
+def build_day_agenda(hairdresser_id, day):
+    from .models import Appointment, Pause
+
+    # Los turnos del día y las solicitudes pendientes en la misma consulta:
+    # las pendientes de confirmación manual son pocas y solo se cuentan
+    start, end = local_day_range(day)
+    appointments = []
+    pending_requests_count = 0
+    for app in (
+        Appointment.objects.filter(service__hairdresser_id=hairdresser_id)
+        .filter(
+            Q(start_time__gte=start, start_time__lt=end)
+            | Q(status="PENDING", expires_at__isnull=True)
+        )
+        .select_related("client", "service__hairdresser")
+        .order_by("start_time")
+    ):
+        if start <= app.start_time < end:
+            appointments.append(app)
+        else:
+            pending_requests_count += 1
+
+    pauses = list(
+        Pause.objects.filter(hairdresser_id=hairdresser_id).on_day(day).order_by("start_time")
+    )
+    return DayAgenda(day, appointments, pauses, pending_requests_count)
+
+
+def day_agenda(hairdresser_id, day=None):
+    """Agenda del día (hoy, por defecto) desde la caché o recién armada."""
+    day = day or timezone.localdate()
+    stamps = get_stamps(hairdresser_scope(hairdresser_id))
+    return cached(
+        "day_agenda",
+        stamps,
+        (hairdresser_id, day.isoformat()),
+        lambda: build_day_agenda(hairdresser_id, day),
+        timeout=DAY_AGENDA_TIMEOUT,
+    )
@@ -0,0 +1,340 @@
+"""
+Generación masiva de datos sintéticos (seed_demo --bulk y bench).
+
+Las filas se escriben con bulk_create en bloques, sin pasar por save(): no
+se ejecutan la consulta previa de Appointment.save() ni las notificaciones.
+Los campos que save() calcularía (end_time, amount) y las celdas de agenda
+de los turnos activos (SlotClaim) se completan aquí, el resumen de
+calificaciones se recalcula al final y se incrementan las versiones de
+caché, ya que bulk_create no dispara señales.
+
+Los turnos de cada peluquería se ubican recorriendo su agenda en orden, de
+modo que los turnos activos nunca se superponen entre sí ni con las pausas.
+"""
+
+import datetime
+import math
+import random
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+OPENING_TIME = datetime.time(9, 0)
+CLOSING_TIME = datetime.time(20, 0)
+WORKING_DAYS = range(6)  # Lunes a sábado
+SLOT_MINUTES = 15
+
+# Proporción aproximada de turnos en el pasado (el resto queda a futuro)
+PAST_RATIO = 0.85
+
+PAST_STATUSES = (["COMPLETED", "NO_SHOW", "CANCELLED"], [80, 8, 12])
+FUTURE_STATUSES = (["CONFIRMED", "PENDING", "CANCELLED"], [75, 15, 10])
+RATINGS = ([5, 4, 3, 2, 1], [50, 30, 10, 5, 5])
+COMMENTS = [
+    "",
+    "Excelente atención.",
+    "Me encantó el resultado.",
+    "Muy profesionales, lo recomiendo.",
+    "Tuve que esperar un poco, pero quedó bien.",
+]
+# Probabilidad de que un turno pagado se haya pagado online (con transacción)
+ONLINE_PAYMENT_RATIO = 0.25
+# Probabilidad de cortar la agenda con una pausa en lugar de un turno
+PAUSE_RATIO = 0.01
+
+
+def _timeline(rng, services, count, start_day, local_tz):
+    """
+    Genera (servicio, inicio, fin) o ("PAUSE", inicio, fin) recorriendo la
+    agenda desde start_day, dejando huecos al azar entre turnos.
+    """
+    day = start_day
+    while day.weekday() not in WORKING_DAYS:
+        day += datetime.timedelta(days=1)
+    cursor = datetime.datetime.combine(day, OPENING_TIME, local_tz)
+    generated = 0
+    while generated < count:
+        closing = datetime.datetime.combine(day, CLOSING_TIME, local_tz)
+        cursor += datetime.timedelta(minutes=SLOT_MINUTES * rng.choice([0, 0, 1, 2, 4]))
+        if rng.random() < PAUSE_RATIO:
+            service, minutes = "PAUSE", 60
+        else:
+            service = rng.choice(services)
+            minutes = math.ceil(service.duration_minutes / SLOT_MINUTES) * SLOT_MINUTES
+        end = cursor + datetime.timedelta(minutes=minutes)
+        if end > closing:
+            day += datetime.timedelta(days=1)
+            while day.weekday() not in WORKING_DAYS:
+                day += datetime.timedelta(days=1)
+            cursor = datetime.datetime.combine(day, OPENING_TIME, local_tz)
+            continue
+        yield service, cursor, end
+        cursor = end
+        if service != "PAUSE":
+            generated += 1
+
+
+def _start_day(rng, services, count):
+    """Primer día de la agenda, para que ~PAST_RATIO de los turnos queden en el pasado."""
+    average_minutes = sum(
+        math.ceil(s.duration_minutes / SLOT_MINUTES) * SLOT_MINUTES for s in services
+    ) / len(services) + SLOT_MINUTES * 1.4  # hueco promedio
+    per_day = (CLOSING_TIME.hour - OPENING_TIME.hour) * 60 / average_minutes
+    working_days = count * PAST_RATIO / per_day
+    calendar_days = math.ceil(working_days * 7 / len(WORKING_DAYS))
+    return timezone.localdate() - datetime.timedelta(days=calendar_days)
+
+
+def _with_pks(model, created, *key_fields):
+    """
+    Asigna los pk a las instancias de bulk_create. Solo los motores que
+    retornan las filas insertadas (PostgreSQL, SQLite, MariaDB) los completan;
+    en MySQL se releen por una clave única (key_fields) antes de crear las
+    filas que apuntan a ellas.
+    """
+    if connection.features.can_return_rows_from_bulk_insert or not created:
+        return created
+
+    def key(obj):
+        return tuple(getattr(obj, field) for field in key_fields)
+
+    lookups = {f"{field}__in": {getattr(obj, field) for obj in created} for field in key_fields}
+    pks = {key(row): row.pk for row in model.objects.filter(**lookups).only("pk", *key_fields)}
+    for obj in created:
+        obj.pk = pks[key(obj)]
+        obj._state.adding = False
+        obj._state.db = connection.alias
+    return created
+
+
+def generate_bulk_dataset(
+    shops,
+    services_per_shop,
+    appointments_per_shop,
+    review_ratio=0.3,
+    seed=2026,
+    chunk_size=5000,
+    prefix="demo",
+    log=None,
+):
+    """
+    Crea peluquerías completas con sus turnos, reseñas, pausas y
+    transacciones de pago. Retorna un resumen con las cantidades creadas y
+    algunas instancias de referencia (primera peluquería, su dueño, etc.).
+    """
+    from django.contrib.auth.hashers import make_password
+
+    from .caching import CATALOG_SCOPE, bump, hairdresser_scope
+    from .models import (
+        Appointment,
+        Hairdresser,
+        PaymentTransaction,
+        Pause,
+        Review,
+        Service,
+        SlotClaim,
+        User,
+        WorkingHours,
+    )
+    from .slots import is_blocking, slot_cells
+
+    log = log or (lambda message: None)
+    rng = random.Random(seed)
+    local_tz = timezone.get_current_timezone()
+    now = timezone.now()
+    # Un único hash para todos: calcularlo por usuario llevaría horas
+    password = make_password(prefix)
+
+    with transaction.atomic():
+        clients = User.objects.bulk_create(
+            [
+                User(
+                    username=f"{prefix}_cliente{i}",
+                    first_name="Cliente",
+                    last_name=str(i),
+                    email=f"{prefix}_cliente{i}@example.com",
+                    password=password,
+                )
+                for i in range(max(50, shops * 10))
+            ],
+            batch_size=chunk_size,
+        )
+        _with_pks(User, clients, "username")
+        owners = User.objects.bulk_create(
+            [
+                User(
+                    username=f"{prefix}_dueno{i}",
+                    first_name="Dueño",
+                    last_name=str(i),
+                    email=f"{prefix}_dueno{i}@example.com",
+                    password=password,
+                    is_owner=True,
+                )
+                for i in range(shops)
+            ],
+            batch_size=chunk_size,
+        )
+        _with_pks(User, owners, "username")
+        hairdressers = Hairdresser.objects.bulk_create(
+            [
+                Hairdresser(
+                    owner=owner,
+                    name=f"Peluquería {prefix.title()} {i}",
+                    address=f"Calle {i}",
+                    description="Peluquería generada automáticamente.",
+                    latitude=-24.78 + rng.uniform(-0.05, 0.05),
+                    longitude=-65.41 + rng.uniform(-0.05, 0.05),
+                    slot_duration=SLOT_MINUTES,
+                )
+                for i, owner in enumerate(owners)
+            ],
+            batch_size=chunk_size,
+        )
+        _with_pks(Hairdresser, hairdressers, "owner_id")
+        WorkingHours.objects.bulk_create(
+            [
+                WorkingHours(
+                    hairdresser=hairdresser,
+                    day_of_week=day,
+                    start_time=OPENING_TIME,
+                    end_time=CLOSING_TIME,
+                )
+                for hairdresser in hairdressers
+                for day in WORKING_DAYS
+            ],
+            batch_size=chunk_size,
+        )
+        services = Service.objects.bulk_create(
+            [
+                Service(
+                    hairdresser=hairdresser,
+                    name=f"Servicio {j}",
+                    price=Decimal(rng.randrange(3000, 30000, 500)),
+                    duration_minutes=rng.choice([15, 30, 45, 60, 90]),
+                )
+                for hairdresser in hairdressers
+                for j in range(services_per_shop)
+            ],
+            batch_size=chunk_size,
+        )
+        _with_pks(Service, services, "hairdresser_id", "name")
+    log(f"{len(hairdressers)} peluquerías, {len(services)} servicios y {len(clients)} clientes creados.")
+
+    services_by_shop = {}
+    for service in services:
+        services_by_shop.setdefault(service.hairdresser_id, []).append(service)
+
+    totals = {"appointments": 0, "reviews": 0, "pauses": 0, "transactions": 0}
+    pending_appointments = []
+    # (calificación, comentario) o None, alineado con pending_appointments
+    pending_reviews = []
+    pending_pauses = []
+
+    def flush():
+        if not pending_appointments and not pending_pauses:
+            return
+        with transaction.atomic():
+            # Cada peluquería tiene a lo sumo un turno por horario
+            created = _with_pks(
+                Appointment,
+                Appointment.objects.bulk_create(pending_appointments),
+                "service_id",
+                "start_time",
+            )
+            Pause.objects.bulk_create(pending_pauses)
+            reviews = []
+            transactions = []
+            claims = []
+            for appointment, review in zip(created, pending_reviews):
+                if appointment.end_time > now and is_blocking(appointment, now):
+                    claims.extend(
+                        SlotClaim(
+                            hairdresser_id=appointment.service.hairdresser_id,
+                            slot_start=cell,
+                            appointment=appointment,
+                        )
+                        for cell in slot_cells(appointment.start_time, appointment.end_time)
+                    )
+                if review:
+                    reviews.append(Review(appointment=appointment, rating=review[0], comment=review[1]))
+                if appointment.mercadopago_payment_id:
+                    transactions.append(
+                        PaymentTransaction(
+                            appointment=appointment,
+                            payment_id=appointment.mercadopago_payment_id,
+                            amount=appointment.amount_paid,
+                            status="approved",
+                        )
+                    )
+            Review.objects.bulk_create(reviews)
+            PaymentTransaction.objects.bulk_create(transactions)
+            SlotClaim.objects.bulk_create(claims)
+        totals["appointments"] += len(created)
+        totals["pauses"] += len(pending_pauses)
+        totals["reviews"] += len(reviews)
+        totals["transactions"] += len(transactions)
+        pending_appointments.clear()
+        pending_reviews.clear()
+        pending_pauses.clear()
+        log(f"Turnos creados: {totals['appointments']}")
+
+    for hairdresser in hairdressers:
+        shop_services = services_by_shop[hairdresser.pk]
+        start_day = _start_day(rng, shop_services, appointments_per_shop)
+        for service, start, end in _timeline(
+            rng, shop_services, appointments_per_shop, start_day, local_tz
+        ):
+            if service == "PAUSE":
+                pending_pauses.append(Pause(hairdresser=hairdresser, start_time=start, end_time=end))
+                continue
+
+            statuses = PAST_STATUSES if start < now else FUTURE_STATUSES
+            status = rng.choices(*statuses)[0]
+            payment_method = "CASH"
+            amount_paid = Decimal("0.00")
+            payment_id = None
+            if status in ("COMPLETED", "CONFIRMED") and rng.random() < ONLINE_PAYMENT_RATIO:
+                payment_method = "FULL"
+                amount_paid = service.price
+                payment_id = f"{prefix}-{hairdresser.pk}-{int(start.timestamp())}"
+            appointment = Appointment(
+                client=rng.choice(clients),
+                service=service,
+                start_time=start,
+                end_time=start + datetime.timedelta(minutes=service.duration_minutes),
+                amount=service.price,
+                status=status,
+                payment_method=payment_method,
+                amount_paid=amount_paid,
+                mercadopago_payment_id=payment_id,
+            )
+            # bulk_create no pasa por save(): completar el texto de búsqueda aquí
+            appointment.search_text = appointment.build_search_text()
+            pending_appointments.append(appointment)
+            # Se sortea al armar el turno y no al escribir el bloque: el
+            # dataset de una semilla no depende de chunk_size
+            review = None
+            if status == "COMPLETED" and rng.random() < review_ratio:
+                review = (rng.choices(*RATINGS)[0], rng.choice(COMMENTS))
+            pending_reviews.append(review)
+            if len(pending_appointments) >= chunk_size:
+                flush()
+    flush()
+
+    log("Actualizando resúmenes de calificaciones...")
+    for hairdresser in hairdressers:
+        hairdresser.refresh_rating_summary()
+        bump(hairdresser_scope(hairdresser.pk))
+    bump(CATALOG_SCOPE)
+
+    return dict(
+        totals,
+        hairdressers=len(hairdressers),
+        services=len(services),
+        clients=len(clients),
+        hairdresser=hairdressers[0] if hairdressers else None,
+        service=services[0] if services else None,
+        owner=owners[0] if owners else None,
+        client=clients[0] if clients else None,
+    )
@@ -4,6 +4,8 @@ import requests
 from django.conf import settings
 from django.core.mail.backends.base import BaseEmailBackend
 
+from .metrics import track_outbound
+
 logger = logging.getLogger("core")
 
 
@@ -82,7 +84,8 @@ class BrevoEmailBackend(BaseEmailBackend):
                     payload["textContent"] = text_content
 
                 # Enviar petición POST a Brevo
-                response = requests.post(self.api_url, headers=headers, json=payload, timeout=10)
+                with track_outbound("brevo") as call:
+                    response = call.response = requests.post(self.api_url, headers=headers, json=payload, timeout=10)
 
                 if response.status_code in [200, 201, 202]:
                     sent_counter += 1
@@ -0,0 +1,288 @@
+"""
+Exportación de turnos y transacciones de pago en CSV o XLSX.
+
+Las filas se leen con .values_list() (sin instanciar modelos) y
+.iterator(chunk_size=...) (sin cargar el resultado completo), y se escriben
+a medida que se generan: tanto el endpoint (StreamingHttpResponse) como el
+comando `export_data` usan memoria constante sin importar cuántos años de
+historia se exporten. Los turnos y transacciones archivados (ver
+core/archive.py) se leen en la misma consulta, con UNION ALL.
+
+El XLSX se arma con zipfile sobre un buffer que se vacía después de cada
+escritura: la hoja se escribe fila a fila con celdas de texto en línea
+(inlineStr), así no hace falta la tabla de strings compartidos que obligaría
+a conocer todos los valores antes de empezar.
+"""
+
+import csv
+import re
+import zipfile
+from datetime import datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.utils import timezone
+
+from .dates import local_month_range
+from .utils import normalize_search_text
+
+# Filas leídas de la base de datos por consulta
+CHUNK_SIZE = 2000
+
+# (encabezado, campo para values_list) de cada exportación
+APPOINTMENT_COLUMNS = [
+    ("ID", "id"),
+    ("Inicio", "start_time"),
+    ("Fin", "end_time"),
+    ("Estado", "status"),
+    ("Servicio", "service__name"),
+    ("Nombre", "client__first_name"),
+    ("Apellido", "client__last_name"),
+    ("Email", "client__email"),
+    ("Cliente presencial", "client_name"),
+    ("Monto", "amount"),
+    ("Método de pago", "payment_method"),
+    ("Monto pagado", "amount_paid"),
+    ("ID de pago de MercadoPago", "mercadopago_payment_id"),
+    ("Creado", "created_at"),
+]
+
+TRANSACTION_COLUMNS = [
+    ("ID", "id"),
+    ("Fecha", "created_at"),
+    ("ID de pago de MercadoPago", "payment_id"),
+    ("Estado", "status"),
+    ("Monto", "amount"),
+    ("Turno", "appointment_id"),
+    ("Inicio del turno", "appointment__start_time"),
+    ("Servicio", "appointment__service__name"),
+]
+
+CONTENT_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+def filter_appointments(queryset, status="", month="", q="", prefix=""):
+    """
+    Filtros del listado de turnos del dueño (estado, mes YYYY-MM y búsqueda de
+    cliente). Con prefix="appointment__" se aplican a las transacciones por
+    el turno al que pertenecen.
+    """
+    if status:
+        queryset = queryset.filter(**{f"{prefix}status": status})
+
+    if month:
+        try:
+            selected = datetime.strptime(month, "%Y-%m").date()
+        except ValueError:
+            pass
+        else:
+            start, end = local_month_range(selected)
+            queryset = queryset.filter(
+                **{f"{prefix}start_time__gte": start, f"{prefix}start_time__lt": end}
+            )
+
+    # Cada palabra debe aparecer en el nombre, apellido, email o nombre presencial
+    for term in normalize_search_text(q).split():
+        queryset = queryset.filter(**{f"{prefix}search_text__contains": term})
+    return queryset
+
+
+def appointment_export(hairdresser, status="", month="", q="", chunk_size=CHUNK_SIZE):
+    """(encabezados, filas) de los turnos de una peluquería, del más viejo al más nuevo."""
+    from .models import Appointment, ArchivedAppointment
+
+    querysets = [
+        filter_appointments(model.objects.filter(service__hairdresser=hairdresser), status, month, q)
+        for model in (Appointment, ArchivedAppointment)
+    ]
+    return _export(querysets, APPOINTMENT_COLUMNS, ("start_time", "id"), chunk_size)
+
+
+def transaction_export(hairdresser, status="", month="", q="", chunk_size=CHUNK_SIZE):
+    """(encabezados, filas) de las transacciones de pago de una peluquería."""
+    from .models import ArchivedPaymentTransaction, PaymentTransaction
+
+    querysets = [
+        filter_appointments(
+            model.objects.filter(appointment__service__hairdresser=hairdresser),
+            status,
+            month,
+            q,
+            prefix="appointment__",
+        )
+        for model in (PaymentTransaction, ArchivedPaymentTransaction)
+    ]
+    return _export(querysets, TRANSACTION_COLUMNS, ("created_at", "id"), chunk_size)
+
+
+def _export(querysets, columns, ordering, chunk_size):
+    """
+    Filas activas y archivadas en una sola consulta (UNION ALL), ordenadas
+    por `ordering`, que debe estar entre las columnas exportadas.
+    """
+    headers = [header for header, _ in columns]
+    fields = [field for _, field in columns]
+    first, *rest = [queryset.order_by().values_list(*fields) for queryset in querysets]
+    rows = first.union(*rest, all=True).order_by(*ordering).iterator(chunk_size=chunk_size)
+    return headers, (tuple(_cell(value) for value in row) for row in rows)
+
+
+# Caracteres con los que Excel y LibreOffice interpretan una celda como fórmula
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _cell(value):
+    """
+    Valor exportable: fechas en hora local, montos como número y None vacío.
+    Los textos que empiezan como una fórmula (nombres y comentarios los
+    escriben los clientes) se anteponen con ' para que la planilla no los
+    ejecute.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return timezone.localtime(value).strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class _Echo:
+    """Pseudo-archivo para csv.writer: retorna la línea en lugar de guardarla."""
+
+    def write(self, value):
+        return value
+
+
+def csv_stream(headers, rows):
+    writer = csv.writer(_Echo())
+    # BOM para que Excel abra el archivo como UTF-8
+    yield "\ufeff" + writer.writerow(headers)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+class _StreamBuffer:
+    """
+    Destino de zipfile sin seek(): zipfile escribe entonces cada archivo con
+    descriptor de datos al final, sin volver atrás, y drain() entrega lo
+    escrito hasta el momento.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+# Caracteres de control que XML no admite
+_INVALID_XML = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+# Filas escritas en la hoja entre cada entrega de datos comprimidos
+XLSX_FLUSH_ROWS = 500
+
+XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        "</Types>"
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        "</Relationships>"
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Datos" sheetId="1" r:id="rId1"/></sheets>'
+        "</workbook>"
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        "</Relationships>"
+    ),
+}
+
+
+def _xlsx_row(values):
+    cells = []
+    for value in values:
+        if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+            cells.append(f"<c><v>{value}</v></c>")
+        else:
+            text = escape(_INVALID_XML.sub("", str(value)))
+            cells.append(f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+    return f"<row>{''.join(cells)}</row>".encode()
+
+
+def xlsx_stream(headers, rows):
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_PARTS.items():
+            archive.writestr(name, content)
+        yield buffer.drain()
+
+        # force_zip64: el tamaño final de la hoja no se conoce de antemano
+        with archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                b"<sheetData>"
+            )
+            sheet.write(_xlsx_row(headers))
+            for count, row in enumerate(rows, start=1):
+                sheet.write(_xlsx_row(row))
+                if count % XLSX_FLUSH_ROWS == 0:
+                    yield buffer.drain()
+            sheet.write(b"</sheetData></worksheet>")
+    yield buffer.drain()
+
+
+def export_stream(fmt, headers, rows):
+    """Generador de bytes/texto del archivo en el formato pedido ("csv" o "xlsx")."""
+    if fmt == "xlsx":
+        return xlsx_stream(headers, rows)
+    return csv_stream(headers, rows)
+
+
+EXPORTS = {
+    "turnos": appointment_export,
+    "transacciones": transaction_export,
+}
+
+
+def export_filename(kind, fmt):
+    return f"{kind}-{timezone.localdate().isoformat()}.{fmt}"
@@ -0,0 +1,192 @@
+"""
+Generación de versiones redimensionadas (derivados) de las imágenes de las
+peluquerías.
+
+Los originales que suben los dueños suelen ser fotos de celular de varios MB.
+Para cada HairdresserImage se generan versiones WebP y JPEG a anchos fijos,
+sin metadatos EXIF (ubicación GPS, modelo de cámara, etc.), que las
+plantillas ofrecen mediante srcset para que el navegador elija la adecuada.
+"""
+
+import logging
+import sys
+import threading
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+# Anchos (en px) de las versiones generadas
+DERIVATIVE_WIDTHS = (320, 640, 1280)
+
+# Se incluye en el nombre de los derivados: al cambiar anchos u opciones de
+# codificación hay que incrementarla para no reutilizar archivos viejos.
+DERIVATIVES_VERSION = 1
+
+# formato -> (formato de Pillow, opciones de guardado)
+DERIVATIVE_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+
+def _target_widths(original_width):
+    """
+    Anchos a generar para un original: los de DERIVATIVE_WIDTHS menores al
+    original, más el propio ancho del original si es menor al máximo (nunca
+    se amplía una imagen).
+    """
+    widths = [w for w in DERIVATIVE_WIDTHS if w < original_width]
+    top = min(original_width, DERIVATIVE_WIDTHS[-1])
+    if top not in widths:
+        widths.append(top)
+    return widths
+
+
+def _encode(picture, pillow_format, options):
+    if pillow_format == "JPEG" and picture.mode != "RGB":
+        # JPEG no admite transparencia: se compone sobre fondo blanco
+        from PIL import Image
+
+        background = Image.new("RGB", picture.size, (255, 255, 255))
+        if picture.mode in ("RGBA", "LA", "P"):
+            rgba = picture.convert("RGBA")
+            background.paste(rgba, mask=rgba.getchannel("A"))
+        else:
+            background.paste(picture.convert("RGB"))
+        picture = background
+    elif pillow_format == "WEBP" and picture.mode not in ("RGB", "RGBA"):
+        picture = picture.convert("RGBA" if "A" in picture.getbands() else "RGB")
+
+    buffer = BytesIO()
+    # Al no pasar exif= ni icc_profile=, Pillow no copia metadatos del original
+    picture.save(buffer, format=pillow_format, **options)
+    return buffer.getvalue()
+
+
+def generate_image_derivatives(image, force=False):
+    """
+    Genera (o regenera si force=True, reescribiendo los archivos) las
+    versiones de una HairdresserImage y registra las dimensiones y el hash
+    del original. Retorna la lista de derivados.
+    """
+    from PIL import Image, ImageOps
+
+    from core.caching import CATALOG_SCOPE, bump, hairdresser_scope
+    from core.models import HairdresserImage, ImageDerivative
+    from core.storage import file_content_hash
+
+    if force:
+        # Solo se borran las filas: los archivos pueden estar compartidos con
+        # otra imagen idéntica y los huérfanos los elimina cleanup_orphans.
+        image.derivatives.all().delete()
+    elif image.derivatives.exists():
+        return list(image.derivatives.all())
+
+    with image.image.open("rb") as source:
+        if not image.content_hash:
+            # Imagen anterior al almacenamiento por contenido: su nombre no
+            # identifica el contenido (foto.jpg y foto.png darían los mismos
+            # derivados), así que se calcula el hash ahora
+            image.content_hash = file_content_hash(source)
+            source.seek(0)
+        with Image.open(source) as original:
+            original.load()
+            # Aplicar la rotación indicada por EXIF antes de descartarlo
+            picture = ImageOps.exif_transpose(original)
+
+    original_width, original_height = picture.size
+    HairdresserImage.objects.filter(pk=image.pk).update(
+        width=original_width, height=original_height, content_hash=image.content_hash
+    )
+    image.width, image.height = original_width, original_height
+    # update() no dispara señales: se invalida la caché explícitamente
+    bump(hairdresser_scope(image.hairdresser_id), CATALOG_SCOPE)
+
+    derivatives = []
+    for width in _target_widths(original_width):
+        height = max(1, round(original_height * width / original_width))
+        resized = (
+            picture
+            if width == original_width
+            else picture.resize((width, height), Image.Resampling.LANCZOS)
+        )
+        for fmt, (pillow_format, options) in DERIVATIVE_FORMATS.items():
+            content = ContentFile(_encode(resized, pillow_format, options))
+            derivative = ImageDerivative(
+                image=image, format=fmt, width=width, height=height
+            )
+            filename = f"{image.content_hash}-{width}w-v{DERIVATIVES_VERSION}.{fmt}"
+            if force:
+                # El almacenamiento reutiliza un archivo con el mismo nombre:
+                # con force se borra antes para que se vuelva a escribir
+                derivative.file.storage.delete(
+                    derivative.file.field.generate_filename(derivative, filename)
+                )
+            derivative.file.save(filename, content, save=False)
+            derivative.save()
+            derivatives.append(derivative)
+    return derivatives
+
+
+def _generate_derivatives_thread(image_id):
+    """
+    Función de hilo que genera los derivados de una imagen, liberando la
+    conexión de base de datos al finalizar (excepto en tests).
+    """
+    from core.models import HairdresserImage
+
+    try:
+        image = HairdresserImage.objects.filter(pk=image_id).first()
+        if image:
+            with transaction.atomic():
+                generate_image_derivatives(image)
+    except Exception as e:
+        logger.error(f"Error generando derivados de la imagen {image_id}: {e}")
+    finally:
+        if "test" not in sys.argv:
+            connection.close()
+
+
+def schedule_image_derivatives(image):
+    """
+    Genera los derivados de una imagen recién subida en segundo plano, para no
+    demorar la respuesta de la subida.
+    En modo de pruebas se ejecuta de manera síncrona.
+    """
+    if "test" in sys.argv:
+        _generate_derivatives_thread(image.pk)
+    else:
+        thread = threading.Thread(
+            target=_generate_derivatives_thread, args=(image.pk,)
+        )
+        thread.daemon = True
+        thread.start()
+
+
+def build_srcset(derivatives, fmt):
+    """Arma el valor de srcset ("url 320w, url 640w") para un formato."""
+    return ", ".join(
+        f"{d.file.url} {d.width}w"
+        for d in sorted(derivatives, key=lambda d: d.width)
+        if d.format == fmt
+    )
+
+
+def get_responsive_sources(derivatives):
+    """
+    Datos para un <picture>: srcset WebP, srcset JPEG y la URL JPEG más grande
+    como src de respaldo. Retorna None si la imagen no tiene derivados aún.
+    """
+    derivatives = list(derivatives)
+    if not derivatives:
+        return None
+    jpegs = [d for d in derivatives if d.format == "jpeg"]
+    fallback = max(jpegs, key=lambda d: d.width) if jpegs else None
+    return {
+        "srcset_webp": build_srcset(derivatives, "webp"),
+        "srcset_jpeg": build_srcset(derivatives, "jpeg"),
+        "src": fallback.file.url if fallback else None,
+    }
@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.archive import BATCH_SIZE, archive_appointments
+
+
+class Command(BaseCommand):
+    help = (
+        "Mueve por lotes los turnos finalizados (completados, cancelados o ausentes) más "
+        "viejos que APPOINTMENT_ARCHIVE_AFTER_DAYS, con sus reseñas y pagos, a las tablas de archivo."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Muestra cuántos turnos se archivarían sin moverlos.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help=f'Turnos movidos por transacción (por defecto: {BATCH_SIZE}).',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0,
+            help='Segundos de espera entre lotes, para no competir con el tráfico (por defecto: 0).',
+        )
+
+    def handle(self, *args, **options):
+        days = settings.APPOINTMENT_ARCHIVE_AFTER_DAYS
+        if not days:
+            self.stdout.write("Archivo de turnos desactivado (APPOINTMENT_ARCHIVE_AFTER_DAYS=0).")
+            return
+
+        dry_run = options['dry_run']
+        count = archive_appointments(
+            batch_size=max(1, options['batch_size']),
+            pause_seconds=options['sleep'],
+            dry_run=dry_run,
+        )
+        if dry_run:
+            self.stdout.write(f"[DRY-RUN] Se archivarían {count} turnos de más de {days} días.")
+            self.stdout.write(self.style.WARNING("\nModo simulación activo. No se movió ningún turno."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Archivo finalizado: {count} turnos archivados (más de {days} días)."))
@@ -0,0 +1,215 @@
+import datetime
+import json
+import math
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+def _percentile(values, percent):
+    """Percentil por rango más cercano (suficiente para decenas de muestras)."""
+    ordered = sorted(values)
+    index = max(0, math.ceil(percent / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Crea un dataset sintético en una base de datos temporal y mide la latencia "
+        "(p50/p95) y la cantidad de consultas de los endpoints principales usando el "
+        "cliente de pruebas. Opcionalmente compara contra una línea base guardada."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shops', type=int, default=20, help='Cantidad de peluquerías (por defecto: 20).')
+        parser.add_argument('--services', type=int, default=5, help='Servicios por peluquería (por defecto: 5).')
+        parser.add_argument('--appointments', type=int, default=200, help='Turnos por peluquería (por defecto: 200).')
+        parser.add_argument(
+            '--reviews',
+            type=float,
+            default=0.3,
+            help='Proporción de turnos completados con reseña (por defecto: 0.3).',
+        )
+        parser.add_argument('--iterations', type=int, default=20, help='Requests por endpoint (por defecto: 20).')
+        parser.add_argument('--seed', type=int, default=2026, help='Semilla aleatoria del dataset (por defecto: 2026).')
+        parser.add_argument('--output', help='Archivo donde guardar el resultado en JSON.')
+        parser.add_argument('--baseline', help='Resultado JSON previo contra el cual comparar.')
+        parser.add_argument(
+            '--threshold',
+            type=float,
+            default=0.25,
+            help='Aumento relativo del p95 considerado regresión (por defecto: 0.25 = 25%%).',
+        )
+
+    def handle(self, *args, **options):
+        from django.test.utils import setup_test_environment, teardown_test_environment
+
+        if options['shops'] < 1 or options['services'] < 1 or options['iterations'] < 1:
+            raise CommandError("--shops, --services e --iterations deben ser al menos 1.")
+
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"No se pudo leer la línea base: {e}")
+
+        # Base de datos temporal (la misma que usan los tests): nunca se
+        # modifican los datos reales.
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.stdout.write("Generando dataset...")
+            started = time.perf_counter()
+            dataset = self._build_dataset(options)
+            self.stdout.write(f"Dataset listo en {time.perf_counter() - started:.1f} s.")
+            results = self._run(dataset, options['iterations'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            "dataset": {
+                key: options[key] for key in ("shops", "services", "appointments", "reviews", "seed")
+            },
+            "iterations": options['iterations'],
+            "endpoints": results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], "w") as f:
+                f.write(output + "\n")
+            self.stdout.write(self.style.SUCCESS(f"Resultado guardado en {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+        if baseline is not None:
+            regressions = self._compare(results, baseline.get("endpoints", {}), options['threshold'])
+            if regressions:
+                for line in regressions:
+                    self.stdout.write(self.style.ERROR(line))
+                raise CommandError(f"Se detectaron {len(regressions)} regresiones respecto de la línea base.")
+            self.stdout.write(self.style.SUCCESS("Sin regresiones respecto de la línea base."))
+
+    def _build_dataset(self, options):
+        from core.demo_data import generate_bulk_dataset
+
+        return generate_bulk_dataset(
+            shops=options['shops'],
+            services_per_shop=options['services'],
+            appointments_per_shop=options['appointments'],
+            review_ratio=options['reviews'],
+            seed=options['seed'],
+            prefix="bench",
+        )
+
+    def _booking_slots(self, hairdresser, service, count):
+        """Horarios libres para los POST de reserva, después del último turno del dataset."""
+        from django.db.models import Max
+        from django.utils import timezone
+
+        local_tz = timezone.get_current_timezone()
+        last = hairdresser.services.aggregate(last=Max("appointments__end_time"))["last"]
+        day = timezone.localdate(last) if last else timezone.localdate()
+        slots = []
+        while len(slots) < count:
+            day += datetime.timedelta(days=1)
+            if day.weekday() > 5:
+                continue
+            start = datetime.datetime.combine(day, datetime.time(9, 0), local_tz)
+            end_of_day = datetime.datetime.combine(day, datetime.time(20, 0), local_tz)
+            step = datetime.timedelta(minutes=math.ceil(service.duration_minutes / hairdresser.slot_duration) * hairdresser.slot_duration)
+            while start + datetime.timedelta(minutes=service.duration_minutes) <= end_of_day and len(slots) < count:
+                slots.append(start)
+                start += step
+        return slots
+
+    def _run(self, dataset, iterations):
+        from django.core.cache import cache
+        from django.test import Client
+        from django.urls import reverse
+
+        hairdresser = dataset["hairdresser"]
+        service = dataset["service"]
+
+        anonymous = Client()
+        customer = Client()
+        customer.force_login(dataset["client"])
+        owner = Client()
+        owner.force_login(dataset["owner"])
+
+        slots = iter(self._booking_slots(hairdresser, service, iterations))
+        detail_url = reverse("hairdresser_detail", args=[hairdresser.pk])
+
+        def book():
+            return customer.post(
+                detail_url,
+                {
+                    "service": service.pk,
+                    "start_time": next(slots).strftime("%Y-%m-%d %H:%M"),
+                    "payment_method": "CASH",
+                },
+            )
+
+        endpoints = [
+            ("home", lambda: anonymous.get(reverse("home"))),
+            ("map_data", lambda: anonymous.get(reverse("map_data"))),
+            ("hairdresser_detail", lambda: anonymous.get(detail_url)),
+            ("appointment_events", lambda: anonymous.get(reverse("appointment_events", args=[hairdresser.pk]))),
+            ("booking_post", book),
+            ("workstation", lambda: owner.get(reverse("workstation"))),
+            ("owner_appointments", lambda: owner.get(reverse("owner_appointments"))),
+            ("owner_stats", lambda: owner.get(reverse("owner_stats"))),
+            ("earnings_chart_data", lambda: owner.get(reverse("earnings_chart_data"))),
+            ("revenue_by_service_chart", lambda: owner.get(reverse("revenue_by_service_chart"))),
+            ("busiest_days_chart", lambda: owner.get(reverse("busiest_days_chart"))),
+        ]
+
+        results = {}
+        for name, request in endpoints:
+            # Cada endpoint arranca con la caché vacía: la primera muestra es "en frío"
+            cache.clear()
+            durations = []
+            queries = []
+            statuses = set()
+            for _ in range(iterations):
+                with CaptureQueriesContext(connection) as ctx:
+                    started = time.perf_counter()
+                    response = request()
+                    durations.append((time.perf_counter() - started) * 1000)
+                queries.append(len(ctx.captured_queries))
+                statuses.add(response.status_code)
+            results[name] = {
+                "p50_ms": round(_percentile(durations, 50), 2),
+                "p95_ms": round(_percentile(durations, 95), 2),
+                "mean_ms": round(statistics.fmean(durations), 2),
+                "queries": int(statistics.median(queries)),
+                "max_queries": max(queries),
+                "status": sorted(statuses),
+            }
+            self.stdout.write(
+                f"{name:28} p50 {results[name]['p50_ms']:8.2f} ms  "
+                f"p95 {results[name]['p95_ms']:8.2f} ms  consultas {results[name]['queries']}"
+            )
+        return results
+
+    def _compare(self, results, baseline, threshold):
+        """Líneas de regresión: p95 por encima del umbral o más consultas que la base."""
+        regressions = []
+        for name, current in results.items():
+            previous = baseline.get(name)
+            if not previous:
+                continue
+            if current["p95_ms"] > previous["p95_ms"] * (1 + threshold):
+                regressions.append(
+                    f"{name}: p95 {current['p95_ms']} ms (base {previous['p95_ms']} ms)"
+                )
+            if current["queries"] > previous["queries"]:
+                regressions.append(
+                    f"{name}: {current['queries']} consultas (base {previous['queries']})"
+                )
+        return regressions
@@ -0,0 +1,92 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+
+from core.images import generate_image_derivatives
+from core.models import HairdresserImage, ImageDerivative
+
+
+def _process_image(image_id, force):
+    image = HairdresserImage.objects.filter(pk=image_id).first()
+    if not image:
+        return image_id, None
+    with transaction.atomic():
+        return image_id, len(generate_image_derivatives(image, force=force))
+
+
+def _process_image_in_thread(image_id, force):
+    """Genera los derivados de una imagen en un hilo del pool."""
+    try:
+        return _process_image(image_id, force)
+    finally:
+        # Cada hilo abre su propia conexión: la liberamos al terminar
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = "Genera las versiones redimensionadas (WebP/JPEG) de las imágenes existentes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Cantidad de imágenes procesadas en paralelo (por defecto: 4).',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Regenera también las imágenes que ya tienen derivados.',
+        )
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        force = options['force']
+
+        images = HairdresserImage.objects.exclude(image="")
+        if not force:
+            images = images.filter(
+                ~Exists(ImageDerivative.objects.filter(image=OuterRef("pk")))
+            )
+        image_ids = list(images.order_by("pk").values_list("pk", flat=True))
+
+        if not image_ids:
+            self.stdout.write(self.style.SUCCESS("No hay imágenes pendientes de procesar."))
+            return
+
+        self.stdout.write(
+            f"Procesando {len(image_ids)} imágenes con {workers} hilos..."
+        )
+        processed = 0
+        failed = 0
+
+        def report(get_result):
+            nonlocal processed, failed
+            try:
+                image_id, count = get_result()
+            except Exception as e:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f"Error al procesar una imagen: {e}"))
+                return
+            if count is not None:
+                processed += 1
+                self.stdout.write(f"Imagen #{image_id}: {count} derivados")
+
+        if workers == 1:
+            # Sin hilos: útil para depurar y en entornos con SQLite en memoria
+            for image_id in image_ids:
+                report(lambda: _process_image(image_id, force))
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(_process_image_in_thread, image_id, force)
+                    for image_id in image_ids
+                ]
+                for future in as_completed(futures):
+                    report(future.result)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"\nSe procesaron {processed} imágenes ({failed} con errores).")
+        )
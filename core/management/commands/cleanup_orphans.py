@@ -1,10 +1,43 @@
 import os
-from django.core.management.base import BaseCommand
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
 from django.conf import settings
-from core.models import HairdresserImage
+from django.core.management.base import BaseCommand
+from django.db import models
+
+
+def _file_fields():
+    """(modelo, campo) de todos los FileField/ImageField del proyecto."""
+    return [
+        (model, field.name)
+        for model in apps.get_models()
+        for field in model._meta.concrete_fields
+        if isinstance(field, models.FileField)
+    ]
+
+
+def _remove_batch(paths):
+    """Elimina un lote de archivos. Retorna (eliminados, bytes, errores)."""
+    removed = 0
+    freed = 0
+    errors = []
+    for path, size in paths:
+        try:
+            os.remove(path)
+            removed += 1
+            freed += size
+        except OSError as e:
+            errors.append(f"{path}: {e}")
+    return removed, freed, errors
+
 
 class Command(BaseCommand):
-    help = "Busca y elimina imágenes huérfanas en el servidor que ya no existen en la base de datos."
+    help = (
+        "Recorre MEDIA_ROOT y elimina los archivos que no están referenciados por "
+        "ningún campo de archivo de la base de datos (imágenes, derivados, etc.)."
+    )
 
     def add_arguments(self, parser):
         # Permite hacer una simulación segura sin borrar nada
@@ -13,53 +46,161 @@ class Command(BaseCommand):
             action='store_true',
             help='Muestra qué archivos se eliminarían sin borrarlos físicamente.',
         )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Cantidad de archivos comparados contra la base de datos por consulta (por defecto: 500).',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Hilos usados para borrar en paralelo (por defecto: 4).',
+        )
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=60,
+            help=(
+                'Antigüedad mínima en minutos para borrar un archivo (por defecto: 60). '
+                'Evita borrar subidas cuya fila todavía no se guardó.'
+            ),
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help=(
+                'Archivo donde se guarda la última ruta procesada. Si existe, el '
+                'recorrido se reanuda desde allí; se elimina al terminar. Se '
+                'ignora con --dry-run.'
+            ),
+        )
+
+    def _walk(self, relative_dir, resume_parts):
+        """
+        Recorre MEDIA_ROOT en profundidad con os.scandir, generando rutas
+        relativas en orden alfabético (necesario para poder reanudar). Solo se
+        mantiene en memoria el listado del directorio actual.
+        """
+        directory = os.path.join(settings.MEDIA_ROOT, relative_dir)
+        with os.scandir(directory) as iterator:
+            entries = sorted(iterator, key=lambda entry: entry.name)
+
+        for entry in entries:
+            relative_path = f"{relative_dir}/{entry.name}" if relative_dir else entry.name
+            parts = relative_path.split("/")
+            if entry.is_dir(follow_symlinks=False):
+                # Se saltean los subárboles ya procesados por completo
+                if resume_parts and parts < resume_parts[: len(parts)]:
+                    continue
+                yield from self._walk(relative_path, resume_parts)
+            elif entry.is_file(follow_symlinks=False):
+                if resume_parts and parts <= resume_parts:
+                    continue
+                yield relative_path, entry
+
+    def _chunks(self, iterator, size):
+        chunk = []
+        for item in iterator:
+            chunk.append(item)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _referenced(self, names, file_fields):
+        """Subconjunto de `names` referenciado por alguna fila de la base."""
+        referenced = set()
+        for model, field_name in file_fields:
+            referenced.update(
+                model._default_manager.filter(**{f"{field_name}__in": names})
+                .values_list(field_name, flat=True)
+            )
+        return referenced
 
     def handle(self, *args, **options):
         dry_run = options['dry_run']
-        
-        # 1. Obtener todas las rutas de imágenes registradas en la base de datos
-        # image.name almacena la ruta relativa desde MEDIA_ROOT (ej: 'hairdressers/foto.jpg')
-        db_images = set(
-            HairdresserImage.objects.exclude(image="").values_list('image', flat=True)
-        )
+        chunk_size = max(1, options['chunk_size'])
+        workers = max(1, options['workers'])
+        min_mtime = time.time() - options['min_age'] * 60
+        checkpoint = options['checkpoint']
+        if dry_run and checkpoint:
+            # Una simulación interrumpida no debe hacer que la corrida real
+            # se saltee los huérfanos que solo se listaron
+            self.stdout.write(self.style.WARNING("--checkpoint se ignora en modo simulación."))
+            checkpoint = None
 
-        # 2. Ruta física del directorio de imágenes de peluquerías
-        hairdressers_dir = os.path.join(settings.MEDIA_ROOT, 'hairdressers')
-
-        if not os.path.exists(hairdressers_dir):
-            self.stdout.write(self.style.WARNING(f"El directorio {hairdressers_dir} no existe."))
+        media_root = str(settings.MEDIA_ROOT)
+        if not os.path.isdir(media_root):
+            self.stdout.write(self.style.WARNING(f"El directorio {media_root} no existe."))
             return
 
+        resume_parts = None
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                last_path = f.read().strip()
+            if last_path:
+                resume_parts = last_path.split("/")
+                self.stdout.write(f"Reanudando después de: {last_path}")
+
+        file_fields = _file_fields()
+        scanned = 0
+        recent = 0
+        orphan_count = 0
+        orphan_bytes = 0
+        removed = 0
+        freed = 0
+
         self.stdout.write("Analizando archivos en el servidor...")
-        orphans = []
-
-        # 3. Recorrer los archivos físicos del directorio
-        for filename in os.listdir(hairdressers_dir):
-            # Reconstruir la ruta relativa tal como se guardaría en el campo ImageField
-            relative_path = os.path.join('hairdressers', filename).replace('\\', '/')
-            
-            if relative_path not in db_images:
-                orphans.append(os.path.join(hairdressers_dir, filename))
-
-        if not orphans:
-            self.stdout.write(self.style.SUCCESS("¡Todo limpio! No se encontraron imágenes huérfanas."))
-            return
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for chunk in self._chunks(self._walk("", resume_parts), chunk_size):
+                scanned += len(chunk)
+                referenced = self._referenced([path for path, _ in chunk], file_fields)
 
-        self.stdout.write(self.style.WARNING(f"Se encontraron {len(orphans)} archivos huérfanos.\n"))
+                orphans = []
+                for relative_path, entry in chunk:
+                    if relative_path in referenced:
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                    if stat.st_mtime > min_mtime:
+                        recent += 1
+                        continue
+                    orphans.append((entry.path, stat.st_size))
+                    orphan_count += 1
+                    orphan_bytes += stat.st_size
 
-        # 4. Eliminar o simular la eliminación
-        for filepath in orphans:
-            filename = os.path.basename(filepath)
-            if dry_run:
-                self.stdout.write(f"[DRY-RUN] Se eliminaría: {filename}")
-            else:
-                try:
-                    os.remove(filepath)
-                    self.stdout.write(self.style.SUCCESS(f"Eliminado: {filename}"))
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f"Error al eliminar {filename}: {e}"))
+                if dry_run:
+                    for path, size in orphans:
+                        relative_path = os.path.relpath(path, media_root)
+                        self.stdout.write(f"[DRY-RUN] Se eliminaría: {relative_path} ({size} bytes)")
+                elif orphans:
+                    batch_size = max(1, -(-len(orphans) // workers))
+                    batches = [
+                        orphans[i : i + batch_size]
+                        for i in range(0, len(orphans), batch_size)
+                    ]
+                    for batch_removed, batch_freed, errors in executor.map(_remove_batch, batches):
+                        removed += batch_removed
+                        freed += batch_freed
+                        for error in errors:
+                            self.stdout.write(self.style.ERROR(f"Error al eliminar {error}"))
 
+                if checkpoint:
+                    with open(checkpoint, "w") as f:
+                        f.write(chunk[-1][0])
+
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+        self.stdout.write(
+            f"\nArchivos analizados: {scanned}. "
+            f"Huérfanos: {orphan_count} ({orphan_bytes} bytes). "
+            f"Omitidos por ser recientes: {recent}."
+        )
         if dry_run:
             self.stdout.write(self.style.WARNING("\nModo simulación activo. No se borró ningún archivo físico. Ejecuta sin '--dry-run' para confirmar."))
+        elif not orphan_count:
+            self.stdout.write(self.style.SUCCESS("¡Todo limpio! No se encontraron archivos huérfanos."))
         else:
-            self.stdout.write(self.style.SUCCESS(f"\nSe eliminaron correctamente {len(orphans)} archivos huérfanos."))
+            self.stdout.write(self.style.SUCCESS(f"\nSe eliminaron correctamente {removed} archivos huérfanos ({freed} bytes)."))
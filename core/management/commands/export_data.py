@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.exports import CHUNK_SIZE, EXPORTS, export_stream
+from core.models import Hairdresser
+
+
+class Command(BaseCommand):
+    help = (
+        "Exporta en CSV o XLSX los turnos o las transacciones de pago de una peluquería, "
+        "con los mismos filtros que el listado de turnos del dueño. Las filas se leen "
+        "y escriben por bloques, en memoria constante."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS), help='Qué exportar.')
+        parser.add_argument('--hairdresser', type=int, required=True, help='ID de la peluquería.')
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'xlsx'],
+            default='csv',
+            help='Formato del archivo (por defecto: csv).',
+        )
+        parser.add_argument('--status', default='', help='Solo turnos en este estado (PENDING, CONFIRMED, ...).')
+        parser.add_argument('--month', default='', help='Solo turnos de este mes (YYYY-MM).')
+        parser.add_argument('--q', default='', help='Búsqueda por nombre o email del cliente.')
+        parser.add_argument(
+            '--output',
+            help='Archivo de destino. Sin este argumento se escribe en la salida estándar (solo CSV).',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help=f'Filas leídas por consulta (por defecto: {CHUNK_SIZE}).',
+        )
+
+    def handle(self, *args, **options):
+        fmt = options['format']
+        output = options['output']
+        if fmt == 'xlsx' and not output:
+            raise CommandError("El formato xlsx requiere --output.")
+
+        try:
+            hairdresser = Hairdresser.objects.get(pk=options['hairdresser'])
+        except Hairdresser.DoesNotExist:
+            raise CommandError(f"No existe la peluquería {options['hairdresser']}.")
+
+        headers, rows = EXPORTS[options['kind']](
+            hairdresser,
+            status=options['status'],
+            month=options['month'],
+            q=options['q'],
+            chunk_size=max(1, options['chunk_size']),
+        )
+        stream = export_stream(fmt, headers, rows)
+
+        if not output:
+            for chunk in stream:
+                self.stdout.write(chunk, ending='')
+            return
+
+        # CSV en texto (con el BOM para Excel) y XLSX en binario
+        with open(output, 'wb') as f:
+            for chunk in stream:
+                f.write(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+        self.stdout.write(self.style.SUCCESS(f"Exportación guardada en {output}."))
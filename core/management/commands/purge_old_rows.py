@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.retention import BATCH_SIZE, POLICIES, purge_expired
+
+
+class Command(BaseCommand):
+    help = (
+        "Borra por lotes los eventos de webhook, ofertas de adelanto y pausas más viejos "
+        "que su retención (*_RETENTION_DAYS) y suma lo borrado a los contadores por mes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Muestra cuántas filas se borrarían sin borrarlas.',
+        )
+        parser.add_argument(
+            '--table',
+            choices=sorted(POLICIES),
+            action='append',
+            help='Tabla a purgar (se puede repetir). Por defecto, todas.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BATCH_SIZE,
+            help=f'Filas borradas por transacción (por defecto: {BATCH_SIZE}).',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=0,
+            help='Segundos de espera entre lotes, para no competir con el tráfico (por defecto: 0).',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        results = purge_expired(
+            tables=options['table'],
+            batch_size=max(1, options['batch_size']),
+            pause_seconds=options['sleep'],
+            dry_run=dry_run,
+        )
+        for table, count in results.items():
+            days = getattr(settings, POLICIES[table][0])
+            if not days:
+                self.stdout.write(f"{table}: sin retención configurada.")
+            elif dry_run:
+                self.stdout.write(f"[DRY-RUN] {table}: se borrarían {count} filas de más de {days} días.")
+            else:
+                self.stdout.write(f"{table}: {count} filas borradas (más de {days} días).")
+
+        if dry_run:
+            self.stdout.write(self.style.WARNING("\nModo simulación activo. No se borró ninguna fila."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"\nPurga finalizada: {sum(results.values())} filas borradas."))
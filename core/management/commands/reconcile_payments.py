@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Hairdresser, ReconciliationCheckpoint
+from core.reconciliation import reconcile_payments, summarize
+
+
+class Command(BaseCommand):
+    help = (
+        "Concilia los pagos registrados en MercadoPago con los turnos y las transacciones "
+        "de pago de cada peluquería con cobros digitales, desde su último punto de control. "
+        "Sin --repair solo informa las diferencias."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repair',
+            action='store_true',
+            help='Corrige las diferencias y avanza el punto de control de cada peluquería.',
+        )
+        parser.add_argument(
+            '--hairdresser',
+            type=int,
+            action='append',
+            help='ID de la peluquería a conciliar (se puede repetir). Por defecto, todas.',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Peluquerías conciliadas en paralelo (por defecto: RECONCILIATION_WORKERS).',
+        )
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Descarta el punto de control y vuelve a revisar RECONCILIATION_LOOKBACK_DAYS días.',
+        )
+
+    def handle(self, *args, **options):
+        hairdressers = Hairdresser.objects.filter(mercadopago_active=True)
+        if options['hairdresser']:
+            hairdressers = hairdressers.filter(pk__in=options['hairdresser'])
+        if options['reset']:
+            ReconciliationCheckpoint.objects.filter(hairdresser__in=hairdressers).delete()
+
+        reports = reconcile_payments(hairdressers, repair=options['repair'], workers=options['workers'])
+        for report in reports:
+            for issue in report['issues']:
+                appointment = f" turno #{issue['appointment_id']}" if issue['appointment_id'] else ""
+                self.stdout.write(
+                    f"[{report['hairdresser']}] {issue['kind']}: pago {issue['payment_id']}{appointment} {issue['detail']}"
+                )
+            if report['error']:
+                self.stdout.write(self.style.ERROR(f"[{report['hairdresser']}] Error: {report['error']}"))
+
+        summary = summarize(reports)
+        self.stdout.write(
+            f"\nPeluquerías: {summary['hairdressers']}. Pagos revisados: {summary['payments']}. "
+            f"Diferencias: {sum(summary['issues'].values())}. Corregidas: {summary['repaired']}."
+        )
+        if not options['repair'] and summary['issues']:
+            self.stdout.write(self.style.WARNING("Modo informe. Ejecuta con '--repair' para corregir las diferencias."))
+        elif not summary['failed']:
+            self.stdout.write(self.style.SUCCESS("Conciliación finalizada."))
@@ -1,15 +1,95 @@
 import datetime
 import random
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone
 from django.db import transaction
 from core.models import User, Hairdresser, Service, Appointment, Review, WorkingHours
 
 class Command(BaseCommand):
-    help = "Genera datos específicos y abundantes para la demo del examen final (8 de Julio de 2026)"
+    help = (
+        "Genera datos específicos y abundantes para la demo del examen final (8 de Julio de 2026). "
+        "Con --bulk genera en su lugar un dataset masivo del tamaño indicado."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bulk',
+            action='store_true',
+            help='Genera un dataset masivo con bulk_create (para pruebas de capacidad).',
+        )
+        parser.add_argument('--shops', type=int, default=50, help='Peluquerías a crear en modo --bulk (por defecto: 50).')
+        parser.add_argument('--services', type=int, default=5, help='Servicios por peluquería en modo --bulk (por defecto: 5).')
+        parser.add_argument(
+            '--appointments',
+            type=int,
+            default=2000,
+            help='Turnos por peluquería en modo --bulk (por defecto: 2000).',
+        )
+        parser.add_argument(
+            '--reviews',
+            type=float,
+            default=0.3,
+            help='Proporción de turnos completados con reseña en modo --bulk (por defecto: 0.3).',
+        )
+        parser.add_argument('--seed', type=int, default=2026, help='Semilla aleatoria (por defecto: 2026).')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Turnos escritos por bloque en modo --bulk (por defecto: 5000).',
+        )
+        parser.add_argument(
+            '--flush',
+            action='store_true',
+            help='En modo --bulk, vacía la base de datos antes de generar (incluye superusuarios).',
+        )
+
+    def handle(self, *args, **options):
+        if options['bulk']:
+            self._handle_bulk(options)
+        else:
+            self._handle_demo()
+
+    def _handle_bulk(self, options):
+        import time
+
+        from django.core.management import call_command
+        from core.demo_data import generate_bulk_dataset
+
+        if options['flush']:
+            # flush vacía las tablas sin cargar filas ni disparar señales,
+            # a diferencia de .delete() que sería inviable con millones de turnos
+            self.stdout.write("Vaciando base de datos...")
+            call_command('flush', interactive=False, verbosity=0)
+        elif Appointment.objects.exists():
+            raise CommandError(
+                "La base de datos ya tiene turnos. Usa --flush para vaciarla antes de generar el dataset."
+            )
+
+        if not User.objects.filter(username="admin").exists():
+            User.objects.create_superuser("admin", "admin@stilo.com", "admin")
+
+        started = time.perf_counter()
+        summary = generate_bulk_dataset(
+            shops=options['shops'],
+            services_per_shop=options['services'],
+            appointments_per_shop=options['appointments'],
+            review_ratio=options['reviews'],
+            seed=options['seed'],
+            chunk_size=max(1, options['chunk_size']),
+            log=self.stdout.write,
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Dataset generado en {time.perf_counter() - started:.1f} s: "
+                f"{summary['hairdressers']} peluquerías, {summary['appointments']} turnos, "
+                f"{summary['reviews']} reseñas, {summary['pauses']} pausas y "
+                f"{summary['transactions']} transacciones. Contraseña de los usuarios: demo"
+            )
+        )
 
     @transaction.atomic
-    def handle(self, *args, **kwargs):
+    def _handle_demo(self):
         self.stdout.write("Limpiando base de datos...")
         Appointment.objects.all().delete()
         Review.objects.all().delete()
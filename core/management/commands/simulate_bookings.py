@@ -0,0 +1,291 @@
+import datetime
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from .bench import _percentile
+
+
+def find_overlapping_appointments(now=None):
+    """
+    Turnos activos (los mismos que bloquean un horario en AppointmentForm)
+    que se superponen con otro turno activo de la misma peluquería.
+    """
+    from django.db.models import Exists, OuterRef, Q
+    from django.utils import timezone
+
+    from core.models import Appointment
+
+    now = now or timezone.now()
+    active = Appointment.objects.filter(
+        Q(status="CONFIRMED")
+        | Q(status="PENDING", expires_at__isnull=True)
+        | Q(status="PENDING", expires_at__gt=now)
+    )
+    clashes = active.filter(
+        service__hairdresser=OuterRef("service__hairdresser"),
+        start_time__lt=OuterRef("end_time"),
+        end_time__gt=OuterRef("start_time"),
+    ).exclude(pk=OuterRef("pk"))
+    return active.filter(Exists(clashes))
+
+
+class FakeMercadoPago:
+    """
+    Reemplaza requests.post durante la simulación: responde las preferencias
+    de pago con un init_point ficticio tras una latencia fija, sin salir a la red.
+    """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def post(self, url, *args, **kwargs):
+        import requests
+
+        with self._lock:
+            self.calls += 1
+            preference_id = f"load-{self.calls}"
+        time.sleep(self.latency)
+
+        response = requests.Response()
+        response.url = url
+        if "/checkout/preferences" in url:
+            response.status_code = 201
+            body = {
+                "id": preference_id,
+                "init_point": f"https://mercadopago.invalid/checkout/{preference_id}",
+                "sandbox_init_point": f"https://sandbox.mercadopago.invalid/checkout/{preference_id}",
+            }
+        else:
+            response.status_code = 404
+            body = {"message": "not found"}
+        response._content = json.dumps(body).encode()
+        response.headers["Content-Type"] = "application/json"
+        return response
+
+
+class Command(BaseCommand):
+    help = (
+        "Simula reservas concurrentes (varios hilos publicando en la vista de detalle "
+        "de una peluquería) sobre el mismo horario y horarios vecinos, contra una base "
+        "de datos temporal en archivo y con MercadoPago simulado. Informa throughput, "
+        "latencia y la cantidad de turnos activos superpuestos."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=16, help='Hilos concurrentes (por defecto: 16).')
+        parser.add_argument('--requests', type=int, default=10, help='Reservas por hilo (por defecto: 10).')
+        parser.add_argument(
+            '--slots',
+            type=int,
+            default=4,
+            help='Horarios vecinos (consecutivos en la grilla) sobre los que se reserva (por defecto: 4).',
+        )
+        parser.add_argument('--services', type=int, default=3, help='Servicios de la peluquería (por defecto: 3).')
+        parser.add_argument(
+            '--online-ratio',
+            type=float,
+            default=0.5,
+            help='Proporción de reservas con pago online por MercadoPago simulado (por defecto: 0.5).',
+        )
+        parser.add_argument(
+            '--mp-latency',
+            type=float,
+            default=50,
+            help='Latencia simulada de MercadoPago en milisegundos (por defecto: 50).',
+        )
+        parser.add_argument('--seed', type=int, default=2026, help='Semilla aleatoria (por defecto: 2026).')
+        parser.add_argument('--output', help='Archivo donde guardar el resultado en JSON.')
+        parser.add_argument(
+            '--fail-on-overlap',
+            action='store_true',
+            help='Termina con error si la auditoría encuentra turnos superpuestos.',
+        )
+
+    def handle(self, *args, **options):
+        from django.test.utils import setup_test_environment, teardown_test_environment
+
+        if options['workers'] < 1 or options['requests'] < 1 or options['slots'] < 1 or options['services'] < 1:
+            raise CommandError("--workers, --requests, --slots y --services deben ser al menos 1.")
+
+        # Base de datos temporal: en SQLite se fuerza un archivo (la base de
+        # tests por defecto es en memoria) para que cada hilo use su propia
+        # conexión como lo haría un servidor real.
+        directory = None
+        settings_dict = connection.settings_dict
+        if connection.vendor == "sqlite":
+            directory = tempfile.mkdtemp(prefix="stilo-load-")
+            settings_dict["TEST"]["NAME"] = os.path.join(directory, "load.sqlite3")
+            # Esperar el lock de escritura en lugar de fallar a los 5 s
+            settings_dict["OPTIONS"].setdefault("timeout", 30)
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            dataset = self._build_dataset(options)
+            report = self._simulate(dataset, options)
+        finally:
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            if directory:
+                shutil.rmtree(directory, ignore_errors=True)
+
+        self._report(report, options)
+
+    def _build_dataset(self, options):
+        from core.demo_data import generate_bulk_dataset
+        from core.models import Hairdresser, User
+
+        dataset = generate_bulk_dataset(
+            shops=1,
+            services_per_shop=options['services'],
+            appointments_per_shop=0,
+            seed=options['seed'],
+            prefix="load",
+        )
+        hairdresser = dataset["hairdresser"]
+        Hairdresser.objects.filter(pk=hairdresser.pk).update(
+            mercadopago_active=True,
+            mercadopago_access_token="APP_USR-load-test",
+            requires_deposit=False,
+            default_allow_prepayment=True,
+            default_allow_on_site_payment=True,
+        )
+        dataset["hairdresser"] = Hairdresser.objects.get(pk=hairdresser.pk)
+        dataset["services"] = list(dataset["hairdresser"].services.all())
+        dataset["clients"] = list(User.objects.filter(username__startswith="load_cliente"))
+        return dataset
+
+    def _target_slots(self, hairdresser, count):
+        """count horarios consecutivos de la grilla, desde las 10:00 del próximo día hábil."""
+        from django.utils import timezone
+
+        from core.demo_data import WORKING_DAYS
+
+        local_tz = timezone.get_current_timezone()
+        day = timezone.localdate() + datetime.timedelta(days=1)
+        while day.weekday() not in WORKING_DAYS:
+            day += datetime.timedelta(days=1)
+        first = datetime.datetime.combine(day, datetime.time(10, 0), local_tz)
+        step = datetime.timedelta(minutes=hairdresser.slot_duration)
+        return [first + step * index for index in range(count)]
+
+    def _simulate(self, dataset, options):
+        from unittest import mock
+
+        from django.test import Client
+        from django.urls import reverse
+
+        from core.models import Appointment
+
+        hairdresser = dataset["hairdresser"]
+        services = dataset["services"]
+        clients = dataset["clients"]
+        slots = self._target_slots(hairdresser, options['slots'])
+        url = reverse("hairdresser_detail", args=[hairdresser.pk])
+        workers = options['workers']
+        per_worker = options['requests']
+
+        fake_mp = FakeMercadoPago(options['mp_latency'] / 1000)
+        barrier = threading.Barrier(workers)
+        samples = []
+        samples_lock = threading.Lock()
+
+        def worker(index):
+            rng = random.Random(options['seed'] + index)
+            browser = Client()
+            results = []
+            try:
+                browser.force_login(clients[index % len(clients)])
+                barrier.wait()
+                for _ in range(per_worker):
+                    data = {
+                        "service": rng.choice(services).pk,
+                        "start_time": rng.choice(slots).strftime("%Y-%m-%d %H:%M"),
+                        "payment_method": "FULL" if rng.random() < options['online_ratio'] else "CASH",
+                    }
+                    started = time.perf_counter()
+                    try:
+                        status = browser.post(url, data).status_code
+                    except Exception:
+                        status = None
+                    finished = time.perf_counter()
+                    results.append((started, finished, status))
+            except threading.BrokenBarrierError:
+                pass
+            finally:
+                with samples_lock:
+                    samples.extend(results)
+                # Cada hilo abre su propia conexión: cerrarla antes de terminar
+                connections.close_all()
+
+        self.stdout.write(
+            f"Simulando {workers} hilos x {per_worker} reservas sobre {len(slots)} horarios..."
+        )
+        threads = [threading.Thread(target=worker, args=(index,)) for index in range(workers)]
+        with mock.patch("requests.post", fake_mp.post):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        if not samples:
+            raise CommandError("Ningún hilo llegó a enviar reservas.")
+
+        durations = [(finished - started) * 1000 for started, finished, _ in samples]
+        elapsed = max(finished for _, finished, _ in samples) - min(started for started, _, _ in samples)
+        statuses = [status for _, _, status in samples]
+        overlapping = find_overlapping_appointments()
+        return {
+            "workers": workers,
+            "requests": len(samples),
+            "slots": len(slots),
+            "elapsed_s": round(elapsed, 3),
+            "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else None,
+            "p50_ms": round(_percentile(durations, 50), 2),
+            "p95_ms": round(_percentile(durations, 95), 2),
+            "max_ms": round(max(durations), 2),
+            "mean_ms": round(statistics.fmean(durations), 2),
+            "booked": statuses.count(200),
+            "rejected": statuses.count(400),
+            "errors": len(statuses) - statuses.count(200) - statuses.count(400),
+            "mercadopago_calls": fake_mp.calls,
+            "active_appointments": Appointment.objects.filter(
+                status__in=["CONFIRMED", "PENDING"]
+            ).count(),
+            "overlapping_appointments": overlapping.count(),
+        }
+
+    def _report(self, report, options):
+        self.stdout.write(
+            f"{report['requests']} reservas en {report['elapsed_s']} s "
+            f"({report['throughput_rps']} req/s): p50 {report['p50_ms']} ms, "
+            f"p95 {report['p95_ms']} ms, máx. {report['max_ms']} ms"
+        )
+        self.stdout.write(
+            f"Aceptadas {report['booked']}, rechazadas {report['rejected']}, "
+            f"errores {report['errors']}, turnos activos {report['active_appointments']}"
+        )
+        if options['output']:
+            with open(options['output'], "w") as f:
+                f.write(json.dumps(report, indent=2) + "\n")
+            self.stdout.write(self.style.SUCCESS(f"Resultado guardado en {options['output']}"))
+
+        if report["overlapping_appointments"]:
+            message = f"Auditoría: {report['overlapping_appointments']} turnos activos superpuestos."
+            if options['fail_on_overlap']:
+                raise CommandError(message)
+            self.stdout.write(self.style.ERROR(message))
+        else:
+            self.stdout.write(self.style.SUCCESS("Auditoría: sin turnos activos superpuestos."))
@@ -0,0 +1,276 @@
+"""
+Registro de métricas en proceso con exposición en formato de texto de
+Prometheus (ver la vista metrics_view, en /metrics).
+
+Cada proceso acumula sus métricas en memoria y las vuelca periódicamente a
+METRICS_DIR/metrics-<pid>.json; la exposición suma los archivos de todos los
+procesos, de modo que con un servidor pre-fork (gunicorn con varios workers)
+cualquier worker que atienda /metrics informa el total. El directorio debe
+vaciarse al desplegar, igual que en el modo multiproceso de prometheus_client.
+
+Las métricas de colas (reembolsos pendientes, webhooks sin procesar, turnos
+PENDING por vencer) se calculan con consultas al momento de la exposición.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger("core")
+
+# Límites superiores (en segundos) de los buckets de los histogramas
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Servicios externos instrumentados con track_outbound()
+OUTBOUND_SERVICES = ("mercadopago", "brevo", "nominatim", "ipinfo", "webpush")
+
+METRIC_HELP = {
+    "stilo_http_requests_total": ("counter", "Requests atendidos por vista, método y estado."),
+    "stilo_http_request_duration_seconds": ("histogram", "Latencia de los requests por vista."),
+    "stilo_outbound_requests_total": ("counter", "Llamadas a servicios externos."),
+    "stilo_outbound_errors_total": ("counter", "Llamadas a servicios externos fallidas."),
+    "stilo_outbound_duration_seconds": ("histogram", "Latencia de las llamadas a servicios externos."),
+    "stilo_pending_refunds": ("gauge", "Reembolsos pendientes de reintento."),
+    "stilo_unprocessed_webhook_events": ("gauge", "Webhooks de MercadoPago recibidos y no procesados."),
+    "stilo_pending_appointments_expiring": ("gauge", "Turnos PENDING con vencimiento próximo o ya vencido."),
+}
+
+# (nombre, etiquetas ordenadas) -> valor, para contadores
+_counters = {}
+# (nombre, etiquetas ordenadas) -> {"buckets": [...], "sum": s, "count": n}
+_histograms = {}
+_lock = threading.Lock()
+_last_flush = 0.0
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def inc_counter(name, labels, amount=1):
+    with _lock:
+        key = (name, _labels_key(labels))
+        _counters[key] = _counters.get(key, 0) + amount
+    _maybe_flush()
+
+
+def observe_histogram(name, labels, value):
+    with _lock:
+        key = (name, _labels_key(labels))
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+            _histograms[key] = histogram
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                histogram["buckets"][index] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+    _maybe_flush()
+
+
+def record_request(view, method, status, duration):
+    inc_counter(
+        "stilo_http_requests_total",
+        {"view": view, "method": method, "status": str(status)},
+    )
+    observe_histogram(
+        "stilo_http_request_duration_seconds", {"view": view, "method": method}, duration
+    )
+
+
+class OutboundCall:
+    """Permite informar la respuesta obtenida dentro de track_outbound()."""
+
+    def __init__(self):
+        self.response = None
+
+    @property
+    def failed(self):
+        status = getattr(self.response, "status_code", None)
+        return isinstance(status, int) and status >= 400
+
+
+@contextmanager
+def track_outbound(service):
+    """
+    Mide una llamada a un servicio externo. Cuenta como error una excepción
+    o una respuesta 4xx/5xx asignada a call.response:
+
+        with track_outbound("ipinfo") as call:
+            call.response = requests.get(...)
+    """
+    call = OutboundCall()
+    start = time.perf_counter()
+    error = False
+    try:
+        yield call
+    except Exception:
+        error = True
+        raise
+    finally:
+        labels = {"service": service}
+        observe_histogram(
+            "stilo_outbound_duration_seconds", labels, time.perf_counter() - start
+        )
+        inc_counter("stilo_outbound_requests_total", labels)
+        if error or call.failed:
+            inc_counter("stilo_outbound_errors_total", labels)
+
+
+def _snapshot():
+    with _lock:
+        return {
+            "counters": [[name, list(labels), value] for (name, labels), value in _counters.items()],
+            "histograms": [
+                [name, list(labels), dict(data, buckets=list(data["buckets"]))]
+                for (name, labels), data in _histograms.items()
+            ],
+        }
+
+
+def flush():
+    """Vuelca las métricas de este proceso a su archivo (reemplazo atómico)."""
+    global _last_flush
+
+    directory = settings.METRICS_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"metrics-{os.getpid()}.json")
+    # Temporal por hilo: con un servidor multihilo dos volcados simultáneos
+    # no deben pisarse el archivo antes del reemplazo
+    temporary = f"{path}.{threading.get_ident()}.tmp"
+    with open(temporary, "w") as f:
+        json.dump(_snapshot(), f)
+    os.replace(temporary, path)
+    _last_flush = time.monotonic()
+
+
+def _maybe_flush():
+    # Con las métricas desactivadas se acumulan en memoria pero no se escriben
+    if not settings.METRICS_ENABLED:
+        return
+    if time.monotonic() - _last_flush < settings.METRICS_FLUSH_INTERVAL:
+        return
+    try:
+        flush()
+    except OSError as e:
+        logger.error(f"[METRICS] No se pudieron guardar las métricas: {e}")
+
+
+def reset():
+    """Descarta las métricas de este proceso (usado en tests)."""
+    global _last_flush
+
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+    _last_flush = 0.0
+
+
+def _collect():
+    """Suma los archivos de todos los procesos."""
+    counters = {}
+    histograms = {}
+    directory = settings.METRICS_DIR
+    if not os.path.isdir(directory):
+        return counters, histograms
+
+    for filename in os.listdir(directory):
+        if not (filename.startswith("metrics-") and filename.endswith(".json")):
+            continue
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, labels, value in data["counters"]:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, values in data["histograms"]:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            merged = histograms.setdefault(
+                key, {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+            )
+            for index, count in enumerate(values["buckets"]):
+                merged["buckets"][index] += count
+            merged["sum"] += values["sum"]
+            merged["count"] += values["count"]
+    return counters, histograms
+
+
+def _queue_gauges():
+    from datetime import timedelta
+
+    from django.utils import timezone
+
+    from .models import Appointment, PendingRefund, WebhookEvent
+
+    now = timezone.now()
+    pending = Appointment.objects.filter(status="PENDING", expires_at__isnull=False)
+    return {
+        ("stilo_pending_refunds", ()): PendingRefund.objects.count(),
+        ("stilo_unprocessed_webhook_events", ()): WebhookEvent.objects.filter(
+            processed=False
+        ).count(),
+        ("stilo_pending_appointments_expiring", (("window", "expired"),)): pending.filter(
+            expires_at__lte=now
+        ).count(),
+        ("stilo_pending_appointments_expiring", (("window", "15m"),)): pending.filter(
+            expires_at__gt=now, expires_at__lte=now + timedelta(minutes=15)
+        ).count(),
+    }
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs) + "}"
+
+
+def _format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_metrics():
+    """Texto en formato de exposición de Prometheus (versión 0.0.4)."""
+    if settings.METRICS_ENABLED:
+        try:
+            flush()
+        except OSError as e:
+            logger.error(f"[METRICS] No se pudieron guardar las métricas: {e}")
+    counters, histograms = _collect()
+    # Los servicios sin llamadas se informan en 0 para que las alertas existan
+    for service in OUTBOUND_SERVICES:
+        for name in ("stilo_outbound_requests_total", "stilo_outbound_errors_total"):
+            counters.setdefault((name, (("service", service),)), 0)
+
+    samples = {}
+    for (name, labels), value in counters.items():
+        samples.setdefault(name, []).append(f"{name}{_format_labels(labels)} {_format_number(value)}")
+    for (name, labels), data in histograms.items():
+        lines = samples.setdefault(name, [])
+        for bound, count in zip(LATENCY_BUCKETS, data["buckets"]):
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {data['count']}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_number(data['sum'])}")
+        lines.append(f"{name}_count{_format_labels(labels)} {data['count']}")
+    for (name, labels), value in _queue_gauges().items():
+        samples.setdefault(name, []).append(f"{name}{_format_labels(labels)} {value}")
+
+    output = []
+    for name, lines in sorted(samples.items()):
+        metric_type, help_text = METRIC_HELP.get(name, ("untyped", ""))
+        output.append(f"# HELP {name} {help_text}")
+        output.append(f"# TYPE {name} {metric_type}")
+        output.extend(sorted(lines))
+    return "\n".join(output) + "\n"
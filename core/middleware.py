@@ -0,0 +1,304 @@
+"""
+Middlewares de diagnóstico de rendimiento.
+
+Instrumentación de consultas SQL por request (opcional).
+
+Con QUERY_INSTRUMENTATION=True se registra, para cada request, la cantidad de
+consultas, el tiempo total en la base de datos, las consultas repetidas
+(misma sentencia con distintos parámetros, típico de un N+1) y las más
+lentas. Los requests que superan los umbrales configurados se registran en el
+logger 'core' y el resumen acumulado por vista se consulta en /debug/queries/.
+
+Perfilado con cProfile a pedido: un usuario staff agrega ?_profile=1 (o la
+cabecera X-Profile: 1) y ese único request se ejecuta bajo cProfile,
+guardando el volcado .prof y un resumen de texto en PROFILE_DIR.
+
+Métricas de latencia por vista para /metrics (ver core/metrics.py).
+
+MetricsMiddleware y ProfilingMiddleware admiten requests async (ASGI), para
+que las vistas de core/async_views.py no pasen por un hilo solo por la cadena
+de middlewares. QueryInstrumentationMiddleware es solo sincrónico: activarlo
+bajo ASGI agrega ese cambio de hilo a cada request.
+"""
+
+import cProfile
+import io
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger("core")
+
+# Resumen acumulado por vista (por proceso): nombre de vista -> métricas
+_view_stats = {}
+_view_stats_lock = threading.Lock()
+
+_IN_LIST_RE = re.compile(r"IN \((?:%s, )*%s\)")
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def query_fingerprint(sql):
+    """
+    Normaliza una sentencia para agrupar las que solo difieren en los valores:
+    listas IN de cualquier largo y literales numéricos o de texto.
+    """
+    sql = _IN_LIST_RE.sub("IN (...)", sql)
+    return _LITERAL_RE.sub("?", sql)
+
+
+def get_view_stats():
+    """Copia del resumen por vista, ordenada por tiempo total en la base."""
+    with _view_stats_lock:
+        rows = [dict(stats, view=view) for view, stats in _view_stats.items()]
+    return sorted(rows, key=lambda row: row["total_db_ms"], reverse=True)
+
+
+def reset_view_stats():
+    with _view_stats_lock:
+        _view_stats.clear()
+
+
+def _record_view_stats(view, query_count, db_ms, duplicate_count):
+    with _view_stats_lock:
+        stats = _view_stats.setdefault(
+            view,
+            {
+                "requests": 0,
+                "total_queries": 0,
+                "max_queries": 0,
+                "total_db_ms": 0.0,
+                "max_db_ms": 0.0,
+                "duplicate_queries": 0,
+            },
+        )
+        stats["requests"] += 1
+        stats["total_queries"] += query_count
+        stats["max_queries"] = max(stats["max_queries"], query_count)
+        stats["total_db_ms"] += db_ms
+        stats["max_db_ms"] = max(stats["max_db_ms"], db_ms)
+        stats["duplicate_queries"] += duplicate_count
+        stats["avg_queries"] = stats["total_queries"] / stats["requests"]
+        stats["avg_db_ms"] = stats["total_db_ms"] / stats["requests"]
+
+
+class QueryRecorder:
+    """execute_wrapper que acumula (sql, duración en ms) de cada consulta."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, (time.perf_counter() - start) * 1000))
+
+    @property
+    def db_ms(self):
+        return sum(duration for _, duration in self.queries)
+
+    def duplicates(self):
+        """[(fingerprint, repeticiones)] de las sentencias ejecutadas más de una vez."""
+        counts = Counter(query_fingerprint(sql) for sql, _ in self.queries)
+        return [(sql, count) for sql, count in counts.most_common() if count > 1]
+
+    def slowest(self, limit):
+        return sorted(self.queries, key=lambda query: query[1], reverse=True)[:limit]
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Mide las consultas SQL de cada request. Se desactiva por completo (sin
+    costo) si QUERY_INSTRUMENTATION es False.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, "QUERY_INSTRUMENTATION", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.max_queries = settings.QUERY_INSTRUMENTATION_MAX_QUERIES
+        self.max_db_ms = settings.QUERY_INSTRUMENTATION_MAX_DB_MS
+        self.slowest_limit = settings.QUERY_INSTRUMENTATION_SLOWEST
+        self.expose_headers = settings.QUERY_INSTRUMENTATION_HEADERS
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+
+        query_count = len(recorder.queries)
+        db_ms = recorder.db_ms
+        duplicates = recorder.duplicates()
+        duplicate_count = sum(count - 1 for _, count in duplicates)
+
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match else request.path
+        _record_view_stats(view, query_count, db_ms, duplicate_count)
+
+        if query_count > self.max_queries or db_ms > self.max_db_ms:
+            lines = [
+                f"[QUERIES] {request.method} {request.path} ({view}): "
+                f"{query_count} consultas, {db_ms:.1f} ms en la base de datos"
+            ]
+            for sql, count in duplicates[:5]:
+                lines.append(f"  repetida x{count}: {sql[:300]}")
+            for sql, duration in recorder.slowest(self.slowest_limit):
+                lines.append(f"  lenta {duration:.1f} ms: {sql[:300]}")
+            logger.warning("\n".join(lines))
+
+        if self.expose_headers:
+            response["X-DB-Query-Count"] = str(query_count)
+            response["X-DB-Time-Ms"] = f"{db_ms:.1f}"
+            response["X-DB-Duplicate-Queries"] = str(duplicate_count)
+        return response
+
+
+def _prune_profiles(directory, max_files, max_total_bytes, retention_days):
+    """
+    Elimina los perfiles más viejos que retention_days y luego los más
+    antiguos hasta respetar max_files y max_total_bytes.
+    """
+    cutoff = time.time() - retention_days * 24 * 60 * 60
+    entries = []
+    with os.scandir(directory) as iterator:
+        for entry in iterator:
+            if entry.is_file() and entry.name.endswith((".prof", ".txt")):
+                stat = entry.stat()
+                if stat.st_mtime < cutoff:
+                    os.remove(entry.path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    entries.sort(reverse=True)  # más nuevos primero
+    total = 0
+    for index, (_, size, path) in enumerate(entries):
+        total += size
+        # Cada perfil son dos archivos (.prof y .txt)
+        if index >= max_files * 2 or total > max_total_bytes:
+            os.remove(path)
+
+
+class ProfilingMiddleware:
+    """
+    Ejecuta bajo cProfile los requests marcados por un usuario staff. Sin la
+    marca solo se revisa un parámetro y una cabecera, sin tocar la sesión.
+    En modo async no se perfila: cProfile mide el hilo del event loop, que
+    también atiende otros requests, y no los hilos donde corre el ORM.
+    """
+
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.get_response(request)
+        if request.GET.get("_profile") != "1" and request.headers.get("X-Profile") != "1":
+            return self.get_response(request)
+
+        from .utils import user_is_developer
+
+        if not user_is_developer(request):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Ya hay otro perfilador activo en este hilo
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+
+        try:
+            profile_id = self._save(request, profiler)
+        except OSError as e:
+            logger.error(f"[PROFILE] No se pudo guardar el perfil de {request.path}: {e}")
+            return response
+        response["X-Profile-Id"] = profile_id
+        return response
+
+    def _save(self, request, profiler):
+        directory = settings.PROFILE_DIR
+        os.makedirs(directory, exist_ok=True)
+
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match else "unresolved"
+        slug = re.sub(r"[^A-Za-z0-9_-]+", "-", view)
+        profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{slug}-{os.getpid()}"
+        base_path = os.path.join(directory, profile_id)
+
+        profiler.dump_stats(f"{base_path}.prof")
+        summary = io.StringIO()
+        summary.write(f"{request.method} {request.get_full_path()} ({view})\n\n")
+        stats = pstats.Stats(profiler, stream=summary)
+        stats.sort_stats("cumulative").print_stats(settings.PROFILE_TOP_FUNCTIONS)
+        with open(f"{base_path}.txt", "w", encoding="utf-8") as f:
+            f.write(summary.getvalue())
+
+        _prune_profiles(
+            directory,
+            settings.PROFILE_MAX_FILES,
+            settings.PROFILE_MAX_TOTAL_MB * 1024 * 1024,
+            settings.PROFILE_RETENTION_DAYS,
+        )
+        logger.info(f"[PROFILE] Perfil guardado: {profile_id} ({request.path})")
+        return profile_id
+
+
+class MetricsMiddleware:
+    """
+    Registra la latencia y el estado de cada request por nombre de URL. Se
+    desactiva con METRICS_ENABLED=False.
+    """
+
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self._acall(request)
+        start = time.perf_counter()
+        response = self.get_response(request)
+        self._record(request, response, start)
+        return response
+
+    async def _acall(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self._record(request, response, start)
+        return response
+
+    def _record(self, request, response, start):
+        from .metrics import record_request
+
+        match = getattr(request, "resolver_match", None)
+        # Las rutas sin resolver (404) se agrupan para no crear una serie por URL
+        view = match.view_name if match else "unresolved"
+        record_request(view, request.method, response.status_code, time.perf_counter() - start)
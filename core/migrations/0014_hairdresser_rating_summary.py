@@ -0,0 +1,41 @@
+# Generated by Django 5.2.3 on 2026-10-19 11:26
+
+from django.db import migrations, models
+
+
+def populate_rating_summary(apps, schema_editor):
+    """
+    Calcula el resumen de reseñas de las peluquerías existentes con una
+    consulta agrupada.
+    """
+    Hairdresser = apps.get_model("core", "Hairdresser")
+    Review = apps.get_model("core", "Review")
+    summaries = (
+        Review.objects.values("appointment__service__hairdresser_id")
+        .annotate(count=models.Count("id"), total=models.Sum("rating"))
+    )
+    for summary in summaries:
+        Hairdresser.objects.filter(
+            pk=summary["appointment__service__hairdresser_id"]
+        ).update(rating_count=summary["count"], rating_sum=summary["total"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_pause'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hairdresser',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Cantidad de reseñas'),
+        ),
+        migrations.AddField(
+            model_name='hairdresser',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Suma de calificaciones'),
+        ),
+        migrations.RunPython(populate_rating_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.3 on 2026-10-19 11:34
+
+from django.db import migrations, models
+
+
+def populate_rating_histogram(apps, schema_editor):
+    """Calcula el histograma de reseñas de las peluquerías existentes."""
+    Hairdresser = apps.get_model("core", "Hairdresser")
+    Review = apps.get_model("core", "Review")
+    histograms = {}
+    rows = Review.objects.values(
+        "appointment__service__hairdresser_id", "rating"
+    ).annotate(count=models.Count("id"))
+    for row in rows:
+        histogram = histograms.setdefault(
+            row["appointment__service__hairdresser_id"],
+            {str(star): 0 for star in range(1, 6)},
+        )
+        histogram[str(row["rating"])] = row["count"]
+    for hairdresser_id, histogram in histograms.items():
+        Hairdresser.objects.filter(pk=hairdresser_id).update(rating_histogram=histogram)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_hairdresser_rating_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hairdresser',
+            name='rating_histogram',
+            field=models.JSONField(default=dict, editable=False, help_text='Ej: {"5": 10, "4": 3, ...}', verbose_name='Reseñas por cantidad de estrellas'),
+        ),
+        migrations.RunPython(populate_rating_histogram, migrations.RunPython.noop),
+    ]
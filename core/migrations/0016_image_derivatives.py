@@ -0,0 +1,40 @@
+# Generated by Django 5.2.3 on 2026-10-19 11:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_hairdresser_rating_histogram'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hairdresserimage',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='hairdresserimage',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='ImageDerivative',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.ImageField(upload_to='hairdressers/derivatives/')),
+                ('format', models.CharField(choices=[('webp', 'WebP'), ('jpeg', 'JPEG')], max_length=10)),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='derivatives', to='core.hairdresserimage')),
+            ],
+            options={
+                'ordering': ['image', 'format', 'width'],
+                'constraints': [models.UniqueConstraint(fields=('image', 'format', 'width'), name='unique_image_derivative')],
+            },
+        ),
+    ]
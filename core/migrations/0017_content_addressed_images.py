@@ -0,0 +1,29 @@
+# Generated by Django 5.2.3 on 2026-10-19 11:46
+
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='hairdresserimage',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='hairdresserimage',
+            name='image',
+            field=models.ImageField(max_length=255, storage=core.storage.ContentAddressedStorage(), upload_to=core.storage.hairdresser_image_upload_to),
+        ),
+        migrations.AlterField(
+            model_name='imagederivative',
+            name='file',
+            field=models.ImageField(max_length=255, storage=core.storage.ContentAddressedStorage(), upload_to=core.storage.image_derivative_upload_to),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.2.3 on 2026-10-19 12:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def claim_future_appointments(apps, schema_editor):
+    """
+    Ocupa las celdas de los turnos activos que todavía no terminaron. Si los
+    datos existentes ya tenían superposiciones, la primera celda gana.
+    """
+    from django.db.models import Q
+    from django.utils import timezone
+
+    from core.slots import slot_cells
+
+    Appointment = apps.get_model("core", "Appointment")
+    SlotClaim = apps.get_model("core", "SlotClaim")
+    now = timezone.now()
+    active = Appointment.objects.filter(end_time__gt=now).filter(
+        Q(status="CONFIRMED")
+        | Q(status="PENDING", expires_at__isnull=True)
+        | Q(status="PENDING", expires_at__gt=now)
+    )
+    claims = []
+    for appointment in active.values("pk", "service__hairdresser_id", "start_time", "end_time").iterator():
+        for cell in slot_cells(appointment["start_time"], appointment["end_time"]):
+            claims.append(
+                SlotClaim(
+                    hairdresser_id=appointment["service__hairdresser_id"],
+                    slot_start=cell,
+                    appointment_id=appointment["pk"],
+                )
+            )
+    SlotClaim.objects.bulk_create(claims, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_changestamp'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlotClaim',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('slot_start', models.DateTimeField()),
+                ('appointment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slot_claims', to='core.appointment')),
+                ('hairdresser', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slot_claims', to='core.hairdresser')),
+            ],
+            options={
+                'verbose_name': 'Celda de agenda ocupada',
+                'verbose_name_plural': 'Celdas de agenda ocupadas',
+                'constraints': [models.UniqueConstraint(fields=('hairdresser', 'slot_start'), name='unique_slot_claim')],
+            },
+        ),
+        migrations.RunPython(claim_future_appointments, migrations.RunPython.noop),
+    ]
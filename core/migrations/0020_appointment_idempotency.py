@@ -0,0 +1,32 @@
+# Generated by Django 5.2.3 on 2026-10-19 12:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_slotclaim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='idempotency_key',
+            field=models.CharField(blank=True, help_text='Clave enviada por el navegador al reservar: los reintentos con la misma clave no crean otro turno.', max_length=64, null=True, verbose_name='Clave de idempotencia'),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='mercadopago_init_point',
+            field=models.URLField(blank=True, default='', help_text='Se reutiliza para reintentar el pago mientras el turno no expire.', max_length=500, verbose_name='URL de checkout de MercadoPago'),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='mercadopago_preference_id',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='ID de preferencia de MercadoPago'),
+        ),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(fields=('client', 'idempotency_key'), name='unique_appointment_idempotency_key'),
+        ),
+    ]
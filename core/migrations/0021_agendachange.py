@@ -0,0 +1,30 @@
+# Generated by Django 5.2.3 on 2026-10-19 13:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_appointment_idempotency'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AgendaChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.BigIntegerField()),
+                ('kind', models.CharField(choices=[('appointment', 'Turno'), ('pause', 'Pausa')], max_length=20)),
+                ('object_id', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('hairdresser', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='agenda_changes', to='core.hairdresser')),
+            ],
+            options={
+                'verbose_name': 'Cambio de agenda',
+                'verbose_name_plural': 'Cambios de agenda',
+                'constraints': [models.UniqueConstraint(fields=('hairdresser', 'seq'), name='unique_agenda_change_seq')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.3 on 2026-10-19 13:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_agendachange'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['service', 'start_time'], name='appointment_service_start'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['start_time'], name='appointment_start'),
+        ),
+        migrations.AddIndex(
+            model_name='pause',
+            index=models.Index(fields=['hairdresser', 'start_time'], name='pause_hairdresser_start'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.3 on 2026-10-19 13:27
+
+from django.db import migrations, models
+
+from core.utils import normalize_search_text
+
+
+def populate_search_text(apps, schema_editor):
+    """Completa el texto de búsqueda de los turnos existentes por lotes."""
+    Appointment = apps.get_model("core", "Appointment")
+    batch = []
+    for appointment in Appointment.objects.select_related("client").iterator(chunk_size=2000):
+        client = appointment.client
+        parts = [client.first_name, client.last_name, client.email] if client else []
+        appointment.search_text = normalize_search_text(*parts, appointment.client_name)
+        batch.append(appointment)
+        if len(batch) >= 2000:
+            Appointment.objects.bulk_update(batch, ["search_text"])
+            batch = []
+    Appointment.objects.bulk_update(batch, ["search_text"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_start_time_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='search_text',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(populate_search_text, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['client', 'start_time'], name='appointment_client_start'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.3 on 2026-10-19 13:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_appointment_search_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReconciliationCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_updated_at', models.DateTimeField(verbose_name='Pagos conciliados hasta')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Última corrida')),
+                ('hairdresser', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='reconciliation_checkpoint', to='core.hairdresser', verbose_name='Peluquería')),
+            ],
+            options={
+                'verbose_name': 'Punto de control de conciliación',
+                'verbose_name_plural': 'Puntos de control de conciliación',
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.3 on 2026-10-19 13:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_reconciliationcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurgedRowCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('table', models.CharField(max_length=50)),
+                ('month', models.DateField(help_text='Primer día del mes (local) de las filas borradas')),
+                ('count', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Filas purgadas',
+                'verbose_name_plural': 'Filas purgadas',
+            },
+        ),
+        migrations.AlterField(
+            model_name='earlystartoffer',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='webhookevent',
+            name='received_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Fecha de recepción'),
+        ),
+        migrations.AddIndex(
+            model_name='pause',
+            index=models.Index(fields=['end_time'], name='pause_end'),
+        ),
+        migrations.AddConstraint(
+            model_name='purgedrowcount',
+            constraint=models.UniqueConstraint(fields=('table', 'month'), name='unique_purged_row_count'),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.3 on 2026-10-19 13:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_retention'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedAppointment',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('start_time', models.DateTimeField()),
+                ('end_time', models.DateTimeField()),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('status', models.CharField(choices=[('PENDING', 'Pendiente'), ('CONFIRMED', 'Confirmado'), ('COMPLETED', 'Completado'), ('CANCELLED', 'Cancelado'), ('NO_SHOW', 'No se presentó')], max_length=10)),
+                ('created_at', models.DateTimeField()),
+                ('payment_method', models.CharField(default='CASH', max_length=10)),
+                ('amount_paid', models.DecimalField(decimal_places=2, default=0, max_digits=8)),
+                ('mercadopago_payment_id', models.CharField(blank=True, max_length=100, null=True)),
+                ('client_name', models.CharField(blank=True, max_length=150, null=True)),
+                ('search_text', models.CharField(blank=True, db_index=True, default='', max_length=255)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('client', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_appointments', to=settings.AUTH_USER_MODEL)),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_appointments', to='core.service')),
+            ],
+            options={
+                'verbose_name': 'Turno archivado',
+                'verbose_name_plural': 'Turnos archivados',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedPaymentTransaction',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('payment_id', models.CharField(max_length=100, unique=True)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('status', models.CharField(max_length=50)),
+                ('created_at', models.DateTimeField()),
+                ('appointment', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='transactions', to='core.archivedappointment')),
+            ],
+            options={
+                'verbose_name': 'Transacción de pago archivada',
+                'verbose_name_plural': 'Transacciones de pago archivadas',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedReview',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('rating', models.PositiveIntegerField(choices=[(1, '1'), (2, '2'), (3, '3'), (4, '4'), (5, '5')])),
+                ('comment', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField()),
+                ('appointment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='review', to='core.archivedappointment')),
+            ],
+            options={
+                'verbose_name': 'Reseña archivada',
+                'verbose_name_plural': 'Reseñas archivadas',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivedappointment',
+            index=models.Index(fields=['service', 'start_time'], name='archived_service_start'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedappointment',
+            index=models.Index(fields=['client', 'start_time'], name='archived_client_start'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-19 14:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookevent',
+            name='sync_claimed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Sincronización iniciada'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.3 on 2026-10-19 14:38
+
+from django.db import migrations, models
+
+# La búsqueda de clientes filtra con search_text LIKE '%term%': el índice
+# B-tree de db_index no sirve para eso. En PostgreSQL se reemplaza por un
+# índice GIN de trigramas (pg_trgm), que sí resuelve LIKE con comodín inicial.
+TRIGRAM_INDEXES = {
+    "core_appointment": "appointment_search_text_trgm",
+    "core_archivedappointment": "archived_appointment_search_text_trgm",
+}
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for table, name in TRIGRAM_INDEXES.items():
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin (search_text gin_trgm_ops)"
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for name in TRIGRAM_INDEXES.values():
+        schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_webhookevent_sync_claimed_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='appointment',
+            name='search_text',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='archivedappointment',
+            name='search_text',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -3,7 +3,15 @@ from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
 from django.conf import settings
 from decimal import Decimal
+from core.dates import local_day_range, local_month_range
 from core.fields import EncryptedCharField
+from core.storage import (
+    content_addressed_storage,
+    file_content_hash,
+    hairdresser_image_upload_to,
+    image_derivative_upload_to,
+)
+from django_cleanup import cleanup
 
 # Create your models here.
 
@@ -24,12 +32,34 @@ class User(AbstractUser):
         return self.username
 
 
+class HairdresserQuerySet(models.QuerySet):
+    def complete(self):
+        """
+        Equivalente en SQL de Hairdresser.is_complete(), para filtrar el
+        catálogo sin cargar horarios y servicios de cada peluquería.
+        """
+        return (
+            self.exclude(name="")
+            .exclude(address="")
+            .filter(latitude__isnull=False, longitude__isnull=False)
+            .exclude(models.Q(latitude=0) | models.Q(longitude=0))
+            .filter(
+                models.Exists(
+                    WorkingHours.objects.filter(hairdresser=models.OuterRef("pk"))
+                ),
+                models.Exists(Service.objects.filter(hairdresser=models.OuterRef("pk"))),
+            )
+        )
+
+
 class Hairdresser(models.Model):
     """
     Representa una peluquería.
     Vinculada 1-a-1 con un usuario que es 'dueño' (owner).
     """
 
+    objects = HairdresserQuerySet.as_manager()
+
     owner = models.OneToOneField(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
@@ -104,6 +134,20 @@ class Hairdresser(models.Model):
         verbose_name="Duración del slot (agenda)",
         help_text="Define la grilla de tiempo del calendario y los múltiplos para duraciones de servicios y turnos."
     )
+    # Resumen de reseñas mantenido por señales (ver core/signals.py) para
+    # mostrar la calificación en listados sin agregar sobre Review.
+    rating_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Cantidad de reseñas"
+    )
+    rating_sum = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="Suma de calificaciones"
+    )
+    rating_histogram = models.JSONField(
+        default=dict,
+        editable=False,
+        verbose_name="Reseñas por cantidad de estrellas",
+        help_text='Ej: {"5": 10, "4": 3, ...}',
+    )
 
     def clean(self):
         super().clean()
@@ -167,6 +211,47 @@ class Hairdresser(models.Model):
         """Cuuenta el número total de reseñas."""
         return Review.objects.filter(appointment__service__hairdresser=self).count()
 
+    @property
+    def cached_average_rating(self):
+        """Promedio calculado a partir del resumen guardado (sin consultas)."""
+        if not self.rating_count:
+            return 0
+        return self.rating_sum / self.rating_count
+
+    def get_rating_histogram(self):
+        """Cantidad de reseñas por estrella (1 a 5), desde el resumen guardado."""
+        histogram = self.rating_histogram or {}
+        return {star: histogram.get(str(star), 0) for star in range(5, 0, -1)}
+
+    def refresh_rating_summary(self):
+        """
+        Recalcula el resumen de reseñas con una consulta agregada por tabla
+        (reseñas de turnos activos y de turnos archivados).
+        """
+        aggregates = {
+            "count": models.Count("id"),
+            "total": models.Sum("rating"),
+            **{
+                f"star_{star}": models.Count("id", filter=models.Q(rating=star))
+                for star in range(1, 6)
+            },
+        }
+        summaries = [
+            model.objects.filter(appointment__service__hairdresser_id=self.pk).aggregate(**aggregates)
+            for model in (Review, ArchivedReview)
+        ]
+        self.rating_count = sum(summary["count"] or 0 for summary in summaries)
+        self.rating_sum = sum(summary["total"] or 0 for summary in summaries)
+        self.rating_histogram = {
+            str(star): sum(summary[f"star_{star}"] for summary in summaries)
+            for star in range(1, 6)
+        }
+        Hairdresser.objects.filter(pk=self.pk).update(
+            rating_count=self.rating_count,
+            rating_sum=self.rating_sum,
+            rating_histogram=self.rating_histogram,
+        )
+
 
 class Service(models.Model):
     """
@@ -305,11 +390,25 @@ class Service(models.Model):
         return self.appointments.filter(review__isnull=False).count()  # type: ignore
 
 
+class StartTimeQuerySet(models.QuerySet):
+    """Filtros por día o mes local sobre start_time como rangos indexables (ver core/dates.py)."""
+
+    def on_day(self, day, days=1):
+        start, end = local_day_range(day, days)
+        return self.filter(start_time__gte=start, start_time__lt=end)
+
+    def in_month(self, day):
+        start, end = local_month_range(day)
+        return self.filter(start_time__gte=start, start_time__lt=end)
+
+
 class Appointment(models.Model):
     """
     Un turno reservado por un cliente para un servicio específico.
     """
 
+    objects = StartTimeQuerySet.as_manager()
+
     STATUS_CHOICES = [
         ("PENDING", "Pendiente"),
         ("CONFIRMED", "Confirmado"),
@@ -381,6 +480,72 @@ class Appointment(models.Model):
         verbose_name="Nombre del cliente presencial",
         help_text="Nombre del cliente para reservas presenciales (walk-ins)."
     )
+    # Nombre, apellido y email del cliente (o el nombre presencial)
+    # normalizados, para buscar turnos sin JOIN con los usuarios. La búsqueda
+    # es por subcadena (LIKE '%term%'), que un índice B-tree no resuelve: en
+    # PostgreSQL la sirve un índice de trigramas (migración 0028); en los
+    # demás motores recorre los turnos ya filtrados por peluquería
+    search_text = models.CharField(max_length=255, blank=True, default="", editable=False)
+    idempotency_key = models.CharField(
+        max_length=64,
+        blank=True,
+        null=True,
+        verbose_name="Clave de idempotencia",
+        help_text="Clave enviada por el navegador al reservar: los reintentos con la misma clave no crean otro turno.",
+    )
+    mercadopago_preference_id = models.CharField(
+        max_length=100,
+        blank=True,
+        default="",
+        verbose_name="ID de preferencia de MercadoPago",
+    )
+    mercadopago_init_point = models.URLField(
+        max_length=500,
+        blank=True,
+        default="",
+        verbose_name="URL de checkout de MercadoPago",
+        help_text="Se reutiliza para reintentar el pago mientras el turno no expire.",
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["client", "idempotency_key"],
+                name="unique_appointment_idempotency_key",
+            )
+        ]
+        indexes = [
+            # Agenda de una peluquería (por servicio) y recordatorios por rango de horario
+            models.Index(fields=["service", "start_time"], name="appointment_service_start"),
+            models.Index(fields=["start_time"], name="appointment_start"),
+            # Listado de turnos de un cliente (paginado por horario)
+            models.Index(fields=["client", "start_time"], name="appointment_client_start"),
+        ]
+
+    # Los turnos finalizados de hace tiempo se mueven a ArchivedAppointment
+    archived = False
+
+    def build_search_text(self):
+        from core.utils import normalize_search_text
+
+        client = self.client
+        if client is None:
+            return normalize_search_text(self.client_name)
+        return normalize_search_text(client.first_name, client.last_name, client.email, self.client_name)
+
+    @property
+    def checkout_url(self):
+        """URL de checkout vigente para completar el pago de un turno PENDING, o None."""
+        from django.utils import timezone
+
+        if (
+            self.status == "PENDING"
+            and self.mercadopago_init_point
+            and self.expires_at
+            and self.expires_at > timezone.now()
+        ):
+            return self.mercadopago_init_point
+        return None
 
     @property
     def display_client_name(self):
@@ -451,10 +616,20 @@ class Appointment(models.Model):
         is_new = self.pk is None
         is_cancelled = False
         is_just_confirmed = False
+        is_moved = False
+        client_changed = True
 
         if self.pk:
             try:
                 old_instance = Appointment.objects.get(pk=self.pk)
+                is_moved = (
+                    old_instance.start_time != self.start_time
+                    or old_instance.end_time != self.end_time
+                )
+                client_changed = (
+                    old_instance.client_id != self.client_id
+                    or old_instance.client_name != self.client_name
+                )
                 if old_instance.status != "CANCELLED" and self.status == "CANCELLED":
                     is_cancelled = True
                 # Detectar transición a CONFIRMED desde cualquier otro estado
@@ -466,8 +641,17 @@ class Appointment(models.Model):
         if is_new:
             # Si el turno es nuevo congelamos el precio.
             self.amount = self.service.price
+        if client_changed:
+            self.search_text = self.build_search_text()
 
-        super().save(*args, **kwargs)
+        from django.db import transaction
+        from core.slots import sync_slot_claims
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # Ocupa o libera las celdas de la agenda junto con el turno: si otra
+            # reserva ya tomó alguna, SlotUnavailable deshace también este guardado.
+            sync_slot_claims(self, moved=is_moved)
 
         # Enviar notificaciones después de guardar exitosamente
         from core.utils import notify_user
@@ -652,21 +836,79 @@ class Review(models.Model):
         return f"Reseña de {self.rating} estrellas para {self.appointment.service.hairdresser.name}"
 
 
+@cleanup.ignore
 class HairdresserImage(models.Model):
     """
     Imágenes para la galería de una peluquería.
+    Los archivos se guardan por hash de contenido y pueden ser compartidos,
+    por eso django-cleanup no los borra (ver core/storage.py).
     """
 
     hairdresser = models.ForeignKey(
         Hairdresser, on_delete=models.CASCADE, related_name="images"
     )
-    image = models.ImageField(upload_to="hairdressers/")
+    image = models.ImageField(
+        upload_to=hairdresser_image_upload_to,
+        storage=content_addressed_storage,
+        max_length=255,
+    )
+    content_hash = models.CharField(
+        max_length=64, blank=True, db_index=True, editable=False
+    )
     caption = models.CharField(max_length=150, blank=True)
+    # Dimensiones del original (ya rotado según EXIF), registradas al generar
+    # las versiones redimensionadas.
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        # El hash se calcula antes de guardar para que upload_to lo use como nombre
+        if self.image and not self.image._committed:
+            self.content_hash = file_content_hash(self.image)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Imagen para {self.hairdresser.name}"
 
 
+@cleanup.ignore
+class ImageDerivative(models.Model):
+    """
+    Versión redimensionada de una HairdresserImage, en un formato web y sin
+    metadatos EXIF. Se generan en segundo plano (ver core/images.py).
+    """
+
+    FORMAT_CHOICES = [
+        ("webp", "WebP"),
+        ("jpeg", "JPEG"),
+    ]
+
+    image = models.ForeignKey(
+        HairdresserImage, on_delete=models.CASCADE, related_name="derivatives"
+    )
+    file = models.ImageField(
+        upload_to=image_derivative_upload_to,
+        storage=content_addressed_storage,
+        max_length=255,
+    )
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ["image", "format", "width"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["image", "format", "width"],
+                name="unique_image_derivative",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.format} {self.width}x{self.height} de imagen #{self.image_id}"
+
+
 class Offer(models.Model):
     """
     Ofertas o promociones especiales de una peluquería.
@@ -799,8 +1041,12 @@ class WebhookEvent(models.Model):
         blank=True,
         verbose_name="ID de request de MercadoPago",
     )
-    received_at = models.DateTimeField(auto_now_add=True, verbose_name="Fecha de recepción")
+    # Indexado para la purga de eventos viejos (ver core/retention.py)
+    received_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="Fecha de recepción")
     processed = models.BooleanField(default=False, verbose_name="Procesado con éxito")
+    # Sincronización en curso desde el retorno del checkout (ver
+    # schedule_payment_sync): evita repetirla desde otro proceso
+    sync_claimed_at = models.DateTimeField(null=True, blank=True, verbose_name="Sincronización iniciada")
 
     def __str__(self):
         return f"WebhookEvent(payment_id={self.payment_id}, processed={self.processed})"
@@ -868,6 +1114,29 @@ class PaymentTransaction(models.Model):
         return f"Transacción #{self.id} - Turno #{self.appointment_id} - Pago: {self.payment_id} - Estado: {self.status}"
 
 
+class ReconciliationCheckpoint(models.Model):
+    """
+    Hasta dónde se conciliaron los pagos de MercadoPago de una peluquería
+    (fecha de última actualización de los pagos revisados). La siguiente
+    corrida de core/reconciliation.py continúa desde allí.
+    """
+    hairdresser = models.OneToOneField(
+        Hairdresser,
+        on_delete=models.CASCADE,
+        related_name="reconciliation_checkpoint",
+        verbose_name="Peluquería",
+    )
+    last_updated_at = models.DateTimeField(verbose_name="Pagos conciliados hasta")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Última corrida")
+
+    class Meta:
+        verbose_name = "Punto de control de conciliación"
+        verbose_name_plural = "Puntos de control de conciliación"
+
+    def __str__(self):
+        return f"Conciliación de {self.hairdresser_id} hasta {self.last_updated_at:%Y-%m-%d %H:%M}"
+
+
 class EarlyStartOffer(models.Model):
     """Oferta para adelantar un turno cuando el anterior terminó antes de lo previsto."""
 
@@ -884,7 +1153,7 @@ class EarlyStartOffer(models.Model):
     new_start_time = models.DateTimeField(
         help_text="El nuevo start_time propuesto"
     )
-    expires_at = models.DateTimeField()
+    expires_at = models.DateTimeField(db_index=True)
     accepted = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -908,13 +1177,221 @@ class Pause(models.Model):
     end_time = models.DateTimeField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = StartTimeQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Pausa"
         verbose_name_plural = "Pausas"
         ordering = ["start_time"]
+        indexes = [
+            models.Index(fields=["hairdresser", "start_time"], name="pause_hairdresser_start"),
+            # Purga de pausas viejas (ver core/retention.py)
+            models.Index(fields=["end_time"], name="pause_end"),
+        ]
 
     def __str__(self):
         return f"Pausa en {self.hairdresser.name} de {self.start_time.strftime('%H:%M')} a {self.end_time.strftime('%H:%M')}"
 
 
 
+class ChangeStamp(models.Model):
+    """
+    Contador de versión por ámbito ("catalog" o "hairdresser:<id>"). Se
+    incrementa con cada alta, modificación o baja de los datos del ámbito y
+    forma parte de las claves de caché: una entrada vieja nunca se vuelve a
+    leer y simplemente expira, sin tener que buscarla para borrarla.
+    """
+    scope = models.CharField(max_length=50, unique=True)
+    version = models.BigIntegerField(default=0)
+    changed_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Versión de datos"
+        verbose_name_plural = "Versiones de datos"
+
+    def __str__(self):
+        return f"{self.scope} v{self.version}"
+
+
+class SlotClaim(models.Model):
+    """
+    Celda de la agenda (de SLOT_CELL_MINUTES minutos) ocupada por un turno
+    activo. La restricción única impide en la base de datos que dos turnos
+    activos ocupen la misma celda (ver core/slots.py).
+    """
+    hairdresser = models.ForeignKey(
+        Hairdresser, on_delete=models.CASCADE, related_name="slot_claims"
+    )
+    slot_start = models.DateTimeField()
+    appointment = models.ForeignKey(
+        Appointment, on_delete=models.CASCADE, related_name="slot_claims"
+    )
+
+    class Meta:
+        verbose_name = "Celda de agenda ocupada"
+        verbose_name_plural = "Celdas de agenda ocupadas"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["hairdresser", "slot_start"],
+                name="unique_slot_claim",
+            )
+        ]
+
+    def __str__(self):
+        return f"Celda {self.slot_start:%Y-%m-%d %H:%M} de {self.hairdresser_id} (turno #{self.appointment_id})"
+
+
+class AgendaChange(models.Model):
+    """
+    Cambio en la agenda de una peluquería (alta, modificación o baja de un
+    turno o una pausa). seq es consecutivo por peluquería y permite que la
+    estación de trabajo pida solo los cambios que todavía no recibió (ver
+    core/agenda.py).
+    """
+    KIND_CHOICES = (
+        ("appointment", "Turno"),
+        ("pause", "Pausa"),
+    )
+
+    hairdresser = models.ForeignKey(
+        Hairdresser, on_delete=models.CASCADE, related_name="agenda_changes"
+    )
+    seq = models.BigIntegerField()
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = "Cambio de agenda"
+        verbose_name_plural = "Cambios de agenda"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["hairdresser", "seq"],
+                name="unique_agenda_change_seq",
+            )
+        ]
+
+    def __str__(self):
+        return f"Cambio #{self.seq} de {self.hairdresser_id}: {self.kind} {self.object_id}"
+
+
+class PurgedRowCount(models.Model):
+    """
+    Filas borradas por la purga de retención (ver core/retention.py), por
+    tabla y mes de la fila: el total histórico sigue disponible aunque las
+    filas ya no existan.
+    """
+    table = models.CharField(max_length=50)
+    month = models.DateField(help_text="Primer día del mes (local) de las filas borradas")
+    count = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Filas purgadas"
+        verbose_name_plural = "Filas purgadas"
+        constraints = [
+            models.UniqueConstraint(fields=["table", "month"], name="unique_purged_row_count")
+        ]
+
+    def __str__(self):
+        return f"{self.table} {self.month:%Y-%m}: {self.count}"
+
+
+# --- Archivo de turnos finalizados (ver core/archive.py) ---
+
+
+class ArchivedAppointment(models.Model):
+    """
+    Turno finalizado (COMPLETED, CANCELLED o NO_SHOW) movido fuera de la
+    tabla de turnos activos. Conserva el id original, así los ids de turnos
+    activos y archivados nunca se repiten.
+    """
+    id = models.IntegerField(primary_key=True)
+    client = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="archived_appointments",
+    )
+    service = models.ForeignKey(
+        Service, on_delete=models.CASCADE, related_name="archived_appointments"
+    )
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField()
+    amount = models.DecimalField(max_digits=8, decimal_places=2)
+    status = models.CharField(max_length=10, choices=Appointment.STATUS_CHOICES)
+    created_at = models.DateTimeField()
+    payment_method = models.CharField(max_length=10, default="CASH")
+    amount_paid = models.DecimalField(max_digits=8, decimal_places=2, default=0)
+    mercadopago_payment_id = models.CharField(max_length=100, blank=True, null=True)
+    client_name = models.CharField(max_length=150, blank=True, null=True)
+    search_text = models.CharField(max_length=255, blank=True, default="")
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    objects = StartTimeQuerySet.as_manager()
+
+    # Solo lectura: se muestran en el historial junto con los turnos activos
+    archived = True
+    checkout_url = None
+    expires_at = None
+    build_search_text = Appointment.build_search_text
+    display_client_name = Appointment.display_client_name
+    get_required_deposit_amount = Appointment.get_required_deposit_amount
+    get_payment_status_info = Appointment.get_payment_status_info
+
+    class Meta:
+        verbose_name = "Turno archivado"
+        verbose_name_plural = "Turnos archivados"
+        indexes = [
+            models.Index(fields=["service", "start_time"], name="archived_service_start"),
+            models.Index(fields=["client", "start_time"], name="archived_client_start"),
+        ]
+
+    def can_be_cancelled_by_client(self):
+        return False
+
+    def __str__(self):
+        return f"Turno archivado #{self.pk} ({self.start_time:%Y-%m-%d %H:%M})"
+
+
+class ArchivedReview(models.Model):
+    """Reseña de un turno archivado (mismo id que la reseña original)."""
+
+    id = models.IntegerField(primary_key=True)
+    appointment = models.OneToOneField(
+        ArchivedAppointment, on_delete=models.CASCADE, related_name="review"
+    )
+    rating = models.PositiveIntegerField(choices=[(i, str(i)) for i in range(1, 6)])
+    comment = models.TextField(blank=True)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Reseña archivada"
+        verbose_name_plural = "Reseñas archivadas"
+
+    def __str__(self):
+        return f"Reseña archivada de {self.rating} estrellas (turno #{self.appointment_id})"
+
+
+class ArchivedPaymentTransaction(models.Model):
+    """Transacción de pago de un turno archivado. Igual que la original, no se borra."""
+
+    id = models.IntegerField(primary_key=True)
+    appointment = models.ForeignKey(
+        ArchivedAppointment, on_delete=models.PROTECT, related_name="transactions"
+    )
+    payment_id = models.CharField(max_length=100, unique=True)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=50)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Transacción de pago archivada"
+        verbose_name_plural = "Transacciones de pago archivadas"
+
+    def delete(self, *args, **kwargs):
+        raise ValidationError("Las transacciones de pago son registros de auditoría inmutables.")
+
+    def __str__(self):
+        return f"Transacción archivada #{self.id} - Turno #{self.appointment_id} - Pago: {self.payment_id}"
@@ -0,0 +1,110 @@
+"""
+Paginación por cursor (keyset) para listados que crecen sin límite.
+
+En lugar de OFFSET, cada página se pide a partir de los valores de orden del
+último elemento entregado, de modo que el costo de pedir la página N no
+depende de N y los elementos insertados mientras se navega no se duplican ni
+se saltean.
+"""
+
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.db.models import Q
+
+
+def encode_cursor(values):
+    """Codifica una lista de valores de orden como un token opaco para URLs."""
+    serializable = []
+    for value in values:
+        if isinstance(value, (datetime, date)):
+            value = value.isoformat()
+        elif isinstance(value, Decimal):
+            value = str(value)
+        serializable.append(value)
+    raw = json.dumps(serializable, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token, size):
+    """
+    Decodifica un token generado por encode_cursor().
+    Retorna None si el token está vacío o es inválido.
+    """
+    if not token:
+        return None
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != size:
+        return None
+    return values
+
+
+def _keyset_filter(ordering, values):
+    """
+    Construye la condición "estrictamente después de `values`" para un orden
+    compuesto, p. ej. ("-created_at", "-id"):
+    created_at < v0 OR (created_at = v0 AND id < v1)
+    """
+    condition = Q()
+    for index, field in enumerate(ordering):
+        name = field.lstrip("-")
+        lookup = "lt" if field.startswith("-") else "gt"
+        step = Q(**{f"{name}__{lookup}": values[index]})
+        for previous_field, previous_value in zip(ordering[:index], values[:index]):
+            step &= Q(**{previous_field.lstrip("-"): previous_value})
+        condition |= step
+    return condition
+
+
+def _get_value(item, name):
+    if isinstance(item, dict):
+        return item[name]
+    return getattr(item, name)
+
+
+def keyset_paginate(queryset, ordering, cursor=None, page_size=20):
+    """
+    Retorna (items, next_cursor) para la página que sigue a `cursor`.
+
+    `ordering` debe terminar en una columna única (normalmente "id" o "-id")
+    para que el orden sea total. Funciona tanto con querysets de modelos como
+    con proyecciones .values() siempre que incluyan las columnas de orden.
+    """
+    return keyset_paginate_many([queryset], ordering, cursor, page_size)
+
+
+def keyset_paginate_many(querysets, ordering, cursor=None, page_size=20):
+    """
+    Como keyset_paginate(), pero la página se arma con los elementos de varios
+    querysets (p. ej. turnos activos y archivados) intercalados según
+    `ordering`. La columna única del final debe serlo también entre todos los
+    querysets. Cada uno aporta a lo sumo page_size + 1 elementos.
+    """
+    values = decode_cursor(cursor, len(ordering))
+    items = []
+    for queryset in querysets:
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(_keyset_filter(ordering, values))
+        # Se pide un elemento extra para saber si hay página siguiente sin COUNT.
+        items.extend(queryset[: page_size + 1])
+
+    if len(querysets) > 1:
+        # Ordenamientos estables sucesivos, de la última columna a la primera
+        for field in reversed(ordering):
+            items.sort(key=lambda item: _get_value(item, field.lstrip("-")), reverse=field.startswith("-"))
+
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor(
+            [_get_value(last, field.lstrip("-")) for field in ordering]
+        )
+    return items, next_cursor
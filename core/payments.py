@@ -0,0 +1,309 @@
+"""
+Sincronización de pagos de MercadoPago con los turnos.
+
+sync_payment() es el único lugar donde un pago aprobado confirma un turno (o
+lo cancela y reembolsa si el horario ya fue ocupado o el monto no alcanza).
+Lo usan el webhook y el retorno desde el checkout, este último en segundo
+plano (schedule_payment_sync) para no demorar la página de "Mis turnos".
+WebhookEvent registra cada pago y marca cuándo quedó procesado: el segundo
+camino en llegar no vuelve a consultar la API ni a reembolsar.
+
+El webhook es el camino durable (MercadoPago lo reintenta hasta recibir un
+200); el retorno desde el checkout es un adelanto de mejor esfuerzo en un
+hilo que puede perderse si el proceso termina. Para no repetirlo entre
+procesos, cada retorno reclama el WebhookEvent (sync_claimed_at) bajo
+select_for_update antes de consultar la API; el webhook no respeta ese
+reclamo, así que un retorno perdido nunca deja un pago sin aplicar. Como los
+eventos procesados se purgan con el tiempo (core/retention.py), un pago
+tampoco se aplica a un turno que ya lo registra o que ya está pagado.
+"""
+
+import logging
+import sys
+import threading
+from datetime import timedelta
+from decimal import Decimal
+
+import requests
+from django.conf import settings as app_settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .metrics import track_outbound
+from .models import Appointment, PaymentTransaction, PendingRefund, WebhookEvent
+from .slots import slot_taken
+
+logger = logging.getLogger('mp')
+
+# Estados de turno en los que un pago aprobado ya quedó aplicado
+PAID_STATUSES = ("CONFIRMED", "COMPLETED", "NO_SHOW")
+
+# Tiempo tras el cual el reclamo de una sincronización desde el retorno se
+# da por perdido (p. ej. el proceso terminó con el hilo en curso)
+RETURN_SYNC_CLAIM = timedelta(minutes=2)
+
+
+class PaymentSyncError(Exception):
+    """Error transitorio (base de datos o API de MercadoPago): conviene reintentar."""
+
+
+def payment_access_token(hairdresser):
+    # En sandbox, usar el token de prueba del panel (misma lógica que la creación de preferencias)
+    if app_settings.MERCADOPAGO_SANDBOX and app_settings.MERCADOPAGO_TEST_ACCESS_TOKEN:
+        return app_settings.MERCADOPAGO_TEST_ACCESS_TOKEN
+    return hairdresser.mercadopago_access_token
+
+
+def sync_payment(hairdresser, payment_id, request_id=None, appointment_id=None):
+    """
+    Consulta el pago en MercadoPago y lo aplica a su turno. Con appointment_id
+    solo se aplica si el pago corresponde a ese turno. Retorna un mensaje
+    breve con el resultado; lanza PaymentSyncError ante errores transitorios.
+    """
+    access_token = payment_access_token(hairdresser)
+    payment_id_str = str(payment_id)
+
+    # Control de Idempotencia por Base de Datos (Rápido)
+    try:
+        with transaction.atomic():
+            event, created = WebhookEvent.objects.select_for_update().get_or_create(
+                payment_id=payment_id_str,
+                defaults={"mp_request_id": request_id}
+            )
+            if not created and event.processed:
+                logger.info(
+                    f"Webhook idempotencia: pago {payment_id_str} ya fue procesado con éxito."
+                )
+                return "OK"
+    except Exception as db_err:
+        logger.error(
+            f"Error de base de datos al verificar idempotencia para pago {payment_id_str}: {str(db_err)}"
+        )
+        raise PaymentSyncError("Database Error")
+
+    # Consultar los detalles del pago en MercadoPago
+    url = f"https://api.mercadopago.com/v1/payments/{payment_id_str}"
+    headers = {"Authorization": f"Bearer {access_token}"}
+
+    try:
+        with track_outbound("mercadopago") as call:
+            response = call.response = requests.get(url, headers=headers, timeout=10)
+        response.raise_for_status()
+        payment_data = response.json()
+    except Exception as e:
+        logger.error(
+            f"Webhook error: Failed to fetch payment {payment_id} details: {str(e)}"
+        )
+        raise PaymentSyncError(f"Error fetching payment details: {str(e)}")
+
+    status = payment_data.get("status")
+    external_reference = payment_data.get("external_reference")
+    transaction_amount = payment_data.get("transaction_amount")
+
+    if not external_reference:
+        logger.warning(
+            f"Webhook warning: Payment {payment_id} does not contain an external_reference."
+        )
+        return "No external reference found in payment"
+
+    if appointment_id is not None and str(external_reference) != str(appointment_id):
+        logger.warning(
+            f"Pago {payment_id_str} no corresponde al turno {appointment_id} (external_reference={external_reference})."
+        )
+        return "Payment does not match appointment"
+
+    try:
+        appointment = Appointment.objects.get(pk=external_reference)
+    except (Appointment.DoesNotExist, ValueError):
+        logger.error(
+            f"Webhook error: Appointment with id {external_reference} not found."
+        )
+        return "Appointment not found"
+
+    # Registrar la transacción de pago para auditoría (inmutable)
+    try:
+        PaymentTransaction.objects.update_or_create(
+            payment_id=payment_id_str,
+            defaults={
+                "appointment": appointment,
+                "amount": Decimal(str(transaction_amount)),
+                "status": status,
+            }
+        )
+    except Exception as trans_err:
+        logger.error(
+            f"Error al registrar PaymentTransaction en webhook para pago {payment_id_str}: {str(trans_err)}"
+        )
+
+    if status != "approved":
+        return "OK"
+
+    try:
+        with transaction.atomic():
+            # Bloquear WebhookEvent para evitar concurrencia
+            event = WebhookEvent.objects.select_for_update().get(payment_id=payment_id_str)
+            if event.processed:
+                logger.info(
+                    f"Webhook idempotencia (concurrente): pago {payment_id_str} ya fue procesado."
+                )
+                return "OK"
+
+            # Bloquear fila del turno para evitar concurrencia
+            appointment_locked = Appointment.objects.select_for_update().get(
+                pk=appointment.id
+            )
+
+            # El WebhookEvent procesado puede haberse purgado (core/retention.py):
+            # el turno también indica si el pago ya se aplicó
+            if (
+                appointment_locked.status in PAID_STATUSES
+                or appointment_locked.mercadopago_payment_id == payment_id_str
+            ):
+                logger.info(
+                    f"Webhook idempotencia: el turno {appointment_locked.id} ya registra el pago {payment_id_str}."
+                )
+            else:
+                _apply_approved_payment(
+                    appointment_locked, payment_id_str, Decimal(str(transaction_amount)), headers
+                )
+
+            # Marcar evento como procesado
+            event.processed = True
+            event.save()
+    except Exception as e:
+        logger.error(f"Error procesando confirmación atómica en webhook: {str(e)}")
+        raise PaymentSyncError("Error processing confirmation")
+
+    return "OK"
+
+
+def _apply_approved_payment(appointment, payment_id, paid_amount, headers):
+    """Confirma el turno bloqueado, o lo cancela y reembolsa si no puede confirmarse."""
+    from .utils import notify_user
+
+    # Verificar si ya existe otro turno CONFIRMADO que se superpone con este
+    # o si otro turno activo ocupa sus celdas de agenda (SlotClaim)
+    has_overlap = (
+        Appointment.objects.filter(
+            service__hairdresser=appointment.service.hairdresser,
+            status="CONFIRMED",
+            start_time__lt=appointment.end_time,
+            end_time__gt=appointment.start_time,
+        )
+        .exclude(pk=appointment.id)
+        .exists()
+    ) or slot_taken(appointment)
+
+    expected_amount = appointment.get_expected_payment_amount()
+    if not has_overlap and paid_amount >= expected_amount:
+        # Confirmar
+        appointment.status = "CONFIRMED"
+        appointment.amount_paid = paid_amount
+        appointment.mercadopago_payment_id = payment_id
+        appointment.expires_at = None
+        appointment.save()
+        logger.info(
+            f"Webhook success: Appointment {appointment.id} paid and CONFIRMED. Paid amount: {paid_amount}"
+        )
+        return
+
+    # El turno ya fue ocupado o el pago es insuficiente: cancelar y reembolsar automáticamente
+    appointment.status = "CANCELLED"
+    appointment.amount_paid = paid_amount
+    appointment.mercadopago_payment_id = payment_id
+    appointment.expires_at = None
+    appointment.save()
+
+    try:
+        refund_url = f"https://api.mercadopago.com/v1/payments/{payment_id}/refunds"
+        with track_outbound("mercadopago") as call:
+            refund_resp = call.response = requests.post(
+                refund_url, headers=headers, json={}, timeout=10
+            )
+        refund_resp.raise_for_status()
+        if has_overlap:
+            logger.warning(
+                f"Sobreventa detectada: Turno {appointment.id} reembolsado automáticamente. Pago ID: {payment_id}"
+            )
+        else:
+            logger.warning(
+                f"Pago insuficiente detectado: Turno {appointment.id} reembolsado automáticamente. Pago ID: {payment_id}. Esperado: {expected_amount}, Pagado: {paid_amount}"
+            )
+    except Exception as refund_err:
+        logger.error(
+            f"Error reembolsando pago {payment_id} para turno {appointment.id}: {str(refund_err)}"
+        )
+        # Registrar reembolso pendiente para reintento automático
+        PendingRefund.objects.get_or_create(
+            appointment=appointment,
+            defaults={
+                'payment_id': payment_id,
+                'amount': paid_amount,
+                'last_error': str(refund_err)
+            }
+        )
+
+    # Enviar notificación especial al cliente
+    if has_overlap:
+        notify_user(
+            user=appointment.client,
+            event_type="APPOINTMENT_CANCELLED_CLIENT",
+            context={"appointment": appointment, "overbooked_refund": True},
+            subject="Reembolso de Turno - Stilo",
+            push_title="Turno cancelado y reembolsado",
+            push_message=f"Tu turno en {appointment.service.hairdresser.name} no estaba disponible y fue reembolsado automáticamente.",
+        )
+    else:
+        notify_user(
+            user=appointment.client,
+            event_type="APPOINTMENT_CANCELLED_CLIENT",
+            context={"appointment": appointment, "underpaid_refund": True},
+            subject="Reembolso de Turno - Stilo",
+            push_title="Turno cancelado por pago insuficiente",
+            push_message=f"Tu turno en {appointment.service.hairdresser.name} fue cancelado y reembolsado porque el pago fue menor al requerido.",
+        )
+
+
+def _sync_payment_thread(hairdresser_id, payment_id, appointment_id):
+    from .models import Hairdresser
+
+    try:
+        hairdresser = Hairdresser.objects.get(pk=hairdresser_id)
+        sync_payment(hairdresser, payment_id, appointment_id=appointment_id)
+    except Exception as e:
+        # El webhook (o el próximo retorno del cliente) lo reintentará
+        logger.error(f"Error sincronizando el pago {payment_id} del turno {appointment_id}: {str(e)}")
+    finally:
+        # Procesado o no, el próximo retorno puede volver a intentarlo
+        WebhookEvent.objects.filter(payment_id=str(payment_id)).update(sync_claimed_at=None)
+        if "test" not in sys.argv:
+            connection.close()
+
+
+def schedule_payment_sync(appointment, payment_id):
+    """
+    Encola la sincronización del pago con el que el cliente volvió del
+    checkout. No hace nada si el pago ya fue procesado (por el webhook o un
+    retorno anterior) o si otro retorno, en este u otro proceso, ya la
+    reclamó hace menos de RETURN_SYNC_CLAIM.
+    En modo de pruebas se ejecuta de manera síncrona.
+    """
+    payment_id = str(payment_id)
+    now = timezone.now()
+    with transaction.atomic():
+        event, _ = WebhookEvent.objects.select_for_update().get_or_create(payment_id=payment_id)
+        if event.processed or (
+            event.sync_claimed_at and event.sync_claimed_at > now - RETURN_SYNC_CLAIM
+        ):
+            return False
+        event.sync_claimed_at = now
+        event.save(update_fields=["sync_claimed_at"])
+
+    args = (appointment.service.hairdresser_id, payment_id, appointment.pk)
+    if "test" in sys.argv:
+        _sync_payment_thread(*args)
+    else:
+        thread = threading.Thread(target=_sync_payment_thread, args=args)
+        thread.daemon = True
+        thread.start()
+    return True
@@ -0,0 +1,312 @@
+"""
+Conciliación de los pagos registrados en MercadoPago con los turnos.
+
+Para cada peluquería con cobros digitales se recorren, con la API de
+búsqueda de pagos, los pagos actualizados desde el último punto de control
+(ReconciliationCheckpoint), en páginas de SEARCH_PAGE_SIZE. Cada página se
+compara contra los turnos, las PaymentTransaction y los WebhookEvent
+cargados con una consulta por tabla (un índice en memoria por página, no
+una consulta por pago) y se informan las diferencias:
+
+- missing_transaction / transaction_mismatch: falta la PaymentTransaction
+  del pago o su monto, estado o turno no coinciden con MercadoPago.
+- amount_paid_mismatch: el turno confirmado no refleja el monto o el ID del
+  pago aprobado.
+- unapplied_payment: un pago aprobado que nunca se aplicó a su turno.
+- duplicate_payment, refunded_but_confirmed y unmatched: casos que requieren
+  revisión manual (un segundo pago aprobado, un pago devuelto de un turno
+  que sigue confirmado o un pago sin turno de la peluquería).
+
+Con repair=True se corrigen los tres primeros grupos: las PaymentTransaction
+y los montos pagados en escrituras por lote (bulk_create / bulk_update), y
+los pagos sin aplicar pasando por sync_payment(), el único camino que
+confirma o reembolsa turnos.
+Solo las corridas con repair avanzan el punto de control, y nunca más allá
+del pago más antiguo que sync_payment() no pudo aplicar: ese pago vuelve a
+revisarse en la corrida siguiente.
+
+Las peluquerías se procesan en paralelo con a lo sumo `workers` hilos (la
+API de MercadoPago limita los pedidos por token) y en modo de pruebas de
+manera secuencial.
+"""
+
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+
+import requests
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .caching import bump, hairdresser_scope
+from .metrics import track_outbound
+from .models import (
+    Appointment,
+    Hairdresser,
+    PaymentTransaction,
+    ReconciliationCheckpoint,
+    WebhookEvent,
+)
+from .payments import PAID_STATUSES, PaymentSyncError, payment_access_token, sync_payment
+
+logger = logging.getLogger('mp')
+
+SEARCH_URL = "https://api.mercadopago.com/v1/payments/search"
+# Pagos por página de la API de búsqueda
+SEARCH_PAGE_SIZE = 100
+# Margen hacia atrás al continuar desde el punto de control: la búsqueda de
+# MercadoPago puede indexar un pago unos minutos después de actualizarlo
+CHECKPOINT_OVERLAP = timedelta(hours=1)
+# Filas por sentencia en las escrituras por lote
+WRITE_BATCH_SIZE = 500
+
+# Pagos devueltos al cliente
+RETURNED_STATUSES = ("refunded", "charged_back")
+
+
+def search_payments(access_token, begin, end, offset):
+    """Una página de pagos actualizados en [begin, end], del más viejo al más nuevo."""
+    params = {
+        "sort": "date_last_updated",
+        "criteria": "asc",
+        "range": "date_last_updated",
+        "begin_date": begin.isoformat(),
+        "end_date": end.isoformat(),
+        "limit": SEARCH_PAGE_SIZE,
+        "offset": offset,
+    }
+    with track_outbound("mercadopago") as call:
+        response = call.response = requests.get(
+            SEARCH_URL,
+            headers={"Authorization": f"Bearer {access_token}"},
+            params=params,
+            timeout=10,
+        )
+    response.raise_for_status()
+    data = response.json()
+    return data.get("results", []), data.get("paging", {}).get("total", 0)
+
+
+def _issue(report, kind, payment_id, appointment_id=None, detail=""):
+    report["issues"].append(
+        {"kind": kind, "payment_id": payment_id, "appointment_id": appointment_id, "detail": detail}
+    )
+
+
+def _appointment_id(reference):
+    try:
+        return int(reference)
+    except (TypeError, ValueError):
+        return None
+
+
+def reconcile_page(hairdresser, payments, report, repair=False):
+    """
+    Compara (y con repair corrige) una página de pagos de la API de búsqueda.
+    Retorna los pagos que no se pudieron aplicar, en el orden de la página.
+    """
+    payment_ids = [str(payment["id"]) for payment in payments]
+    appointments = Appointment.objects.filter(
+        pk__in={_appointment_id(p.get("external_reference")) for p in payments} - {None},
+        service__hairdresser=hairdresser,
+    ).only("pk", "status", "amount_paid", "mercadopago_payment_id").in_bulk()
+    transactions = PaymentTransaction.objects.filter(payment_id__in=payment_ids).in_bulk(
+        field_name="payment_id"
+    )
+    processed = set(
+        WebhookEvent.objects.filter(payment_id__in=payment_ids, processed=True).values_list(
+            "payment_id", flat=True
+        )
+    )
+
+    new_transactions = []
+    changed_transactions = []
+    changed_appointments = []
+    unapplied = []
+    for payment in payments:
+        payment_id = str(payment["id"])
+        status = payment.get("status")
+        amount = Decimal(str(payment.get("transaction_amount") or 0))
+        appointment = appointments.get(_appointment_id(payment.get("external_reference")))
+        if appointment is None:
+            _issue(report, "unmatched", payment_id, detail=f"external_reference={payment.get('external_reference')}")
+            continue
+
+        tx = transactions.get(payment_id)
+        if tx is None:
+            _issue(report, "missing_transaction", payment_id, appointment.pk, f"{status} ${amount}")
+            new_transactions.append(
+                PaymentTransaction(appointment=appointment, payment_id=payment_id, amount=amount, status=status)
+            )
+        elif (tx.appointment_id, tx.amount, tx.status) != (appointment.pk, amount, status):
+            _issue(
+                report, "transaction_mismatch", payment_id, appointment.pk,
+                f"registrado {tx.status} ${tx.amount}, MercadoPago {status} ${amount}",
+            )
+            tx.appointment_id, tx.amount, tx.status = appointment.pk, amount, status
+            changed_transactions.append(tx)
+
+        applied_id = appointment.mercadopago_payment_id
+        if status == "approved":
+            if appointment.status not in PAID_STATUSES:
+                if payment_id not in processed:
+                    _issue(report, "unapplied_payment", payment_id, appointment.pk, appointment.status)
+                    unapplied.append(payment)
+            elif applied_id and applied_id != payment_id:
+                _issue(report, "duplicate_payment", payment_id, appointment.pk, f"el turno registra el pago {applied_id}")
+            elif applied_id != payment_id or appointment.amount_paid != amount:
+                _issue(
+                    report, "amount_paid_mismatch", payment_id, appointment.pk,
+                    f"registrado ${appointment.amount_paid}, MercadoPago ${amount}",
+                )
+                appointment.amount_paid = amount
+                appointment.mercadopago_payment_id = payment_id
+                changed_appointments.append(appointment)
+        elif status in RETURNED_STATUSES and applied_id == payment_id and appointment.status == "CONFIRMED":
+            _issue(report, "refunded_but_confirmed", payment_id, appointment.pk, status)
+
+    if not repair:
+        return []
+
+    with transaction.atomic():
+        PaymentTransaction.objects.bulk_create(
+            new_transactions, batch_size=WRITE_BATCH_SIZE, ignore_conflicts=True
+        )
+        PaymentTransaction.objects.bulk_update(
+            changed_transactions, ["appointment", "amount", "status"], batch_size=WRITE_BATCH_SIZE
+        )
+        Appointment.objects.bulk_update(
+            changed_appointments, ["amount_paid", "mercadopago_payment_id"], batch_size=WRITE_BATCH_SIZE
+        )
+    report["repaired"] += len(new_transactions) + len(changed_transactions) + len(changed_appointments)
+    if changed_appointments:
+        # bulk_update no dispara las señales que invalidan la caché
+        bump(hairdresser_scope(hairdresser.pk))
+
+    failed = []
+    for payment in unapplied:
+        try:
+            sync_payment(hairdresser, str(payment["id"]))
+            report["repaired"] += 1
+        except PaymentSyncError as e:
+            _issue(report, "sync_failed", str(payment["id"]), detail=str(e))
+            failed.append(payment)
+    return failed
+
+
+def reconcile_hairdresser(hairdresser, end=None, repair=False):
+    """
+    Concilia los pagos de una peluquería actualizados hasta `end` (ahora, por
+    defecto). Retorna el reporte: pagos revisados, diferencias, correcciones
+    y el error que haya cortado la corrida.
+    """
+    end = end or timezone.now()
+    report = {"hairdresser": hairdresser.pk, "payments": 0, "issues": [], "repaired": 0, "error": None}
+
+    access_token = payment_access_token(hairdresser)
+    if not access_token:
+        report["error"] = "Sin token de MercadoPago"
+        return report
+
+    checkpoint = ReconciliationCheckpoint.objects.filter(hairdresser=hairdresser).first()
+    if checkpoint:
+        begin = checkpoint.last_updated_at - CHECKPOINT_OVERLAP
+    else:
+        begin = end - timedelta(days=settings.RECONCILIATION_LOOKBACK_DAYS)
+
+    # Fecha del pago más antiguo que no se pudo aplicar: el punto de control
+    # no pasa de ahí para que la próxima corrida lo reintente
+    retry_from = None
+    offset = 0
+    while True:
+        try:
+            payments, total = search_payments(access_token, begin, end, offset)
+        except Exception as e:
+            logger.error(f"[CONCILIACIÓN] Error buscando pagos de la peluquería {hairdresser.pk}: {str(e)}")
+            report["error"] = str(e)
+            return report
+        if not payments:
+            break
+
+        failed = reconcile_page(hairdresser, payments, report, repair=repair)
+        if failed and retry_from is None:
+            # Las páginas van del pago más viejo al más nuevo
+            retry_from = parse_datetime(failed[0].get("date_last_updated") or "") or begin
+        report["payments"] += len(payments)
+        offset += len(payments)
+        if repair:
+            # Lo ya revisado no se repite si la corrida se corta en la página siguiente
+            last_updated = parse_datetime(payments[-1].get("date_last_updated") or "")
+            if last_updated:
+                _save_checkpoint(hairdresser, min(last_updated, retry_from or last_updated))
+        if offset >= total:
+            break
+
+    if repair:
+        _save_checkpoint(hairdresser, retry_from or end)
+    return report
+
+
+def _save_checkpoint(hairdresser, last_updated_at):
+    ReconciliationCheckpoint.objects.update_or_create(
+        hairdresser=hairdresser, defaults={"last_updated_at": last_updated_at}
+    )
+
+
+def _reconcile_thread(hairdresser, end, repair):
+    try:
+        return reconcile_hairdresser(hairdresser, end=end, repair=repair)
+    except Exception as e:
+        logger.error(f"[CONCILIACIÓN] Error conciliando la peluquería {hairdresser.pk}: {str(e)}")
+        return {"hairdresser": hairdresser.pk, "payments": 0, "issues": [], "repaired": 0, "error": str(e)}
+    finally:
+        if "test" not in sys.argv:
+            connection.close()
+
+
+def reconcile_payments(hairdressers=None, repair=False, workers=None):
+    """
+    Concilia todas las peluquerías con cobros digitales (o las indicadas),
+    con a lo sumo `workers` en paralelo. Retorna un reporte por peluquería.
+    """
+    if hairdressers is None:
+        hairdressers = Hairdresser.objects.filter(mercadopago_active=True)
+    hairdressers = list(hairdressers)
+    workers = max(1, workers or settings.RECONCILIATION_WORKERS)
+    # Mismo límite superior para todas: los pagos que se actualicen mientras
+    # tanto quedan para la próxima corrida
+    end = timezone.now()
+
+    if "test" in sys.argv or workers == 1:
+        reports = [_reconcile_thread(hairdresser, end, repair) for hairdresser in hairdressers]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            reports = list(
+                executor.map(lambda hairdresser: _reconcile_thread(hairdresser, end, repair), hairdressers)
+            )
+
+    for report in reports:
+        logger.info(
+            f"[CONCILIACIÓN] Peluquería {report['hairdresser']}: pagos={report['payments']}, "
+            f"diferencias={len(report['issues'])}, corregidas={report['repaired']}, error={report['error']}"
+        )
+    return reports
+
+
+def summarize(reports):
+    """Totales de una corrida: pagos revisados, diferencias por tipo, correcciones y errores."""
+    issues = {}
+    for report in reports:
+        for issue in report["issues"]:
+            issues[issue["kind"]] = issues.get(issue["kind"], 0) + 1
+    return {
+        "hairdressers": len(reports),
+        "payments": sum(report["payments"] for report in reports),
+        "issues": issues,
+        "repaired": sum(report["repaired"] for report in reports),
+        "failed": sum(1 for report in reports if report["error"]),
+    }
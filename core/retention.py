@@ -0,0 +1,133 @@
+"""
+Retención de las tablas operativas que crecen sin límite.
+
+Los eventos de webhook, las ofertas de adelanto y las pausas solo se usan
+mientras están vigentes, pero se consultan en cada webhook, en la agenda y
+en la estación de trabajo. purge_expired() borra las filas más viejas que
+la retención configurada para cada tabla (*_RETENTION_DAYS, 0 = nunca) en
+lotes pequeños, cada uno en su propia transacción, para no bloquear las
+tablas durante toda la purga. Cada lote suma sus filas a PurgedRowCount
+(por tabla y mes) en la misma transacción en la que las borra.
+
+Nunca se borran filas que todavía se usan:
+
+- WebhookEvent: solo los procesados. Los pendientes son pagos que aún deben
+  reintentarse, y los de un reembolso pendiente (PendingRefund) evitan que
+  un webhook repetido vuelva a aplicar el pago.
+- EarlyStartOffer: solo las vencidas; el enlace de la oferta ya no sirve.
+- Pause: solo las que terminaron. Se borran con delete() dentro de
+  quiet_agenda_changes() (no son cambios de agenda que la estación de
+  trabajo deba recibir) y la caché de cada peluquería se invalida una vez
+  por lote.
+
+Los WebhookEvent procesados ya no son la única protección contra un pago
+aplicado dos veces: sync_payment() tampoco vuelve a aplicar un pago a un
+turno que ya lo registra o que ya está pagado (PAID_STATUSES).
+"""
+
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .caching import bump, hairdresser_scope
+from .models import EarlyStartOffer, Pause, PendingRefund, PurgedRowCount, WebhookEvent
+from .signals import quiet_agenda_changes
+
+# Filas borradas por transacción
+BATCH_SIZE = 500
+
+
+def _webhook_events(cutoff):
+    return WebhookEvent.objects.filter(received_at__lt=cutoff, processed=True).exclude(
+        payment_id__in=PendingRefund.objects.values("payment_id")
+    )
+
+
+def _early_start_offers(cutoff):
+    return EarlyStartOffer.objects.filter(expires_at__lt=cutoff)
+
+
+def _pauses(cutoff):
+    return Pause.objects.filter(end_time__lt=cutoff)
+
+
+def _delete_pauses(queryset):
+    scopes = [
+        hairdresser_scope(hairdresser_id)
+        for hairdresser_id in queryset.order_by().values_list("hairdresser_id", flat=True).distinct()
+    ]
+    with quiet_agenda_changes():
+        deleted, _ = queryset.delete()
+    bump(*scopes)
+    return deleted
+
+
+def _delete(queryset):
+    deleted, _ = queryset.delete()
+    return deleted
+
+
+# Tabla: (setting de retención, filas vencidas, campo de fecha, borrado de un lote)
+POLICIES = {
+    "webhook_events": ("WEBHOOK_EVENT_RETENTION_DAYS", _webhook_events, "received_at", _delete),
+    "early_start_offers": ("EARLY_START_OFFER_RETENTION_DAYS", _early_start_offers, "expires_at", _delete),
+    "pauses": ("PAUSE_RETENTION_DAYS", _pauses, "end_time", _delete_pauses),
+}
+
+
+def _count_batch(table, batch):
+    """Suma las filas del lote a PurgedRowCount, por mes."""
+    for row in batch.annotate(month=TruncMonth(POLICIES[table][2])).values("month").annotate(
+        rows=Count("pk")
+    ).order_by():
+        month = timezone.localtime(row["month"]).date()
+        counter, _ = PurgedRowCount.objects.get_or_create(table=table, month=month)
+        PurgedRowCount.objects.filter(pk=counter.pk).update(count=F("count") + row["rows"])
+
+
+def expired_rows(table, now=None):
+    """Filas de la tabla que superan su retención, o None si no tiene retención."""
+    setting, rows, _, _ = POLICIES[table]
+    days = getattr(settings, setting)
+    if not days:
+        return None
+    return rows((now or timezone.now()) - timedelta(days=days))
+
+
+def purge_table(table, now=None, batch_size=BATCH_SIZE, pause_seconds=0, dry_run=False):
+    """Borra por lotes las filas vencidas de una tabla. Retorna cuántas borró (o borraría)."""
+    queryset = expired_rows(table, now)
+    if queryset is None:
+        return 0
+    if dry_run:
+        return queryset.count()
+
+    delete = POLICIES[table][3]
+    purged = 0
+    while True:
+        ids = list(queryset.order_by("pk").values_list("pk", flat=True)[:batch_size])
+        if not ids:
+            return purged
+        with transaction.atomic():
+            # Se vuelven a aplicar las condiciones: una fila pudo volver a
+            # usarse desde que se eligió el lote
+            batch = queryset.filter(pk__in=ids)
+            _count_batch(table, batch)
+            purged += delete(batch)
+        if pause_seconds:
+            # Deja pasar a otras escrituras entre lote y lote
+            time.sleep(pause_seconds)
+
+
+def purge_expired(tables=None, now=None, batch_size=BATCH_SIZE, pause_seconds=0, dry_run=False):
+    """Purga las tablas indicadas (todas, por defecto). Retorna {tabla: filas borradas}."""
+    now = now or timezone.now()
+    return {
+        table: purge_table(table, now, batch_size, pause_seconds, dry_run)
+        for table in (tables or POLICIES)
+    }
@@ -0,0 +1,163 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .agenda import record_agenda_change
+from .caching import CATALOG_SCOPE, bump, hairdresser_scope
+from .models import (
+    Appointment,
+    Hairdresser,
+    HairdresserImage,
+    ImageDerivative,
+    Pause,
+    Review,
+    Service,
+    User,
+    WorkingHours,
+)
+
+
+def _review_hairdresser_id(review):
+    # Se consulta el id de la peluquería en lugar de recorrer las relaciones
+    # de la instancia: en un borrado en cascada el turno puede ya no existir.
+    return (
+        Appointment.objects.filter(pk=review.appointment_id)
+        .values_list("service__hairdresser_id", flat=True)
+        .first()
+    )
+
+
+def _refresh_hairdresser_rating(review):
+    hairdresser_id = _review_hairdresser_id(review)
+    if hairdresser_id is None:
+        return
+    Hairdresser(pk=hairdresser_id).refresh_rating_summary()
+    bump(hairdresser_scope(hairdresser_id), CATALOG_SCOPE)
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, **kwargs):
+    _refresh_hairdresser_rating(instance)
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    _refresh_hairdresser_rating(instance)
+
+
+# --- Versiones de caché (ver core/caching.py) ---
+
+
+def _hairdresser_id(instance):
+    if isinstance(instance, Hairdresser):
+        return instance.pk
+    if isinstance(instance, Appointment):
+        if Appointment.service.is_cached(instance):  # type: ignore
+            return instance.service.hairdresser_id
+        return (
+            Service.objects.filter(pk=instance.service_id)
+            .values_list("hairdresser_id", flat=True)
+            .first()
+        )
+    if isinstance(instance, ImageDerivative):
+        return (
+            HairdresserImage.objects.filter(pk=instance.image_id)
+            .values_list("hairdresser_id", flat=True)
+            .first()
+        )
+    return instance.hairdresser_id
+
+
+# Modelos que se muestran en el listado/mapa además de en el detalle
+CATALOG_MODELS = (Hairdresser, Service, WorkingHours, HairdresserImage, ImageDerivative)
+# Modelos que solo afectan al detalle y la agenda de la peluquería
+HAIRDRESSER_MODELS = (Appointment, Pause)
+
+
+# Activo dentro de quiet_agenda_changes()
+_quiet = ContextVar("quiet_agenda_changes", default=False)
+
+
+@contextmanager
+def quiet_agenda_changes():
+    """
+    Las altas y bajas de turnos y pausas dentro del bloque no se registran
+    como cambios de agenda ni invalidan la caché fila por fila: quien lo usa
+    invalida la caché una vez al terminar (p. ej. la purga de pausas
+    terminadas, que la estación de trabajo no necesita recibir).
+    """
+    token = _quiet.set(True)
+    try:
+        yield
+    finally:
+        _quiet.reset(token)
+
+
+def _bump_versions(sender, instance, **kwargs):
+    if kwargs.get("raw") or (sender in HAIRDRESSER_MODELS and _quiet.get()):
+        return
+    hairdresser_id = _hairdresser_id(instance)
+    scopes = [hairdresser_scope(hairdresser_id)] if hairdresser_id else []
+    if sender in CATALOG_MODELS:
+        scopes.append(CATALOG_SCOPE)
+    bump(*scopes)
+
+
+for _model in CATALOG_MODELS + HAIRDRESSER_MODELS:
+    post_save.connect(_bump_versions, sender=_model, dispatch_uid=f"bump_{_model.__name__}")
+    post_delete.connect(_bump_versions, sender=_model, dispatch_uid=f"bump_del_{_model.__name__}")
+
+
+# --- Cambios de agenda para la estación de trabajo (ver core/agenda.py) ---
+
+AGENDA_KINDS = {Appointment: "appointment", Pause: "pause"}
+
+
+def _record_agenda_save(sender, instance, **kwargs):
+    if kwargs.get("raw") or _quiet.get():
+        return
+    hairdresser_id = _hairdresser_id(instance)
+    if hairdresser_id:
+        record_agenda_change(hairdresser_id, AGENDA_KINDS[sender], instance.pk)
+
+
+def _record_agenda_delete(sender, instance, origin=None, **kwargs):
+    # Solo bajas directas: en un borrado en cascada (peluquería, servicio,
+    # usuario) la fila nueva podría apuntar a una peluquería que se está
+    # borrando en la misma operación.
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model is not sender or _quiet.get():
+        return
+    hairdresser_id = _hairdresser_id(instance)
+    if hairdresser_id:
+        record_agenda_change(hairdresser_id, AGENDA_KINDS[sender], instance.pk)
+
+
+for _model in AGENDA_KINDS:
+    post_save.connect(_record_agenda_save, sender=_model, dispatch_uid=f"agenda_{_model.__name__}")
+    post_delete.connect(_record_agenda_delete, sender=_model, dispatch_uid=f"agenda_del_{_model.__name__}")
+
+
+# --- Texto de búsqueda de los turnos (ver Appointment.search_text) ---
+
+SEARCH_TEXT_FIELDS = {"first_name", "last_name", "email"}
+
+
+@receiver(post_save, sender=User)
+def refresh_appointment_search_text(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # Los logins guardan solo last_login: no cambian el texto de búsqueda
+    if created or raw or (update_fields and not SEARCH_TEXT_FIELDS & set(update_fields)):
+        return
+    # Turnos activos y archivados: el historial busca en ambos
+    for appointments in (instance.appointments, instance.archived_appointments):
+        changed = []
+        for appointment in appointments.only("pk", "client_id", "client_name", "search_text"):
+            appointment.client = instance
+            search_text = appointment.build_search_text()
+            if appointment.search_text != search_text:
+                appointment.search_text = search_text
+                changed.append(appointment)
+        appointments.model.objects.bulk_update(changed, ["search_text"])
@@ -0,0 +1,215 @@
+"""
+Reserva de horarios a nivel de base de datos.
+
+La agenda de cada peluquería se divide en celdas fijas de SLOT_CELL_MINUTES
+minutos. Un turno activo ocupa una fila SlotClaim por cada celda que toca su
+franja [start_time, end_time) (de la celda que contiene el inicio a la que
+contiene el final, aunque los horarios no caigan en la grilla, como los que
+dejan los ajustes y las cascadas), y la restricción única (hairdresser,
+slot_start) garantiza que dos turnos activos no ocupen la misma celda: si dos
+reservas compiten por el mismo horario, la segunda inserción falla en la base
+de datos aunque ambas hayan pasado la validación del formulario. Las reservas
+de horarios distintos no comparten filas y no se bloquean entre sí.
+
+Dos turnos contiguos fuera de la grilla (uno termina a las 10:04 y el
+siguiente empieza a esa hora) tocan la misma celda sin superponerse: la
+celda queda para el que la tomó primero y pasa al otro si aquel la libera.
+Como ningún turno dura menos que una celda, dos turnos que sí se superponen
+siempre compiten por alguna celda que ninguno de sus vecinos toca.
+
+Appointment.save() sincroniza las celdas dentro de la misma transacción que
+el turno. Las altas (reservas, walk-ins) y los cambios de estado son
+estrictos; en cambio, cuando se mueve el horario de un turno existente
+(ajustes del dueño, cascadas, adelantos) el turno desplaza a los turnos
+posteriores con los que se superpone, que son los que la cascada mueve a
+continuación y recuperan sus celdas al guardarse en su nuevo horario. Un
+turno anterior superpuesto no se desplaza: el cambio falla con
+SlotUnavailable. Las celdas de turnos que dejaron de bloquear la agenda sin
+pasar por save() (un PENDING cuyo pago venció, un .update() masivo) se
+consideran obsoletas y se liberan al chocar con ellas.
+"""
+
+import math
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import IntegrityError, transaction
+
+# Divisor común de las duraciones de grilla (10, 15, 20, 30, 60 minutos)
+SLOT_CELL_MINUTES = 5
+CELL = timedelta(minutes=SLOT_CELL_MINUTES)
+
+UNAVAILABLE_MESSAGE = "El horario seleccionado ya no está disponible. Por favor, elija otro."
+
+
+class SlotUnavailable(Exception):
+    """Otro turno activo ya ocupa alguna celda del horario pedido."""
+
+    def __init__(self, message=UNAVAILABLE_MESSAGE):
+        super().__init__(message)
+
+
+def slot_cells(start, end):
+    """Inicio (UTC) de cada celda que toca [start, end)."""
+    step = SLOT_CELL_MINUTES * 60
+    end_ts = end.timestamp()
+    cell = math.floor(start.timestamp() / step) * step
+    cells = []
+    while cell < end_ts:
+        cells.append(datetime.fromtimestamp(cell, tz=dt_timezone.utc))
+        cell += step
+    return cells
+
+
+def _touches(appointment, cell):
+    return cell < appointment.end_time and cell + CELL > appointment.start_time
+
+
+def _overlaps(appointment, other):
+    return appointment.start_time < other.end_time and other.start_time < appointment.end_time
+
+
+def is_blocking(appointment, now=None):
+    """Mismo criterio que AppointmentForm: CONFIRMED o PENDING no vencido."""
+    from django.utils import timezone
+
+    if appointment.status == "CONFIRMED":
+        return True
+    if appointment.status != "PENDING":
+        return False
+    return appointment.expires_at is None or appointment.expires_at > (now or timezone.now())
+
+
+def _is_stale(claim, now):
+    """La celda ya no corresponde a su turno: dejó de bloquear o se movió sin save()."""
+    return not is_blocking(claim.appointment, now) or not _touches(claim.appointment, claim.slot_start)
+
+
+def slot_taken(appointment):
+    """Indica si otro turno activo superpuesto ocupa alguna celda de la franja de appointment."""
+    from django.utils import timezone
+
+    from .models import SlotClaim
+
+    now = timezone.now()
+    claims = (
+        SlotClaim.objects.filter(
+            hairdresser_id=appointment.service.hairdresser_id,
+            slot_start__in=slot_cells(appointment.start_time, appointment.end_time),
+        )
+        .exclude(appointment_id=appointment.pk)
+        .select_related("appointment")
+    )
+    return any(
+        not _is_stale(claim, now) and _overlaps(claim.appointment, appointment) for claim in claims
+    )
+
+
+def _claimable(appointment, cells, displace):
+    """
+    Celdas de cells que el turno debe insertar. Libera las obsoletas y, con
+    displace, las de turnos posteriores superpuestos (la cascada los mueve
+    después); omite las que un vecino solo toca en el borde. Lanza
+    SlotUnavailable si las ocupa otro turno activo superpuesto.
+    """
+    from django.utils import timezone
+
+    from .models import SlotClaim
+
+    now = timezone.now()
+    claims = (
+        SlotClaim.objects.filter(hairdresser_id=appointment.service.hairdresser_id, slot_start__in=cells)
+        .exclude(appointment_id=appointment.pk)
+        .select_related("appointment")
+    )
+    freed = []
+    shared = set()
+    for claim in claims:
+        other = claim.appointment
+        if _is_stale(claim, now):
+            freed.append(claim.pk)
+        elif not _overlaps(other, appointment):
+            shared.add(claim.slot_start)
+        elif displace and other.start_time >= appointment.start_time:
+            freed.append(claim.pk)
+        else:
+            raise SlotUnavailable()
+    if freed:
+        SlotClaim.objects.filter(pk__in=freed).delete()
+    return [cell for cell in cells if cell not in shared]
+
+
+def _hand_over(hairdresser_id, cells):
+    """Cede las celdas liberadas a los turnos activos que también las tocan."""
+    from .models import Appointment, SlotClaim
+
+    neighbours = Appointment.objects.filter(
+        service__hairdresser_id=hairdresser_id,
+        start_time__lt=max(cells) + CELL,
+        end_time__gt=min(cells),
+        status__in=("CONFIRMED", "PENDING"),
+    )
+    SlotClaim.objects.bulk_create(
+        [
+            SlotClaim(hairdresser_id=hairdresser_id, slot_start=cell, appointment=neighbour)
+            for neighbour in neighbours
+            if is_blocking(neighbour)
+            for cell in slot_cells(neighbour.start_time, neighbour.end_time)
+            if cell in cells
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def claim_slot(appointment, displace=False):
+    """
+    Ocupa las celdas de la franja del turno (liberando las que ya no cubre).
+    Lanza SlotUnavailable si otro turno activo superpuesto ocupa alguna,
+    salvo con displace=True si es un turno posterior, al que se las quita.
+    """
+    from .models import SlotClaim
+
+    hairdresser_id = appointment.service.hairdresser_id
+    cells = slot_cells(appointment.start_time, appointment.end_time)
+    own = SlotClaim.objects.filter(appointment=appointment)
+    held = set(own.values_list("slot_start", flat=True))
+    released = held - set(cells)
+    if released:
+        own.filter(slot_start__in=released).delete()
+        _hand_over(hairdresser_id, released)
+
+    missing = [cell for cell in cells if cell not in held]
+    for attempt in range(2):
+        missing = _claimable(appointment, missing, displace)
+        if not missing:
+            return
+        try:
+            with transaction.atomic():
+                SlotClaim.objects.bulk_create(
+                    [
+                        SlotClaim(hairdresser_id=hairdresser_id, slot_start=cell, appointment=appointment)
+                        for cell in missing
+                    ]
+                )
+            return
+        except IntegrityError:
+            # Otra reserva tomó alguna celda entre la lectura y la inserción:
+            # un solo reintento, que vuelve a clasificar las celdas ocupadas
+            if attempt:
+                raise SlotUnavailable()
+
+
+def sync_slot_claims(appointment, moved=False):
+    """
+    Ocupa o libera las celdas del turno según su estado actual. moved indica
+    que cambió el horario de un turno existente (ver docstring del módulo).
+    """
+    from .models import SlotClaim
+
+    if is_blocking(appointment):
+        claim_slot(appointment, displace=moved)
+        return
+    own = SlotClaim.objects.filter(appointment=appointment)
+    released = set(own.values_list("slot_start", flat=True))
+    if released:
+        own.delete()
+        _hand_over(appointment.service.hairdresser_id, released)
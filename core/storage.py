@@ -0,0 +1,70 @@
+"""
+Almacenamiento direccionado por contenido para las imágenes subidas.
+
+El nombre de cada archivo se deriva del hash SHA-256 de su contenido, de modo
+que la misma foto subida varias veces (o por varias peluquerías) se guarda una
+sola vez. Como un archivo puede estar referenciado por varias filas, estos
+archivos no se borran al eliminar una fila: el comando cleanup_orphans
+elimina los que ya no tienen referencias.
+"""
+
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+def file_content_hash(field_file):
+    """SHA-256 (hex) del contenido de un archivo, leído por bloques."""
+    digest = hashlib.sha256()
+    for chunk in field_file.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _sharded_name(prefix, stem, filename):
+    # Se reparte en subdirectorios por los dos primeros caracteres para no
+    # acumular todos los archivos en un único directorio.
+    return f"{prefix}/{stem[:2]}/{filename}"
+
+
+def hairdresser_image_upload_to(instance, filename):
+    """hairdressers/ab/<sha256>.jpg (ver HairdresserImage.save())."""
+    extension = os.path.splitext(filename)[1].lower()
+    if not instance.content_hash:
+        return f"hairdressers/{filename}"
+    return _sharded_name(
+        "hairdressers", instance.content_hash, f"{instance.content_hash}{extension}"
+    )
+
+
+def image_derivative_upload_to(instance, filename):
+    """
+    hairdressers/derivatives/ab/<sha256>-640w-v1.webp
+
+    El nombre ya es determinístico (hash del original + parámetros), por lo
+    que dos originales idénticos comparten sus derivados.
+    """
+    return _sharded_name("hairdressers/derivatives", filename, filename)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    FileSystemStorage que, si el nombre ya existe, reutiliza el archivo en
+    lugar de generar un nombre alternativo: con nombres derivados del
+    contenido, mismo nombre implica mismo contenido. Para reescribir un
+    archivo (p. ej. build_image_derivatives --force) hay que borrarlo antes.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name and self.exists(name):
+            # Se actualiza la fecha de modificación para que cleanup_orphans
+            # no lo borre mientras se guarda la fila que lo referencia.
+            os.utime(self.path(name), None)
+            return name
+        return super().save(name, content, max_length=max_length)
+
+
+content_addressed_storage = ContentAddressedStorage()
@@ -0,0 +1,24 @@
+from django import template
+
+from core.images import get_responsive_sources
+
+register = template.Library()
+
+
+@register.inclusion_tag("includes/responsive_image.html")
+def responsive_image(image, sizes="100vw", css_class="", style="", alt="", lazy=True):
+    """
+    Renderiza una HairdresserImage como <picture> con srcset WebP/JPEG.
+    Si todavía no tiene derivados, usa el archivo original.
+    Conviene precargar "derivatives" con prefetch_related.
+    """
+    sources = get_responsive_sources(image.derivatives.all())
+    return {
+        "sources": sources,
+        "src": (sources and sources["src"]) or image.image.url,
+        "sizes": sizes,
+        "css_class": css_class,
+        "style": style,
+        "alt": alt,
+        "lazy": lazy,
+    }
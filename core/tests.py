@@ -1,5 +1,5 @@
 from unittest.mock import patch, MagicMock
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 from core.utils import geocode_address
@@ -1484,7 +1484,7 @@ class CancelExpiredAppointmentsTestCase(TestCase):
         valid_app = Appointment.objects.create(
             client=self.client_user,
             service=self.service,
-            start_time=timezone.now() + datetime.timedelta(days=1),
+            start_time=timezone.now() + datetime.timedelta(days=1, hours=2),
             amount=self.service.price,
             status="PENDING",
             expires_at=timezone.now() + datetime.timedelta(minutes=25),
@@ -1494,7 +1494,7 @@ class CancelExpiredAppointmentsTestCase(TestCase):
         confirmed_app = Appointment.objects.create(
             client=self.client_user,
             service=self.service,
-            start_time=timezone.now() + datetime.timedelta(days=1),
+            start_time=timezone.now() + datetime.timedelta(days=1, hours=4),
             amount=self.service.price,
             status="CONFIRMED",
             expires_at=timezone.now() - datetime.timedelta(minutes=5),
@@ -1621,18 +1621,20 @@ class AppointmentConcurrencyAndOverbookingTestCase(TestCase):
         start_time = timezone.now() + datetime.timedelta(days=1)
         start_time = start_time.replace(hour=14, minute=0, second=0, microsecond=0)
 
-        # Crear dos turnos PENDING concurrentes para el mismo slot
-        app_confirmed = Appointment.objects.create(
-            client=self.client_user_1,
+        # Dos turnos PENDING para el mismo slot: el segundo venció sin pagarse
+        # (liberando el horario) y su pago llega tarde, cuando el primero ya
+        # lo ocupó. Dos PENDING vigentes no pueden coexistir (SlotClaim).
+        app_refunded = Appointment.objects.create(
+            client=self.client_user_2,
             service=self.service,
             start_time=start_time,
             amount=self.service.price,
             status="PENDING",
-            expires_at=timezone.now() + datetime.timedelta(minutes=10),
+            expires_at=timezone.now() - datetime.timedelta(minutes=1),
         )
 
-        app_refunded = Appointment.objects.create(
-            client=self.client_user_2,
+        app_confirmed = Appointment.objects.create(
+            client=self.client_user_1,
             service=self.service,
             start_time=start_time,
             amount=self.service.price,
@@ -2867,6 +2869,7 @@ class ServiceViewsTestCase(TestCase):
         self.assertEqual(response.status_code, 302)
 
 
+import os
 import shutil
 import tempfile
 from django.test import override_settings
@@ -2994,7 +2997,7 @@ class HomeSearchFilterTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         hairdressers = response.context["hairdressers"]
         self.assertEqual(len(hairdressers), 1)
-        self.assertEqual(hairdressers[0].name, "Barbería Premium")
+        self.assertEqual(hairdressers[0]["name"], "Barbería Premium")
         # El carrusel de destacados debe estar vacío si hay filtros activos
         self.assertEqual(len(response.context["featured_hairdressers"]), 0)
 
@@ -3003,7 +3006,7 @@ class HomeSearchFilterTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         hairdressers = response.context["hairdressers"]
         self.assertEqual(len(hairdressers), 1)
-        self.assertEqual(hairdressers[0].name, "Estilo & Color")
+        self.assertEqual(hairdressers[0]["name"], "Estilo & Color")
 
         # Buscar término que no existe
         response = self.client.get(reverse("home"), {"q": "Inexistente"})
@@ -3017,14 +3020,14 @@ class HomeSearchFilterTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         hairdressers = response.context["hairdressers"]
         self.assertEqual(len(hairdressers), 1)
-        self.assertEqual(hairdressers[0].name, "Barbería Premium")
+        self.assertEqual(hairdressers[0]["name"], "Barbería Premium")
 
         # Filtrar por "color"
         response = self.client.get(reverse("home"), {"service": "color"})
         self.assertEqual(response.status_code, 200)
         hairdressers = response.context["hairdressers"]
         self.assertEqual(len(hairdressers), 1)
-        self.assertEqual(hairdressers[0].name, "Estilo & Color")
+        self.assertEqual(hairdressers[0]["name"], "Estilo & Color")
 
     def test_map_data_filtered(self):
         # Sin filtros
@@ -4396,9 +4399,2632 @@ class PauseTests(TestCase):
         self.assertFalse(Pause.objects.filter(pk=pause.pk).exists())
 
 
+class HomePaginationTestCase(TestCase):
+    def setUp(self):
+        from core.models import Service, WorkingHours
+        from core.views import HOME_PAGE_SIZE
+
+        self.client = Client()
+        self.page_size = HOME_PAGE_SIZE
+        self.hairdressers = []
+        # Una página completa y algunas más
+        for i in range(HOME_PAGE_SIZE + 3):
+            owner = User.objects.create_user(
+                username=f"owner_page_{i}",
+                password="password123",
+                first_name="Owner",
+                last_name=str(i),
+                is_owner=True,
+            )
+            hairdresser = Hairdresser.objects.create(
+                owner=owner,
+                name=f"Peluquería {i:02d}",
+                address=f"Calle {i}",
+                latitude=-24.78,
+                longitude=-65.42,
+            )
+            WorkingHours.objects.create(
+                hairdresser=hairdresser,
+                day_of_week=0,
+                start_time="09:00",
+                end_time="18:00",
+            )
+            Service.objects.create(
+                hairdresser=hairdresser,
+                name="Corte",
+                price=1000,
+                duration_minutes=30,
+            )
+            self.hairdressers.append(hairdresser)
+
+        # Una peluquería incompleta (sin servicios) no debe aparecer
+        incomplete_owner = User.objects.create_user(
+            username="owner_incomplete", password="password123", is_owner=True
+        )
+        Hairdresser.objects.create(
+            owner=incomplete_owner,
+            name="Incompleta",
+            address="Sin servicios",
+            latitude=-24.78,
+            longitude=-65.42,
+        )
+
+    def test_home_renders_first_page_with_cursor(self):
+        response = self.client.get(reverse("home"))
+        self.assertEqual(response.status_code, 200)
+        cards = response.context["hairdressers"]
+        self.assertEqual(len(cards), self.page_size)
+        self.assertEqual(cards[0]["name"], "Peluquería 00")
+        self.assertIsNotNone(response.context["next_cursor"])
+        self.assertContains(response, "load-more-hairdressers")
+
+    def test_cards_endpoint_returns_next_page(self):
+        first = self.client.get(reverse("home"))
+        cursor = first.context["next_cursor"]
+
+        response = self.client.get(reverse("hairdresser_cards"), {"cursor": cursor})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        names = [card["name"] for card in data["results"]]
+        self.assertEqual(names, ["Peluquería 12", "Peluquería 13", "Peluquería 14"])
+        self.assertIsNone(data["next_cursor"])
+        self.assertNotIn("Incompleta", names)
+
+    def test_cards_endpoint_keeps_filters_and_ignores_invalid_cursor(self):
+        response = self.client.get(
+            reverse("hairdresser_cards"), {"q": "Peluquería 03", "cursor": "basura"}
+        )
+        data = response.json()
+        self.assertEqual(len(data["results"]), 1)
+        self.assertEqual(data["results"][0]["name"], "Peluquería 03")
+        self.assertIsNone(data["next_cursor"])
+
+    def test_card_uses_cached_rating_summary(self):
+        from core.models import Appointment, Review
+        from django.utils import timezone
+        import datetime
+
+        hairdresser = self.hairdressers[0]
+        service = hairdresser.services.first()
+        client_user = User.objects.create_user(
+            username="client_page", password="password123"
+        )
+        for rating in (5, 4):
+            appointment = Appointment.objects.create(
+                client=client_user,
+                service=service,
+                start_time=timezone.now() - datetime.timedelta(days=rating),
+                status="COMPLETED",
+            )
+            Review.objects.create(appointment=appointment, rating=rating)
+
+        hairdresser.refresh_from_db()
+        self.assertEqual(hairdresser.rating_count, 2)
+        self.assertEqual(hairdresser.rating_sum, 9)
+
+        response = self.client.get(reverse("hairdresser_cards"), {"q": hairdresser.name})
+        card = response.json()["results"][0]
+        self.assertEqual(card["review_count"], 2)
+        self.assertEqual(card["average_rating"], 4.5)
+
+        # Al borrar una reseña el resumen se actualiza
+        Review.objects.filter(rating=4).delete()
+        hairdresser.refresh_from_db()
+        self.assertEqual(hairdresser.rating_count, 1)
+        self.assertEqual(hairdresser.rating_sum, 5)
+
+
+class HairdresserDetailQueryTestCase(TestCase):
+    def setUp(self):
+        from core.models import Service, WorkingHours
+
+        self.client = Client()
+        owner = User.objects.create_user(
+            username="owner_detail_q", password="password123", is_owner=True
+        )
+        self.client_user = User.objects.create_user(
+            username="client_detail_q",
+            password="password123",
+            first_name="Ana",
+            last_name="López",
+        )
+        self.hairdresser = Hairdresser.objects.create(
+            owner=owner, name="Peluquería Detalle", address="Calle 1"
+        )
+        WorkingHours.objects.create(
+            hairdresser=self.hairdresser, day_of_week=0, start_time="08:30", end_time="12:00"
+        )
+        WorkingHours.objects.create(
+            hairdresser=self.hairdresser, day_of_week=1, start_time="14:00", end_time="19:30"
+        )
+        self.services = [
+            Service.objects.create(
+                hairdresser=self.hairdresser,
+                name=f"Servicio {i}",
+                price=1000,
+                duration_minutes=30,
+            )
+            for i in range(3)
+        ]
+
+    def _add_reviewed_appointments(self, count):
+        from core.models import Appointment, Review
+        from django.utils import timezone
+        import datetime
+
+        for i in range(count):
+            appointment = Appointment.objects.create(
+                client=self.client_user,
+                service=self.services[i % len(self.services)],
+                start_time=timezone.now() - datetime.timedelta(days=i + 1),
+                status="COMPLETED",
+            )
+            Review.objects.create(appointment=appointment, rating=4 + i % 2)
+
+    def _count_detail_queries(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(
+                reverse("hairdresser_detail", args=[self.hairdresser.pk])
+            )
+        self.assertEqual(response.status_code, 200)
+        return response, len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_history(self):
+        self._add_reviewed_appointments(1)
+        _, few_queries = self._count_detail_queries()
+
+        self._add_reviewed_appointments(12)
+        response, many_queries = self._count_detail_queries()
+
+        self.assertEqual(few_queries, many_queries)
+        services = {s.name: s for s in response.context["services"]}
+        self.assertEqual(services["Servicio 0"].rating_total, 5)
+        self.assertAlmostEqual(services["Servicio 0"].rating_avg, 4.4)
+
+    def test_slot_range_from_aggregate(self):
+        response, _ = self._count_detail_queries()
+        self.assertEqual(response.context["slot_min_time"], "07:30:00")
+        self.assertEqual(response.context["slot_max_time"], "20:30:00")
+
+
+class ReviewsPaginationTestCase(TestCase):
+    def setUp(self):
+        from core.models import Appointment, Review, Service
+        from core.views import REVIEWS_PAGE_SIZE
+        from django.utils import timezone
+        import datetime
+
+        self.client = Client()
+        self.page_size = REVIEWS_PAGE_SIZE
+        owner = User.objects.create_user(
+            username="owner_reviews", password="password123", is_owner=True
+        )
+        client_user = User.objects.create_user(
+            username="client_reviews",
+            password="password123",
+            first_name="Lucía",
+            last_name="Pérez",
+        )
+        self.hairdresser = Hairdresser.objects.create(
+            owner=owner, name="Peluquería Reseñas", address="Calle 2"
+        )
+        service = Service.objects.create(
+            hairdresser=self.hairdresser, name="Corte", price=1000, duration_minutes=30
+        )
+        base = timezone.now() - datetime.timedelta(days=30)
+        self.total = REVIEWS_PAGE_SIZE + 3
+        for i in range(self.total):
+            appointment = Appointment.objects.create(
+                client=client_user,
+                service=service,
+                start_time=base + datetime.timedelta(days=i),
+                status="COMPLETED",
+            )
+            review = Review.objects.create(
+                appointment=appointment, rating=5 if i % 3 else 3, comment=f"Reseña {i}"
+            )
+            # Todas con la misma fecha para forzar el desempate por id
+            Review.objects.filter(pk=review.pk).update(created_at=base)
+
+    def test_detail_renders_only_first_page(self):
+        response = self.client.get(reverse("hairdresser_detail", args=[self.hairdresser.pk]))
+        reviews = response.context["reviews"]
+        self.assertEqual(len(reviews), self.page_size)
+        self.assertEqual(reviews[0].comment, f"Reseña {self.total - 1}")
+        self.assertIsNotNone(response.context["reviews_next_cursor"])
+
+    def test_reviews_endpoint_continues_from_cursor(self):
+        first = self.client.get(reverse("hairdresser_detail", args=[self.hairdresser.pk]))
+        cursor = first.context["reviews_next_cursor"]
+
+        response = self.client.get(
+            reverse("hairdresser_reviews", args=[self.hairdresser.pk]), {"cursor": cursor}
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(
+            [r["comment"] for r in data["results"]], ["Reseña 2", "Reseña 1", "Reseña 0"]
+        )
+        self.assertIsNone(data["next_cursor"])
+        self.assertEqual(data["results"][0]["author"], "Lucía P.")
+        self.assertEqual(data["count"], self.total)
+
+    def test_histogram_comes_from_summary(self):
+        from core.models import Review
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        url = reverse("hairdresser_reviews", args=[self.hairdresser.pk])
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.client.get(url).json()
+        # Peluquería + página de reseñas (activas y archivadas), sin contar
+        # reseñas por estrella
+        self.assertEqual(len(ctx.captured_queries), 3)
+        self.assertEqual(data["histogram"], {"5": 8, "4": 0, "3": 5, "2": 0, "1": 0})
+
+        Review.objects.filter(rating=3).first().delete()
+        data = self.client.get(url).json()
+        self.assertEqual(data["histogram"]["3"], 4)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImageDerivativeTestCase(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.client = Client()
+        self.owner = User.objects.create_user(
+            username="owner_images", password="password123", is_owner=True
+        )
+        self.hairdresser = Hairdresser.objects.create(
+            owner=self.owner, name="Peluquería Fotos", address="Calle 3"
+        )
+
+    def _photo(self, size=(2000, 1000), name="foto.jpg"):
+        """JPEG con orientación EXIF (rotar 90°) y datos de cámara."""
+        from io import BytesIO
+        from PIL import Image
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        picture = Image.new("RGB", size, (200, 30, 30))
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: rotar 90° en sentido horario
+        exif[0x010F] = "CamaraDePrueba"  # Make
+        buffer = BytesIO()
+        picture.save(buffer, format="JPEG", exif=exif)
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/jpeg")
+
+    def test_upload_generates_derivatives_without_exif(self):
+        from PIL import Image
+        from core.models import HairdresserImage
+
+        self.client.login(username="owner_images", password="password123")
+        response = self.client.post(
+            reverse("my_hairdresser_images"),
+            {"action": "upload", "image": self._photo(), "caption": "Frente"},
+        )
+        self.assertEqual(response.status_code, 302)
+
+        image = HairdresserImage.objects.get(hairdresser=self.hairdresser)
+        # La orientación EXIF se aplica: el original queda vertical
+        self.assertEqual((image.width, image.height), (1000, 2000))
+
+        derivatives = list(image.derivatives.all())
+        self.assertEqual(
+            sorted((d.format, d.width) for d in derivatives),
+            [("jpeg", 320), ("jpeg", 640), ("jpeg", 1000),
+             ("webp", 320), ("webp", 640), ("webp", 1000)],
+        )
+        for derivative in derivatives:
+            with derivative.file.open("rb") as f, Image.open(f) as picture:
+                self.assertEqual(picture.size, (derivative.width, derivative.height))
+                self.assertEqual(len(picture.getexif()), 0)
+
+    def test_detail_page_emits_srcset(self):
+        from core.images import generate_image_derivatives
+        from core.models import HairdresserImage
+
+        image = HairdresserImage.objects.create(
+            hairdresser=self.hairdresser, image=self._photo(size=(800, 600))
+        )
+        generate_image_derivatives(image)
+
+        response = self.client.get(reverse("hairdresser_detail", args=[self.hairdresser.pk]))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, "-320w-v1.webp 320w")
+        self.assertContains(response, "-600w-v1.jpeg 600w")
+
+    def test_backfill_command(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from core.models import HairdresserImage, ImageDerivative
+
+        for i in range(2):
+            HairdresserImage.objects.create(
+                hairdresser=self.hairdresser,
+                image=self._photo(size=(400, 300), name=f"foto{i}.jpg"),
+            )
+
+        out = StringIO()
+        call_command("build_image_derivatives", "--workers", "1", stdout=out)
+        self.assertIn("Se procesaron 2 imágenes", out.getvalue())
+        # Originales de 300px de ancho tras rotar: nunca se amplían, así que
+        # hay una sola versión por formato
+        self.assertEqual(ImageDerivative.objects.count(), 2 * 2)
+
+        # Una segunda corrida no tiene nada pendiente
+        out = StringIO()
+        call_command("build_image_derivatives", "--workers", "1", stdout=out)
+        self.assertIn("No hay imágenes pendientes", out.getvalue())
+
+
+class ContentAddressedMediaTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.owners = [
+            User.objects.create_user(
+                username=f"owner_media_{i}", password="password123", is_owner=True
+            )
+            for i in range(2)
+        ]
+        self.hairdressers = [
+            Hairdresser.objects.create(owner=owner, name=f"Peluquería {i}", address="Calle")
+            for i, owner in enumerate(self.owners)
+        ]
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def _photo(self, name="foto.jpg", color=(10, 120, 200)):
+        from io import BytesIO
+        from PIL import Image
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        buffer = BytesIO()
+        Image.new("RGB", (500, 400), color).save(buffer, format="JPEG")
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/jpeg")
+
+    def _media_files(self):
+        import os
+
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.media_root).replace("\\", "/")
+            for root, _, names in os.walk(self.media_root)
+            for name in names
+        )
+
+    def test_identical_uploads_are_stored_once(self):
+        from core.images import generate_image_derivatives
+        from core.models import HairdresserImage
+
+        first = HairdresserImage.objects.create(
+            hairdresser=self.hairdressers[0], image=self._photo("a.jpg")
+        )
+        second = HairdresserImage.objects.create(
+            hairdresser=self.hairdressers[1], image=self._photo("otro_nombre.JPG")
+        )
+        self.assertEqual(len(first.content_hash), 64)
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(
+            first.image.name,
+            f"hairdressers/{first.content_hash[:2]}/{first.content_hash}.jpg",
+        )
+
+        generate_image_derivatives(first)
+        generate_image_derivatives(second)
+        # Un original y sus dos derivados (WebP/JPEG a 320px y 500px)
+        self.assertEqual(len(self._media_files()), 1 + 4)
+
+        # Borrar una de las filas no borra el archivo compartido
+        first.delete()
+        second.refresh_from_db()
+        self.assertTrue(second.image.storage.exists(second.image.name))
+
+    def test_legacy_images_get_a_content_hash(self):
+        from core.images import generate_image_derivatives
+        from core.models import HairdresserImage
+
+        # Imágenes subidas antes del hash: mismo nombre base, distinto contenido
+        images = []
+        for name, color in (("foto.jpg", (200, 10, 10)), ("foto.png", (10, 200, 10))):
+            image = HairdresserImage.objects.create(hairdresser=self.hairdressers[0], image=self._photo(name, color))
+            HairdresserImage.objects.filter(pk=image.pk).update(content_hash="")
+            image.refresh_from_db()
+            images.append(image)
+
+        names = [{d.file.name for d in generate_image_derivatives(image)} for image in images]
+
+        self.assertFalse(names[0] & names[1])
+        for image in images:
+            image.refresh_from_db()
+            self.assertEqual(len(image.content_hash), 64)
+
+    def test_force_rewrites_existing_derivative_files(self):
+        from core.images import generate_image_derivatives
+        from core.models import HairdresserImage
+
+        image = HairdresserImage.objects.create(hairdresser=self.hairdressers[0], image=self._photo())
+        derivative = generate_image_derivatives(image)[0]
+        with open(derivative.file.path, "wb") as f:
+            f.write(b"corrupto")
+
+        regenerated = generate_image_derivatives(image, force=True)
+
+        with open(derivative.file.path, "rb") as f:
+            self.assertNotEqual(f.read(), b"corrupto")
+        self.assertIn(derivative.file.name, {d.file.name for d in regenerated})
+
+    def test_cleanup_orphans_deletes_only_old_unreferenced_files(self):
+        import os
+        import time
+        from io import StringIO
+        from django.core.management import call_command
+        from core.models import HairdresserImage
+
+        image = HairdresserImage.objects.create(
+            hairdresser=self.hairdressers[0], image=self._photo()
+        )
+        legacy_dir = os.path.join(self.media_root, "hairdressers")
+        old = time.time() - 2 * 3600
+        for name in ("huerfana_vieja.jpg", "huerfana_nueva.jpg"):
+            with open(os.path.join(legacy_dir, name), "wb") as f:
+                f.write(b"x" * 10)
+        os.utime(os.path.join(legacy_dir, "huerfana_vieja.jpg"), (old, old))
+        os.utime(image.image.path, (old, old))
+
+        out = StringIO()
+        call_command("cleanup_orphans", "--dry-run", "--chunk-size", "1", stdout=out)
+        self.assertIn("Se eliminaría: hairdressers/huerfana_vieja.jpg (10 bytes)", out.getvalue())
+        self.assertIn("Omitidos por ser recientes: 1", out.getvalue())
+        self.assertIn("hairdressers/huerfana_vieja.jpg", self._media_files())
+
+        checkpoint = self.media_root + ".checkpoint"
+        out = StringIO()
+        call_command(
+            "cleanup_orphans", "--chunk-size", "1", "--workers", "2",
+            "--checkpoint", checkpoint, stdout=out,
+        )
+        self.assertIn("Se eliminaron correctamente 1 archivos huérfanos", out.getvalue())
+        self.assertEqual(
+            self._media_files(), sorted([image.image.name, "hairdressers/huerfana_nueva.jpg"])
+        )
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_cleanup_orphans_resumes_from_checkpoint(self):
+        import os
+        import time
+        from io import StringIO
+        from django.core.management import call_command
+
+        directory = os.path.join(self.media_root, "hairdressers", "ab")
+        os.makedirs(directory)
+        old = time.time() - 2 * 3600
+        for name in ("a.jpg", "b.jpg", "c.jpg"):
+            path = os.path.join(directory, name)
+            with open(path, "wb") as f:
+                f.write(b"x")
+            os.utime(path, (old, old))
+
+        checkpoint = self.media_root + ".checkpoint"
+        with open(checkpoint, "w") as f:
+            f.write("hairdressers/ab/a.jpg")
+
+        # Una simulación no lee ni avanza el punto de control
+        out = StringIO()
+        call_command("cleanup_orphans", "--dry-run", "--checkpoint", checkpoint, stdout=out)
+        self.assertIn("Archivos analizados: 3.", out.getvalue())
+        with open(checkpoint) as f:
+            self.assertEqual(f.read(), "hairdressers/ab/a.jpg")
+
+        out = StringIO()
+        call_command("cleanup_orphans", "--checkpoint", checkpoint, stdout=out)
+        self.assertIn("Archivos analizados: 2.", out.getvalue())
+        self.assertEqual(self._media_files(), ["hairdressers/ab/a.jpg"])
+
+
+class VersionedCacheTestCase(TestCase):
+    def setUp(self):
+        from core.models import Service, WorkingHours
+
+        self.client = Client()
+        owner = User.objects.create_user(
+            username="owner_cache", password="password123", is_owner=True
+        )
+        self.hairdresser = Hairdresser.objects.create(
+            owner=owner,
+            name="Peluquería Caché",
+            address="Calle 1",
+            latitude=-24.78,
+            longitude=-65.42,
+        )
+        WorkingHours.objects.create(
+            hairdresser=self.hairdresser, day_of_week=0, start_time="09:00", end_time="18:00"
+        )
+        self.service = Service.objects.create(
+            hairdresser=self.hairdresser, name="Corte", price=1000, duration_minutes=30
+        )
+
+    def _count_queries(self, url):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(ctx.captured_queries)
+
+    def test_saves_bump_hairdresser_and_catalog_versions(self):
+        from core.caching import CATALOG_SCOPE, get_stamps, hairdresser_scope
+        from core.models import Pause
+        from django.utils import timezone
+
+        scope = hairdresser_scope(self.hairdresser.pk)
+        before = get_stamps(scope, CATALOG_SCOPE)
+
+        # Una pausa solo afecta a la agenda de la peluquería
+        Pause.objects.create(
+            hairdresser=self.hairdresser,
+            start_time=timezone.now(),
+            end_time=timezone.now() + timedelta(hours=1),
+        )
+        after_pause = get_stamps(scope, CATALOG_SCOPE)
+        self.assertGreater(after_pause[scope][0], before[scope][0])
+        self.assertEqual(after_pause[CATALOG_SCOPE][0], before[CATALOG_SCOPE][0])
+
+        self.service.delete()
+        after_delete = get_stamps(scope, CATALOG_SCOPE)
+        self.assertGreater(after_delete[scope][0], after_pause[scope][0])
+        self.assertGreater(after_delete[CATALOG_SCOPE][0], after_pause[CATALOG_SCOPE][0])
+
+    def test_home_and_map_served_from_cache_until_change(self):
+        map_url = reverse("map_data")
+        self.client.get(reverse("home"))
+        self.client.get(map_url)
+
+        # Con la caché caliente solo se consulta la versión del catálogo
+        _, home_queries = self._count_queries(reverse("home"))
+        response, map_queries = self._count_queries(map_url)
+        self.assertEqual(home_queries, 1)
+        self.assertEqual(map_queries, 1)
+        self.assertEqual(response.json()[0]["name"], "Peluquería Caché")
+
+        self.hairdresser.name = "Peluquería Renombrada"
+        self.hairdresser.save()
+        response = self.client.get(map_url)
+        self.assertEqual(response.json()[0]["name"], "Peluquería Renombrada")
+        response = self.client.get(reverse("home"))
+        self.assertEqual(response.context["hairdressers"][0]["name"], "Peluquería Renombrada")
+
+    def test_events_reflect_new_appointment(self):
+        from core.models import Appointment
+        from django.utils import timezone
+
+        url = reverse("appointment_events", args=[self.hairdresser.pk])
+        self.client.get(url)
+        response, queries = self._count_queries(url)
+        self.assertEqual(queries, 1)
+        self.assertFalse(any(e.get("title") == "Reservado" for e in response.json()))
+
+        Appointment.objects.create(
+            service=self.service,
+            start_time=timezone.now() + timedelta(days=1),
+            status="CONFIRMED",
+        )
+        response = self.client.get(url)
+        self.assertTrue(any(e.get("title") == "Reservado" for e in response.json()))
+
+    def test_detail_context_invalidated_by_service_change(self):
+        url = reverse("hairdresser_detail", args=[self.hairdresser.pk])
+        _, cold_queries = self._count_queries(url)
+        response, warm_queries = self._count_queries(url)
+        self.assertLess(warm_queries, cold_queries)
+        self.assertEqual(response.context["services"][0].price, 1000)
+
+        self.service.price = 1500
+        self.service.save()
+        response = self.client.get(url)
+        self.assertEqual(response.context["services"][0].price, 1500)
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        from core.models import Appointment, Review, Service
+
+        self.client = Client()
+        self.owner = User.objects.create_user(
+            username="owner_etag", password="password123", is_owner=True
+        )
+        self.client_user = User.objects.create_user(
+            username="client_etag", password="password123"
+        )
+        self.hairdresser = Hairdresser.objects.create(
+            owner=self.owner, name="Peluquería ETag", address="Calle 1"
+        )
+        self.service = Service.objects.create(
+            hairdresser=self.hairdresser, name="Corte", price=1000, duration_minutes=30
+        )
+        appointment = Appointment.objects.create(
+            client=self.client_user,
+            service=self.service,
+            start_time=timezone.now() - timedelta(days=1),
+            status="COMPLETED",
+        )
+        self.review = Review.objects.create(appointment=appointment, rating=4)
+
+    def _revalidate(self, url, response, queries=None):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as ctx:
+            second = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        if queries is not None:
+            self.assertEqual(len(ctx.captured_queries), queries)
+        return second
+
+    def test_events_answer_304_until_schedule_changes(self):
+        from core.models import Pause
 
+        url = reverse("appointment_events", args=[self.hairdresser.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("no-cache", response["Cache-Control"])
+        self.assertTrue(response.has_header("Last-Modified"))
+
+        # Solo la consulta de la versión
+        self.assertEqual(self._revalidate(url, response, queries=1).status_code, 304)
+        not_modified = self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"]
+        )
+        self.assertEqual(not_modified.status_code, 304)
+
+        Pause.objects.create(
+            hairdresser=self.hairdresser,
+            start_time=timezone.now() + timedelta(hours=1),
+            end_time=timezone.now() + timedelta(hours=2),
+        )
+        self.assertEqual(self._revalidate(url, response).status_code, 200)
+
+    def test_map_etag_depends_on_filters(self):
+        url = reverse("map_data")
+        response = self.client.get(url)
+        self.assertEqual(self._revalidate(url, response).status_code, 304)
 
+        filtered = self.client.get(url, {"q": "centro"}, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(filtered.status_code, 200)
 
+    def test_service_detail_validator_is_per_user(self):
+        url = reverse("service_detail", args=[self.service.pk])
+        self.client.login(username="owner_etag", password="password123")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("private", response["Cache-Control"])
+        self.assertFalse(response.has_header("Last-Modified"))
+        self.assertEqual(self._revalidate(url, response).status_code, 304)
 
+        self.service.price = 2000
+        self.service.save()
+        updated = self._revalidate(url, response)
+        self.assertEqual(updated.status_code, 200)
+        self.assertEqual(updated.json()["price"], "2000.00")
 
+    def test_review_detail_other_user_does_not_get_304(self):
+        url = reverse("review_detail_api", args=[self.review.pk])
+        self.client.login(username="client_etag", password="password123")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._revalidate(url, response).status_code, 304)
+
+        self.client.login(username="owner_etag", password="password123")
+        self.assertEqual(self._revalidate(url, response).status_code, 404)
+
+    def test_error_responses_carry_no_validators(self):
+        from django.http import JsonResponse
+        from django.test import RequestFactory
+
+        from core.caching import CATALOG_SCOPE, conditional_on_stamps
+
+        @conditional_on_stamps(lambda request: (CATALOG_SCOPE,))
+        def view(request):
+            return JsonResponse({"error": "Parámetros inválidos"}, status=int(request.GET["status"]))
+
+        factory = RequestFactory()
+        ok = view(factory.get("/", {"status": 200}))
+        self.assertTrue(ok.has_header("ETag"))
+        self.assertTrue(ok.has_header("Last-Modified"))
+        error = view(factory.get("/", {"status": 400}))
+        self.assertFalse(error.has_header("ETag"))
+        self.assertFalse(error.has_header("Last-Modified"))
+        self.assertIn("no-cache", error["Cache-Control"])
+
+
+@override_settings(
+    QUERY_INSTRUMENTATION=True,
+    QUERY_INSTRUMENTATION_MAX_QUERIES=2,
+    QUERY_INSTRUMENTATION_HEADERS=True,
+)
+class QueryInstrumentationTestCase(TestCase):
+    def setUp(self):
+        from core.middleware import reset_view_stats
+
+        reset_view_stats()
+        self.client = Client()
+        self.owner = User.objects.create_user(
+            username="owner_queries", password="password123", is_owner=True
+        )
+        self.hairdresser = Hairdresser.objects.create(
+            owner=self.owner, name="Peluquería Consultas", address="Calle 1"
+        )
+
+    def test_fingerprint_groups_repeated_statements(self):
+        from core.middleware import query_fingerprint
+
+        self.assertEqual(
+            query_fingerprint('SELECT * FROM "t" WHERE "id" IN (%s, %s, %s) AND "x" = 5'),
+            query_fingerprint('SELECT * FROM "t" WHERE "id" IN (%s) AND "x" = 7'),
+        )
+
+    def test_headers_log_and_view_summary(self):
+        from core.middleware import get_view_stats
+
+        url = reverse("appointment_events", args=[self.hairdresser.pk])
+        with self.assertLogs("core", level="WARNING") as logs:
+            response = self.client.get(url)
+        self.assertGreater(int(response["X-DB-Query-Count"]), 2)
+        self.assertIn("X-DB-Time-Ms", response)
+        self.assertIn("appointment_events", logs.output[0])
+
+        self.client.get(url)
+        stats = {row["view"]: row for row in get_view_stats()}
+        self.assertEqual(stats["appointment_events"]["requests"], 2)
+
+    def test_summary_page_restricted_to_staff(self):
+        url = reverse("query_stats")
+        with self.settings(DEBUG=False):
+            self.client.login(username="owner_queries", password="password123")
+            self.assertEqual(self.client.get(url).status_code, 403)
+
+            User.objects.create_user(
+                username="staff_queries", password="password123", is_staff=True
+            )
+            self.client.login(username="staff_queries", password="password123")
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("stats", response.context)
+
+
+class QueryInstrumentationDisabledTestCase(TestCase):
+    def test_no_headers_when_disabled(self):
+        response = self.client.get(reverse("map_data"))
+        self.assertNotIn("X-DB-Query-Count", response)
+
+
+class ProfilingMiddlewareTestCase(TestCase):
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir, ignore_errors=True)
+        User.objects.create_user(
+            username="staff_profile", password="password123", is_staff=True
+        )
+        User.objects.create_user(username="client_profile", password="password123")
+
+    def _profile_files(self):
+        return sorted(os.listdir(self.profile_dir))
+
+    def test_staff_request_is_profiled(self):
+        with self.settings(PROFILE_DIR=self.profile_dir, DEBUG=False):
+            self.client.login(username="staff_profile", password="password123")
+            response = self.client.get(reverse("map_data"), {"_profile": "1"})
+
+        self.assertEqual(response.status_code, 200)
+        profile_id = response["X-Profile-Id"]
+        self.assertEqual(
+            self._profile_files(), [f"{profile_id}.prof", f"{profile_id}.txt"]
+        )
+        with open(os.path.join(self.profile_dir, f"{profile_id}.txt")) as f:
+            self.assertIn("cumulative", f.read())
+
+    def test_non_staff_flag_is_ignored(self):
+        with self.settings(PROFILE_DIR=self.profile_dir, DEBUG=False):
+            self.client.login(username="client_profile", password="password123")
+            response = self.client.get(reverse("map_data"), HTTP_X_PROFILE="1")
+
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(self._profile_files(), [])
+
+    def test_old_profiles_are_pruned(self):
+        with self.settings(
+            PROFILE_DIR=self.profile_dir, DEBUG=False, PROFILE_MAX_FILES=1
+        ):
+            self.client.login(username="staff_profile", password="password123")
+            stale = os.path.join(self.profile_dir, "old.prof")
+            with open(stale, "w") as f:
+                f.write("x")
+            os.utime(stale, (0, 0))
+            self.client.get(reverse("map_data"), {"_profile": "1"})
+            self.client.get(reverse("home"), {"_profile": "1"})
+
+        files = self._profile_files()
+        self.assertEqual(len(files), 2)
+        self.assertNotIn("old.prof", files)
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        from core import metrics
+
+        metrics.reset()
+        self.metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.metrics_dir, ignore_errors=True)
+        settings_override = self.settings(
+            METRICS_ENABLED=True, METRICS_DIR=self.metrics_dir, METRICS_TOKEN="secreto-metricas"
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = Client()
+
+    def _scrape(self):
+        response = self.client.get(
+            reverse("metrics"), HTTP_AUTHORIZATION="Bearer secreto-metricas"
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_requires_token(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer incorrecto")
+        self.assertEqual(response.status_code, 403)
+        # El token en la URL no se acepta: quedaría en los logs de acceso
+        response = self.client.get(reverse("metrics"), {"token": "secreto-metricas"})
+        self.assertEqual(response.status_code, 403)
+
+    def test_request_latency_histogram_per_url_name(self):
+        self.client.get(reverse("map_data"))
+        body = self._scrape()
+        self.assertIn("# TYPE stilo_http_request_duration_seconds histogram", body)
+        self.assertIn(
+            'stilo_http_request_duration_seconds_count{method="GET",view="map_data"} 1', body
+        )
+        self.assertIn(
+            'stilo_http_requests_total{method="GET",status="200",view="map_data"} 1', body
+        )
+
+    def test_outbound_errors_and_queue_gauges(self):
+        from core.models import PendingRefund, WebhookEvent
+        from core.utils import geocode_address
+
+        WebhookEvent.objects.create(payment_id="pago-metricas")
+        with patch("requests.get", side_effect=requests.RequestException("caído")):
+            geocode_address("Calle Falsa 123")
+
+        body = self._scrape()
+        self.assertIn('stilo_outbound_requests_total{service="nominatim"} 1', body)
+        self.assertIn('stilo_outbound_errors_total{service="nominatim"} 1', body)
+        self.assertIn('stilo_outbound_errors_total{service="brevo"} 0', body)
+        self.assertIn("stilo_unprocessed_webhook_events 1", body)
+        self.assertIn(f"stilo_pending_refunds {PendingRefund.objects.count()}", body)
+
+    def test_disabled_metrics_write_no_files(self):
+        from core.metrics import inc_counter
+
+        with self.settings(METRICS_ENABLED=False):
+            inc_counter("stilo_outbound_requests_total", {"service": "ipinfo"})
+        self.assertEqual(os.listdir(self.metrics_dir), [])
+
+    def test_files_from_other_processes_are_aggregated(self):
+        import json
+
+        other = {
+            "counters": [["stilo_outbound_requests_total", [["service", "ipinfo"]], 4]],
+            "histograms": [],
+        }
+        with open(os.path.join(self.metrics_dir, "metrics-99999.json"), "w") as f:
+            json.dump(other, f)
+        body = self._scrape()
+        self.assertIn('stilo_outbound_requests_total{service="ipinfo"} 4', body)
+
+
+class BenchCommandTestCase(TestCase):
+    def test_dataset_fills_derived_fields(self):
+        from core.management.commands.bench import Command
+        from core.models import Appointment, Review
+
+        dataset = Command()._build_dataset(
+            {"shops": 2, "services": 2, "appointments": 30, "reviews": 0.5, "seed": 1}
+        )
+        self.assertEqual(Hairdresser.objects.complete().count(), 2)
+        self.assertEqual(Appointment.objects.count(), 60)
+        appointment = Appointment.objects.select_related("service").first()
+        self.assertEqual(
+            appointment.end_time - appointment.start_time,
+            timedelta(minutes=appointment.service.duration_minutes),
+        )
+        self.assertEqual(appointment.amount, appointment.service.price)
+
+        hairdresser = Hairdresser.objects.get(pk=dataset["hairdresser"].pk)
+        reviews = Review.objects.filter(appointment__service__hairdresser=hairdresser)
+        self.assertEqual(hairdresser.rating_count, reviews.count())
+
+    def test_compare_flags_latency_and_query_regressions(self):
+        from core.management.commands.bench import Command, _percentile
+
+        self.assertEqual(_percentile([5, 1, 3, 2, 4], 50), 3)
+        self.assertEqual(_percentile([5, 1, 3, 2, 4], 95), 5)
+
+        baseline = {"home": {"p95_ms": 10.0, "queries": 3}}
+        self.assertEqual(
+            Command()._compare({"home": {"p95_ms": 12.0, "queries": 3}}, baseline, 0.25), []
+        )
+        regressions = Command()._compare(
+            {"home": {"p95_ms": 20.0, "queries": 5}}, baseline, 0.25
+        )
+        self.assertEqual(len(regressions), 2)
+
+
+class SeedDemoBulkTestCase(TestCase):
+    def test_bulk_dataset_is_consistent(self):
+        from io import StringIO
+
+        from django.core.management import call_command
+
+        from core.models import Appointment, PaymentTransaction, Pause, Review
+
+        out = StringIO()
+        call_command(
+            "seed_demo", bulk=True, shops=2, services=3, appointments=80, seed=7, chunk_size=25, stdout=out
+        )
+        self.assertIn("Dataset generado", out.getvalue())
+        self.assertEqual(Hairdresser.objects.complete().count(), 2)
+        self.assertEqual(Appointment.objects.count(), 160)
+        self.assertTrue(User.objects.filter(username="admin", is_superuser=True).exists())
+        self.assertTrue(Review.objects.exists())
+
+        for appointment in Appointment.objects.select_related("service"):
+            self.assertEqual(
+                appointment.end_time,
+                appointment.start_time + timedelta(minutes=appointment.service.duration_minutes),
+            )
+            self.assertEqual(appointment.amount, appointment.service.price)
+        self.assertEqual(
+            PaymentTransaction.objects.count(),
+            Appointment.objects.exclude(mercadopago_payment_id=None).count(),
+        )
+
+        # Ningún turno activo se superpone con otro ni con una pausa
+        active = Appointment.objects.exclude(status__in=["CANCELLED", "NO_SHOW"])
+        for appointment in active.select_related("service"):
+            hairdresser_id = appointment.service.hairdresser_id
+            overlapping = active.filter(
+                service__hairdresser_id=hairdresser_id,
+                start_time__lt=appointment.end_time,
+                end_time__gt=appointment.start_time,
+            ).exclude(pk=appointment.pk)
+            self.assertFalse(overlapping.exists())
+            self.assertFalse(
+                Pause.objects.filter(
+                    hairdresser_id=hairdresser_id,
+                    start_time__lt=appointment.end_time,
+                    end_time__gt=appointment.start_time,
+                ).exists()
+            )
+
+    def test_bulk_refuses_existing_data_without_flush(self):
+        from django.core.management import CommandError, call_command
+
+        from core.demo_data import generate_bulk_dataset
+
+        generate_bulk_dataset(1, 1, 5, seed=1)
+        with self.assertRaises(CommandError):
+            call_command("seed_demo", bulk=True, shops=1, appointments=5)
+
+    def test_bulk_is_deterministic(self):
+        from core.demo_data import generate_bulk_dataset
+        from core.models import Appointment
+
+        def generated(prefix):
+            generate_bulk_dataset(1, 2, 20, seed=3, prefix=prefix)
+            return list(
+                Appointment.objects.filter(client__username__startswith=f"{prefix}_")
+                .order_by("start_time")
+                .values_list("start_time", "status", "amount")
+            )
+
+        self.assertEqual(generated("a"), generated("b"))
+
+    def test_bulk_does_not_depend_on_chunk_size(self):
+        from core.demo_data import generate_bulk_dataset
+        from core.models import Appointment, Review
+
+        def generated(prefix, chunk_size):
+            generate_bulk_dataset(1, 2, 60, seed=3, prefix=prefix, chunk_size=chunk_size)
+            appointments = Appointment.objects.filter(client__username__startswith=f"{prefix}_")
+            return (
+                list(appointments.order_by("start_time").values_list("start_time", "status")),
+                list(
+                    Review.objects.filter(appointment__in=appointments)
+                    .order_by("appointment__start_time")
+                    .values_list("appointment__start_time", "rating", "comment")
+                ),
+            )
+
+        self.assertEqual(generated("a", 5000), generated("b", 7))
+
+    def test_bulk_without_returned_pks(self):
+        from django.db import connection
+
+        from core.demo_data import generate_bulk_dataset
+        from core.models import Appointment, Review, SlotClaim
+
+        # Como en MySQL: bulk_create no completa los pk
+        with patch.object(type(connection.features), "can_return_rows_from_bulk_insert", False):
+            dataset = generate_bulk_dataset(1, 2, 40, seed=5, prefix="mysql")
+
+        self.assertEqual(dataset["hairdresser"].owner_id, dataset["owner"].pk)
+        self.assertEqual(Appointment.objects.filter(service__hairdresser=dataset["hairdresser"]).count(), 40)
+        self.assertTrue(Review.objects.exists())
+        for claim in SlotClaim.objects.select_related("appointment__service"):
+            self.assertEqual(claim.hairdresser_id, claim.appointment.service.hairdresser_id)
+
+
+class SimulateBookingsTestCase(TestCase):
+    def setUp(self):
+        from core.demo_data import generate_bulk_dataset
+
+        dataset = generate_bulk_dataset(1, 1, 0, seed=1)
+        self.service = dataset["service"]
+        self.client_user = dataset["client"]
+        self.start = timezone.now().replace(microsecond=0) + timedelta(days=2)
+
+    def _book(self, offset_minutes, **kwargs):
+        # bulk_create omite save() y sus SlotClaim: permite armar superposiciones
+        start = self.start + timedelta(minutes=offset_minutes)
+        [appointment] = Appointment.objects.bulk_create(
+            [
+                Appointment(
+                    client=self.client_user,
+                    service=self.service,
+                    start_time=start,
+                    end_time=start + timedelta(minutes=self.service.duration_minutes),
+                    amount=self.service.price,
+                    **kwargs,
+                )
+            ]
+        )
+        return appointment
+
+    def test_audit_counts_only_active_overlaps(self):
+        from core.management.commands.simulate_bookings import find_overlapping_appointments
+
+        first = self._book(0, status="CONFIRMED")
+        second = self._book(self.service.duration_minutes - 5, status="PENDING")
+        # Fuera de la auditoría: cancelado, PENDING vencido y turno contiguo
+        self._book(0, status="CANCELLED")
+        self._book(0, status="PENDING", expires_at=timezone.now() - timedelta(minutes=1))
+        self._book(self.service.duration_minutes * 3, status="CONFIRMED")
+
+        self.assertEqual(
+            set(find_overlapping_appointments().values_list("pk", flat=True)),
+            {first.pk, second.pk},
+        )
+
+    def test_fake_mercadopago_answers_preferences(self):
+        from core.management.commands.simulate_bookings import FakeMercadoPago
+
+        fake = FakeMercadoPago(latency=0)
+        response = fake.post("https://api.mercadopago.com/checkout/preferences", json={})
+        self.assertEqual(response.status_code, 201)
+        self.assertIn("init_point", response.json())
+        self.assertEqual(fake.post("https://api.mercadopago.com/v1/payments/1").status_code, 404)
+        self.assertEqual(fake.calls, 2)
+
+
+class SlotClaimTestCase(TestCase):
+    def setUp(self):
+        from core.demo_data import WORKING_DAYS, generate_bulk_dataset
+
+        dataset = generate_bulk_dataset(1, 1, 0, seed=1)
+        self.hairdresser = dataset["hairdresser"]
+        self.service = dataset["service"]
+        self.client_user = dataset["client"]
+        day = timezone.localdate() + timedelta(days=2)
+        while day.weekday() not in WORKING_DAYS:
+            day += timedelta(days=1)
+        self.start = datetime.datetime.combine(
+            day, datetime.time(10, 0), timezone.get_current_timezone()
+        )
+        # Celdas de 5 minutos que ocupa un turno del servicio
+        self.cells = -(-self.service.duration_minutes // 5)
+
+    def _create(self, offset_minutes=0, **kwargs):
+        kwargs.setdefault("status", "CONFIRMED")
+        return Appointment.objects.create(
+            client=self.client_user,
+            service=self.service,
+            start_time=self.start + timedelta(minutes=offset_minutes),
+            **kwargs,
+        )
+
+    def test_overlapping_insert_is_rejected_and_rolled_back(self):
+        from core.models import SlotClaim
+        from core.slots import SlotUnavailable
+
+        first = self._create()
+        self.assertEqual(first.slot_claims.count(), self.cells)
+        with self.assertRaises(SlotUnavailable):
+            self._create(offset_minutes=5, status="PENDING")
+        self.assertEqual(Appointment.objects.count(), 1)
+        self.assertFalse(SlotClaim.objects.exclude(appointment=first).exists())
+
+        # El horario contiguo no comparte celdas
+        self._create(offset_minutes=self.service.duration_minutes)
+
+    def test_cancelled_and_expired_appointments_free_their_cells(self):
+        first = self._create()
+        first.status = "CANCELLED"
+        first.save()
+        self.assertFalse(first.slot_claims.exists())
+
+        pending = self._create(status="PENDING", expires_at=timezone.now() + timedelta(minutes=10))
+        # El pago vence sin pasar por save(): sus celdas quedan obsoletas
+        Appointment.objects.filter(pk=pending.pk).update(expires_at=timezone.now() - timedelta(minutes=1))
+        second = self._create()
+        self.assertTrue(second.slot_claims.exists())
+        self.assertFalse(pending.slot_claims.exists())
+
+    def test_moving_an_appointment_displaces_the_next_one(self):
+        from core.utils import reschedule_subsequent_appointments
+
+        first = self._create()
+        second = self._create(offset_minutes=self.service.duration_minutes)
+        first.extra_minutes = 15
+        first.save()
+        reschedule_subsequent_appointments(first, 15)
+
+        second.refresh_from_db()
+        self.assertEqual(second.start_time, first.end_time)
+        self.assertEqual(second.slot_claims.count(), self.cells)
+
+    def test_cascade_does_not_overwrite_changes_missing_from_cached_agenda(self):
+        from core.day_agenda import day_agenda
+        from core.utils import reschedule_subsequent_appointments
+
+        first = self._create()
+        second = self._create(offset_minutes=self.service.duration_minutes)
+        cached = day_agenda(self.hairdresser.pk, timezone.localtime(self.start).date())
+        Appointment.objects.filter(pk=second.pk).update(client_name="Cambio reciente", extra_minutes=5)
+        first.extra_minutes = 15
+        first.save()
+        # La agenda en caché todavía no refleja el cambio
+        with patch("core.day_agenda.day_agenda", return_value=cached):
+            reschedule_subsequent_appointments(first, 15)
+
+        second.refresh_from_db()
+        self.assertEqual(second.start_time, first.end_time)
+        self.assertEqual(second.client_name, "Cambio reciente")
+        self.assertEqual(second.extra_minutes, 5)
+
+    def test_misaligned_times_claim_every_touched_cell(self):
+        from core.slots import SlotUnavailable, slot_cells
+
+        at = lambda minutes: self.start + timedelta(minutes=minutes)
+        self.assertEqual(slot_cells(at(1), at(4)), [at(0)])
+        self.assertEqual(
+            set(slot_cells(at(-30), at(4))) & set(slot_cells(at(3), at(33))), {at(0)}
+        )
+
+        duration = self.service.duration_minutes
+        first = self._create(offset_minutes=1)
+        self.assertEqual(first.slot_claims.count(), self.cells + 1)
+        # Se superponen un minuto dentro de la última celda del primero
+        with self.assertRaises(SlotUnavailable):
+            self._create(offset_minutes=duration)
+        # Contiguo: comparte la celda de borde sin superponerse
+        second = self._create(offset_minutes=duration + 1)
+        self.assertEqual(second.slot_claims.count(), self.cells)
+
+        # Al cancelar el primero, la celda compartida pasa al segundo
+        first.status = "CANCELLED"
+        first.save()
+        self.assertEqual(second.slot_claims.count(), self.cells + 1)
+
+    def test_moving_earlier_does_not_strip_the_previous_appointment(self):
+        from core.slots import SlotUnavailable
+
+        first = self._create()
+        second = self._create(offset_minutes=self.service.duration_minutes + 10)
+        # Adelantar el segundo sobre el final del primero (que la cascada no mueve)
+        second.start_time = first.end_time - timedelta(minutes=10)
+        with self.assertRaises(SlotUnavailable):
+            second.save()
+        self.assertEqual(first.slot_claims.count(), self.cells)
+
+    def test_booking_view_rejects_slot_taken_after_validation(self):
+        from core.forms import AppointmentForm
+
+        self._create()
+        browser = Client()
+        browser.force_login(User.objects.filter(is_owner=False).exclude(pk=self.client_user.pk).first())
+        # Simula que otra reserva ganó la carrera después de validar el formulario
+        with patch.object(AppointmentForm, "clean", lambda form: form.cleaned_data):
+            response = browser.post(
+                reverse("hairdresser_detail", args=[self.hairdresser.pk]),
+                {
+                    "service": self.service.pk,
+                    "start_time": timezone.localtime(self.start).strftime("%Y-%m-%d %H:%M"),
+                    "payment_method": "CASH",
+                },
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("ya no está disponible", response.json()["error"])
+        self.assertEqual(Appointment.objects.count(), 1)
+
+
+class AsyncViewsTestCase(TestCase):
+    """Vistas de core/async_views.py, activadas con ASYNC_VIEWS=True."""
+
+    def setUp(self):
+        import importlib
+
+        import core.urls
+        from django.urls import clear_url_caches
+
+        from core.demo_data import WORKING_DAYS, generate_bulk_dataset
+
+        def load_urls():
+            # El urlconf raíz guarda los patrones incluidos: recargar ambos
+            importlib.reload(core.urls)
+            importlib.reload(importlib.import_module(settings.ROOT_URLCONF))
+            clear_url_caches()
+
+        with override_settings(ASYNC_VIEWS=True):
+            load_urls()
+        self.addCleanup(load_urls)
+
+        dataset = generate_bulk_dataset(1, 1, 0, seed=1, prefix="async")
+        self.hairdresser = dataset["hairdresser"]
+        Hairdresser.objects.filter(pk=self.hairdresser.pk).update(
+            mercadopago_active=True, mercadopago_access_token="APP_USR-async"
+        )
+        self.service = dataset["service"]
+        self.owner = dataset["owner"]
+        self.client_user = dataset["client"]
+        day = timezone.localdate() + timedelta(days=2)
+        while day.weekday() not in WORKING_DAYS:
+            day += timedelta(days=1)
+        self.start = datetime.datetime.combine(
+            day, datetime.time(10, 0), timezone.get_current_timezone()
+        )
+
+    def _mp_response(self, status_code, body):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = json.dumps(body).encode()
+        return response
+
+    def test_urls_use_async_views(self):
+        from django.urls import resolve
+
+        from core import async_views
+
+        self.assertIs(resolve(reverse("geocode_address_api")).func, async_views.geocode_address_api)
+        self.assertIs(
+            resolve(reverse("hairdresser_detail", args=[self.hairdresser.pk])).func,
+            async_views.hairdresser_detail,
+        )
+
+    def test_http_client_reused_within_event_loop(self):
+        import asyncio
+
+        from core import async_http
+
+        async def clients():
+            return async_http._get_client(), async_http._get_client()
+
+        first, second = asyncio.run(clients())
+        self.assertIs(first, second)
+        # Otro loop no puede usar las conexiones del anterior
+        third, _ = asyncio.run(clients())
+        self.assertIsNot(third, first)
+
+    @patch("core.async_http.get")
+    async def test_geocode_under_asgi(self, mock_get):
+        from django.test import AsyncClient
+
+        mock_get.return_value = self._mp_response(200, [{"lat": "-24.78", "lon": "-65.41"}])
+        await self.async_client.aforce_login(self.owner)
+
+        response = await self.async_client.get(reverse("geocode_address_api"), {"address": "Salta"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["latitude"], -24.78)
+        anonymous = await AsyncClient().get(reverse("geocode_address_api"), {"address": "Salta"})
+        self.assertEqual(anonymous.status_code, 403)
+
+    @override_settings(WORKSTATION_STREAM_SECONDS=0, WORKSTATION_LONGPOLL_SECONDS=0)
+    async def test_workstation_feed_under_asgi(self):
+        from asgiref.sync import sync_to_async
+
+        from core.agenda import latest_sequence
+
+        await self.async_client.aforce_login(self.owner)
+        since = await sync_to_async(latest_sequence)(self.hairdresser.pk)
+        appointment = await Appointment.objects.acreate(
+            client=self.client_user,
+            service=self.service,
+            start_time=self.start,
+            amount=self.service.price,
+            status="CONFIRMED",
+        )
+
+        response = await self.async_client.get(reverse("workstation_events"), {"since": since})
+        body = b"".join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertIn("event: agenda", body)
+        self.assertIn(f'"id": {appointment.pk}', body)
+
+        response = await self.async_client.get(reverse("workstation_changes"), {"since": since})
+        self.assertEqual(response.json()["changes"][0]["id"], appointment.pk)
+
+    @patch("core.async_http.post")
+    def test_booking_creates_preference(self, mock_post):
+        mock_post.return_value = self._mp_response(
+            201, {"id": "pref-1", "init_point": "https://mp.invalid/checkout/pref-1"}
+        )
+        self.client.force_login(self.client_user)
+        url = reverse("hairdresser_detail", args=[self.hairdresser.pk])
+        data = {
+            "service": self.service.pk,
+            "start_time": self.start.strftime("%Y-%m-%d %H:%M"),
+            "payment_method": "FULL",
+        }
+
+        with self.settings(MERCADOPAGO_SANDBOX=False):
+            response = self.client.post(url, data)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["redirect_url"], "https://mp.invalid/checkout/pref-1")
+        self.assertEqual(Appointment.objects.get().status, "PENDING")
+
+        # Si MercadoPago falla, el turno no queda tomando el horario
+        mock_post.return_value = self._mp_response(500, {"message": "error"})
+        data["start_time"] = (self.start + timedelta(hours=2)).strftime("%Y-%m-%d %H:%M")
+        with self.settings(MERCADOPAGO_SANDBOX=False):
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    @patch("core.async_http.post")
+    def test_oauth_callback_saves_credentials(self, mock_post):
+        mock_post.return_value = self._mp_response(
+            200, {"access_token": "APP_USR-new", "refresh_token": "TG-new", "user_id": 42}
+        )
+        self.client.force_login(self.owner)
+
+        with self.settings(MERCADOPAGO_CLIENT_ID="id", MERCADOPAGO_CLIENT_SECRET="secret"):
+            response = self.client.get(
+                reverse("mercadopago_callback"), {"code": "abc", "state": self.hairdresser.pk}
+            )
+
+        self.assertRedirects(response, reverse("my_hairdresser_info"), fetch_redirect_response=False)
+        self.hairdresser.refresh_from_db()
+        self.assertEqual(self.hairdresser.mercadopago_access_token, "APP_USR-new")
+        self.assertEqual(self.hairdresser.mercadopago_user_id, "42")
+
+
+class IdempotentBookingTestCase(TestCase):
+    def setUp(self):
+        from core.demo_data import WORKING_DAYS, generate_bulk_dataset
+
+        dataset = generate_bulk_dataset(1, 1, 0, seed=1, prefix="idem")
+        self.hairdresser = dataset["hairdresser"]
+        Hairdresser.objects.filter(pk=self.hairdresser.pk).update(
+            mercadopago_active=True, mercadopago_access_token="APP_USR-idem"
+        )
+        self.service = dataset["service"]
+        self.client.force_login(dataset["client"])
+        day = timezone.localdate() + timedelta(days=2)
+        while day.weekday() not in WORKING_DAYS:
+            day += timedelta(days=1)
+        self.start = datetime.datetime.combine(
+            day, datetime.time(10, 0), timezone.get_current_timezone()
+        )
+        self.url = reverse("hairdresser_detail", args=[self.hairdresser.pk])
+
+    def _book(self, key, payment_method="FULL"):
+        with self.settings(MERCADOPAGO_SANDBOX=False):
+            return self.client.post(
+                self.url,
+                {
+                    "service": self.service.pk,
+                    "start_time": self.start.strftime("%Y-%m-%d %H:%M"),
+                    "payment_method": payment_method,
+                },
+                headers={"Idempotency-Key": key},
+            )
+
+    def _preference(self, status_code=201):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = json.dumps(
+            {"id": "pref-1", "init_point": "https://mp.invalid/checkout/pref-1"}
+        ).encode()
+        return response
+
+    @patch("requests.post")
+    def test_repeated_key_reuses_appointment_and_preference(self, mock_post):
+        mock_post.return_value = self._preference()
+
+        first = self._book("key-1")
+        second = self._book("key-1")
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.json(), first.json())
+        mock_post.assert_called_once()
+        self.assertIn("expiration_date_to", mock_post.call_args.kwargs["json"])
+        appointment = Appointment.objects.get()
+        self.assertEqual(appointment.mercadopago_preference_id, "pref-1")
+        self.assertEqual(appointment.checkout_url, "https://mp.invalid/checkout/pref-1")
+
+        # El listado ofrece completar el pago con la misma preferencia
+        response = self.client.get(reverse("my_appointments"))
+        self.assertContains(response, "https://mp.invalid/checkout/pref-1")
+
+        # Vencido el plazo de pago, la clave ya no reutiliza el checkout
+        Appointment.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(self._book("key-1").status_code, 409)
+        mock_post.assert_called_once()
+
+    def test_repeated_key_without_online_payment(self):
+        first = self._book("key-cash", payment_method="CASH")
+        second = self._book("key-cash", payment_method="CASH")
+
+        self.assertEqual(first.json()["redirect_url"], reverse("my_appointments"))
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    @patch("requests.post")
+    def test_failed_preference_can_be_retried_with_same_key(self, mock_post):
+        mock_post.return_value = self._preference(status_code=500)
+        self.assertEqual(self._book("key-2").status_code, 500)
+        self.assertFalse(Appointment.objects.exists())
+
+        mock_post.return_value = self._preference()
+        self.assertEqual(self._book("key-2").status_code, 200)
+        self.assertEqual(Appointment.objects.get().idempotency_key, "key-2")
+
+
+class CheckoutReturnSyncTestCase(TestCase):
+    def setUp(self):
+        from core.demo_data import generate_bulk_dataset
+
+        dataset = generate_bulk_dataset(1, 1, 0, seed=1, prefix="sync")
+        self.hairdresser = dataset["hairdresser"]
+        Hairdresser.objects.filter(pk=self.hairdresser.pk).update(
+            mercadopago_active=True, mercadopago_access_token="APP_USR-sync"
+        )
+        self.service = dataset["service"]
+        self.client_user = dataset["client"]
+        self.appointment = Appointment.objects.create(
+            client=self.client_user,
+            service=self.service,
+            start_time=timezone.now() + timedelta(days=2),
+            amount=self.service.price,
+            status="PENDING",
+            payment_method="FULL",
+            expires_at=timezone.now() + timedelta(minutes=10),
+        )
+        self.client.force_login(self.client_user)
+
+    def _payment(self):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(
+            {
+                "status": "approved",
+                "external_reference": str(self.appointment.pk),
+                "transaction_amount": float(self.service.price),
+            }
+        ).encode()
+        return response
+
+    def _return_from_checkout(self):
+        return self.client.get(
+            reverse("my_appointments"),
+            {"payment_id": "777", "status": "approved", "external_reference": self.appointment.pk},
+        )
+
+    @patch("core.webhooks._verify_mp_signature", return_value=True)
+    @patch("requests.get")
+    def test_return_and_webhook_share_the_sync(self, mock_get, mock_verify_signature):
+        mock_get.return_value = self._payment()
+
+        response = self._return_from_checkout()
+
+        self.assertContains(response, "payment-processing")
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.status, "CONFIRMED")
+        self.assertTrue(WebhookEvent.objects.get(payment_id="777").processed)
+
+        # El webhook del mismo pago llega después: no repite la consulta
+        response = self.client.post(
+            reverse("mercadopago_webhook", args=[self.hairdresser.pk]),
+            json.dumps({"type": "payment", "data": {"id": "777"}}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self._return_from_checkout()
+        mock_get.assert_called_once()
+
+    @patch("requests.get")
+    def test_schedule_skips_payments_claimed_by_another_return(self, mock_get):
+        from core import payments
+
+        mock_get.return_value = self._payment()
+        # Otro proceso reclamó la sincronización hace poco
+        WebhookEvent.objects.create(payment_id="777", sync_claimed_at=timezone.now())
+
+        self.assertFalse(payments.schedule_payment_sync(self.appointment, "777"))
+        mock_get.assert_not_called()
+
+        # Un reclamo viejo se da por perdido y el retorno vuelve a sincronizar
+        WebhookEvent.objects.update(sync_claimed_at=timezone.now() - payments.RETURN_SYNC_CLAIM)
+        self.assertTrue(payments.schedule_payment_sync(self.appointment, "777"))
+        mock_get.assert_called_once()
+        event = WebhookEvent.objects.get(payment_id="777")
+        self.assertTrue(event.processed)
+        self.assertIsNone(event.sync_claimed_at)
+
+    @patch("requests.get")
+    def test_payment_for_another_appointment_is_ignored(self, mock_get):
+        from core.payments import sync_payment
+
+        mock_get.return_value = self._payment()
+
+        result = sync_payment(self.hairdresser, "777", appointment_id=self.appointment.pk + 1)
+
+        self.assertEqual(result, "Payment does not match appointment")
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.status, "PENDING")
+
+    def test_payment_status_endpoint(self):
+        url = reverse("appointment_payment_status", args=[self.appointment.pk])
+
+        data = self.client.get(url).json()
+        self.assertTrue(data["processing"])
+        self.assertEqual(data["status"], "PENDING")
+
+        Appointment.objects.filter(pk=self.appointment.pk).update(status="CONFIRMED", expires_at=None)
+        self.assertFalse(self.client.get(url).json()["processing"])
+
+        # Solo el cliente del turno puede consultarlo
+        other = User.objects.create_user(username="other_sync", password="password123")
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+@override_settings(WORKSTATION_STREAM_SECONDS=0, WORKSTATION_LONGPOLL_SECONDS=0)
+class WorkstationFeedTestCase(TestCase):
+    def setUp(self):
+        from core.demo_data import generate_bulk_dataset
+
+        dataset = generate_bulk_dataset(1, 1, 0, seed=1, prefix="feed")
+        self.hairdresser = dataset["hairdresser"]
+        self.service = dataset["service"]
+        self.client_user = dataset["client"]
+        self.client.force_login(dataset["owner"])
+
+    def _book(self, hours=1):
+        return Appointment.objects.create(
+            client=self.client_user,
+            service=self.service,
+            start_time=timezone.now() + timedelta(hours=hours),
+            amount=self.service.price,
+            status="CONFIRMED",
+        )
+
+    def _latest(self):
+        from core.agenda import latest_sequence
+
+        return latest_sequence(self.hairdresser.pk)
+
+    def _events(self, **kwargs):
+        response = self.client.get(reverse("workstation_events"), **kwargs)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        return b"".join(response.streaming_content).decode()
+
+    def _batches(self, body):
+        return [
+            json.loads(line[len("data: "):])
+            for line in body.splitlines()
+            if line.startswith("data: ")
+        ]
+
+    def test_changes_get_consecutive_sequence(self):
+        from core.models import AgendaChange, Pause
+
+        appointment = self._book()
+        pause = Pause.objects.create(
+            hairdresser=self.hairdresser,
+            start_time=timezone.now() + timedelta(hours=3),
+            end_time=timezone.now() + timedelta(hours=3, minutes=20),
+        )
+        appointment.status = "COMPLETED"
+        appointment.save()
+        pause_id = pause.pk
+        pause.delete()
+
+        changes = list(
+            AgendaChange.objects.filter(hairdresser=self.hairdresser)
+            .order_by("seq")
+            .values_list("seq", "kind", "object_id")
+        )
+        self.assertEqual(
+            [(kind, object_id) for _, kind, object_id in changes],
+            [
+                ("appointment", appointment.pk),
+                ("pause", pause_id),
+                ("appointment", appointment.pk),
+                ("pause", pause_id),
+            ],
+        )
+        seqs = [seq for seq, _, _ in changes]
+        self.assertEqual(seqs, list(range(seqs[0], seqs[0] + 4)))
+        self.assertEqual(self._latest(), seqs[-1])
+
+    def test_stream_sends_changes_after_since(self):
+        first = self._book()
+        since = self._latest()
+        second = self._book(hours=2)
+        second.status = "CANCELLED"
+        second.save()
+
+        body = self._events(data={"since": since})
+        self.assertTrue(body.startswith("retry: "))
+        self.assertIn(f"id: {self._latest()}\nevent: agenda\n", body)
+        [batch] = self._batches(body)
+        # El turno cambiado dos veces se informa una sola vez, con su estado actual
+        self.assertEqual(len(batch["changes"]), 1)
+        change = batch["changes"][0]
+        self.assertEqual((change["id"], change["status"]), (second.pk, "CANCELLED"))
+        self.assertNotEqual(change["id"], first.pk)
+        self.assertFalse(batch["reset"])
+
+    def test_stream_resumes_from_last_event_id(self):
+        self._book()
+        seen = self._latest()
+        latest = self._book(hours=2)
+
+        body = self._events(data={"since": seen - 1}, HTTP_LAST_EVENT_ID=str(seen))
+        [batch] = self._batches(body)
+        self.assertEqual([change["id"] for change in batch["changes"]], [latest.pk])
+
+        # Sin cambios nuevos el stream solo indica el tiempo de reconexión
+        self.assertEqual(self._batches(self._events(HTTP_LAST_EVENT_ID=str(self._latest()))), [])
+
+    def test_longpoll_returns_changes_and_deletions(self):
+        appointment = self._book()
+        since = self._latest()
+        appointment_id = appointment.pk
+        appointment.delete()
+
+        data = self.client.get(reverse("workstation_changes"), {"since": since}).json()
+        self.assertEqual(data["seq"], self._latest())
+        self.assertEqual(
+            data["changes"], [{"type": "appointment", "id": appointment_id, "deleted": True}]
+        )
+        self.assertEqual(data["pending_requests_count"], 0)
+
+        data = self.client.get(reverse("workstation_changes"), {"since": data["seq"]}).json()
+        self.assertEqual(data["changes"], [])
+
+    def test_pruned_changes_ask_for_full_refresh(self):
+        from core.agenda import prune_agenda_changes
+        from core.models import AgendaChange
+
+        self._book()
+        since = self._latest()
+        self._book(hours=2)
+        self._book(hours=3)
+        AgendaChange.objects.filter(seq=since + 1).update(
+            created_at=timezone.now() - timedelta(hours=settings.AGENDA_CHANGE_RETENTION_HOURS + 1)
+        )
+        self.assertEqual(prune_agenda_changes(), 1)
+
+        data = self.client.get(reverse("workstation_changes"), {"since": since}).json()
+        self.assertTrue(data["reset"])
+        self.assertEqual(len(data["changes"]), 1)
+
+    def test_cascade_delete_does_not_record_changes(self):
+        from core.models import AgendaChange
+
+        self._book()
+        self.hairdresser.delete()
+        self.assertFalse(AgendaChange.objects.exists())
+
+    def test_feed_requires_owner(self):
+        self.client.force_login(self.client_user)
+        self.assertEqual(self.client.get(reverse("workstation_events")).status_code, 403)
+        self.assertEqual(self.client.get(reverse("workstation_changes")).status_code, 403)
+
+    def test_workstation_fragment_renders_sections_only(self):
+        appointment = self._book()
+
+        response = self.client.get(reverse("workstation"))
+        self.assertContains(response, f'data-agenda-seq="{self._latest()}"')
+        self.assertContains(response, 'id="walkInModal"')
+
+        response = self.client.get(reverse("workstation"), {"fragment": 1})
+        self.assertContains(response, 'id="next-appointment-section"')
+        self.assertContains(response, f'data-appointment-id="{appointment.pk}"')
+        self.assertNotContains(response, 'id="walkInModal"')
+        self.assertNotContains(response, "<html")
+
+
+class DayAgendaTestCase(TestCase):
+    def setUp(self):
+        from core.demo_data import generate_bulk_dataset
+
+        dataset = generate_bulk_dataset(1, 1, 0, seed=1, prefix="day")
+        self.hairdresser = dataset["hairdresser"]
+        self.service = dataset["service"]
+        self.client_user = dataset["client"]
+        self.owner = dataset["owner"]
+        # Anclado al mediodía local para que todo quede en el mismo día
+        self.now = timezone.make_aware(
+            datetime.datetime.combine(timezone.localdate(), datetime.time(12, 0))
+        )
+
+    def _book(self, start, status="CONFIRMED", expires_at=None):
+        return Appointment.objects.create(
+            client=self.client_user,
+            service=self.service,
+            start_time=start,
+            amount=self.service.price,
+            status=status,
+            expires_at=expires_at,
+        )
+
+    def test_classifies_day_like_the_workstation(self):
+        from core.day_agenda import build_day_agenda
+        from core.models import Pause
+
+        noon = self.now
+        done = self._book(noon - timedelta(hours=3), status="COMPLETED")
+        current = self._book(noon - timedelta(minutes=10))
+        following = self._book(noon + timedelta(hours=1))
+        later = self._book(noon + timedelta(hours=2))
+        pause = Pause.objects.create(
+            hairdresser=self.hairdresser,
+            start_time=noon + timedelta(minutes=90),
+            end_time=noon + timedelta(minutes=105),
+        )
+        self._book(noon + timedelta(days=3), status="PENDING")
+        self._book(noon + timedelta(days=3, hours=2), status="PENDING", expires_at=noon + timedelta(days=1))
+
+        agenda = build_day_agenda(self.hairdresser.pk, timezone.localdate())
+        view = agenda.workstation(noon)
+        self.assertEqual(view["current_appointment"], current)
+        self.assertEqual(view["next_appointment"], following)
+        self.assertEqual(view["completed_appointments"], [done])
+        self.assertIsNone(view["active_pause"])
+        self.assertEqual([item["object"] for item in view["upcoming_timeline"]], [pause, later])
+        self.assertEqual(view["upcoming_timeline"][0]["duration"], 15)
+        # Solo cuentan las solicitudes de otros días sin vencimiento de pago
+        self.assertEqual(agenda.pending_requests_count, 1)
+        self.assertEqual(agenda.next_appointment(noon), following)
+        self.assertEqual(agenda.active_after(noon + timedelta(minutes=70)), [later])
+
+    def test_snapshot_is_cached_until_the_agenda_changes(self):
+        from core import day_agenda
+
+        appointment = self._book(self.now + timedelta(minutes=30))
+        self.client.force_login(self.owner)
+
+        with patch("django.utils.timezone.now", return_value=self.now), patch(
+            "core.day_agenda.build_day_agenda", wraps=day_agenda.build_day_agenda
+        ) as build:
+            self.client.get(reverse("workstation"))
+            self.client.get(reverse("workstation"), {"fragment": 1})
+            self.assertEqual(build.call_count, 1)
+
+            appointment.status = "NO_SHOW"
+            appointment.save()
+            response = self.client.get(reverse("workstation"))
+            self.assertEqual(build.call_count, 2)
+        self.assertEqual(response.context["completed_appointments"], [appointment])
+
+    @patch("core.utils.notify_user")
+    def test_early_completion_offers_next_appointment_from_snapshot(self, mock_notify):
+        from core.models import EarlyStartOffer
+
+        current = self._book(self.now - timedelta(minutes=5))
+        following = self._book(current.end_time + timedelta(minutes=5))
+        self.client.force_login(self.owner)
+
+        with patch("django.utils.timezone.now", return_value=self.now):
+            response = self.client.post(
+                reverse("update_appointment_status", args=[current.pk]), {"status": "COMPLETED"}
+            )
+        self.assertEqual(response.json()["status"], "success")
+        self.assertEqual(EarlyStartOffer.objects.get().appointment, following)
+
+
+class LocalDayRangeTestCase(TestCase):
+    def setUp(self):
+        from core.demo_data import generate_bulk_dataset
+
+        dataset = generate_bulk_dataset(1, 1, 0, seed=1, prefix="range")
+        self.service = dataset["service"]
+        self.client_user = dataset["client"]
+        self.owner = dataset["owner"]
+
+    def _book(self, local_dt, status="COMPLETED"):
+        return Appointment.objects.create(
+            client=self.client_user,
+            service=self.service,
+            start_time=timezone.make_aware(local_dt),
+            amount=self.service.price,
+            status=status,
+        )
+
+    def test_ranges_cover_the_local_day_and_month(self):
+        from core.dates import local_day_range, local_month_range, month_from_param
+
+        start, end = local_day_range(datetime.date(2026, 3, 31))
+        # Salta es UTC-3: el día local empieza a las 03:00 UTC
+        self.assertEqual(start.astimezone(datetime.timezone.utc).hour, 3)
+        self.assertEqual(end - start, timedelta(days=1))
+
+        start, end = local_month_range(datetime.date(2026, 2, 14))
+        self.assertEqual((start.date(), end.date()), (datetime.date(2026, 2, 1), datetime.date(2026, 3, 1)))
+        self.assertEqual(month_from_param("2026-02"), datetime.date(2026, 2, 1))
+        self.assertEqual(month_from_param("febrero"), timezone.localdate().replace(day=1))
+
+    def test_querysets_filter_by_local_boundaries_without_casting(self):
+        late = self._book(datetime.datetime(2026, 3, 31, 23, 30))
+        self._book(datetime.datetime(2026, 4, 1, 0, 0))
+        self._book(datetime.datetime(2026, 2, 28, 23, 59))
+
+        day = Appointment.objects.on_day(datetime.date(2026, 3, 31))
+        self.assertEqual(list(day), [late])
+        self.assertEqual(list(Appointment.objects.in_month(datetime.date(2026, 3, 1))), [late])
+        # Comparación directa de la columna (sin convertir cada fila a fecha local)
+        self.assertNotIn("cast_date", str(day.query))
+
+    def test_stats_charts_include_the_last_evening_of_the_month(self):
+        self._book(datetime.datetime(2026, 3, 31, 21, 0))
+        self._book(datetime.datetime(2026, 4, 1, 10, 0))
+        self.client.force_login(self.owner)
+
+        data = self.client.get(reverse("revenue_by_service_chart"), {"month": "2026-03"}).json()
+        self.assertEqual(data["data"], [float(self.service.price)])
+
+        response = self.client.get(reverse("owner_stats"), {"month": "2026-03"})
+        self.assertEqual(response.context["monthly_appointments"], 1)
+
+
+class AppointmentListKeysetTestCase(TestCase):
+    def setUp(self):
+        from core.demo_data import generate_bulk_dataset
+
+        dataset = generate_bulk_dataset(1, 1, 0, seed=1, prefix="keyset")
+        self.service = dataset["service"]
+        self.client_user = dataset["client"]
+        self.owner = dataset["owner"]
+        self.start = timezone.make_aware(datetime.datetime(2026, 3, 2, 10, 0))
+
+    def _book(self, days, status="COMPLETED", **kwargs):
+        kwargs.setdefault("client", self.client_user)
+        return Appointment.objects.create(
+            service=self.service,
+            start_time=self.start + timedelta(days=days),
+            amount=self.service.price,
+            status=status,
+            **kwargs,
+        )
+
+    def _collect(self, url, params=None):
+        """Recorre todas las páginas siguiendo next_page_query."""
+        from urllib.parse import parse_qsl
+
+        params = dict(params or {})
+        pages = []
+        while True:
+            response = self.client.get(url, params)
+            pages.append([app.pk for app in response.context["appointments"]])
+            if not response.context["next_page_query"]:
+                return pages
+            params = dict(parse_qsl(response.context["next_page_query"]))
+
+    def test_lists_page_by_cursor_without_gaps_or_duplicates(self):
+        booked = [self._book(day) for day in range(45)]
+        expected = [app.pk for app in reversed(booked)]
+
+        self.client.force_login(self.owner)
+        pages = self._collect(reverse("owner_appointments"), {"status": "COMPLETED"})
+        self.assertEqual([len(page) for page in pages], [25, 20])
+        self.assertEqual(sum(pages, []), expected)
+
+        self.client.force_login(self.client_user)
+        pages = self._collect(reverse("my_appointments"))
+        self.assertEqual([len(page) for page in pages], [20, 20, 5])
+        self.assertEqual(sum(pages, []), expected)
+        self.assertContains(self.client.get(reverse("my_appointments")), "load-more-appointments")
+
+    def test_search_matches_every_term_ignoring_case_and_accents(self):
+        User = get_user_model()
+        maria = User.objects.create_user(
+            username="maria.keyset", email="maria@keyset.test", first_name="María", last_name="Gómez"
+        )
+        match = self._book(0, client=maria)
+        walk_in = self._book(1, client=None, client_name="José  Núñez")
+        self._book(2)
+
+        self.client.force_login(self.owner)
+        url = reverse("owner_appointments")
+        results = lambda q: [app.pk for app in self.client.get(url, {"q": q}).context["appointments"]]
+        self.assertEqual(results("maria GOMEZ"), [match.pk])
+        self.assertEqual(results("keyset.test"), [match.pk])
+        self.assertEqual(results("jose nunez"), [walk_in.pk])
+        self.assertEqual(results("maria nunez"), [])
+
+        # Un cambio de nombre del usuario actualiza sus turnos
+        maria.last_name = "Pérez"
+        maria.save()
+        self.assertEqual(results("maria perez"), [match.pk])
+        self.assertEqual(results("gomez"), [])
+
+    def test_status_counters_come_from_one_grouped_query(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        self._book(0, status="PENDING")
+        self._book(1, status="PENDING", expires_at=timezone.now() + timedelta(minutes=10))
+        self._book(2, status="CONFIRMED")
+        self._book(3, status="COMPLETED")
+
+        self.client.force_login(self.owner)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("owner_appointments"))
+        grouped = [q["sql"] for q in queries.captured_queries if "GROUP BY" in q["sql"]]
+        self.assertEqual(len(grouped), 1)
+        # Solo las solicitudes sin pago en curso esperan confirmación manual
+        self.assertEqual(response.context["pending_count"], 1)
+        counts = {value: count for value, _, count in response.context["status_choices"]}
+        self.assertEqual(counts["PENDING"], 2)
+        self.assertEqual(counts["CONFIRMED"], 1)
+        self.assertEqual(counts["CANCELLED"], 0)
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        from core.demo_data import generate_bulk_dataset
+        from core.models import PaymentTransaction
+
+        dataset = generate_bulk_dataset(1, 1, 0, seed=1, prefix="export")
+        self.hairdresser = dataset["hairdresser"]
+        self.service = dataset["service"]
+        self.owner = dataset["owner"]
+        start = timezone.make_aware(datetime.datetime(2026, 3, 2, 10, 0))
+        self.walk_in = Appointment.objects.create(
+            service=self.service, start_time=start, client_name="José Núñez", status="COMPLETED"
+        )
+        self.booked = Appointment.objects.create(
+            service=self.service,
+            client=dataset["client"],
+            start_time=start + timedelta(days=40),
+            status="CONFIRMED",
+            payment_method="FULL",
+        )
+        PaymentTransaction.objects.create(
+            appointment=self.booked, payment_id="mp-export-1", amount=self.booked.amount, status="approved"
+        )
+        self.client.force_login(self.owner)
+
+    def _csv_rows(self, response):
+        import csv
+        import io
+
+        content = b"".join(response.streaming_content).decode("utf-8-sig")
+        return list(csv.reader(io.StringIO(content)))
+
+    def test_csv_export_streams_filtered_rows(self):
+        response = self.client.get(reverse("export_appointments"))
+        self.assertTrue(response.streaming)
+        self.assertIn("attachment;", response["Content-Disposition"])
+        rows = self._csv_rows(response)
+        self.assertEqual(rows[0][:2], ["ID", "Inicio"])
+        self.assertEqual([row[0] for row in rows[1:]], [str(self.walk_in.pk), str(self.booked.pk)])
+        # Horario local, no UTC
+        self.assertEqual(rows[1][1], "2026-03-02 10:00:00")
+
+        rows = self._csv_rows(self.client.get(reverse("export_appointments"), {"q": "jose nunez"}))
+        self.assertEqual([row[0] for row in rows[1:]], [str(self.walk_in.pk)])
+
+        rows = self._csv_rows(self.client.get(reverse("export_transactions"), {"month": "2026-03"}))
+        self.assertEqual(len(rows), 1)
+        rows = self._csv_rows(self.client.get(reverse("export_transactions"), {"month": "2026-04"}))
+        self.assertEqual([row[2] for row in rows[1:]], ["mp-export-1"])
+
+    def test_xlsx_export_is_a_valid_workbook(self):
+        import io
+        import zipfile
+
+        response = self.client.get(reverse("export_appointments"), {"format": "xlsx"})
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertIsNone(archive.testzip())
+        self.assertIn("[Content_Types].xml", archive.namelist())
+        sheet = archive.read("xl/worksheets/sheet1.xml").decode()
+        self.assertEqual(sheet.count("<row>"), 3)
+        self.assertIn("José Núñez", sheet)
+
+        response = self.client.get(reverse("export_appointments"), {"format": "pdf"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_formula_like_text_is_escaped(self):
+        import io
+        import zipfile
+
+        Appointment.objects.filter(pk=self.walk_in.pk).update(client_name='=HYPERLINK("http://x","y")')
+
+        rows = self._csv_rows(self.client.get(reverse("export_appointments")))
+        self.assertIn('\'=HYPERLINK("http://x","y")', rows[1])
+
+        response = self.client.get(reverse("export_appointments"), {"format": "xlsx"})
+        sheet = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))).read(
+            "xl/worksheets/sheet1.xml"
+        ).decode()
+        self.assertIn("'=HYPERLINK", sheet)
+
+    def test_only_owners_can_export(self):
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse("export_transactions")).status_code, 403)
+
+    def test_command_writes_the_export_to_a_file(self):
+        import io
+        import os
+        import tempfile
+        import zipfile
+
+        from django.core.management import call_command
+
+        out = io.StringIO()
+        call_command(
+            "export_data", "turnos", hairdresser=self.hairdresser.pk, status="CONFIRMED", stdout=out
+        )
+        lines = out.getvalue().strip().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith(f"{self.booked.pk},"))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "transacciones.xlsx")
+            call_command(
+                "export_data", "transacciones", hairdresser=self.hairdresser.pk,
+                format="xlsx", output=path, chunk_size=1, stdout=io.StringIO(),
+            )
+            with zipfile.ZipFile(path) as archive:
+                self.assertIn("mp-export-1", archive.read("xl/worksheets/sheet1.xml").decode())
+
+
+class PaymentReconciliationTestCase(TestCase):
+    def setUp(self):
+        from core.demo_data import generate_bulk_dataset
+
+        dataset = generate_bulk_dataset(1, 1, 0, seed=1, prefix="recon")
+        self.hairdresser = dataset["hairdresser"]
+        self.hairdresser.mercadopago_active = True
+        self.hairdresser.mercadopago_access_token = "recon-token"
+        self.hairdresser.save()
+        self.service = dataset["service"]
+        self.start = timezone.now() + timedelta(days=3)
+        self.confirmed = Appointment.objects.create(
+            client=dataset["client"],
+            service=self.service,
+            start_time=self.start,
+            status="CONFIRMED",
+            payment_method="FULL",
+        )
+        self.pending = Appointment.objects.create(
+            client=dataset["client"],
+            service=self.service,
+            start_time=self.start + timedelta(hours=3),
+            payment_method="FULL",
+            expires_at=timezone.now() + timedelta(minutes=10),
+        )
+
+    def _payment(self, payment_id, appointment, status="approved", minutes=0):
+        return {
+            "id": payment_id,
+            "status": status,
+            "external_reference": str(appointment.pk) if appointment else "999999",
+            "transaction_amount": float(self.service.price),
+            "date_last_updated": (timezone.now() - timedelta(minutes=60 - minutes)).isoformat(),
+        }
+
+    def _search(self, *pages, fail_after=None):
+        """Mock de requests.get: páginas de la búsqueda y el detalle de cada pago."""
+        payments = {str(p["id"]): p for page in pages for p in page}
+        total = sum(len(page) for page in pages)
+        calls = []
+
+        def get(url, params=None, **kwargs):
+            response = MagicMock()
+            response.raise_for_status.return_value = None
+            if url.endswith("/search"):
+                calls.append(params)
+                if fail_after is not None and len(calls) > fail_after:
+                    raise Exception("timeout")
+                page = pages[len(calls) - 1] if len(calls) <= len(pages) else []
+                response.json.return_value = {"results": page, "paging": {"total": total}}
+            else:
+                response.json.return_value = payments[url.rsplit("/", 1)[1]]
+            return response
+
+        return get, calls
+
+    def test_report_lists_differences_without_writing(self):
+        from core.models import PaymentTransaction, ReconciliationCheckpoint
+        from core.reconciliation import reconcile_payments, summarize
+
+        get, _ = self._search([
+            self._payment(501, self.confirmed),
+            self._payment(502, self.pending),
+            self._payment(503, None),
+        ])
+        with patch("core.reconciliation.requests.get", side_effect=get):
+            summary = summarize(reconcile_payments())
+
+        self.assertEqual(summary["payments"], 3)
+        self.assertEqual(
+            summary["issues"],
+            {"missing_transaction": 2, "amount_paid_mismatch": 1, "unapplied_payment": 1, "unmatched": 1},
+        )
+        self.assertEqual(summary["repaired"], 0)
+        self.assertFalse(PaymentTransaction.objects.exists())
+        self.assertFalse(ReconciliationCheckpoint.objects.exists())
+
+    def test_repair_writes_in_batches_and_applies_unprocessed_payments(self):
+        from core.models import PaymentTransaction, ReconciliationCheckpoint
+        from core.reconciliation import CHECKPOINT_OVERLAP, reconcile_payments, summarize
+
+        get, calls = self._search([self._payment(501, self.confirmed), self._payment(502, self.pending)])
+        with patch("core.reconciliation.requests.get", side_effect=get):
+            summary = summarize(reconcile_payments(repair=True))
+
+        self.assertEqual(summary["repaired"], 4)
+        self.assertEqual(
+            set(PaymentTransaction.objects.values_list("payment_id", flat=True)), {"501", "502"}
+        )
+        self.confirmed.refresh_from_db()
+        self.assertEqual(self.confirmed.amount_paid, self.service.price)
+        self.assertEqual(self.confirmed.mercadopago_payment_id, "501")
+        # El pago sin aplicar pasó por sync_payment y confirmó el turno
+        self.pending.refresh_from_db()
+        self.assertEqual(self.pending.status, "CONFIRMED")
+
+        # La siguiente corrida sigue desde el punto de control y ya no encuentra diferencias
+        checkpoint = ReconciliationCheckpoint.objects.get(hairdresser=self.hairdresser)
+        get, calls = self._search([self._payment(501, self.confirmed), self._payment(502, self.pending)])
+        with patch("core.reconciliation.requests.get", side_effect=get):
+            summary = summarize(reconcile_payments(repair=True))
+        self.assertEqual(summary["issues"], {})
+        self.assertEqual(calls[0]["begin_date"], (checkpoint.last_updated_at - CHECKPOINT_OVERLAP).isoformat())
+
+    def test_interrupted_run_resumes_after_the_last_page(self):
+        from django.utils.dateparse import parse_datetime
+
+        from core.models import ReconciliationCheckpoint
+        from core.reconciliation import reconcile_payments
+
+        first = self._payment(501, self.confirmed, minutes=1)
+        get, calls = self._search([first], [self._payment(502, self.pending, minutes=2)], fail_after=1)
+        with patch("core.reconciliation.requests.get", side_effect=get):
+            [report] = reconcile_payments(repair=True)
+
+        self.assertEqual(report["payments"], 1)
+        self.assertEqual(report["error"], "timeout")
+        self.assertEqual(calls[1]["offset"], 1)
+        checkpoint = ReconciliationCheckpoint.objects.get(hairdresser=self.hairdresser)
+        self.assertEqual(checkpoint.last_updated_at, parse_datetime(first["date_last_updated"]))
+
+    def test_failed_sync_holds_the_checkpoint(self):
+        from django.utils.dateparse import parse_datetime
+
+        from core.models import ReconciliationCheckpoint
+        from core.reconciliation import reconcile_payments, summarize
+
+        unapplied = self._payment(502, self.pending, minutes=1)
+        pages = ([unapplied], [self._payment(501, self.confirmed, minutes=2)])
+        search, _ = self._search(*pages)
+
+        def get(url, **kwargs):
+            if not url.endswith("/search"):
+                raise requests.ConnectionError("MercadoPago no responde")
+            return search(url, **kwargs)
+
+        # Mismo módulo requests: también falla la consulta de sync_payment()
+        with patch("core.reconciliation.requests.get", side_effect=get):
+            summary = summarize(reconcile_payments(repair=True))
+
+        self.assertEqual(summary["issues"].get("sync_failed"), 1)
+        checkpoint = ReconciliationCheckpoint.objects.get(hairdresser=self.hairdresser)
+        self.assertEqual(checkpoint.last_updated_at, parse_datetime(unapplied["date_last_updated"]))
+
+        # La corrida siguiente vuelve a encontrar el pago y lo aplica
+        get, _ = self._search(*pages)
+        with patch("core.reconciliation.requests.get", side_effect=get):
+            reconcile_payments(repair=True)
+        self.pending.refresh_from_db()
+        self.assertEqual(self.pending.status, "CONFIRMED")
+        checkpoint.refresh_from_db()
+        self.assertGreater(checkpoint.last_updated_at, parse_datetime(unapplied["date_last_updated"]))
+
+    @override_settings(CRON_SECRET="secret_token_123")
+    def test_cron_endpoint_requires_the_secret(self):
+        url = reverse("reconcile_payments_cron_endpoint")
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        get, _ = self._search([])
+        with patch("core.reconciliation.requests.get", side_effect=get):
+            response = self.client.get(url, {"token": "secret_token_123"})
+        self.assertEqual(response.json()["hairdressers"], 1)
+        self.assertEqual(response.json()["payments"], 0)
+
+    def test_command_prints_each_difference(self):
+        import io
+
+        from django.core.management import call_command
+
+        out = io.StringIO()
+        get, _ = self._search([self._payment(503, None)])
+        with patch("core.reconciliation.requests.get", side_effect=get):
+            call_command("reconcile_payments", hairdresser=[self.hairdresser.pk], stdout=out)
+        self.assertIn("unmatched: pago 503", out.getvalue())
+        self.assertIn("Pagos revisados: 1", out.getvalue())
+
+
+class RetentionPurgeTestCase(TestCase):
+    def setUp(self):
+        from core.demo_data import generate_bulk_dataset
+
+        dataset = generate_bulk_dataset(1, 1, 0, seed=1, prefix="purge")
+        self.hairdresser = dataset["hairdresser"]
+        self.appointment = Appointment.objects.create(
+            client=dataset["client"],
+            service=dataset["service"],
+            start_time=timezone.now() + timedelta(days=2),
+            status="CANCELLED",
+        )
+        self.old = timezone.make_aware(datetime.datetime(2024, 5, 10, 10, 0))
+
+    def _event(self, payment_id, received_at, processed=True):
+        event = WebhookEvent.objects.create(payment_id=payment_id, processed=processed)
+        WebhookEvent.objects.filter(pk=event.pk).update(received_at=received_at)
+        return event
+
+    def _offer(self, token, expires_at):
+        from core.models import EarlyStartOffer
+
+        return EarlyStartOffer.objects.create(
+            appointment=self.appointment,
+            token=token,
+            minutes_available=10,
+            new_start_time=expires_at,
+            expires_at=expires_at,
+        )
+
+    def _pause(self, start):
+        from core.models import Pause
+
+        return Pause.objects.create(hairdresser=self.hairdresser, start_time=start, end_time=start + timedelta(minutes=30))
+
+    def test_purge_deletes_only_expired_unreferenced_rows_in_batches(self):
+        from core.models import AgendaChange, EarlyStartOffer, Pause, PendingRefund, PurgedRowCount
+        from core.retention import purge_expired
+
+        self._event("old-1", self.old)
+        self._event("old-2", self.old + timedelta(days=40))
+        unprocessed = self._event("old-pending", self.old, processed=False)
+        refunding = self._event("old-refund", self.old)
+        PendingRefund.objects.create(appointment=self.appointment, payment_id="old-refund", amount=Decimal("100"))
+        recent = self._event("recent", timezone.now())
+        self._offer("old-offer", self.old)
+        live_offer = self._offer("live-offer", timezone.now() + timedelta(minutes=5))
+        self._pause(self.old)
+        live_pause = self._pause(timezone.now() + timedelta(hours=1))
+        changes = AgendaChange.objects.count()
+
+        result = purge_expired(batch_size=1)
+
+        self.assertEqual(result, {"webhook_events": 2, "early_start_offers": 1, "pauses": 1})
+        self.assertEqual(
+            set(WebhookEvent.objects.values_list("pk", flat=True)), {unprocessed.pk, refunding.pk, recent.pk}
+        )
+        self.assertEqual(list(EarlyStartOffer.objects.all()), [live_offer])
+        self.assertEqual(list(Pause.objects.all()), [live_pause])
+        # Las pausas purgadas no son cambios de agenda
+        self.assertEqual(AgendaChange.objects.count(), changes)
+        self.assertEqual(
+            set(PurgedRowCount.objects.values_list("table", "month", "count")),
+            {
+                ("webhook_events", datetime.date(2024, 5, 1), 1),
+                ("webhook_events", datetime.date(2024, 6, 1), 1),
+                ("early_start_offers", datetime.date(2024, 5, 1), 1),
+                ("pauses", datetime.date(2024, 5, 1), 1),
+            },
+        )
+
+        # Una segunda corrida no encuentra nada y los contadores se acumulan
+        self._event("old-3", self.old)
+        purge_expired(tables=["webhook_events"])
+        self.assertEqual(
+            PurgedRowCount.objects.get(table="webhook_events", month=datetime.date(2024, 5, 1)).count, 2
+        )
+
+    @override_settings(PAUSE_RETENTION_DAYS=0)
+    def test_command_dry_run_and_disabled_retention(self):
+        import io
+
+        from django.core.management import call_command
+
+        from core.models import Pause
+
+        self._event("old-1", self.old)
+        self._pause(self.old)
+        out = io.StringIO()
+        call_command("purge_old_rows", dry_run=True, stdout=out)
+        self.assertIn("webhook_events: se borrarían 1 filas", out.getvalue())
+        self.assertIn("pauses: sin retención configurada.", out.getvalue())
+        self.assertTrue(WebhookEvent.objects.exists())
+
+        call_command("purge_old_rows", stdout=io.StringIO())
+        self.assertFalse(WebhookEvent.objects.exists())
+        self.assertTrue(Pause.objects.exists())
+
+    @patch("core.payments.requests.post")
+    @patch("core.payments.requests.get")
+    def test_replayed_payment_after_purge_is_not_applied_again(self, mock_get, mock_post):
+        from core.payments import sync_payment
+        from core.retention import purge_expired
+
+        # Pago rechazado por horario ocupado: el turno quedó cancelado y reembolsado
+        Appointment.objects.filter(pk=self.appointment.pk).update(
+            mercadopago_payment_id="mp-replay", amount_paid=self.appointment.service.price
+        )
+        self._event("mp-replay", self.old)
+        purge_expired(tables=["webhook_events"])
+        self.assertFalse(WebhookEvent.objects.exists())
+
+        mock_get.return_value.json.return_value = {
+            "status": "approved",
+            "external_reference": str(self.appointment.pk),
+            "transaction_amount": float(self.appointment.service.price),
+        }
+        self.assertEqual(sync_payment(self.hairdresser, "mp-replay"), "OK")
+
+        mock_post.assert_not_called()
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.status, "CANCELLED")
+        self.assertTrue(WebhookEvent.objects.get(payment_id="mp-replay").processed)
+
+
+class AppointmentArchiveTestCase(TestCase):
+    def setUp(self):
+        from core.demo_data import generate_bulk_dataset
+        from core.models import PaymentTransaction, PendingRefund, Review
+
+        dataset = generate_bulk_dataset(1, 1, 0, seed=1, prefix="archive")
+        self.hairdresser = dataset["hairdresser"]
+        self.owner = dataset["owner"]
+        self.customer = dataset["client"]
+        service = dataset["service"]
+        self.old = (timezone.localtime() - timedelta(days=400)).replace(hour=10, minute=0, second=0, microsecond=0)
+
+        self.done = Appointment.objects.create(
+            service=service, client=self.customer, start_time=self.old, status="COMPLETED", payment_method="FULL"
+        )
+        Review.objects.create(appointment=self.done, rating=4, comment="Muy bien")
+        PaymentTransaction.objects.create(
+            appointment=self.done, payment_id="mp-archive-1", amount=self.done.amount, status="approved"
+        )
+        self.no_show = Appointment.objects.create(
+            service=service, client_name="Ana Pérez", start_time=self.old + timedelta(hours=2), status="NO_SHOW"
+        )
+        self.refunding = Appointment.objects.create(
+            service=service, client=self.customer, start_time=self.old + timedelta(hours=4), status="CANCELLED"
+        )
+        PendingRefund.objects.create(appointment=self.refunding, payment_id="mp-archive-2", amount=Decimal("100"))
+        self.recent = Appointment.objects.create(
+            service=service,
+            client=self.customer,
+            start_time=timezone.now() - timedelta(days=10),
+            status="COMPLETED",
+        )
+        Review.objects.create(appointment=self.recent, rating=2)
+
+    def _history(self):
+        """Lo que muestran las estadísticas, exportaciones, listados y reseñas."""
+        month = {"month": self.old.strftime("%Y-%m")}
+        self.client.force_login(self.owner)
+        stats = self.client.get(reverse("owner_stats"), month).context
+        export = b"".join(self.client.get(reverse("export_appointments")).streaming_content)
+        transactions = b"".join(self.client.get(reverse("export_transactions")).streaming_content)
+        owner_list = self.client.get(reverse("owner_appointments"), {"status": "NO_SHOW"}).context
+        self.client.force_login(self.customer)
+        my_list = self.client.get(reverse("my_appointments")).context
+        reviews = self.client.get(reverse("hairdresser_reviews", args=[self.hairdresser.pk])).json()
+        return {
+            "stats": [stats[key] for key in ("monthly_revenue", "monthly_appointments", "no_show_rate")],
+            "top_clients": list(stats["top_clients"]),
+            "export": export,
+            "transactions": transactions,
+            "owner_list": [app.pk for app in owner_list["appointments"]],
+            "status_choices": owner_list["status_choices"],
+            "my_list": [app.pk for app in my_list["appointments"]],
+            "reviews": [(review["id"], review["rating"]) for review in reviews["results"]],
+        }
+
+    def test_archive_copies_exactly_what_it_deletes(self):
+        from core import archive
+        from core.models import ArchivedAppointment
+
+        scope = archive.hairdresser_scope
+        all_ids = set(Appointment.objects.values_list("pk", flat=True))
+
+        def change_mid_batch(hairdresser_id):
+            # Otra escritura cambia un turno del lote después de elegirlo
+            Appointment.objects.filter(pk=self.no_show.pk).update(status="CONFIRMED")
+            return scope(hairdresser_id)
+
+        with patch("core.archive.hairdresser_scope", side_effect=change_mid_batch):
+            archived = archive.archive_appointments()
+
+        archived_ids = set(ArchivedAppointment.objects.values_list("pk", flat=True))
+        self.assertEqual(len(archived_ids), archived)
+        self.assertEqual(set(Appointment.objects.values_list("pk", flat=True)) | archived_ids, all_ids)
+
+    def test_archive_moves_old_finished_appointments_and_keeps_history(self):
+        from core.archive import archive_appointments
+        from core.models import (
+            ArchivedAppointment,
+            ArchivedPaymentTransaction,
+            ArchivedReview,
+            PaymentTransaction,
+            Review,
+        )
+
+        before = self._history()
+        self.client.force_login(self.owner)
+        earnings = self.client.get(reverse("earnings_chart_data")).json()
+
+        self.assertEqual(archive_appointments(batch_size=1), 2)
+
+        self.assertEqual(
+            set(Appointment.objects.values_list("pk", flat=True)), {self.refunding.pk, self.recent.pk}
+        )
+        self.assertEqual(
+            set(ArchivedAppointment.objects.values_list("pk", flat=True)), {self.done.pk, self.no_show.pk}
+        )
+        archived_review = ArchivedReview.objects.get()
+        self.assertEqual((archived_review.appointment_id, archived_review.rating), (self.done.pk, 4))
+        self.assertEqual(ArchivedPaymentTransaction.objects.get().payment_id, "mp-archive-1")
+        self.assertEqual(list(Review.objects.all()), [self.recent.review])
+        self.assertFalse(PaymentTransaction.objects.exists())
+
+        # Estadísticas, exportaciones, listados y reseñas no cambian
+        self.assertEqual(self._history(), before)
+        self.client.force_login(self.owner)
+        self.assertEqual(self.client.get(reverse("earnings_chart_data")).json(), earnings)
+        self.hairdresser.refresh_rating_summary()
+        self.assertEqual((self.hairdresser.rating_count, self.hairdresser.rating_sum), (2, 6))
+
+        # El historial del cliente muestra el turno archivado sin acciones
+        self.client.force_login(self.customer)
+        response = self.client.get(reverse("my_appointments"))
+        self.assertContains(response, f'data-appointment-id="{self.done.pk}"')
+        self.assertNotContains(response, f'data-review-pk="{archived_review.pk}"')
+
+        # Los cambios de datos del cliente llegan también a los turnos archivados
+        self.customer.first_name = "Renombrado"
+        self.customer.save()
+        self.assertIn("renombrado", ArchivedAppointment.objects.get(pk=self.done.pk).search_text)
+
+    def test_keyset_pages_interleave_active_and_archived(self):
+        from core.archive import archive_appointments
+        from core.models import ArchivedAppointment
+        from core.pagination import keyset_paginate_many
+
+        expected = list(
+            Appointment.objects.order_by("-start_time", "-id").values_list("pk", flat=True)
+        )
+        archive_appointments()
+        querysets = [Appointment.objects.all(), ArchivedAppointment.objects.all()]
+        seen = []
+        cursor = None
+        while True:
+            items, cursor = keyset_paginate_many(querysets, ("-start_time", "-id"), cursor, page_size=1)
+            seen += [item.pk for item in items]
+            if not cursor:
+                break
+        self.assertEqual(seen, expected)
+
+    def test_every_appointment_relation_is_archived_or_kept(self):
+        from core.archive import ARCHIVED_RELATED, DELETED_RELATED
+        from core.models import PendingRefund
 
+        related = {relation.related_model for relation in Appointment._meta.related_objects}
+        # Los turnos con PendingRefund no se archivan
+        self.assertEqual(related, set(ARCHIVED_RELATED + DELETED_RELATED) | {PendingRefund})
+
+    def test_command_dry_run_and_disabled_archive(self):
+        import io
+
+        from django.core.management import call_command
+
+        out = io.StringIO()
+        call_command("archive_appointments", dry_run=True, stdout=out)
+        self.assertIn("Se archivarían 2 turnos", out.getvalue())
+        self.assertEqual(Appointment.objects.count(), 4)
+
+        with override_settings(APPOINTMENT_ARCHIVE_AFTER_DAYS=0):
+            out = io.StringIO()
+            call_command("archive_appointments", stdout=out)
+            self.assertIn("desactivado", out.getvalue())
+        self.assertEqual(Appointment.objects.count(), 4)
+
+        call_command("archive_appointments", stdout=io.StringIO())
+        self.assertEqual(Appointment.objects.count(), 2)
+
+
+class AgendaSequenceConcurrencyTestCase(TransactionTestCase):
+    def test_concurrent_changes_get_unique_consecutive_sequence(self):
+        import threading
+
+        from django.db import OperationalError, connection
+
+        from core.agenda import record_agenda_change
+        from core.demo_data import generate_bulk_dataset
+        from core.models import AgendaChange
+
+        hairdresser = generate_bulk_dataset(1, 1, 0, seed=1, prefix="seq")["hairdresser"]
+        barrier = threading.Barrier(4)
+        errors = []
+
+        def record(object_id):
+            # La base de tests (SQLite en memoria) no espera los bloqueos de
+            # otras conexiones: falla enseguida y la transacción se reintenta
+            while True:
+                try:
+                    return record_agenda_change(hairdresser.pk, "appointment", object_id)
+                except OperationalError as e:
+                    if "locked" not in str(e):
+                        raise
+
+        def worker(offset):
+            try:
+                barrier.wait()
+                for index in range(10):
+                    record(offset + index)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(offset * 100,)) for offset in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        seqs = sorted(
+            AgendaChange.objects.filter(hairdresser=hairdresser).values_list("seq", flat=True)
+        )
+        self.assertEqual(seqs, list(range(seqs[0], seqs[0] + 40)))
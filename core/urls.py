@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from django.contrib.auth.views import LogoutView
 from django.views.generic import RedirectView
@@ -15,18 +16,25 @@ from .views import (
     ReviewUpdateView,
     ReviewDeleteView,
     get_review_detail,
+    hairdresser_reviews_data,
     appointment_events_data,
     hairdresser_map_data,
+    hairdresser_cards_data,
     OwnerStatsView,
     earnings_chart_data,
     revenue_by_service_chart_data,
     busiest_days_chart_data,
+    export_appointments,
+    export_transactions,
     WorkstationView,
+    workstation_events,
+    workstation_changes,
     RegisterWalkInView,
     AddPauseView,
     delete_pause,
     update_appointment_status,
     cancel_appointment_client,
+    appointment_payment_status,
     adjust_appointment_time,
     accept_early_start,
     MyHairdresserInfoView,
@@ -49,11 +57,27 @@ from .views import (
     cancel_expired_appointments_view,
     email_preview_list,
     email_preview_render,
+    query_stats_view,
+    metrics_view,
     retry_refunds_cron_view,
+    reconcile_payments_cron_view,
     refresh_mercadopago_tokens_cron_view,
 )
 from .webhooks import mercadopago_webhook
 
+hairdresser_detail = HairdresserDetailView.as_view()
+
+if settings.ASYNC_VIEWS:
+    # Servidor ASGI: versiones async de las vistas que esperan a APIs externas
+    # o a cambios de la agenda
+    from .async_views import (
+        geocode_address_api,
+        hairdresser_detail,
+        mercadopago_callback,
+        workstation_changes,
+        workstation_events,
+    )
+
 urlpatterns = [
     # URLs de Autenticación y Home
     path("", HomeView.as_view(), name="home"),
@@ -63,6 +87,8 @@ urlpatterns = [
     # URLs del CRUD de Servicios
     path("stats/", OwnerStatsView.as_view(), name="owner_stats"),
     path("workstation/", WorkstationView.as_view(), name="workstation"),
+    path("workstation/events/", workstation_events, name="workstation_events"),
+    path("workstation/changes/", workstation_changes, name="workstation_changes"),
     path(
         "workstation/register-walk-in/",
         RegisterWalkInView.as_view(),
@@ -98,6 +124,16 @@ urlpatterns = [
         OwnerAppointmentListView.as_view(),
         name="owner_appointments",
     ),
+    path(
+        "my-hairdresser/appointments/export/",
+        export_appointments,
+        name="export_appointments",
+    ),
+    path(
+        "my-hairdresser/transactions/export/",
+        export_transactions,
+        name="export_transactions",
+    ),
     path(
         "my-hairdresser/",
         RedirectView.as_view(pattern_name="my_hairdresser_info", permanent=False),
@@ -144,10 +180,15 @@ urlpatterns = [
     ),
     path(
         "hairdresser/<int:pk>/",
-        HairdresserDetailView.as_view(),
+        hairdresser_detail,
         name="hairdresser_detail",
     ),
     path("my-appointments/", AppointmentListView.as_view(), name="my_appointments"),
+    path(
+        "api/appointments/<int:pk>/payment-status/",
+        appointment_payment_status,
+        name="appointment_payment_status",
+    ),
     path(
         "my-appointments/<int:pk>/cancel/",
         cancel_appointment_client,
@@ -167,6 +208,7 @@ urlpatterns = [
     ),
     # URLs de la API
     path("api/map-data/", hairdresser_map_data, name="map_data"),
+    path("api/hairdressers/", hairdresser_cards_data, name="hairdresser_cards"),
     path("api/geocode/", geocode_address_api, name="geocode_address_api"),
     path("api/earnings-chart/", earnings_chart_data, name="earnings_chart_data"),
     path(
@@ -185,6 +227,11 @@ urlpatterns = [
         name="appointment_events",
     ),
     path("api/services/<int:pk>/", get_service_detail, name="service_detail"),
+    path(
+        "api/hairdresser/<int:pk>/reviews/",
+        hairdresser_reviews_data,
+        name="hairdresser_reviews",
+    ),
     path("tasks/send-reminders/", send_reminders_view, name="send_reminders"),
     path(
         "tasks/cancel-expired/",
@@ -201,6 +248,11 @@ urlpatterns = [
         refresh_mercadopago_tokens_cron_view,
         name="refresh_mercadopago_tokens_cron_endpoint",
     ),
+    path(
+        "tasks/reconcile-payments/",
+        reconcile_payments_cron_view,
+        name="reconcile_payments_cron_endpoint",
+    ),
     path("api/push-subscribe/", push_subscribe, name="push_subscribe"),
     path("api/push-unsubscribe/", push_unsubscribe, name="push_unsubscribe"),
     path("service-worker.js", service_worker, name="service_worker"),
@@ -223,4 +275,6 @@ urlpatterns = [
         email_preview_render,
         name="email_preview_render",
     ),
+    path("debug/queries/", query_stats_view, name="query_stats"),
+    path("metrics", metrics_view, name="metrics"),
 ]
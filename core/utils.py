@@ -1,9 +1,24 @@
 import logging
 import requests
 
+from .metrics import track_outbound
+
 logger = logging.getLogger(__name__)
 mp_logger = logging.getLogger('mp')
 
+# Tiempo que se recuerda la ubicación obtenida para cada IP
+IP_LOCATION_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def user_is_developer(request):
+    """Acceso a herramientas de diagnóstico: DEBUG=True o usuario staff/superuser."""
+    from django.conf import settings
+
+    user = request.user
+    return settings.DEBUG or (
+        user.is_authenticated and (user.is_staff or user.is_superuser)
+    )
+
 
 def get_ip(request):
     """Obtiene la IP real del usuario, incluso si está detrás de un proxy."""
@@ -26,18 +41,30 @@ def get_location_from_ip(request):
     if ip == "127.0.0.1" or ip == "localhost":
         return default_coords
 
+    # La ubicación de una IP casi no cambia: se evita llamar a la API externa
+    # (hasta 3 s) en cada visita al home.
+    from django.core.cache import cache
+
+    cache_key = f"stilo:ipinfo:{ip}"
+    cached_coords = cache.get(cache_key)
+    if cached_coords is not None:
+        return cached_coords
+
     try:
         # Hacemos la llamada a la API
-        response = requests.get(f"https://ipinfo.io/{ip}/json", timeout=3)
+        with track_outbound("ipinfo") as call:
+            response = call.response = requests.get(f"https://ipinfo.io/{ip}/json", timeout=3)
         response.raise_for_status()  # Lanza un error si la respuesta es 4xx o 5xx
         data = response.json()
 
         # Parseamos las coordenadas
         if "loc" in data:
             lat, lon = data["loc"].split(",")
-            return {"lat": float(lat), "lon": float(lon)}
+            coords = {"lat": float(lat), "lon": float(lon)}
         else:
-            return default_coords
+            coords = default_coords
+        cache.set(cache_key, coords, IP_LOCATION_CACHE_TIMEOUT)
+        return coords
 
     except (requests.RequestException, ValueError, KeyError) as e:
         # Si la API falla, el JSON es inválido o no tiene 'loc', usamos el fallback
@@ -45,6 +72,24 @@ def get_location_from_ip(request):
         return default_coords
 
 
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+NOMINATIM_HEADERS = {
+    "User-Agent": "Stilo Hairdresser App (UNSa Desarrollo Web; contacto@stilo.com)"
+}
+
+
+def _parse_geocode_response(response):
+    response.raise_for_status()
+    results = response.json()
+
+    if results and isinstance(results, list) and len(results) > 0:
+        return {
+            "latitude": float(results[0]["lat"]),
+            "longitude": float(results[0]["lon"]),
+        }
+    return None
+
+
 def geocode_address(address):
     """
     Geocodifica una dirección usando la API de Nominatim (OpenStreetMap).
@@ -53,23 +98,34 @@ def geocode_address(address):
     if not address or not isinstance(address, str) or not address.strip():
         return None
 
-    url = "https://nominatim.openstreetmap.org/search"
     params = {"q": address.strip(), "format": "json", "limit": 1}
-    headers = {
-        "User-Agent": "Stilo Hairdresser App (UNSa Desarrollo Web; contacto@stilo.com)"
-    }
 
     try:
-        response = requests.get(url, params=params, headers=headers, timeout=5)
-        response.raise_for_status()
-        results = response.json()
+        with track_outbound("nominatim") as call:
+            response = call.response = requests.get(
+                NOMINATIM_URL, params=params, headers=NOMINATIM_HEADERS, timeout=5
+            )
+        return _parse_geocode_response(response)
+    except Exception as e:
+        logger.error(f"Error in geocode_address: {e}")
+        return None
+
+
+async def ageocode_address(address):
+    """Versión async de geocode_address (para vistas ASGI)."""
+    from . import async_http
 
-        if results and isinstance(results, list) and len(results) > 0:
-            return {
-                "latitude": float(results[0]["lat"]),
-                "longitude": float(results[0]["lon"]),
-            }
+    if not address or not isinstance(address, str) or not address.strip():
         return None
+
+    params = {"q": address.strip(), "format": "json", "limit": 1}
+
+    try:
+        with track_outbound("nominatim") as call:
+            response = call.response = await async_http.get(
+                NOMINATIM_URL, params=params, headers=NOMINATIM_HEADERS, timeout=5
+            )
+        return _parse_geocode_response(response)
     except Exception as e:
         logger.error(f"Error in geocode_address: {e}")
         return None
@@ -129,19 +185,20 @@ def send_push_to_subscription(subscription, title, message):
         return
 
     try:
-        webpush(
-            subscription_info=subscription_info,
-            data=json.dumps(
-                {
-                    "title": title,
-                    "body": message,
-                }
-            ),
-            vapid_private_key=vapid_private_key,
-            vapid_claims={
-                "sub": "mailto:contacto@stilo.com",
-            },
-        )
+        with track_outbound("webpush"):
+            webpush(
+                subscription_info=subscription_info,
+                data=json.dumps(
+                    {
+                        "title": title,
+                        "body": message,
+                    }
+                ),
+                vapid_private_key=vapid_private_key,
+                vapid_claims={
+                    "sub": "mailto:contacto@stilo.com",
+                },
+            )
     except WebPushException as ex:
         # Si la suscripción ha expirado o es inválida, la removemos de la base de datos (404 Not Found o 410 Gone)
         if ex.response is not None and ex.response.status_code in [404, 410]:
@@ -358,7 +415,8 @@ def get_mercadopago_payment_id_from_api(hairdresser, appointment_id):
             "limit": 1,
         }
 
-        response = requests.get(search_url, headers=headers, params=params, timeout=10)
+        with track_outbound("mercadopago") as call:
+            response = call.response = requests.get(search_url, headers=headers, params=params, timeout=10)
         response.raise_for_status()
 
         data = response.json()
@@ -459,7 +517,8 @@ def process_mercadopago_refund(hairdresser, payment_id, amount=None):
     mp_logger.info(f"[REFUND] X-Idempotency-Key: {idempotency_key}")
 
     try:
-        response = requests.post(refund_url, headers=headers, json=payload, timeout=10)
+        with track_outbound("mercadopago") as call:
+            response = call.response = requests.post(refund_url, headers=headers, json=payload, timeout=10)
 
         mp_logger.info(f"[REFUND] Response status: {response.status_code}")
         mp_logger.info(f"[REFUND] Response body: {response.text}")
@@ -527,7 +586,8 @@ def refresh_mercadopago_token(hairdresser):
 
     mp_logger.info(f"[OAUTH] Renovando token de MercadoPago para peluquería ID: {hairdresser.pk}")
     
-    response = requests.post(token_url, data=payload, headers=headers, timeout=10)
+    with track_outbound("mercadopago") as call:
+        response = call.response = requests.post(token_url, data=payload, headers=headers, timeout=10)
     response.raise_for_status()
     data = response.json()
 
@@ -545,66 +605,86 @@ def refresh_mercadopago_token(hairdresser):
     return data
 
 
+def normalize_search_text(*parts):
+    """
+    Texto de búsqueda: partes no vacías en minúsculas, sin tildes y con los
+    espacios colapsados ("María  Pérez" -> "maria perez").
+    """
+    import unicodedata
+
+    text = " ".join(part for part in parts if part)
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(text.lower().split())
+
+
 def _cascade_shift_appointments(hairdresser, cursor, after_time, today):
     """
     Desplaza en cascada los turnos del día que se solapen con el cursor.
     Solo mueve los turnos necesarios, absorbiendo huecos libres.
     Retorna (shifted_count, affected_to_notify).
     """
-    from datetime import timedelta
+    from django.db import transaction
     from django.utils import timezone
+    from core.day_agenda import FINISHED_STATUSES, day_agenda
     from core.models import Appointment
 
-    subsequent = Appointment.objects.filter(
-        service__hairdresser=hairdresser,
-        start_time__date=today,
-        start_time__gt=after_time,
-    ).exclude(status__in=["COMPLETED", "NO_SHOW", "CANCELLED"]).order_by("start_time")
+    # La agenda del día en caché solo elige los turnos: sus instancias pueden
+    # estar desactualizadas y save() pisaría cambios posteriores, así que se
+    # releen bloqueadas antes de moverlas
+    ids = [app.pk for app in day_agenda(hairdresser.pk, today).active_after(after_time)]
 
     shifted_count = 0
     affected_to_notify = []
     now = timezone.now()
 
-    for app in subsequent:
-        if cursor <= app.start_time:
-            break  # Hay hueco libre suficiente, se corta la cascada
-
-        # Desplazar start_time al cursor actual
-        app.start_time = cursor
-        app.save()  # Esto recalcula y guarda end_time automáticamente
-        cursor = app.end_time
-        shifted_count += 1
-
-        # Lógica de notificaciones "escalonadas" para evitar spam:
-        remaining_minutes = (app.start_time - now).total_seconds() / 60
-
-        should_notify = False
-        if not app.last_notified_start_time:
-            # Si nunca fue notificado, notificar si falta menos de 2 horas (120m)
-            if remaining_minutes <= 120:
-                should_notify = True
-        else:
-            last_remaining = (app.last_notified_start_time - now).total_seconds() / 60
+    with transaction.atomic():
+        subsequent = (
+            Appointment.objects.select_for_update()
+            .filter(pk__in=ids, start_time__gt=after_time)
+            .exclude(status__in=FINISHED_STATUSES)
+            .order_by("start_time")
+        )
+        for app in subsequent:
+            if cursor <= app.start_time:
+                break  # Hay hueco libre suficiente, se corta la cascada
+
+            # Desplazar start_time al cursor actual
+            app.start_time = cursor
+            app.save()  # Esto recalcula y guarda end_time automáticamente
+            cursor = app.end_time
+            shifted_count += 1
+
+            # Lógica de notificaciones "escalonadas" para evitar spam:
+            remaining_minutes = (app.start_time - now).total_seconds() / 60
+
+            should_notify = False
+            if not app.last_notified_start_time:
+                # Si nunca fue notificado, notificar si falta menos de 2 horas (120m)
+                if remaining_minutes <= 120:
+                    should_notify = True
+            else:
+                last_remaining = (app.last_notified_start_time - now).total_seconds() / 60
             
-            if remaining_minutes <= 30:
-                # Menos de 30 minutos: cualquier cambio se notifica
-                if app.start_time != app.last_notified_start_time:
+                if remaining_minutes <= 30:
+                    # Menos de 30 minutos: cualquier cambio se notifica
+                    if app.start_time != app.last_notified_start_time:
+                        should_notify = True
+                elif remaining_minutes <= 60 and last_remaining > 60:
+                    # Cruzó el escalón de 1 hora hacia abajo
+                    should_notify = True
+                elif remaining_minutes <= 120 and last_remaining > 120:
+                    # Cruzó el escalón de 2 horas hacia abajo
                     should_notify = True
-            elif remaining_minutes <= 60 and last_remaining > 60:
-                # Cruzó el escalón de 1 hora hacia abajo
-                should_notify = True
-            elif remaining_minutes <= 120 and last_remaining > 120:
-                # Cruzó el escalón de 2 horas hacia abajo
-                should_notify = True
-            elif remaining_minutes > 60 and last_remaining <= 60:
-                # Cruzó el escalón de 1 hora hacia arriba (retrasado)
-                should_notify = True
-            elif remaining_minutes > 120 and last_remaining <= 120:
-                # Cruzó el escalón de 2 horas hacia arriba (retrasado)
-                should_notify = True
-
-        if should_notify:
-            affected_to_notify.append(app)
+                elif remaining_minutes > 60 and last_remaining <= 60:
+                    # Cruzó el escalón de 1 hora hacia arriba (retrasado)
+                    should_notify = True
+                elif remaining_minutes > 120 and last_remaining <= 120:
+                    # Cruzó el escalón de 2 horas hacia arriba (retrasado)
+                    should_notify = True
+
+            if should_notify:
+                affected_to_notify.append(app)
 
     return shifted_count, affected_to_notify
 
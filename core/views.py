@@ -1,8 +1,8 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse_lazy, reverse
-from django.http import HttpResponseRedirect, JsonResponse, Http404
+from django.http import HttpResponseRedirect, JsonResponse, Http404, StreamingHttpResponse
 from django.utils import timezone
-from django.db.models import Sum, Count, Avg, Q
+from django.db.models import Sum, Count, Avg, Min, Max, Q, Exists, OuterRef, Subquery, Value, IntegerField
 from decimal import Decimal
 from django.db.models.functions import TruncMonth
 from django.contrib.auth import login
@@ -22,7 +22,7 @@ from django.views.generic import (
 )
 
 from datetime import datetime, timedelta
-import calendar
+from urllib.parse import urlencode
 import logging
 import requests
 
@@ -46,15 +46,27 @@ from .forms import (
 )
 from .models import (
     Appointment,
+    ArchivedAppointment,
+    ArchivedReview,
     Hairdresser,
     Service,
     User,
     HairdresserImage,
     Review,
     WorkingHours,
-    PaymentTransaction,
 )
 from .utils import get_location_from_ip, geocode_address
+from .caching import CATALOG_SCOPE, conditional_on_stamps, hairdresser_scope
+from .agenda import (
+    event_stream,
+    latest_sequence,
+    requested_sequence,
+    wait_for_changes,
+)
+from .dates import month_from_param
+from .day_agenda import day_agenda
+from .slots import SlotUnavailable
+from .metrics import track_outbound
 
 # Create your views here.
 
@@ -188,62 +200,148 @@ class ServiceDeleteView(OwnerRequiredMixin, DeleteView):
         return redirect("my_hairdresser_services")
 
 
-class HomeView(ListView):
-    model = Hairdresser
-    template_name = "home.html"
-    context_object_name = "hairdressers"
+# Palabras clave (en nombres de servicios) para cada filtro del buscador
+SERVICE_FILTER_KEYWORDS = {
+    "corte": ["corte"],
+    "color": ["color", "tinte", "mechas"],
+    "barberia": ["barba", "barber"],
+    "peinado": ["peinado", "secado"],
+    "tratamientos": ["tratamiento", "keratina"],
+}
 
-    def get_queryset(self):
-        # Prefetch related objects for efficiency when calling is_complete() and images.exists()
-        queryset = (
-            super()
-            .get_queryset()
-            .prefetch_related("working_hours", "services", "images")
+HOME_PAGE_SIZE = 12
+HOME_FEATURED_LIMIT = 5
+
+
+def _filter_hairdressers(queryset, q, service):
+    """Aplica los filtros del buscador del home (texto y tipo de servicio)."""
+    if q:
+        queryset = queryset.filter(
+            Q(name__icontains=q) |
+            Q(address__icontains=q) |
+            Q(description__icontains=q)
         )
-        
-        q = self.request.GET.get("q", "").strip()
-        service = self.request.GET.get("service", "").strip()
-        
-        if q:
-            queryset = queryset.filter(
-                Q(name__icontains=q) |
-                Q(address__icontains=q) |
-                Q(description__icontains=q)
+
+    keywords = SERVICE_FILTER_KEYWORDS.get(service)
+    if keywords:
+        # Exists evita el JOIN + DISTINCT sobre servicios
+        service_match = Q()
+        for keyword in keywords:
+            service_match |= Q(name__icontains=keyword)
+        queryset = queryset.filter(
+            Exists(
+                Service.objects.filter(service_match, hairdresser=OuterRef("pk"))
             )
-            
-        if service:
-            if service == "corte":
-                queryset = queryset.filter(services__name__icontains="corte")
-            elif service == "color":
-                queryset = queryset.filter(
-                    Q(services__name__icontains="color") |
-                    Q(services__name__icontains="tinte") |
-                    Q(services__name__icontains="mechas")
-                )
-            elif service == "barberia":
-                queryset = queryset.filter(
-                    Q(services__name__icontains="barba") |
-                    Q(services__name__icontains="barber")
-                )
-            elif service == "peinado":
-                queryset = queryset.filter(
-                    Q(services__name__icontains="peinado") |
-                    Q(services__name__icontains="secado")
-                )
-            elif service == "tratamientos":
-                queryset = queryset.filter(
-                    Q(services__name__icontains="tratamiento") |
-                    Q(services__name__icontains="keratina")
-                )
-                
-        return queryset.distinct()
+        )
+    return queryset
+
+
+def _hairdresser_cards_queryset(q="", service=""):
+    """
+    Proyección liviana de las peluquerías completas para las tarjetas del
+    home: solo las columnas que se muestran, sin instanciar modelos.
+    """
+    images = HairdresserImage.objects.filter(hairdresser=OuterRef("pk"))
+    queryset = _filter_hairdressers(Hairdresser.objects.complete(), q, service)
+    first_image = images.order_by("pk")[:1]
+    return queryset.annotate(
+        has_images=Exists(images),
+        first_image_id=Subquery(first_image.values("pk")),
+        first_image=Subquery(first_image.values("image")),
+    ).values(
+        "id",
+        "name",
+        "address",
+        "description",
+        "cover_image_id",
+        "cover_image__image",
+        "first_image_id",
+        "first_image",
+        "has_images",
+        "rating_count",
+        "rating_sum",
+    )
+
+
+def _build_hairdresser_cards(rows):
+    """
+    Convierte las filas de la proyección en tarjetas, con los srcset de la
+    imagen principal obtenidos en una única consulta adicional.
+    """
+    from .images import get_responsive_sources
+    from .models import ImageDerivative
+
+    image_storage = HairdresserImage._meta.get_field("image").storage
+    image_ids = [
+        row["cover_image_id"] or row["first_image_id"]
+        for row in rows
+        if row["cover_image_id"] or row["first_image_id"]
+    ]
+    derivatives = {}
+    if image_ids:
+        for derivative in ImageDerivative.objects.filter(image_id__in=image_ids):
+            derivatives.setdefault(derivative.image_id, []).append(derivative)
+
+    cards = []
+    for row in rows:
+        if row["cover_image_id"]:
+            image_id, image_name = row["cover_image_id"], row["cover_image__image"]
+        else:
+            image_id, image_name = row["first_image_id"], row["first_image"]
+        sources = get_responsive_sources(derivatives.get(image_id, []))
+        rating = row["rating_sum"] / row["rating_count"] if row["rating_count"] else 0
+        cards.append(
+            {
+                "id": row["id"],
+                "name": row["name"],
+                "address": row["address"],
+                "description": row["description"],
+                "image_url": (sources and sources["src"])
+                or (image_storage.url(image_name) if image_name else None),
+                "srcset_webp": sources["srcset_webp"] if sources else "",
+                "srcset_jpeg": sources["srcset_jpeg"] if sources else "",
+                "has_images": row["has_images"],
+                "review_count": row["rating_count"],
+                "average_rating": round(rating, 1),
+                "url": reverse("hairdresser_detail", args=[row["id"]]),
+            }
+        )
+    return cards
+
+
+def _get_hairdresser_cards_page(request, stamps=None):
+    from .caching import cached, get_stamps
+    from .pagination import keyset_paginate
+
+    q = request.GET.get("q", "").strip()
+    service = request.GET.get("service", "").strip()
+    cursor = request.GET.get("cursor") or ""
+
+    def build():
+        rows, next_cursor = keyset_paginate(
+            _hairdresser_cards_queryset(q, service),
+            ("id",),
+            cursor=cursor,
+            page_size=HOME_PAGE_SIZE,
+        )
+        return _build_hairdresser_cards(rows), next_cursor
+
+    if stamps is None:
+        stamps = get_stamps(CATALOG_SCOPE)
+    return cached("home_cards", stamps, (q, service, cursor), build)
+
+
+class HomeView(TemplateView):
+    template_name = "home.html"
 
     def get_context_data(self, **kwargs):
+        from .caching import cached, get_stamps
+
         context = super().get_context_data(**kwargs)
-        # self.object_list contains the queryset returned by get_queryset()
-        # Filter for complete hairdressers
-        complete_hairdressers = [h for h in self.get_queryset() if h.is_complete()]
-        context["hairdressers"] = complete_hairdressers
+        stamps = get_stamps(CATALOG_SCOPE)
+        cards, next_cursor = _get_hairdresser_cards_page(self.request, stamps)
+        context["hairdressers"] = cards
+        context["next_cursor"] = next_cursor
 
         q = self.request.GET.get("q", "").strip()
         service = self.request.GET.get("service", "").strip()
@@ -252,10 +350,15 @@ class HomeView(ListView):
         if q or service:
             context["featured_hairdressers"] = []
         else:
-            # Get featured hairdressers from the complete ones that also have images
-            context["featured_hairdressers"] = [
-                h for h in complete_hairdressers if h.images.exists()
-            ][:5]
+            featured = _hairdresser_cards_queryset().filter(has_images=True)
+            context["featured_hairdressers"] = cached(
+                "home_featured",
+                stamps,
+                (),
+                lambda: _build_hairdresser_cards(
+                    list(featured.order_by("id")[:HOME_FEATURED_LIMIT])
+                ),
+            )
 
         fallback_coords = get_location_from_ip(self.request)
         context["fallback_lat"] = fallback_coords["lat"]
@@ -264,36 +367,93 @@ class HomeView(ListView):
         return context
 
 
+def hairdresser_cards_data(request):
+    """
+    Endpoint para el scroll infinito del home: devuelve la siguiente página
+    de tarjetas a partir del cursor recibido.
+    """
+    cards, next_cursor = _get_hairdresser_cards_page(request)
+    return JsonResponse({"results": cards, "next_cursor": next_cursor})
+
+
+REVIEWS_PAGE_SIZE = 10
+
+
+def _get_reviews_page(hairdresser, cursor=None):
+    from .pagination import keyset_paginate_many
+
+    # Reseñas de turnos activos y archivados, intercaladas por fecha
+    reviews = [
+        model.objects.filter(
+            appointment__service__hairdresser=hairdresser
+        ).select_related("appointment__client", "appointment__service")
+        for model in (Review, ArchivedReview)
+    ]
+    return keyset_paginate_many(
+        reviews, ("-created_at", "-id"), cursor=cursor, page_size=REVIEWS_PAGE_SIZE
+    )
+
+
+def _serialize_review(review):
+    from django.template.defaultfilters import date as date_filter
+
+    client = review.appointment.client
+    author = ""
+    if client:
+        author = f"{client.first_name} {client.last_name[:1]}.".strip()
+    return {
+        "id": review.pk,
+        "author": author,
+        "created_at": date_filter(timezone.localtime(review.created_at), "d M, Y"),
+        "rating": review.rating,
+        "comment": review.comment,
+        "service": review.appointment.service.name,
+    }
+
+
 class HairdresserDetailView(DetailView):
     model = Hairdresser
     template_name = "hairdresser_detail.html"
     context_object_name = "hairdresser"
 
-    def get_queryset(self):
-        # Prefetch images y services para eficiencia
-        return (
-            super()
-            .get_queryset()
-            .prefetch_related(
-                "images",
-                "services__appointments__review",
-                "working_hours",
+    def get_context_data(self, **kwargs):
+        from .caching import cached, get_stamps
+
+        context = super().get_context_data(**kwargs)
+        hairdresser = self.object
+        # Todo lo que depende solo de los datos de la peluquería se guarda en
+        # caché bajo su versión; cualquier cambio en ella genera otra clave.
+        context.update(
+            cached(
+                "hairdresser_detail",
+                get_stamps(hairdresser_scope(hairdresser.pk)),
+                (hairdresser.pk,),
+                lambda: self.get_hairdresser_context(hairdresser),
             )
         )
+        # El formulario de reserva solo se incluye para clientes, no para owners.
+        if not (self.request.user.is_authenticated and self.request.user.is_owner):
+            context["form"] = AppointmentForm(hairdresser=hairdresser)
+        return context
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        hairdresser = self.get_object()
-        all_images = list(hairdresser.images.all())  # type: ignore
-        if hairdresser.cover_image and hairdresser.cover_image in all_images:  # type: ignore
-            all_images.remove(hairdresser.cover_image)  # type: ignore
-            all_images.insert(0, hairdresser.cover_image)  # type: ignore
+    def get_hairdresser_context(self, hairdresser):
+        context = {}
+        all_images = list(hairdresser.images.prefetch_related("derivatives"))  # type: ignore
+        # La portada se mueve al principio usando la instancia ya precargada
+        cover_index = next(
+            (i for i, img in enumerate(all_images) if img.pk == hairdresser.cover_image_id),
+            None,
+        )
+        if cover_index:
+            all_images.insert(0, all_images.pop(cover_index))
         context["ordered_images"] = all_images
 
-        working_hours = hairdresser.working_hours.all()  # type: ignore
-        if working_hours.exists():
-            min_time = min(wh.start_time for wh in working_hours)
-            max_time = max(wh.end_time for wh in working_hours)
+        hours_range = hairdresser.working_hours.aggregate(  # type: ignore
+            min_time=Min("start_time"), max_time=Max("end_time")
+        )
+        if hours_range["min_time"] is not None:
+            min_time = hours_range["min_time"]
+            max_time = hours_range["max_time"]
             
             # Start slot 1 hour before min_time, but do not go below 00:00:00
             min_hour = max(0, min_time.hour - 1)
@@ -310,20 +470,64 @@ class HairdresserDetailView(DetailView):
             context["slot_min_time"] = "09:00:00"
             context["slot_max_time"] = "20:00:00"
 
-        context["services"] = hairdresser.services.all()  # type: ignore
-        # El formulario de reserva solo se incluye para clientes, no para owners.
-        if not (self.request.user.is_authenticated and self.request.user.is_owner):
-            context["form"] = AppointmentForm(hairdresser=hairdresser)
-        # Pasamos las reseñas a la plantilla
-        context["reviews"] = (
-            Review.objects.filter(appointment__service__hairdresser=hairdresser)
-            .select_related("appointment__client")
-            .order_by("-created_at")
+        from .archive import merged_totals
+
+        # Usar el related manager mantiene service.hairdresser en caché
+        context["services"] = list(hairdresser.services.all())  # type: ignore
+        # Calificación de cada servicio con las reseñas activas y archivadas
+        ratings = merged_totals(
+            [
+                model.objects.filter(appointment__service__hairdresser=hairdresser)
+                for model in (Review, ArchivedReview)
+            ],
+            ["appointment__service_id"],
+            rating_sum=Sum("rating"),
+            rating_total=Count("id"),
         )
+        for service in context["services"]:
+            totals = ratings.get((service.pk,), {"rating_sum": 0, "rating_total": 0})
+            service.rating_total = totals["rating_total"]
+            service.rating_avg = (
+                totals["rating_sum"] / totals["rating_total"] if totals["rating_total"] else None
+            )
+        # Solo la primera página de reseñas; el resto se pide por cursor
+        reviews, next_cursor = _get_reviews_page(hairdresser)
+        context["reviews"] = reviews
+        context["reviews_next_cursor"] = next_cursor
+        context["rating_histogram"] = [
+            {
+                "stars": stars,
+                "count": count,
+                "percent": round(count * 100 / hairdresser.rating_count)
+                if hairdresser.rating_count
+                else 0,
+            }
+            for stars, count in hairdresser.get_rating_histogram().items()
+        ]
         return context
 
     def post(self, request, *args, **kwargs):
-        from django.db import transaction
+        reservation = self.reserve(request)
+        if isinstance(reservation, JsonResponse):
+            return reservation
+        appointment, payment_amount = reservation
+
+        # requires_payment=True: crear preferencia en MercadoPago
+        try:
+            pref_url, payload, mp_headers = self.preference_request(request, appointment, payment_amount)
+            with track_outbound("mercadopago") as call:
+                mp_response = call.response = requests.post(pref_url, json=payload, headers=mp_headers, timeout=10)
+            return self.preference_response(appointment, mp_response)
+        except Exception as e:
+            return self.preference_failed(appointment, e)
+
+    def reserve(self, request):
+        """
+        Valida y guarda el turno PENDING. Retorna la JsonResponse final si no
+        hace falta pago online (o si hubo un error), o (turno, monto a cobrar)
+        para continuar con la preferencia de MercadoPago.
+        """
+        from django.db import IntegrityError, transaction
 
         if not request.user.is_authenticated or request.user.is_owner:
             return JsonResponse(
@@ -331,360 +535,345 @@ class HairdresserDetailView(DetailView):
                 status=403,
             )
 
+        # Un doble clic o un reintento de red repite la clave: se responde con
+        # el turno ya creado en lugar de reservar (y cobrar) de nuevo.
+        idempotency_key = (
+            request.headers.get("Idempotency-Key") or request.POST.get("idempotency_key") or ""
+        ).strip() or None
+        if idempotency_key:
+            if len(idempotency_key) > 64:
+                return JsonResponse(
+                    {"success": False, "error": "Clave de idempotencia inválida."}, status=400
+                )
+            previous = Appointment.objects.filter(
+                client=request.user, idempotency_key=idempotency_key
+            ).first()
+            if previous:
+                return self.replay_booking(previous)
+
         hairdresser = self.get_object()
         form = AppointmentForm(request.POST, hairdresser=hairdresser)
 
-        if form.is_valid():
-            # Determinamos si se requiere pago antes de guardar,
-            # para poder establecer expires_at y evitar notificaciones prematuras.
-            service = form.cleaned_data["service"]
-            payment_method = form.cleaned_data["payment_method"]
-
-            # Calculamos si requiere pago digital usando una instancia temporal
-            temp_app = Appointment(service=service, payment_method=payment_method, amount=service.price)
-            requires_payment = False
-            payment_amount = Decimal('0.00')
+        if not form.is_valid():
+            # Devolver el primer error encontrado para mostrarlo en el modal
+            error_message = "Por favor, corrige los errores."
+            if "__all__" in form.errors:
+                error_message = form.errors["__all__"][0]
+            else:
+                for field in form.errors:
+                    error_message = form.errors[field][0]
+                    break
+            return JsonResponse({"success": False, "error": error_message}, status=400)
 
-            if payment_method == 'FULL':
+        # Determinamos si se requiere pago antes de guardar,
+        # para poder establecer expires_at y evitar notificaciones prematuras.
+        service = form.cleaned_data["service"]
+        payment_method = form.cleaned_data["payment_method"]
+
+        # Calculamos si requiere pago digital usando una instancia temporal
+        temp_app = Appointment(service=service, payment_method=payment_method, amount=service.price)
+        requires_payment = False
+        payment_amount = Decimal('0.00')
+
+        if payment_method == 'FULL':
+            requires_payment = True
+            payment_amount = service.price
+        else:  # CASH
+            deposit_amount = temp_app.get_required_deposit_amount()
+            if deposit_amount > 0:
                 requires_payment = True
-                payment_amount = service.price
-            else:  # CASH
-                deposit_amount = temp_app.get_required_deposit_amount()
-                if deposit_amount > 0:
-                    requires_payment = True
-                    payment_amount = deposit_amount
+                payment_amount = deposit_amount
 
-            try:
-                with transaction.atomic():
-                    appointment = form.save(commit=False)
-                    appointment.client = request.user
-                    appointment.status = 'PENDING'
-
-                    if requires_payment:
-                        # El turno expira en 10 minutos si no se completa el pago
-                        appointment.expires_at = timezone.now() + timedelta(minutes=10)
-
-                    appointment.save()
-
-                    if not requires_payment:
-                        # No requiere pago inmediato: el turno queda PENDING
-                        # esperando que el dueño lo confirme manualmente.
-                        # Las notificaciones de "solicitud recibida" se envían
-                        # automáticamente desde Appointment.save().
-                        messages.success(self.request, "Tu solicitud de turno fue enviada. Recibirás una notificación cuando el local la confirme.")
-                        return JsonResponse(
-                            {"success": True, "redirect_url": reverse("my_appointments")}
-                        )
-            except Exception as e:
+        try:
+            with transaction.atomic():
+                appointment = form.save(commit=False)
+                appointment.client = request.user
+                appointment.status = 'PENDING'
+                appointment.idempotency_key = idempotency_key
+
+                if requires_payment:
+                    # El turno expira en 10 minutos si no se completa el pago
+                    appointment.expires_at = timezone.now() + timedelta(minutes=10)
+
+                appointment.save()
+
+                if not requires_payment:
+                    # No requiere pago inmediato: el turno queda PENDING
+                    # esperando que el dueño lo confirme manualmente.
+                    # Las notificaciones de "solicitud recibida" se envían
+                    # automáticamente desde Appointment.save().
+                    messages.success(self.request, "Tu solicitud de turno fue enviada. Recibirás una notificación cuando el local la confirme.")
+                    return JsonResponse(
+                        {"success": True, "redirect_url": reverse("my_appointments")}
+                    )
+        except SlotUnavailable as e:
+            # Otra reserva tomó el horario entre la validación y el guardado
+            return JsonResponse({"success": False, "error": str(e)}, status=400)
+        except IntegrityError as e:
+            # Un envío simultáneo con la misma clave llegó primero
+            previous = idempotency_key and Appointment.objects.filter(
+                client=request.user, idempotency_key=idempotency_key
+            ).first()
+            if previous:
+                return self.replay_booking(previous)
+            logger.error(f"Error guardando el turno: {str(e)}")
+            return JsonResponse(
+                {"success": False, "error": "Error al crear la reserva. Intente nuevamente."},
+                status=500
+            )
+        except Exception as e:
 
-                logger.error(f"Error guardando el turno: {str(e)}")
-                return JsonResponse(
-                    {"success": False, "error": "Error al crear la reserva. Intente nuevamente."},
-                    status=500
-                )
+            logger.error(f"Error guardando el turno: {str(e)}")
+            return JsonResponse(
+                {"success": False, "error": "Error al crear la reserva. Intente nuevamente."},
+                status=500
+            )
 
-            # requires_payment=True: crear preferencia en MercadoPago
-            try:
-                import requests as http_requests
-
-                from django.conf import settings as app_settings
-                # En sandbox, usamos el token de prueba del panel (no-marketplace)
-                # porque el token OAuth genera preferencias en modo marketplace,
-                # que falla en sandbox con "algo anduvo mal".
-                if app_settings.MERCADOPAGO_SANDBOX and app_settings.MERCADOPAGO_TEST_ACCESS_TOKEN:
-                    access_token = app_settings.MERCADOPAGO_TEST_ACCESS_TOKEN
-                else:
-                    access_token = hairdresser.mercadopago_access_token
-                if not access_token:
-                    raise ValueError("La peluquería no tiene un token de MercadoPago configurado.")
-
-                pref_url = "https://api.mercadopago.com/checkout/preferences"
-                mp_headers = {
-                    "Authorization": f"Bearer {access_token}",
-                    "Content-Type": "application/json"
-                }
+        return appointment, payment_amount
 
-                back_url = request.build_absolute_uri(reverse("my_appointments"))
-                notification_url = request.build_absolute_uri(
-                    reverse("mercadopago_webhook", args=[hairdresser.id])
-                )
+    def replay_booking(self, appointment):
+        """Respuesta para un envío repetido (misma clave de idempotencia)."""
+        if appointment.status == "CONFIRMED" or (
+            appointment.status == "PENDING" and not appointment.expires_at
+        ):
+            return JsonResponse({"success": True, "redirect_url": reverse("my_appointments")})
+        if appointment.checkout_url:
+            return JsonResponse({"success": True, "redirect_url": appointment.checkout_url})
+        if appointment.status == "PENDING" and appointment.expires_at > timezone.now():
+            # La preferencia del primer envío todavía se está creando
+            return JsonResponse(
+                {"success": False, "error": "Tu reserva se está procesando. Espera unos segundos."},
+                status=409,
+            )
+        return JsonResponse(
+            {"success": False, "error": "Esta reserva ya no está vigente. Por favor, vuelve a intentarlo."},
+            status=409,
+        )
 
-                title = f"Turno Stilo - {appointment.service.name}"
-                if appointment.payment_method == 'FULL':
-                    title += " (Pago Completo)"
-                else:
-                    title += " (Seña)"
-
-                payload = {
-                    "items": [
-                        {
-                            "id": str(appointment.service.id),
-                            "title": title,
-                            "description": f"Turno para {appointment.service.name} en {hairdresser.name}",
-                            "quantity": 1,
-                            "currency_id": "ARS",
-                            "unit_price": float(payment_amount)
-                        }
-                    ],
-                    "payer": {
-                        "name": appointment.client.first_name,
-                        "surname": appointment.client.last_name,
-                        "email": appointment.client.email,
-                    },
-                    "back_urls": {
-                        "success": back_url,
-                        "failure": back_url,
-                        "pending": back_url
-                    },
-                    "auto_return": "approved",
-                    "binary_mode": True,
-                    "notification_url": notification_url,
-                    "statement_descriptor": "Stilo",
-                    "external_reference": str(appointment.id)
+    def preference_request(self, request, appointment, payment_amount):
+        """(url, payload, headers) para crear la preferencia de pago del turno."""
+        from django.conf import settings as app_settings
+
+        hairdresser = appointment.service.hairdresser
+        # En sandbox, usamos el token de prueba del panel (no-marketplace)
+        # porque el token OAuth genera preferencias en modo marketplace,
+        # que falla en sandbox con "algo anduvo mal".
+        if app_settings.MERCADOPAGO_SANDBOX and app_settings.MERCADOPAGO_TEST_ACCESS_TOKEN:
+            access_token = app_settings.MERCADOPAGO_TEST_ACCESS_TOKEN
+        else:
+            access_token = hairdresser.mercadopago_access_token
+        if not access_token:
+            raise ValueError("La peluquería no tiene un token de MercadoPago configurado.")
+
+        pref_url = "https://api.mercadopago.com/checkout/preferences"
+        mp_headers = {
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json"
+        }
+
+        back_url = request.build_absolute_uri(reverse("my_appointments"))
+        notification_url = request.build_absolute_uri(
+            reverse("mercadopago_webhook", args=[hairdresser.id])
+        )
+
+        title = f"Turno Stilo - {appointment.service.name}"
+        if appointment.payment_method == 'FULL':
+            title += " (Pago Completo)"
+        else:
+            title += " (Seña)"
+
+        payload = {
+            "items": [
+                {
+                    "id": str(appointment.service.id),
+                    "title": title,
+                    "description": f"Turno para {appointment.service.name} en {hairdresser.name}",
+                    "quantity": 1,
+                    "currency_id": "ARS",
+                    "unit_price": float(payment_amount)
                 }
+            ],
+            "payer": {
+                "name": appointment.client.first_name,
+                "surname": appointment.client.last_name,
+                "email": appointment.client.email,
+            },
+            "back_urls": {
+                "success": back_url,
+                "failure": back_url,
+                "pending": back_url
+            },
+            "auto_return": "approved",
+            "binary_mode": True,
+            "notification_url": notification_url,
+            "statement_descriptor": "Stilo",
+            "external_reference": str(appointment.id)
+        }
+        if appointment.expires_at:
+            # El checkout deja de aceptar pagos cuando se libera el horario
+            payload["expires"] = True
+            payload["expiration_date_to"] = appointment.expires_at.isoformat(timespec="milliseconds")
 
-                # Comisión del marketplace (Application Fee)
-                commission_str = getattr(app_settings, "MERCADOPAGO_COMMISSION_PERCENTAGE", "3.0")
-                try:
-                    commission_percentage = Decimal(str(commission_str))
-                except Exception:
-                    commission_percentage = Decimal("3.0")
+        # Comisión del marketplace (Application Fee)
+        commission_str = getattr(app_settings, "MERCADOPAGO_COMMISSION_PERCENTAGE", "3.0")
+        try:
+            commission_percentage = Decimal(str(commission_str))
+        except Exception:
+            commission_percentage = Decimal("3.0")
+
+        if commission_percentage > 0:
+            # OJO: Solo cobramos comisión si NO estamos usando el token de prueba global.
+            # En sandbox con el token de prueba general daría error "marketplace_fee_not_allowed"
+            # porque no hay un flujo OAuth real (el vendedor y el marketplace son el mismo usuario).
+            is_test_token = app_settings.MERCADOPAGO_SANDBOX and access_token == app_settings.MERCADOPAGO_TEST_ACCESS_TOKEN
+            if not is_test_token:
+                marketplace_fee = (payment_amount * (commission_percentage / Decimal("100.00"))).quantize(Decimal("0.01"))
+                payload["marketplace_fee"] = float(marketplace_fee)
+
+
+        mp_logger.info(f"Creando preferencia MP para turno {appointment.id} por monto {payment_amount}")
+        return pref_url, payload, mp_headers
+
+    def preference_response(self, appointment, mp_response):
+        """
+        Redirección al checkout a partir de la respuesta de MercadoPago. La
+        preferencia queda guardada en el turno para reintentar el pago.
+        """
+        from django.conf import settings as app_settings
+
+        mp_response.raise_for_status()
+        pref_data = mp_response.json()
+
+        redirect_url = pref_data.get("sandbox_init_point") if app_settings.MERCADOPAGO_SANDBOX else pref_data.get("init_point")
+        if not redirect_url:
+            redirect_url = pref_data.get("init_point") or pref_data.get("sandbox_init_point")
+        if not redirect_url:
+            raise ValueError("No se pudo obtener el punto de inicio de MercadoPago (init_point/sandbox_init_point).")
+
+        # update(): sin pasar por save() (notificaciones, celdas de agenda)
+        Appointment.objects.filter(pk=appointment.pk).update(
+            mercadopago_preference_id=str(pref_data.get("id") or ""),
+            mercadopago_init_point=redirect_url,
+        )
+        return JsonResponse(
+            {"success": True, "redirect_url": redirect_url}
+        )
 
-                if commission_percentage > 0:
-                    # OJO: Solo cobramos comisión si NO estamos usando el token de prueba global.
-                    # En sandbox con el token de prueba general daría error "marketplace_fee_not_allowed"
-                    # porque no hay un flujo OAuth real (el vendedor y el marketplace son el mismo usuario).
-                    is_test_token = app_settings.MERCADOPAGO_SANDBOX and access_token == app_settings.MERCADOPAGO_TEST_ACCESS_TOKEN
-                    if not is_test_token:
-                        marketplace_fee = (payment_amount * (commission_percentage / Decimal("100.00"))).quantize(Decimal("0.01"))
-                        payload["marketplace_fee"] = float(marketplace_fee)
+    def preference_failed(self, appointment, error):
+        # En caso de error, cancelamos la creación del turno
+        appointment.delete()
 
+        mp_logger.error(f"Error creando preferencia de MercadoPago: {str(error)}")
+        return JsonResponse(
+            {"success": False, "error": f"Error al iniciar el pago con MercadoPago: {str(error)}"},
+            status=500
+        )
 
-                mp_logger.info(f"Creando preferencia MP para turno {appointment.id} por monto {payment_amount}")
 
-                mp_response = http_requests.post(pref_url, json=payload, headers=mp_headers, timeout=10)
-                mp_response.raise_for_status()
-                pref_data = mp_response.json()
+class KeysetPaginationMixin:
+    """
+    Paginación por cursor (core/pagination.py) para ListView en lugar de
+    OFFSET: la página siguiente se pide con ?cursor= y el template ofrece
+    "Cargar más" con next_page_query. No se cuenta el total de resultados.
+    """
 
-                redirect_url = pref_data.get("sandbox_init_point") if app_settings.MERCADOPAGO_SANDBOX else pref_data.get("init_point")
-                if not redirect_url:
-                    redirect_url = pref_data.get("init_point") or pref_data.get("sandbox_init_point")
-                if not redirect_url:
-                    raise ValueError("No se pudo obtener el punto de inicio de MercadoPago (init_point/sandbox_init_point).")
+    keyset_ordering = ("-start_time", "-id")
 
-                return JsonResponse(
-                    {"success": True, "redirect_url": redirect_url}
-                )
-            except Exception as e:
-                # En caso de error, cancelamos la creación del turno
-                appointment.delete()
+    def get_archived_queryset(self):
+        """Turnos archivados que se intercalan con los del listado, o None."""
+        return None
 
-                mp_logger.error(f"Error creando preferencia de MercadoPago: {str(e)}")
-                return JsonResponse(
-                    {"success": False, "error": f"Error al iniciar el pago con MercadoPago: {str(e)}"},
-                    status=500
-                )
-        else:
-            # Devolver el primer error encontrado para mostrarlo en el modal
-            error_message = "Por favor, corrige los errores."
-            if "__all__" in form.errors:
-                error_message = form.errors["__all__"][0]
-            else:
-                for field in form.errors:
-                    error_message = form.errors[field][0]
-                    break
-            return JsonResponse({"success": False, "error": error_message}, status=400)
+    def paginate_queryset(self, queryset, page_size):
+        from .pagination import keyset_paginate_many
 
+        querysets = [queryset]
+        archived = self.get_archived_queryset()
+        if archived is not None:
+            querysets.append(archived)
+        items, self.next_cursor = keyset_paginate_many(
+            querysets, self.keyset_ordering, cursor=self.request.GET.get("cursor"), page_size=page_size
+        )
+        return None, None, items, self.next_cursor is not None
 
-class AppointmentListView(LoginRequiredMixin, ListView):
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Filtros actuales más el cursor de la página siguiente
+        next_page_query = ""
+        if self.next_cursor:
+            params = self.request.GET.copy()
+            params["cursor"] = self.next_cursor
+            next_page_query = params.urlencode()
+        context["next_page_query"] = next_page_query
+        return context
+
+
+class AppointmentListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Appointment
     template_name = "my_appointments.html"
     context_object_name = "appointments"
+    paginate_by = 20
 
     def get(self, request, *args, **kwargs):
         # Los owners tienen su propia vista de gestión de turnos.
         if request.user.is_owner:
             return redirect("owner_appointments")
 
-        # Capturar parámetros de retorno de MercadoPago para fallback/sincronización instantánea
+        # Al volver del checkout se encola la sincronización del pago (la
+        # misma que hace el webhook) y la página se muestra sin esperarla.
+        self.payment_processing = None
+        checkout = self.checkout_return(request)
+        if checkout:
+            from .payments import schedule_payment_sync
+
+            self.payment_processing, payment_id = checkout
+            schedule_payment_sync(self.payment_processing, payment_id)
+
+        return super().get(request, *args, **kwargs)
+
+    def checkout_return(self, request):
+        """
+        (turno del cliente, payment_id) a sincronizar al volver del checkout
+        de MercadoPago, o None si no hay nada que sincronizar.
+        """
+        # Capturar parámetros de retorno de MercadoPago
         payment_id = request.GET.get("payment_id") or request.GET.get("collection_id")
         status = request.GET.get("status") or request.GET.get("collection_status")
         external_reference = request.GET.get("external_reference")
 
-        if payment_id and status == "approved" and external_reference:
-            try:
-                # Verificar que el turno pertenezca al usuario logueado
-                appointment = Appointment.objects.get(pk=external_reference, client=request.user)
-
-                # Si el turno no está confirmado o el monto pagado sigue siendo cero, consultamos
-                if appointment.status != 'CONFIRMED' or appointment.amount_paid == Decimal('0.00'):
-                    hairdresser = appointment.service.hairdresser
-                    from django.conf import settings as app_settings
+        if not (payment_id and status == "approved" and external_reference):
+            return None
+        try:
+            # Verificar que el turno pertenezca al usuario logueado
+            appointment = Appointment.objects.select_related("service__hairdresser").get(
+                pk=external_reference, client=request.user
+            )
+        except (Appointment.DoesNotExist, ValueError):
+            return None
 
-                    if app_settings.MERCADOPAGO_SANDBOX and app_settings.MERCADOPAGO_TEST_ACCESS_TOKEN:
-                        access_token = app_settings.MERCADOPAGO_TEST_ACCESS_TOKEN
-                    else:
-                        access_token = hairdresser.mercadopago_access_token
-
-                    if access_token:
-                        url = f"https://api.mercadopago.com/v1/payments/{payment_id}"
-                        headers = {"Authorization": f"Bearer {access_token}"}
-                        response = requests.get(url, headers=headers, timeout=10)
-                        if response.status_code == 200:
-                            payment_data = response.json()
-                            api_status = payment_data.get('status')
-                            api_ext_ref = str(payment_data.get('external_reference'))
-                            transaction_amount = payment_data.get('transaction_amount')
-
-                            # Registrar la transacción de pago para auditoría (inmutable)
-                            try:
-                                PaymentTransaction.objects.update_or_create(
-                                    payment_id=str(payment_id),
-                                    defaults={
-                                        "appointment": appointment,
-                                        "amount": Decimal(str(transaction_amount)),
-                                        "status": api_status,
-                                    }
-                                )
-                            except Exception as trans_err:
-                                mp_logger.error(
-                                    f"Error al registrar PaymentTransaction en fallback para pago {payment_id}: {str(trans_err)}"
-                                )
-
-                            if api_status == 'approved' and api_ext_ref == str(appointment.id):
-                                from django.db import transaction
-                                try:
-                                    with transaction.atomic():
-                                        # Bloquear la fila del turno para evitar concurrencia
-                                        appointment_locked = Appointment.objects.select_for_update().get(pk=appointment.id)
-                                        
-                                        if appointment_locked.status != 'CONFIRMED':
-                                            # Verificar si ya existe otro turno CONFIRMADO que se superpone con este
-                                            has_overlap = Appointment.objects.filter(
-                                                service__hairdresser=appointment_locked.service.hairdresser,
-                                                status="CONFIRMED",
-                                                start_time__lt=appointment_locked.end_time,
-                                                end_time__gt=appointment_locked.start_time,
-                                            ).exclude(pk=appointment_locked.id).exists()
-
-                                            if has_overlap:
-                                                # El turno ya fue ocupado: cancelar y reembolsar
-                                                appointment_locked.status = 'CANCELLED'
-                                                appointment_locked.amount_paid = Decimal(str(transaction_amount))
-                                                appointment_locked.mercadopago_payment_id = str(payment_id)
-                                                appointment_locked.expires_at = None
-                                                appointment_locked.save()
-
-                                                # Realizar reembolso en MercadoPago
-                                                try:
-                                                    refund_url = f"https://api.mercadopago.com/v1/payments/{payment_id}/refunds"
-                                                    refund_resp = requests.post(refund_url, headers=headers, json={}, timeout=10)
-                                                    refund_resp.raise_for_status()
-                                                    messages.warning(request, "El turno seleccionado ya fue confirmado por otro usuario. Se ha realizado un reembolso automático a tu cuenta.")
-                                                except Exception as refund_err:
-
-                                                    mp_logger.error(f"Error reembolsando pago {payment_id} para turno {appointment_locked.id}: {str(refund_err)}")
-                                                    # Registrar reembolso pendiente
-                                                    from core.models import PendingRefund
-                                                    PendingRefund.objects.get_or_create(
-                                                        appointment=appointment_locked,
-                                                        defaults={
-                                                            'payment_id': payment_id,
-                                                            'amount': Decimal(str(transaction_amount)),
-                                                            'last_error': str(refund_err)
-                                                        }
-                                                    )
-                                                    messages.error(request, "El turno ya no está disponible. No se pudo procesar tu reembolso automático en este momento, pero el sistema lo reintentará automáticamente. Por favor contacta al local.")
-
-                                                # Notificar al cliente
-                                                from core.utils import notify_user
-                                                notify_user(
-                                                    user=appointment_locked.client,
-                                                    event_type="APPOINTMENT_CANCELLED_CLIENT",
-                                                    context={"appointment": appointment_locked, "overbooked_refund": True},
-                                                    subject="Reembolso de Turno - Stilo",
-                                                    push_title="Turno cancelado y reembolsado",
-                                                    push_message=f"Tu turno en {appointment_locked.service.hairdresser.name} no estaba disponible y fue reembolsado automáticamente."
-                                                )
-                                            else:
-                                                # Verificar que el monto pagado sea suficiente
-                                                expected_amount = appointment_locked.get_expected_payment_amount()
-                                                paid_amount = Decimal(str(transaction_amount))
-
-                                                if paid_amount < expected_amount:
-                                                    # Pago insuficiente: cancelar y reembolsar automáticamente
-                                                    appointment_locked.status = 'CANCELLED'
-                                                    appointment_locked.amount_paid = paid_amount
-                                                    appointment_locked.mercadopago_payment_id = str(payment_id)
-                                                    appointment_locked.expires_at = None
-                                                    appointment_locked.save()
-
-                                                    # Realizar reembolso en MercadoPago
-                                                    try:
-                                                        refund_url = f"https://api.mercadopago.com/v1/payments/{payment_id}/refunds"
-                                                        refund_resp = requests.post(refund_url, headers=headers, json={}, timeout=10)
-                                                        refund_resp.raise_for_status()
-                                                        messages.error(request, "El pago realizado es insuficiente. Se ha cancelado el turno y se ha realizado un reembolso automático a tu cuenta.")
-                                                    except Exception as refund_err:
-
-                                                        mp_logger.error(f"Error reembolsando pago insuficiente {payment_id} para turno {appointment_locked.id}: {str(refund_err)}")
-                                                        # Registrar reembolso pendiente
-                                                        from core.models import PendingRefund
-                                                        PendingRefund.objects.get_or_create(
-                                                            appointment=appointment_locked,
-                                                            defaults={
-                                                                'payment_id': payment_id,
-                                                                'amount': paid_amount,
-                                                                'last_error': str(refund_err)
-                                                            }
-                                                        )
-                                                        messages.error(request, "El pago realizado es insuficiente. No se pudo procesar tu reembolso automático en este momento, pero el sistema lo reintentará automáticamente. Por favor contacta al local.")
-
-                                                    # Notificar al cliente
-                                                    from core.utils import notify_user
-                                                    notify_user(
-                                                        user=appointment_locked.client,
-                                                        event_type="APPOINTMENT_CANCELLED_CLIENT",
-                                                        context={"appointment": appointment_locked, "underpaid_refund": True},
-                                                        subject="Reembolso de Turno - Stilo",
-                                                        push_title="Turno cancelado por pago insuficiente",
-                                                        push_message=f"Tu turno en {appointment_locked.service.hairdresser.name} fue cancelado y reembolsado porque el pago fue menor al requerido."
-                                                    )
-                                                else:
-                                                    # Confirmar normalmente
-                                                    appointment_locked.status = 'CONFIRMED'
-                                                    appointment_locked.amount_paid = paid_amount
-                                                    appointment_locked.mercadopago_payment_id = str(payment_id)
-                                                    appointment_locked.expires_at = None
-                                                    appointment_locked.save()
-                                                    messages.success(request, "¡Tu pago ha sido acreditado y tu turno está confirmado!")
-                                except Exception as e:
-
-                                    mp_logger.error(f"Error procesando confirmación atómica en vista: {str(e)}")
-
-            except Appointment.DoesNotExist:
-                pass
-            except Exception as e:
-
-                mp_logger.error(f"Error en fallback de MercadoPago en AppointmentListView: {str(e)}")
-
-        return super().get(request, *args, **kwargs)
+        # Solo se sincroniza si el turno no está confirmado o el monto pagado sigue siendo cero
+        if appointment.status == 'CONFIRMED' and appointment.amount_paid != Decimal('0.00'):
+            return None
+        return appointment, payment_id
 
     def get_queryset(self):
         # CRÍTICO: Solo mostrar turnos del cliente logueado.
-        return (
-            Appointment.objects.filter(client=self.request.user)
-            .select_related("review", "service__hairdresser")
-            .order_by("-start_time")
+        return Appointment.objects.filter(client=self.request.user).select_related(
+            "review", "service__hairdresser"
+        )
+
+    def get_archived_queryset(self):
+        return ArchivedAppointment.objects.filter(client=self.request.user).select_related(
+            "review", "service__hairdresser"
         )
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["review_form"] = ReviewForm()
+        context["payment_processing"] = self.payment_processing
         return context
 
 
-class OwnerAppointmentListView(OwnerRequiredMixin, ListView):
+class OwnerAppointmentListView(OwnerRequiredMixin, KeysetPaginationMixin, ListView):
     """
     Vista de gestión de turnos exclusiva para owners.
     Muestra todos los turnos de su peluquería con filtros por estado y fecha.
@@ -695,57 +884,68 @@ class OwnerAppointmentListView(OwnerRequiredMixin, ListView):
     paginate_by = 25
 
     def get_queryset(self):
-        hairdresser = self.request.user.hairdresser_profile  # type: ignore
-        qs = (
-            Appointment.objects.filter(service__hairdresser=hairdresser)
-            .select_related("client", "service", "review")
-            .order_by("-start_time")
-        )
+        return self.filter_queryset(Appointment)
 
-        # Filtro por estado
-        status_filter = self.request.GET.get("status", "")
-        if status_filter:
-            qs = qs.filter(status=status_filter)
+    def get_archived_queryset(self):
+        return self.filter_queryset(ArchivedAppointment)
 
-        # Filtro por fecha (mes, formato YYYY-MM)
-        month_str = self.request.GET.get("month", "")
-        if month_str:
-            try:
-                from datetime import datetime as dt
-                selected = dt.strptime(month_str, "%Y-%m").date()
-                import calendar
-                _, num_days = calendar.monthrange(selected.year, selected.month)
-                qs = qs.filter(
-                    start_time__date__gte=selected.replace(day=1),
-                    start_time__date__lte=selected.replace(day=num_days),
-                )
-            except ValueError:
-                pass
+    def filter_queryset(self, model):
+        hairdresser = self.request.user.hairdresser_profile  # type: ignore
+        qs = model.objects.filter(service__hairdresser=hairdresser).select_related(
+            "client", "service", "review"
+        )
 
-        # Filtro por texto (búsqueda de cliente)
-        q = self.request.GET.get("q", "").strip()
-        if q:
-            qs = qs.filter(
-                Q(client__first_name__icontains=q)
-                | Q(client__last_name__icontains=q)
-                | Q(client__email__icontains=q)
-                | Q(client_name__icontains=q)
-            )
+        # Filtros por estado, mes (YYYY-MM) y búsqueda de cliente, compartidos
+        # con la exportación
+        from .exports import filter_appointments
 
-        return qs
+        return filter_appointments(
+            qs,
+            status=self.request.GET.get("status", ""),
+            month=self.request.GET.get("month", ""),
+            q=self.request.GET.get("q", ""),
+        )
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["status_filter"] = self.request.GET.get("status", "")
         context["month_filter"] = self.request.GET.get("month", "")
         context["q_filter"] = self.request.GET.get("q", "")
-        context["status_choices"] = Appointment.STATUS_CHOICES
-        # Contadores por estado para el resumen rápido
+        # Filtros actuales (sin el cursor) para los enlaces de exportación
+        context["filter_query"] = urlencode(
+            {key: self.request.GET[key] for key in ("status", "month", "q") if self.request.GET.get(key)}
+        )
+        # Contadores por estado para el resumen rápido, en una consulta agrupada
+        # (los archivados, todos finalizados, se suman con UNION ALL)
         hairdresser = self.request.user.hairdresser_profile  # type: ignore
         context["hairdresser"] = hairdresser
-        context["pending_count"] = Appointment.objects.filter(
-            service__hairdresser=hairdresser, status="PENDING", expires_at__isnull=True
-        ).count()
+        status_counts = {}
+        pending_count = 0
+        for row in (
+            Appointment.objects.filter(service__hairdresser=hairdresser)
+            .values("status")
+            .annotate(
+                total=Count("id"),
+                # Solicitudes que esperan confirmación manual (sin pago en curso)
+                manual=Count("id", filter=Q(expires_at__isnull=True)),
+            )
+            .order_by()
+            .union(
+                ArchivedAppointment.objects.filter(service__hairdresser=hairdresser)
+                .values("status")
+                .annotate(total=Count("id"), manual=Value(0, output_field=IntegerField()))
+                .order_by(),
+                all=True,
+            )
+        ):
+            status_counts[row["status"]] = status_counts.get(row["status"], 0) + row["total"]
+            if row["status"] == "PENDING":
+                pending_count += row["manual"]
+        context["status_choices"] = [
+            (value, label, status_counts.get(value, 0))
+            for value, label in Appointment.STATUS_CHOICES
+        ]
+        context["pending_count"] = pending_count
         return context
 
 
@@ -807,73 +1007,72 @@ class ReviewDeleteView(LoginRequiredMixin, View):
         return JsonResponse({"success": True})
 
 
+def _review_detail_scopes(request, pk):
+    if not request.user.is_authenticated:
+        return None
+    hairdresser_id = (
+        Review.objects.filter(pk=pk)
+        .values_list("appointment__service__hairdresser_id", flat=True)
+        .first()
+    )
+    return (hairdresser_scope(hairdresser_id),) if hairdresser_id else None
+
+
+@conditional_on_stamps(_review_detail_scopes, per_user=True)
 def get_review_detail(request, pk):
     # API endpoint to fetch review data for the edit modal
-    review = get_object_or_404(Review, pk=pk)
-    if request.user != review.appointment.client:
+    if not request.user.is_authenticated:
+        raise Http404
+    # Una sola consulta: el filtro por cliente reemplaza cargar el turno
+    data = (
+        Review.objects.filter(pk=pk, appointment__client_id=request.user.pk)
+        .values("rating", "comment")
+        .first()
+    )
+    if data is None:
         raise Http404
-
-    data = {
-        "rating": review.rating,
-        "comment": review.comment,
-    }
     return JsonResponse(data)
 
 
-def hairdresser_map_data(request):
-    # Filtramos peluquerías que tengan latitud Y longitud
-    hairdressers = Hairdresser.objects.filter(
-        latitude__isnull=False, longitude__isnull=False
+def hairdresser_reviews_data(request, pk):
+    """
+    Reseñas de una peluquería paginadas por cursor (created_at, id), junto con
+    el histograma de calificaciones del resumen guardado.
+    """
+    hairdresser = get_object_or_404(Hairdresser, pk=pk)
+    reviews, next_cursor = _get_reviews_page(hairdresser, request.GET.get("cursor"))
+    return JsonResponse(
+        {
+            "results": [_serialize_review(review) for review in reviews],
+            "next_cursor": next_cursor,
+            "count": hairdresser.rating_count,
+            "average": round(hairdresser.cached_average_rating, 1),
+            "histogram": hairdresser.get_rating_histogram(),
+        }
     )
-    
+
+
+@conditional_on_stamps(lambda request: (CATALOG_SCOPE,))
+def hairdresser_map_data(request):
+    from .caching import cached, request_stamps
+
     q = request.GET.get("q", "").strip()
     service = request.GET.get("service", "").strip()
-    
-    if q:
-        hairdressers = hairdressers.filter(
-            Q(name__icontains=q) |
-            Q(address__icontains=q) |
-            Q(description__icontains=q)
-        )
-        
-    if service:
-        if service == "corte":
-            hairdressers = hairdressers.filter(services__name__icontains="corte")
-        elif service == "color":
-            hairdressers = hairdressers.filter(
-                Q(services__name__icontains="color") |
-                Q(services__name__icontains="tinte") |
-                Q(services__name__icontains="mechas")
-            )
-        elif service == "barberia":
-            hairdressers = hairdressers.filter(
-                Q(services__name__icontains="barba") |
-                Q(services__name__icontains="barber")
-            )
-        elif service == "peinado":
-            hairdressers = hairdressers.filter(
-                Q(services__name__icontains="peinado") |
-                Q(services__name__icontains="secado")
-            )
-        elif service == "tratamientos":
-            hairdressers = hairdressers.filter(
-                Q(services__name__icontains="tratamiento") |
-                Q(services__name__icontains="keratina")
-            )
-            
-    # Sincronizar con is_complete()
-    hairdressers = hairdressers.prefetch_related("working_hours", "services").distinct()
-    complete_hairdressers = [h for h in hairdressers if h.is_complete()]
-    
-    data = [
-        {
-            "name": h.name,
-            "lat": h.latitude,
-            "lon": h.longitude,
-            "url": reverse("hairdresser_detail", args=[h.pk]),
-        }
-        for h in complete_hairdressers
-    ]
+
+    def build():
+        # Sincronizar con is_complete()
+        hairdressers = _filter_hairdressers(Hairdresser.objects.complete(), q, service)
+        return [
+            {
+                "name": h["name"],
+                "lat": h["latitude"],
+                "lon": h["longitude"],
+                "url": reverse("hairdresser_detail", args=[h["id"]]),
+            }
+            for h in hairdressers.values("id", "name", "latitude", "longitude")
+        ]
+
+    data = cached("map", request_stamps(request, CATALOG_SCOPE), (q, service), build)
     return JsonResponse(data, safe=False)
 
 
@@ -889,42 +1088,36 @@ class OwnerStatsView(OwnerRequiredMixin, TemplateView):
         hairdresser = self.request.user.hairdresser_profile  # type: ignore
 
         # --- Filtro de fecha ---
-        month_str = self.request.GET.get("month")  # formato YYYY-MM
-        try:
-            # Si se provee un mes, se usa. Si no, se usa el actual.
-            if month_str:
-                selected_date = datetime.strptime(month_str, "%Y-%m").date()
-            else:
-                selected_date = timezone.now().date()
-        except ValueError:
-            selected_date = timezone.now().date()
-
-        start_of_month = selected_date.replace(day=1)
-        _, num_days = calendar.monthrange(selected_date.year, selected_date.month)
-        end_of_month = selected_date.replace(day=num_days)
+        # Mes pedido (formato YYYY-MM) o, si falta o es inválido, el actual
+        start_of_month = month_from_param(self.request.GET.get("month"))
 
         context["selected_month_iso"] = start_of_month.strftime("%Y-%m")
         context["start_of_month"] = start_of_month
 
-        # Appointments base querysets for the selected month
-        apps_in_month = Appointment.objects.filter(
-            service__hairdresser=hairdresser,
-            start_time__range=[start_of_month, end_of_month],
-        )
-        completed_in_month = apps_in_month.filter(status="COMPLETED")
+        # Turnos del mes seleccionado, activos y archivados: cada estadística
+        # suma los agregados de ambas tablas
+        from .archive import merged_totals
+
+        apps_in_month = [
+            model.objects.filter(service__hairdresser=hairdresser).in_month(start_of_month)
+            for model in (Appointment, ArchivedAppointment)
+        ]
+        by_status = merged_totals(apps_in_month, ["status"], count=Count("id"), revenue=Sum("amount"))
+        completed = by_status.get(("COMPLETED",), {"count": 0, "revenue": 0})
 
         # --- Resumen del mes seleccionado ---
-        context["monthly_revenue"] = (
-            completed_in_month.aggregate(total=Sum("amount"))["total"] or 0
-        )
-        context["monthly_appointments"] = completed_in_month.count()
+        context["monthly_revenue"] = completed["revenue"]
+        context["monthly_appointments"] = completed["count"]
 
         # --- Estadísticas generales del mes seleccionado ---
         # Tasa de ausentismo
-        total_finished_apps = apps_in_month.filter(
-            status__in=["COMPLETED", "NO_SHOW", "CANCELLED"]
-        ).count()
-        absent_apps = apps_in_month.filter(status__in=["NO_SHOW", "CANCELLED"]).count()
+        total_finished_apps = sum(
+            by_status.get((status,), {"count": 0})["count"]
+            for status in ["COMPLETED", "NO_SHOW", "CANCELLED"]
+        )
+        absent_apps = sum(
+            by_status.get((status,), {"count": 0})["count"] for status in ["NO_SHOW", "CANCELLED"]
+        )
         context["no_show_rate"] = (
             (absent_apps / total_finished_apps) * 100 if total_finished_apps > 0 else 0
         )
@@ -937,33 +1130,22 @@ class OwnerStatsView(OwnerRequiredMixin, TemplateView):
         )
 
         # Top 5 Clientes (basado en el mes seleccionado, excluyendo turnos presenciales)
-        context["top_clients"] = (
-            completed_in_month.filter(client__isnull=False)
-            .values("client__first_name", "client__last_name")
-            .annotate(total_spent=Sum("amount"))
-            .order_by("-total_spent")[:5]
+        spent = merged_totals(
+            [apps.filter(status="COMPLETED", client__isnull=False) for apps in apps_in_month],
+            ["client__first_name", "client__last_name"],
+            total_spent=Sum("amount"),
         )
+        context["top_clients"] = sorted(
+            (
+                {"client__first_name": first_name, "client__last_name": last_name, **totals}
+                for (first_name, last_name), totals in spent.items()
+            ),
+            key=lambda row: row["total_spent"],
+            reverse=True,
+        )[:5]
         return context
 
 
-def _get_date_range_from_request(request):
-    """Helper to get a date range for a given month from a request, or default to current month."""
-    month_str = request.GET.get("month")
-    try:
-        if month_str:
-            selected_date = datetime.strptime(month_str, "%Y-%m").date()
-        else:
-            selected_date = timezone.now().date()
-    except ValueError:
-        selected_date = timezone.now().date()
-
-    start_of_month = selected_date.replace(day=1)
-    _, num_days = calendar.monthrange(start_of_month.year, start_of_month.month)
-    end_of_month = start_of_month.replace(day=num_days)
-
-    return start_of_month, end_of_month
-
-
 def owner_api_required(view_func):
     """
     Decorator to check if user is an authenticated owner for API views.
@@ -1004,16 +1186,21 @@ def geocode_address_api(request):
 @owner_api_required
 def earnings_chart_data(request):
     hairdresser = request.user.hairdresser_profile  # type: ignore
+    from .archive import merged_totals
+
     # This chart shows all-time monthly evolution, so it's not filtered by month.
-    data = (
-        Appointment.objects.filter(service__hairdresser=hairdresser, status="COMPLETED")
-        .annotate(month=TruncMonth("start_time"))
-        .values("month")
-        .annotate(total_earnings=Sum("amount"))
-        .order_by("month")
+    data = merged_totals(
+        [
+            model.objects.filter(service__hairdresser=hairdresser, status="COMPLETED")
+            .annotate(month=TruncMonth("start_time"))
+            for model in (Appointment, ArchivedAppointment)
+        ],
+        ["month"],
+        total_earnings=Sum("amount"),
     )
-    labels = [d["month"].strftime("%B %Y").capitalize() for d in data]
-    earnings = [float(d["total_earnings"]) for d in data]
+    months = sorted(data)
+    labels = [month.strftime("%B %Y").capitalize() for (month,) in months]
+    earnings = [float(data[key]["total_earnings"]) for key in months]
 
     return JsonResponse({"labels": labels, "data": earnings})
 
@@ -1021,21 +1208,24 @@ def earnings_chart_data(request):
 @owner_api_required
 def revenue_by_service_chart_data(request):
     hairdresser = request.user.hairdresser_profile  # type: ignore
-    start_date, end_date = _get_date_range_from_request(request)
+    from .archive import merged_totals
 
-    data = (
-        Appointment.objects.filter(
-            service__hairdresser=hairdresser,
-            status="COMPLETED",
-            start_time__range=[start_date, end_date],
-        )
-        .values("service__name")
-        .annotate(total_revenue=Sum("amount"))
-        .order_by("-total_revenue")
+    month = month_from_param(request.GET.get("month"))
+    data = merged_totals(
+        [
+            model.objects.filter(
+                service__hairdresser=hairdresser,
+                status="COMPLETED",
+            ).in_month(month)
+            for model in (Appointment, ArchivedAppointment)
+        ],
+        ["service__name"],
+        total_revenue=Sum("amount"),
     )
+    ranking = sorted(data.items(), key=lambda item: item[1]["total_revenue"], reverse=True)
 
-    labels = [d["service__name"] for d in data]
-    revenue_data = [float(d["total_revenue"]) for d in data]
+    labels = [name for (name,), _ in ranking]
+    revenue_data = [float(totals["total_revenue"]) for _, totals in ranking]
 
     return JsonResponse({"labels": labels, "data": revenue_data})
 
@@ -1043,18 +1233,20 @@ def revenue_by_service_chart_data(request):
 @owner_api_required
 def busiest_days_chart_data(request):
     hairdresser = request.user.hairdresser_profile  # type: ignore
-    start_date, end_date = _get_date_range_from_request(request)
-
     # El lookup `__week_day` devuelve 1 (Dom) a 7 (Sáb)
-    day_counts = (
-        Appointment.objects.filter(
-            service__hairdresser=hairdresser,
-            status__in=["COMPLETED", "CONFIRMED"],
-            start_time__range=[start_date, end_date],
-        )
-        .values("start_time__week_day")
-        .annotate(count=Count("id"))
-        .order_by("start_time__week_day")
+    from .archive import merged_totals
+
+    month = month_from_param(request.GET.get("month"))
+    day_counts = merged_totals(
+        [
+            model.objects.filter(
+                service__hairdresser=hairdresser,
+                status__in=["COMPLETED", "CONFIRMED"],
+            ).in_month(month)
+            for model in (Appointment, ArchivedAppointment)
+        ],
+        ["start_time__week_day"],
+        count=Count("id"),
     )
 
     day_map = {
@@ -1067,10 +1259,10 @@ def busiest_days_chart_data(request):
         7: "Sábado",
     }
     final_counts = {day: 0 for day in day_map.values()}
-    for item in day_counts:
-        day_name = day_map.get(item["start_time__week_day"])
+    for (week_day,), totals in day_counts.items():
+        day_name = day_map.get(week_day)
         if day_name:
-            final_counts[day_name] = item["count"]
+            final_counts[day_name] = totals["count"]
 
     ordered_labels = [
         "Lunes",
@@ -1086,64 +1278,113 @@ def busiest_days_chart_data(request):
     return JsonResponse({"labels": ordered_labels, "data": ordered_data})
 
 
+def _export_response(request, kind, build_export):
+    """
+    Descarga en streaming (CSV por defecto, XLSX con ?format=xlsx) con los
+    mismos filtros que el listado de turnos del dueño.
+    """
+    from .exports import CONTENT_TYPES, export_filename, export_stream
+
+    fmt = request.GET.get("format", "csv")
+    if fmt not in CONTENT_TYPES:
+        return JsonResponse({"error": "Formato no soportado."}, status=400)
+
+    headers, rows = build_export(
+        request.user.hairdresser_profile,  # type: ignore
+        status=request.GET.get("status", ""),
+        month=request.GET.get("month", ""),
+        q=request.GET.get("q", ""),
+    )
+    response = StreamingHttpResponse(export_stream(fmt, headers, rows), content_type=CONTENT_TYPES[fmt])
+    response["Content-Disposition"] = f'attachment; filename="{export_filename(kind, fmt)}"'
+    return response
+
+
+@owner_api_required
+def export_appointments(request):
+    from .exports import appointment_export
+
+    return _export_response(request, "turnos", appointment_export)
+
+
+@owner_api_required
+def export_transactions(request):
+    from .exports import transaction_export
+
+    return _export_response(request, "transacciones", transaction_export)
+
+
+@conditional_on_stamps(
+    lambda request, hairdresser_id: (hairdresser_scope(hairdresser_id),)
+)
 def appointment_events_data(request, hairdresser_id):
     # Devuelve los turnos de una peluquería como eventos de FullCalendar.
     # Se bloquean:
     #   - CONFIRMED: turnos confirmados.
     #   - PENDING sin expires_at: solicitudes esperando confirmación del dueño (ocupan el slot).
     # No se bloquean los PENDING con expires_at (checkout de pago en curso, expiran solos).
-    from django.db.models import Q
-    appointments = Appointment.objects.filter(
-        service__hairdresser_id=hairdresser_id,
-    ).filter(
-        Q(status="CONFIRMED") |
-        Q(status="PENDING", expires_at__isnull=True)
-    )
-    working_hours = WorkingHours.objects.filter(hairdresser_id=hairdresser_id)
-    events = []
-
-    # Agregar horarios de atención como eventos de fondo
-    # Mapeo: Django (0=Lun..6=Dom) a FullCalendar (0=Dom..6=Sab)
-    for wh in working_hours:
-        fc_day = (wh.day_of_week + 1) % 7
-        events.append(
-            {
-                "daysOfWeek": [fc_day],
-                "startTime": wh.start_time.strftime("%H:%M"),
-                "endTime": wh.end_time.strftime("%H:%M"),
-                "display": "background",
-                "groupId": "working_hours",  # Para usar en selectConstraint
-            }
+    from .caching import cached, request_stamps
+
+    def build():
+        from django.db.models import Q
+        appointments = Appointment.objects.filter(
+            service__hairdresser_id=hairdresser_id,
+        ).filter(
+            Q(status="CONFIRMED") |
+            Q(status="PENDING", expires_at__isnull=True)
         )
+        working_hours = WorkingHours.objects.filter(hairdresser_id=hairdresser_id)
+        events = []
+
+        # Agregar horarios de atención como eventos de fondo
+        # Mapeo: Django (0=Lun..6=Dom) a FullCalendar (0=Dom..6=Sab)
+        for wh in working_hours:
+            fc_day = (wh.day_of_week + 1) % 7
+            events.append(
+                {
+                    "daysOfWeek": [fc_day],
+                    "startTime": wh.start_time.strftime("%H:%M"),
+                    "endTime": wh.end_time.strftime("%H:%M"),
+                    "display": "background",
+                    "groupId": "working_hours",  # Para usar en selectConstraint
+                }
+            )
 
-    for app in appointments:
-        events.append(
-            {
-                "title": "Reservado",  # Por privacidad
-                "start": app.start_time.isoformat(),
-                "end": app.end_time.isoformat(),
-                "color": "#6c757d",
-                "classNames": ["reserved-event"],
-            }
-        )
+        for app in appointments:
+            events.append(
+                {
+                    "title": "Reservado",  # Por privacidad
+                    "start": app.start_time.isoformat(),
+                    "end": app.end_time.isoformat(),
+                    "color": "#6c757d",
+                    "classNames": ["reserved-event"],
+                }
+            )
 
-    from core.models import Pause
-    pauses = Pause.objects.filter(hairdresser_id=hairdresser_id)
-    for p in pauses:
-        events.append(
-            {
-                "title": "No disponible",
-                "start": p.start_time.isoformat(),
-                "end": p.end_time.isoformat(),
-                "color": "#dc3545",
-                "textColor": "#ffffff",
-                "classNames": ["pause-event"],
-                "extendedProps": {
-                    "isPause": True
+        from core.models import Pause
+        pauses = Pause.objects.filter(hairdresser_id=hairdresser_id)
+        for p in pauses:
+            events.append(
+                {
+                    "title": "No disponible",
+                    "start": p.start_time.isoformat(),
+                    "end": p.end_time.isoformat(),
+                    "color": "#dc3545",
+                    "textColor": "#ffffff",
+                    "classNames": ["pause-event"],
+                    "extendedProps": {
+                        "isPause": True
+                    }
                 }
-            }
-        )
+            )
+        return events
 
+    events = cached(
+        "appointment_events",
+        request_stamps(request, hairdresser_scope(hairdresser_id)),
+        (hairdresser_id,),
+        build,
+    )
     return JsonResponse(events, safe=False)
 
 
@@ -1240,7 +1481,9 @@ class MyHairdresserImagesView(OwnerRequiredMixin, CurrentHairdresserMixin, View)
 
     def get(self, request, *args, **kwargs):
         hairdresser = self.get_object()
-        images = HairdresserImage.objects.filter(hairdresser=hairdresser)
+        images = HairdresserImage.objects.filter(hairdresser=hairdresser).prefetch_related(
+            "derivatives"
+        )
         upload_form = HairdresserImageForm()
         update_form = HairdresserImageUpdateForm()
         return render(
@@ -1262,9 +1505,13 @@ class MyHairdresserImagesView(OwnerRequiredMixin, CurrentHairdresserMixin, View)
         if action == "upload":
             form = HairdresserImageForm(request.POST, request.FILES)
             if form.is_valid():
+                from .images import schedule_image_derivatives
+
                 image = form.save(commit=False)
                 image.hairdresser = hairdresser
                 image.save()
+                # Versiones redimensionadas en segundo plano
+                schedule_image_derivatives(image)
                 messages.success(request, "Imagen subida exitosamente.")
             else:
                 messages.error(
@@ -1365,13 +1612,22 @@ class CustomPasswordChangeView(LoginRequiredMixin, PasswordChangeView):
 
 
 
+def _service_detail_scopes(request, pk):
+    if not request.user.is_authenticated or not request.user.is_owner:
+        return None
+    hairdresser_id = (
+        Hairdresser.objects.filter(owner=request.user).values_list("pk", flat=True).first()
+    )
+    return (hairdresser_scope(hairdresser_id),) if hairdresser_id else None
+
+
+@conditional_on_stamps(_service_detail_scopes, per_user=True)
 def get_service_detail(request, pk):
     if not request.user.is_authenticated or not request.user.is_owner:
         return JsonResponse({"error": "Unauthorized"}, status=403)
 
-    service = get_object_or_404(
-        Service, pk=pk, hairdresser=request.user.hairdresser_profile
-    )
+    # Se filtra por dueño en la misma consulta en vez de cargar el perfil
+    service = get_object_or_404(Service, pk=pk, hairdresser__owner=request.user)
     return JsonResponse(
         {
             "name": service.name,
@@ -1400,7 +1656,10 @@ class RegisterWalkInView(OwnerRequiredMixin, View):
             appointment.amount_paid = Decimal("0.00")
             appointment.expires_at = None
             appointment.client = None
-            appointment.save()
+            try:
+                appointment.save()
+            except SlotUnavailable as e:
+                return JsonResponse({"status": "error", "message": str(e)}, status=400)
             return JsonResponse({"status": "success", "message": "Turno presencial registrado exitosamente."})
         else:
             error_message = "Por favor, corrige los errores."
@@ -1445,7 +1704,7 @@ def delete_pause(request, pk):
     if not request.user.is_owner:
         return JsonResponse({"status": "error", "message": "No autorizado."}, status=403)
     
-    from core.models import Pause, Appointment
+    from core.models import Pause
     pause = get_object_or_404(Pause, pk=pk, hairdresser=request.user.hairdresser_profile)
     
     now = timezone.now()
@@ -1460,11 +1719,7 @@ def delete_pause(request, pk):
         
         # Si la pausa se acortó al menos 5 minutos, ofrecer adelantar al próximo cliente
         if minutes_early >= 5:
-            next_app = Appointment.objects.filter(
-                service__hairdresser=pause.hairdresser,
-                start_time__date=now.date(),
-                start_time__gt=now
-            ).exclude(status__in=["COMPLETED", "NO_SHOW", "CANCELLED"]).order_by("start_time").first()
+            next_app = day_agenda(pause.hairdresser_id).next_appointment(now)
             
             if next_app:
                 import uuid
@@ -1504,98 +1759,74 @@ class WorkstationView(OwnerRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         hairdresser = self.request.user.hairdresser_profile
-        today = timezone.now().date()
 
-        # Obtenemos todos los turnos del día, ordenados
-        appointments_today = (
-            Appointment.objects.filter(
-                service__hairdresser=hairdresser, start_time__date=today
-            )
-            .select_related("client", "service")
-            .order_by("start_time")
+        # Último cambio de agenda reflejado en la página (se lee antes que los
+        # datos: un cambio posterior se recibe por el feed en vivo)
+        context["agenda_seq"] = latest_sequence(hairdresser.pk)
+        # ?fragment=1: solo el contenido, para que el feed actualice las secciones
+        context["base_template"] = (
+            "workstation_fragment.html" if self.request.GET.get("fragment") else "base.html"
         )
 
-        now = timezone.now()
-        current_appointment = None
-        next_appointment = None
-        upcoming_appointments = []
-        completed_appointments = []
-
-        # Separar los turnos finalizados (completados, ausentes o cancelados) de los activos
-        active_appointments = []
-        for app in appointments_today:
-            if app.status in ["COMPLETED", "NO_SHOW", "CANCELLED"]:
-                completed_appointments.append(app)
-            else:
-                active_appointments.append(app)
-
-        # Clasificar los turnos activos cronológicamente
-        for app in active_appointments:
-            # Si el turno ya comenzó (o debió comenzar) y aún no tenemos un turno actual en curso, se asigna como actual
-            if app.start_time <= now and not current_appointment:
-                current_appointment = app
-            else:
-                # Si empieza en el futuro, o si ya tenemos un turno en curso, se asigna como siguiente o futuro
-                if not next_appointment:
-                    next_appointment = app
-                else:
-                    upcoming_appointments.append(app)
-
-        # Obtener las pausas de hoy
-        from core.models import Pause
-        pauses_today = Pause.objects.filter(
-            hairdresser=hairdresser,
-            start_time__date=today,
-        ).order_by("start_time")
-
-        active_pause = None
-        for p in pauses_today:
-            if p.start_time <= now < p.end_time:
-                active_pause = p
-                break
-
-        context["current_appointment"] = current_appointment
-        context["next_appointment"] = next_appointment
-        context["completed_appointments"] = completed_appointments
+        # Turnos y pausas de hoy desde la agenda del día en caché (core/day_agenda.py)
+        agenda = day_agenda(hairdresser.pk)
+        context.update(agenda.workstation(timezone.now()))
         context["hairdresser"] = hairdresser
-        context["active_pause"] = active_pause
+        active_pause = context["active_pause"]
         if active_pause:
             context["pause_duration_minutes"] = int((active_pause.end_time - active_pause.start_time).total_seconds() / 60)
 
-        # Construir la timeline de eventos futuros (turnos en espera y pausas futuras)
-        upcoming_timeline = []
-        for app in upcoming_appointments:
-            upcoming_timeline.append({
-                "type": "appointment",
-                "time": app.start_time,
-                "object": app
-            })
-
-        for p in pauses_today:
-            if p.start_time > now:
-                upcoming_timeline.append({
-                    "type": "pause",
-                    "time": p.start_time,
-                    "object": p,
-                    "duration": int((p.end_time - p.start_time).total_seconds() / 60)
-                })
-
-        upcoming_timeline.sort(key=lambda x: x["time"])
-        context["upcoming_timeline"] = upcoming_timeline
-
         # Cantidad de solicitudes pendientes de confirmación manual para otros días
-        context["pending_requests_count"] = (
-            Appointment.objects.filter(
-                service__hairdresser=hairdresser,
-                status="PENDING",
-                expires_at__isnull=True,
-            )
-            .exclude(start_time__date=today)  # las de hoy ya aparecen arriba
-            .count()
-        )
+        context["pending_requests_count"] = agenda.pending_requests_count
         return context
 
 
+def _workstation_hairdresser_id(request):
+    """Peluquería del dueño logueado, o None si el usuario no es dueño."""
+    if not request.user.is_owner:
+        return None
+    return Hairdresser.objects.filter(owner=request.user).values_list("pk", flat=True).first()
+
+
+@login_required
+def workstation_events(request):
+    """
+    Cambios de la agenda como Server-Sent Events (ver core/agenda.py). La
+    conexión se cierra a los WORKSTATION_STREAM_SECONDS y EventSource se
+    reconecta enviando Last-Event-ID para seguir desde el último cambio.
+    """
+    from django.conf import settings
+
+    hairdresser_id = _workstation_hairdresser_id(request)
+    if hairdresser_id is None:
+        return JsonResponse({"error": "No autorizado"}, status=403)
+
+    since = requested_sequence(request, hairdresser_id)
+    response = StreamingHttpResponse(
+        event_stream(hairdresser_id, since, settings.WORKSTATION_STREAM_SECONDS),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    # Evitar que nginx acumule el stream en su buffer
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@login_required
+def workstation_changes(request):
+    """Long-poll con los mismos lotes que workstation_events (sin EventSource)."""
+    from django.conf import settings
+
+    hairdresser_id = _workstation_hairdresser_id(request)
+    if hairdresser_id is None:
+        return JsonResponse({"error": "No autorizado"}, status=403)
+
+    since = requested_sequence(request, hairdresser_id)
+    return JsonResponse(
+        wait_for_changes(hairdresser_id, since, settings.WORKSTATION_LONGPOLL_SECONDS)
+    )
+
+
 @login_required
 @require_POST
 def update_appointment_status(request, pk):
@@ -1733,11 +1964,7 @@ def update_appointment_status(request, pk):
                 minutes_early = int(round((appointment.end_time - now).total_seconds() / 60))
                 if minutes_early >= 5:
                     # Buscar el próximo turno del día
-                    next_app = Appointment.objects.filter(
-                        service__hairdresser=appointment.service.hairdresser,
-                        start_time__date=now.date(),
-                        start_time__gt=now
-                    ).exclude(status__in=["COMPLETED", "NO_SHOW", "CANCELLED"]).order_by("start_time").first()
+                    next_app = day_agenda(appointment.service.hairdresser_id).next_appointment(now)
 
                     if next_app:
                         import uuid
@@ -1778,6 +2005,29 @@ def update_appointment_status(request, pk):
         return JsonResponse({"status": "error", "message": str(e)}, status=500)
 
 
+@login_required
+def appointment_payment_status(request, pk):
+    """
+    Estado del turno para la página de "Mis turnos" mientras se sincroniza
+    el pago con el que el cliente volvió del checkout (ver core/payments.py).
+    """
+    appointment = get_object_or_404(
+        Appointment.objects.select_related("service__hairdresser"), pk=pk, client=request.user
+    )
+    # Sigue en proceso mientras el turno espera un pago que todavía no venció
+    processing = (
+        appointment.status == "PENDING"
+        and appointment.expires_at is not None
+        and appointment.expires_at > timezone.now()
+    )
+    return JsonResponse({
+        "status": appointment.status,
+        "status_display": appointment.get_status_display(),
+        "processing": processing,
+        "payment": appointment.get_payment_status_info()["label"],
+    })
+
+
 @login_required
 @require_POST
 def cancel_appointment_client(request, pk):
@@ -1987,8 +2237,7 @@ def send_reminders_view(request):
 
     # Filtrar solo los turnos CONFIRMED para el día siguiente.
     # Los turnos PENDING que nunca fueron pagados no deben recibir recordatorios.
-    appointments = Appointment.objects.filter(
-        start_time__date=tomorrow_date,
+    appointments = Appointment.objects.on_day(tomorrow_date).filter(
         status="CONFIRMED"
     ).select_related("client", "service__hairdresser")
 
@@ -2133,11 +2382,14 @@ def mercadopago_unlink(request):
     return redirect("my_hairdresser_info")
 
 
-@login_required
-def mercadopago_callback(request):
+def _mercadopago_token_request(request):
+    """
+    Valida el retorno del OAuth de MercadoPago. Retorna una redirección si no
+    se puede continuar, o (peluquería, url, payload, headers) para canjear el
+    código por las credenciales.
+    """
     from django.conf import settings
-    import requests
-    
+
     if not request.user.is_owner:
         messages.error(request, "No tienes permisos para realizar esta acción.")
         return redirect("home")
@@ -2176,9 +2428,12 @@ def mercadopago_callback(request):
         "accept": "application/json",
         "content-type": "application/x-www-form-urlencoded"
     }
-    
+    return hairdresser, token_url, payload, headers
+
+
+def _save_mercadopago_token(request, hairdresser, response):
+    """Guarda las credenciales obtenidas de MercadoPago (o informa el error)."""
     try:
-        response = requests.post(token_url, data=payload, headers=headers, timeout=10)
         response.raise_for_status()
         data = response.json()
         
@@ -2187,8 +2442,6 @@ def mercadopago_callback(request):
         hairdresser.mercadopago_user_id = str(data.get("user_id", ""))
         
         expires_in = data.get("expires_in")
-        from django.utils import timezone
-        from datetime import timedelta
         if expires_in:
             hairdresser.mercadopago_token_expires_at = timezone.now() + timedelta(seconds=int(expires_in))
         else:
@@ -2208,13 +2461,32 @@ def mercadopago_callback(request):
         mp_logger.error(f"Error swapping oauth code for token: {error_msg}")
         messages.error(request, f"Error al vincular con MercadoPago: {error_msg}")
     except Exception as e:
-
-        mp_logger.error(f"Error swapping oauth code for token: {str(e)}")
-        messages.error(request, f"Error al vincular con MercadoPago: {str(e)}")
+        _mercadopago_token_failed(request, e)
         
     return redirect("my_hairdresser_info")
 
 
+def _mercadopago_token_failed(request, error):
+    mp_logger.error(f"Error swapping oauth code for token: {str(error)}")
+    messages.error(request, f"Error al vincular con MercadoPago: {str(error)}")
+    return redirect("my_hairdresser_info")
+
+
+@login_required
+def mercadopago_callback(request):
+    prepared = _mercadopago_token_request(request)
+    if isinstance(prepared, HttpResponseRedirect):
+        return prepared
+    hairdresser, token_url, payload, headers = prepared
+
+    try:
+        with track_outbound("mercadopago") as call:
+            response = call.response = requests.post(token_url, data=payload, headers=headers, timeout=10)
+    except Exception as e:
+        return _mercadopago_token_failed(request, e)
+    return _save_mercadopago_token(request, hairdresser, response)
+
+
 def cancel_expired_appointments_view(request):
     """
     Endpoint para cancelar los turnos PENDING cuyo tiempo de espera de pago ha expirado.
@@ -2246,11 +2518,16 @@ def cancel_expired_appointments_view(request):
         except Exception as e:
             cron_logger.error(f"Error al cancelar turno #{app.pk}: {e}")
 
-    cron_logger.info(f"[CRON] cancel-expired finalizado: procesados={count}, cancelados={cancelled}")
+    # Aprovechar la corrida periódica para descartar cambios de agenda viejos
+    from core.agenda import prune_agenda_changes
+    pruned = prune_agenda_changes(now)
+
+    cron_logger.info(f"[CRON] cancel-expired finalizado: procesados={count}, cancelados={cancelled}, cambios de agenda borrados={pruned}")
     return JsonResponse({
         "status": "success",
         "processed": count,
-        "cancelled": cancelled
+        "cancelled": cancelled,
+        "pruned_agenda_changes": pruned,
     })
 
 
@@ -2304,15 +2581,39 @@ def retry_refunds_cron_view(request):
     })
 
 
+def reconcile_payments_cron_view(request):
+    """
+    Endpoint cron para conciliar los pagos de MercadoPago de todas las
+    peluquerías con cobros digitales. Con ?repair=1 corrige las diferencias;
+    sin él solo las informa. Protegido por token/clave secreta.
+    """
+    token = request.GET.get("token") or request.headers.get("X-Cron-Secret")
+    from django.conf import settings
+    if not token or token != settings.CRON_SECRET:
+        return JsonResponse({"error": "No autorizado"}, status=403)
+
+    from core.reconciliation import reconcile_payments, summarize
+
+    repair = request.GET.get("repair") == "1"
+    cron_logger.info(f"[CRON] Ejecutando reconcile-payments (repair={repair})")
+    summary = summarize(reconcile_payments(repair=repair))
+    cron_logger.info(
+        f"[CRON] reconcile-payments finalizado: peluquerías={summary['hairdressers']}, "
+        f"pagos={summary['payments']}, diferencias={summary['issues']}, "
+        f"corregidas={summary['repaired']}, fallidas={summary['failed']}"
+    )
+    return JsonResponse({"status": "success", **summary})
+
+
 def developer_required(view_func):
     """
     Decorador que permite el acceso solo si DEBUG=True o si el usuario es staff/superuser.
     """
-    from django.conf import settings
     from django.http import HttpResponseForbidden
+    from .utils import user_is_developer
 
     def _wrapped_view(request, *args, **kwargs):
-        if settings.DEBUG or (request.user.is_authenticated and (request.user.is_staff or request.user.is_superuser)):
+        if user_is_developer(request):
             return view_func(request, *args, **kwargs)
         return HttpResponseForbidden("Acceso restringido a desarrolladores.")
     return _wrapped_view
@@ -2414,6 +2715,48 @@ def email_preview_render(request, template_name):
     return render(request, path, context)
 
 
+@developer_required
+def query_stats_view(request):
+    """
+    Resumen por vista de la instrumentación de consultas (QUERY_INSTRUMENTATION).
+    Los datos son del proceso que atiende el request; POST los reinicia.
+    """
+    from django.conf import settings
+    from .middleware import get_view_stats, reset_view_stats
+
+    if request.method == "POST":
+        reset_view_stats()
+        return redirect("query_stats")
+    return render(
+        request,
+        "debug_query_stats.html",
+        {"stats": get_view_stats(), "enabled": settings.QUERY_INSTRUMENTATION},
+    )
+
+
+def metrics_view(request):
+    """
+    Métricas en formato de texto de Prometheus, sumando todos los procesos.
+    Protegido por METRICS_TOKEN, solo en la cabecera Authorization: Bearer
+    (un ?token= quedaría registrado en los logs de acceso y de los proxies).
+    """
+    import hmac
+
+    from django.conf import settings
+    from django.http import HttpResponse
+    from .metrics import render_metrics
+
+    authorization = request.headers.get("Authorization", "")
+    token = authorization.removeprefix("Bearer ").strip() if authorization.startswith("Bearer ") else ""
+    if not settings.METRICS_TOKEN or not hmac.compare_digest(
+        token.encode(), settings.METRICS_TOKEN.encode()
+    ):
+        return JsonResponse({"error": "No autorizado"}, status=403)
+    return HttpResponse(
+        render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
 def refresh_mercadopago_tokens_cron_view(request):
     """
     Endpoint de cron para renovar de forma automática los tokens de MercadoPago
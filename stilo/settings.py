@@ -46,6 +46,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "core.middleware.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -53,6 +54,8 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "core.middleware.QueryInstrumentationMiddleware",
+    "core.middleware.ProfilingMiddleware",
 ]
 
 ROOT_URLCONF = "stilo.urls"
@@ -124,6 +127,35 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Caché
+# Las claves de los datos públicos incluyen versiones guardadas en la base
+# (ver core/caching.py), por lo que cualquier backend es seguro; en producción
+# conviene uno compartido entre procesos (p. ej. Redis o Memcached).
+CACHES = {
+    "default": {
+        "BACKEND": config(
+            "CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": config("CACHE_LOCATION", default="stilo"),
+    }
+}
+
+# Instrumentación de consultas SQL por request (ver core/middleware.py)
+QUERY_INSTRUMENTATION = config("QUERY_INSTRUMENTATION", default=False, cast=bool)
+# Umbrales a partir de los cuales el request se registra en el logger 'core'
+QUERY_INSTRUMENTATION_MAX_QUERIES = config("QUERY_INSTRUMENTATION_MAX_QUERIES", default=30, cast=int)
+QUERY_INSTRUMENTATION_MAX_DB_MS = config("QUERY_INSTRUMENTATION_MAX_DB_MS", default=200, cast=int)
+QUERY_INSTRUMENTATION_SLOWEST = config("QUERY_INSTRUMENTATION_SLOWEST", default=3, cast=int)
+# Agrega las cabeceras X-DB-Query-Count, X-DB-Time-Ms y X-DB-Duplicate-Queries
+QUERY_INSTRUMENTATION_HEADERS = config("QUERY_INSTRUMENTATION_HEADERS", default=False, cast=bool)
+
+# Perfilado a pedido de requests de staff (?_profile=1, ver core/middleware.py)
+PROFILE_DIR = BASE_DIR / "logs" / "profiles"
+PROFILE_TOP_FUNCTIONS = config("PROFILE_TOP_FUNCTIONS", default=40, cast=int)
+PROFILE_MAX_FILES = config("PROFILE_MAX_FILES", default=20, cast=int)
+PROFILE_MAX_TOTAL_MB = config("PROFILE_MAX_TOTAL_MB", default=50, cast=int)
+PROFILE_RETENTION_DAYS = config("PROFILE_RETENTION_DAYS", default=7, cast=int)
+
 # Extra settings
 
 AUTH_USER_MODEL = "core.User"
@@ -200,10 +232,51 @@ if not DEBUG:
 
 
 # Detectar si estamos ejecutando tests
+import os
 import sys
+import tempfile
 TESTING = 'test' in sys.argv
 log_suffix = '_test' if TESTING else ''
 
+# Métricas en formato Prometheus (ver core/metrics.py); desactivadas en los
+# tests para no dejar archivos de métricas por cada corrida
+METRICS_ENABLED = config("METRICS_ENABLED", default=not TESTING, cast=bool)
+# Token requerido por /metrics (Authorization: Bearer <token>); vacío = deshabilitado
+METRICS_TOKEN = config("METRICS_TOKEN", default="")
+# Directorio compartido por los procesos del servidor, fuera del repositorio;
+# vaciar al desplegar
+METRICS_DIR = config("METRICS_DIR", default=os.path.join(tempfile.gettempdir(), "stilo-metrics"))
+METRICS_FLUSH_INTERVAL = config("METRICS_FLUSH_INTERVAL", default=5, cast=int)
+
+# Vistas async (core/async_views.py) para las llamadas a MercadoPago y
+# Nominatim (usan httpx); activar solo si el sitio corre bajo un servidor ASGI
+ASYNC_VIEWS = config("ASYNC_VIEWS", default=False, cast=bool)
+
+# Estación de trabajo en vivo (ver core/agenda.py). Bajo WSGI cada conexión
+# SSE ocupa un hilo: se cierra a los WORKSTATION_STREAM_SECONDS y el
+# navegador se reconecta desde el último cambio recibido.
+WORKSTATION_STREAM_SECONDS = config("WORKSTATION_STREAM_SECONDS", default=60, cast=int)
+# Espera máxima de cada pedido long-poll (navegadores sin EventSource)
+WORKSTATION_LONGPOLL_SECONDS = config("WORKSTATION_LONGPOLL_SECONDS", default=25, cast=int)
+# Antigüedad máxima de los cambios guardados para reconexiones
+AGENDA_CHANGE_RETENTION_HOURS = config("AGENDA_CHANGE_RETENTION_HOURS", default=24, cast=int)
+
+# Conciliación de pagos con MercadoPago (ver core/reconciliation.py):
+# días hacia atrás en la primera corrida de cada peluquería y peluquerías
+# conciliadas en paralelo
+RECONCILIATION_LOOKBACK_DAYS = config("RECONCILIATION_LOOKBACK_DAYS", default=30, cast=int)
+RECONCILIATION_WORKERS = config("RECONCILIATION_WORKERS", default=4, cast=int)
+
+# Retención de tablas operativas, en días (0 = no purgar). Ver core/retention.py
+# y el comando purge_old_rows.
+WEBHOOK_EVENT_RETENTION_DAYS = config("WEBHOOK_EVENT_RETENTION_DAYS", default=90, cast=int)
+EARLY_START_OFFER_RETENTION_DAYS = config("EARLY_START_OFFER_RETENTION_DAYS", default=30, cast=int)
+PAUSE_RETENTION_DAYS = config("PAUSE_RETENTION_DAYS", default=365, cast=int)
+
+# Días tras los cuales los turnos finalizados pasan a las tablas de archivo
+# (0 = no archivar). Ver core/archive.py y el comando archive_appointments.
+APPOINTMENT_ARCHIVE_AFTER_DAYS = config("APPOINTMENT_ARCHIVE_AFTER_DAYS", default=365, cast=int)
+
 # Configuración de Logging temático: archivos separados por funcionalidad
 LOGGING = {
     'version': 1,